@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Archivo de períodos fiscales cerrados
+
+    python archive_fiscal_periods.py [--years 10] [--dry-run]
+
+Exporta cada mes anterior a --years años (ventas, artículos, ledger de NCF,
+NCF anulados y ajustes de inventario) a FISCAL_ARCHIVE_DIR/AAAA-MM/ en JSONL
+comprimido con un manifest.json, y lo elimina de las tablas vivas. Los meses
+archivados siguen visibles en la vista previa DGII 607. También crea las
+particiones mensuales de los próximos meses (PostgreSQL); conviene correrlo
+una vez al mes desde cron.
+"""
+import argparse
+import logging
+
+from main import app
+from models import db
+import fiscal_archive
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archivo de períodos fiscales cerrados')
+    parser.add_argument('--years', type=int, default=fiscal_archive.DEFAULT_RETENTION_YEARS,
+                        help='Archivar los meses anteriores a este número de años')
+    parser.add_argument('--dry-run', action='store_true', help='Listar los meses sin archivarlos')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    with app.app_context():
+        with db.engine.begin() as connection:
+            created = fiscal_archive.ensure_partitions(connection, app.config['FISCAL_PARTITION_MONTHS_AHEAD'])
+        print(f"✅ {len(created)} particiones nuevas")
+
+        summary = fiscal_archive.archive_periods(args.years, dry_run=args.dry_run)
+
+    for manifest in summary['archived']:
+        rows = sum(table['rows'] for table in manifest.get('tables', {}).values())
+        suffix = ' (simulación)' if args.dry_run else f': {rows} filas'
+        print(f"✅ {manifest['period']}{suffix}")
+    for skipped in summary['skipped']:
+        print(f"❌ {skipped['reason']}")
+
+
+if __name__ == '__main__':
+    main()
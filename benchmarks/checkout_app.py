@@ -0,0 +1,39 @@
+"""
+Aplicación WSGI que usa benchmarks/server_workers.py
+
+Es main.app con el rate limit desactivado y dos esperas opcionales:
+
+- BENCH_DB_LATENCY_MS: espera antes de cada consulta, como el viaje de red a un
+  PostgreSQL remoto (con SQLite la espera dentro de una escritura retiene el
+  bloqueo de la base: úsela con --database-url de PostgreSQL).
+- BENCH_SLOW_MS: la ruta GET /bench/slow espera ese tiempo, en lugar de las
+  rutas lentas que no se pueden reproducir aquí (prueba de impresora de red,
+  escaneo Bluetooth).
+
+time.sleep es cooperativo con gevent (gunicorn.conf.py aplica monkey.patch_all)
+y libera el GIL con gthread, igual que la E/S real.
+"""
+import os
+import time
+
+from flask import jsonify
+from sqlalchemy import event
+
+from main import app, db, limiter
+
+limiter.enabled = False
+
+DB_LATENCY = float(os.environ.get('BENCH_DB_LATENCY_MS', '0')) / 1000
+SLOW = float(os.environ.get('BENCH_SLOW_MS', '0')) / 1000
+
+if DB_LATENCY:
+    with app.app_context():
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _network_round_trip(conn, cursor, statement, parameters, context, executemany):
+            time.sleep(DB_LATENCY)
+
+
+@app.route('/bench/slow')
+def bench_slow():
+    time.sleep(SLOW)
+    return jsonify({'slept_ms': SLOW * 1000})
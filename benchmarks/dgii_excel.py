@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark: exportación Excel DGII 607 en memoria frente a la escritura en streaming
+
+Crea N ventas completadas de un mes en una base SQLite temporal y genera el
+607 de dos formas:
+
+- legacy: copia del flujo anterior de export_607_excel (Sale.query.all(),
+  libro normal de openpyxl con Font/PatternFill por celda, wb.save);
+- streaming: dgii_excel.write_report con la consulta por columnas en lotes
+  (yield_per), hoja write-only y SpooledTemporaryFile.
+
+Mide tiempo y pico de memoria de Python (tracemalloc); el pico de streaming
+debe mantenerse plano al crecer las filas.
+
+Uso:
+    python benchmarks/dgii_excel.py [--rows 10000 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('SESSION_SECRET', 'benchmark')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='dgii_excel_'), 'bench.db')}"
+
+import openpyxl
+from openpyxl.styles import Font, PatternFill, Alignment
+from sqlalchemy import func, insert, select
+
+from main import app
+from models import db, Sale, User, UserRole
+import dgii_excel
+from routes.dgii import DGII_607_HEADERS, _607_excel_row
+
+START = datetime(2026, 9, 1)
+END = datetime(2026, 10, 1)
+
+
+def seed(rows):
+    Sale.query.delete()
+    user = User.query.first()
+    if user is None:
+        user = User(username='bench', email='bench@test.com', role=UserRole.ADMINISTRADOR, name='Bench',
+                    password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+    batch = []
+    for index in range(rows):
+        subtotal = round(random.uniform(50, 5000), 2)
+        batch.append({
+            'user_id': user.id, 'ncf': f'B02{index + 1:08d}', 'subtotal': subtotal,
+            'tax_amount': round(subtotal * 0.18, 2), 'total': round(subtotal * 1.18, 2), 'status': 'completed',
+            'customer_rnc': random.choice((None, '131234567', '40212345678')),
+            'created_at': START + timedelta(seconds=index * (30 * 86400 // max(rows, 1))),
+        })
+        if len(batch) == 5000:
+            db.session.execute(insert(Sale), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Sale), batch)
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def legacy_export():
+    """Copia del flujo anterior de export_607_excel"""
+    sales = Sale.query.filter(Sale.created_at >= START, Sale.created_at < END, Sale.status == 'completed').all()
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "DGII 607 - September 2026"
+    ws.merge_cells('A1:N1')
+    ws['A1'] = "Reporte DGII 607 - Ventas - September 2026"
+    ws['A1'].font = Font(color='FFFFFF', size=16, bold=True)
+    ws['A1'].fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
+    ws['A1'].alignment = Alignment(horizontal='center')
+    for col, header in enumerate(DGII_607_HEADERS, 1):
+        cell = ws.cell(row=3, column=col, value=header)
+        cell.font = Font(bold=True)
+        cell.fill = PatternFill(start_color='D9E2F3', end_color='D9E2F3', fill_type='solid')
+    for row_num, sale in enumerate(sales, 4):
+        row_data = _607_excel_row((sale.customer_rnc, sale.ncf, sale.created_at, sale.total, sale.tax_amount), '')
+        for col, value in enumerate(row_data, 1):
+            ws.cell(row=row_num, column=col, value=value)
+    output = tempfile.NamedTemporaryFile(suffix='.xlsx')
+    wb.save(output.name)
+    db.session.expunge_all()
+    return output
+
+
+def streaming_export():
+    statement = select(Sale.customer_rnc, Sale.ncf, Sale.created_at, Sale.total, Sale.tax_amount).where(
+        Sale.created_at >= START, Sale.created_at < END, Sale.status == 'completed'
+    ).order_by(Sale.created_at, Sale.id)
+    return dgii_excel.write_report("Reporte DGII 607 - Ventas - September 2026", "DGII 607 - September 2026",
+                                   DGII_607_HEADERS,
+                                   dgii_excel.stream_rows(db.session, statement, lambda r: _607_excel_row(r, '')))
+
+
+def measure(export):
+    tracemalloc.start()
+    started = time.perf_counter()
+    output = export()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    output.seek(0, os.SEEK_END)
+    size = output.tell()
+    output.close()
+    return elapsed, peak / 1e6, size / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        print(f"{'filas':>8}  {'modo':<10}{'segundos':>10}{'pico MB':>10}{'xlsx MB':>9}")
+        for rows in args.rows:
+            seed(rows)
+            assert db.session.execute(select(func.count()).select_from(Sale)).scalar() == rows
+            for name, export in (('legacy', legacy_export), ('streaming', streaming_export)):
+                elapsed, peak, size = measure(export)
+                print(f"{rows:>8}  {name:<10}{elapsed:>10.2f}{peak:>10.1f}{size:>9.1f}")
+            print()
+
+
+if __name__ == '__main__':
+    main()
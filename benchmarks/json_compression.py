@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark: serialización JSON y compresión de respuestas de reportes
+
+Compara bytes y tiempo del proveedor JSON por defecto de Flask (con y sin
+indentación) contra CompactJSONProvider, y el tamaño/tiempo de gzip y brotli,
+sobre cargas con la forma de /admin/api/sales-report, /api/products y
+/api/pending-orders.
+
+Uso:
+    python benchmarks/json_compression.py [--sales 5000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import json_provider
+import response_compression
+
+
+def sales_report_payload(count):
+    start = datetime(2025, 1, 1, 8, 0)
+    sales = []
+    for i in range(count):
+        subtotal = round(random.uniform(150, 4500), 2)
+        sales.append({
+            'id': i + 1,
+            'ncf': f'B02{i + 1:08d}',
+            'created_at': (start + timedelta(minutes=7 * i)).isoformat(),
+            'total': round(subtotal * 1.18, 2),
+            'subtotal': subtotal,
+            'tax_amount': round(subtotal * 0.18, 2),
+            'payment_method': random.choice(['cash', 'card', 'transfer']),
+            'customer_name': random.choice([None, 'Cliente Contado', 'Empresa Dominicana SRL']),
+            'items': [{
+                'product_name': random.choice(['Presidente Grande', 'Mofongo', 'Brugal Añejo', 'Chicharrón']),
+                'quantity': random.randint(1, 6),
+                'unit_price': 250.0,
+                'total_price': 250.0 * random.randint(1, 6)
+            } for _ in range(random.randint(1, 5))]
+        })
+    return {
+        'success': True,
+        'period': 'custom',
+        'summary': {'total_sales': count, 'total_amount': sum(s['total'] for s in sales)},
+        'sales_by_day': [{'date': f'2025-01-{d:02d}', 'count': 40, 'total': 51234.5} for d in range(1, 29)],
+        'sales': sales
+    }
+
+
+def products_payload(count):
+    return [{
+        'id': i + 1,
+        'name': f'Producto {i + 1}',
+        'price': round(random.uniform(50, 3000), 2),
+        'stock': random.randint(0, 500),
+        'category_id': random.randint(1, 20),
+        'product_type': random.choice(['inventariable', 'consumible']),
+        'tax_types': [{'id': 1, 'name': 'ITBIS 18%', 'rate': 0.18, 'is_inclusive': True}]
+    } for i in range(count)]
+
+
+def pending_orders_payload(count):
+    return [{
+        'id': i + 1,
+        'table': f'Mesa {i % 30 + 1}',
+        'status': 'pending',
+        'total': round(random.uniform(300, 9000), 2),
+        'created_at': datetime(2025, 1, 1, 20, 0) + timedelta(minutes=i),
+        'items': [{'name': 'Presidente', 'quantity': 2, 'price': 250.0}] * 4
+    } for i in range(count)]
+
+
+def timed(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return result, best * 1000
+
+
+def run(sales_count, repeat):
+    random.seed(42)
+    app = Flask(__name__)
+    default = DefaultJSONProvider(app)
+    compact = json_provider.CompactJSONProvider(app)
+    config = {
+        'COMPRESS_GZIP_LEVEL': response_compression.DEFAULT_GZIP_LEVEL,
+        'COMPRESS_BROTLI_QUALITY': response_compression.DEFAULT_BROTLI_QUALITY,
+    }
+
+    payloads = {
+        'sales-report': sales_report_payload(sales_count),
+        'products': products_payload(sales_count // 5),
+        'pending-orders': pending_orders_payload(sales_count // 20),
+    }
+
+    print(f"orjson: {'sí' if json_provider.orjson else 'no'} | brotli: {'sí' if response_compression.brotli else 'no'}")
+    print(f"{'endpoint':<16}{'serializador':<22}{'bytes':>12}{'ms':>10}")
+    for name, payload in payloads.items():
+        pretty, pretty_ms = timed(lambda: default.dumps(payload, indent=2).encode('utf-8'), repeat)
+        flask_compact, flask_ms = timed(lambda: default.dumps(payload, separators=(',', ':')).encode('utf-8'), repeat)
+        body, compact_ms = timed(lambda: compact.dumps_bytes(payload), repeat)
+
+        print(f"{name:<16}{'flask indent=2':<22}{len(pretty):>12,}{pretty_ms:>10.2f}")
+        print(f"{'':<16}{'flask compacto':<22}{len(flask_compact):>12,}{flask_ms:>10.2f}")
+        print(f"{'':<16}{'CompactJSONProvider':<22}{len(body):>12,}{compact_ms:>10.2f}")
+
+        for encoding in response_compression._supported_encodings():
+            compressed, compress_ms = timed(
+                lambda: response_compression.compress_bytes(body, encoding, config), max(1, repeat // 4))
+            print(f"{'':<16}{'  + ' + encoding:<22}{len(compressed):>12,}{compress_ms:>10.2f}"
+                  f"   ({len(compressed) / len(pretty):.1%} de indent=2)")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark de JSON compacto y compresión')
+    parser.add_argument('--sales', type=int, default=5000, help='Ventas en el reporte simulado')
+    parser.add_argument('--repeat', type=int, default=20, help='Repeticiones (se reporta el mejor tiempo)')
+    args = parser.parse_args(argv)
+    run(args.sales, args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
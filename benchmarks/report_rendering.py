@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark: reporte de ventas PDF con un solo doc.build frente al renderizado por bloques en paralelo
+
+Genera el reporte de ventas (receipt_generator.generate_sales_report_pdf) con
+ventas simuladas de N filas y mide el tiempo total según el número de procesos
+del pool (REPORT_PDF_WORKERS). "sin dividir" es el doc.build único anterior.
+El renderizado en paralelo solo ayuda con varios núcleos: con un CPU, los
+bloque en un proceso ya es más rápido que el build único, porque ReportLab
+divide una tabla larga página por página y cada división recorre las filas
+restantes. El build único se omite por encima de --baseline-max filas.
+
+Uso:
+    python benchmarks/report_rendering.py [--rows 10000 100000 1000000] [--workers 1 2 4] [--baseline-max 100000]
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import receipt_generator
+import report_pdf
+
+CUSTOMERS = (None, 'Juan Pérez', 'Distribuidora del Caribe SRL', 'María Rodríguez', 'Colmado La Esquina')
+METHODS = ('efectivo', 'tarjeta', 'transferencia')
+
+
+def make_sales(count):
+    start = datetime(2025, 1, 1, 8, 0)
+    sales = []
+    for index in range(count):
+        subtotal = round(random.uniform(50, 5000), 2)
+        tax = round(subtotal * 0.18, 2)
+        sales.append(SimpleNamespace(
+            created_at=start + timedelta(seconds=index * 30),
+            ncf=f"B02{index + 1:08d}",
+            customer_name=random.choice(CUSTOMERS),
+            payment_method=random.choice(METHODS),
+            subtotal=subtotal,
+            tax_amount=tax,
+            total=subtotal + tax
+        ))
+    return sales
+
+
+def run(sales, workers):
+    if workers is None:
+        os.environ['REPORT_PDF_PARALLEL_MIN_ROWS'] = str(len(sales) + 1)
+    else:
+        os.environ['REPORT_PDF_PARALLEL_MIN_ROWS'] = '0'
+        os.environ['REPORT_PDF_WORKERS'] = str(workers)
+    started = time.perf_counter()
+    path = receipt_generator.generate_sales_report_pdf(sales, 'Año 2025', datetime(2025, 1, 1), datetime(2025, 12, 31))
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path)
+    os.remove(path)
+    return elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--baseline-max', type=int, default=100000)
+    args = parser.parse_args()
+
+    # Reports are written under static/receipts relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='report_bench_'))
+    print(f"CPUs: {os.cpu_count()}  bloque: {os.environ.get('REPORT_PDF_CHUNK_ROWS', 2000)} filas\n")
+    print(f"{'filas':>9}  {'modo':<14}{'segundos':>10}{'filas/s':>10}{'MB':>8}{'speedup':>9}")
+
+    for rows in args.rows:
+        sales = make_sales(rows)
+        baseline = None
+        modes = ([None] if rows <= args.baseline_max else []) + args.workers
+        for workers in modes:
+            elapsed, size = run(sales, workers)
+            baseline = baseline or elapsed
+            mode = 'sin dividir' if workers is None else f'{workers} proceso(s)'
+            print(f"{rows:>9}  {mode:<14}{elapsed:>10.2f}{rows / elapsed:>10.0f}{size / 1e6:>8.1f}{baseline / elapsed:>8.2f}x")
+        print()
+
+    report_pdf.shutdown(wait=True)
+    # Pool workers are forkserver children: only the main process is measured here
+    parent = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Memoria máxima del proceso principal: {parent:.0f} MB")
+
+if __name__ == '__main__':
+    main()
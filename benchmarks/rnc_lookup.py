@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark: importación del padrón de RNC y latencia del autocompletado
+
+Genera un archivo DGII_RNC sintético de N contribuyentes, lo importa en una
+base SQLite temporal (carga por lotes; en PostgreSQL se usa COPY), lo vuelve
+a importar con un 1% de cambios para medir la diferencia, y mide la latencia
+de rnc_registry.search con el índice en memoria y con la consulta a la base
+de datos.
+
+Uso:
+    python benchmarks/rnc_lookup.py [--rows 700000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('SESSION_SECRET', 'benchmark')
+WORK_DIR = tempfile.mkdtemp(prefix='rnc_lookup_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+
+from main import app
+from models import db
+import rnc_registry
+
+WORDS = ['DISTRIBUIDORA', 'COMERCIAL', 'INVERSIONES', 'GRUPO', 'FARMACIA', 'COLMADO', 'FERRETERIA', 'CARIBE',
+         'SANTO', 'DOMINGO', 'CIBAO', 'ESTE', 'NORTE', 'SERVICIOS', 'CONSTRUCTORA', 'TECNOLOGIA', 'JUAN', 'MARIA',
+         'PEREZ', 'RODRIGUEZ', 'MARTINEZ', 'GOMEZ', 'SRL', 'SAS', 'EIRL']
+
+
+def _line(index, rng, status='ACTIVO'):
+    rnc = str(100000000 + index * 7) if index % 3 else f'{40200000000 + index * 13:011d}'
+    name = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))) + f' {index}'
+    trade = ' '.join(rng.choice(WORDS) for _ in range(2)) if index % 4 == 0 else ''
+    return f'{rnc}|{name}|{trade}|COMERCIO|||||01/01/2010|{status}|NORMAL\n'
+
+
+def _write(path, rows, changed=0.0):
+    rng = random.Random(42)
+    change = random.Random(7)
+    with open(path, 'w', encoding='latin-1') as registry:
+        for index in range(rows):
+            status = 'SUSPENDIDO' if change.random() < changed else 'ACTIVO'
+            registry.write(_line(index, rng, status))
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000
+
+
+def _latency(queries):
+    samples = []
+    for query in queries:
+        started = time.perf_counter()
+        rnc_registry.search(query)
+        samples.append(time.perf_counter() - started)
+    return _percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=700000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    path = os.path.join(WORK_DIR, 'DGII_RNC.TXT')
+    _write(path, args.rows)
+
+    with app.app_context():
+        db.create_all()
+
+        summary = rnc_registry.import_registry(path)
+        print(f"Importación inicial: {summary['rows']} filas en {summary['seconds']} s")
+
+        _write(path, args.rows, changed=0.01)
+        summary = rnc_registry.import_registry(path)
+        print(f"Reimportación (1% cambios): {summary['updated']} actualizadas en {summary['seconds']} s")
+
+        started = time.perf_counter()
+        count = rnc_registry.warm()
+        seconds = time.perf_counter() - started
+        tracemalloc.start()
+        rnc_registry.build_index()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        index = rnc_registry._cache.index
+        size = len(index.rncs) + len(index.names) + index.name_offsets.itemsize * len(index.name_offsets)
+        print(f"Índice en memoria: {count} RNC en {seconds:.1f} s, {size / 1e6:.1f} MB "
+              f"(pico durante la carga {peak / 1e6:.0f} MB)")
+
+        rng = random.Random(1)
+        queries = []
+        for _ in range(args.queries):
+            if rng.random() < 0.5:
+                queries.append(str(rng.choice([1, 4])) + ''.join(rng.choice(string.digits) for _ in range(3)))
+            else:
+                queries.append(rng.choice(WORDS)[:rng.randint(3, 8)])
+
+        p50, p99 = _latency(queries)
+        print(f"search() en memoria:       p50 {p50:.2f} ms  p99 {p99:.2f} ms")
+        rnc_registry._cache.enabled = False
+        p50, p99 = _latency(queries)
+        print(f"search() en base de datos: p50 {p50:.2f} ms  p99 {p99:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cálculo de ITBIS con tax_engine frente a los ciclos anteriores
+
+Compara, sobre ventas simuladas, los dos ciclos con floats que usaba
+finalize_sale (impuestos agregados + todos los impuestos) contra
+tax_engine.compute_sale, y el recálculo masivo de muchas ventas con un ciclo
+por venta contra tax_engine.compute_bulk_totals (numpy si está instalado).
+También cuenta en cuántas ventas los montos difieren entre ambos métodos.
+
+Uso:
+    python benchmarks/tax_engine.py [--sales 20000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tax_engine
+
+RATES = (0.0, 0.16, 0.18, 0.18, 0.18)
+PRICES = (65.0, 99.99, 125.0, 150.0, 249.5, 325.0, 1450.0, 2375.75)
+
+
+class Item:
+    __slots__ = ('total_price', 'tax_rate', 'is_tax_included', 'product')
+
+    def __init__(self, total_price, tax_rate, is_tax_included):
+        self.total_price = total_price
+        self.tax_rate = tax_rate
+        self.is_tax_included = is_tax_included
+        self.product = None
+
+
+def make_sales(count):
+    sales = []
+    for _ in range(count):
+        sales.append([Item(random.choice(PRICES) * random.randint(1, 6), random.choice(RATES), random.random() < 0.7)
+                      for _ in range(random.randint(1, 8))])
+    return sales
+
+
+def legacy_totals(items):
+    """Copia de la lógica anterior de finalize_sale (dos ciclos con floats)"""
+    subtotal = sum(item.total_price for item in items)
+    tax_exclusive = 0
+    for item in items:
+        rate = item.tax_rate
+        if not item.is_tax_included and rate > 0:
+            tax_exclusive += round(item.total_price * rate, 2)
+    tax_all = 0
+    for item in items:
+        rate = item.tax_rate
+        if rate > 0:
+            if item.is_tax_included:
+                tax_all += round(item.total_price - (item.total_price / (1 + rate)), 2)
+            else:
+                tax_all += round(item.total_price * rate, 2)
+    return round(subtotal, 2), round(tax_all, 2), round(subtotal + tax_exclusive)
+
+
+def timed(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return result, best * 1000
+
+
+def run(sales_count, repeat):
+    random.seed(42)
+    sales = make_sales(sales_count)
+    line_count = sum(len(items) for items in sales)
+    print(f"{sales_count:,} ventas, {line_count:,} líneas | numpy: {'sí' if tax_engine.np is not None else 'no'}")
+
+    legacy, legacy_ms = timed(lambda: [legacy_totals(items) for items in sales], repeat)
+    engine, engine_ms = timed(lambda: [tax_engine.compute_sale_items(items) for items in sales], repeat)
+
+    sale_ids, line_totals, rates, inclusive = [], [], [], []
+    for sale_id, items in enumerate(sales):
+        for item in items:
+            sale_ids.append(sale_id)
+            line_totals.append(item.total_price)
+            rates.append(item.tax_rate)
+            inclusive.append(item.is_tax_included)
+
+    bulk, bulk_ms = timed(lambda: tax_engine.compute_bulk_totals(sale_ids, line_totals, rates, inclusive), repeat)
+    python_bulk, python_bulk_ms = timed(
+        lambda: tax_engine._bulk_python(sale_ids, line_totals, rates, inclusive), repeat)
+
+    print(f"{'método':<36}{'ms':>10}{'µs/venta':>12}")
+    for label, ms in (('ciclos anteriores (floats)', legacy_ms),
+                      ('tax_engine.compute_sale_items', engine_ms),
+                      ('compute_bulk_totals (Python)', python_bulk_ms),
+                      ('compute_bulk_totals', bulk_ms)):
+        print(f"{label:<36}{ms:>10.2f}{ms * 1000 / sales_count:>12.2f}")
+
+    assert bulk == python_bulk, "numpy y Python deben dar los mismos centavos"
+    tax_diffs = sum(1 for old, new in zip(legacy, engine) if abs(old[1] - new.tax_amount) > 0.001)
+    total_diffs = sum(1 for old, new in zip(legacy, engine) if old[2] != new.rounded_total)
+    print(f"ventas con ITBIS distinto al cálculo anterior: {tax_diffs:,} | con total distinto: {total_diffs:,}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark del motor de impuestos')
+    parser.add_argument('--sales', type=int, default=20000, help='Ventas simuladas')
+    parser.add_argument('--repeat', type=int, default=5, help='Repeticiones (se reporta el mejor tiempo)')
+    args = parser.parse_args(argv)
+    run(args.sales, args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
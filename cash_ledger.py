@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Libro de caja por sesión
+Cada venta finalizada se enlaza a la CashSession abierta de su caja y actualiza
+los totales acumulados de la sesión en la misma transacción; el cierre, el
+reporte X y el estado de caja se leen de esos totales sin recorrer ventas.
+
+Uso como comando de reconciliación:
+    python cash_ledger.py                 # verificar todas las sesiones
+    python cash_ledger.py --session-id 12 # verificar una sesión
+    python cash_ledger.py --fix           # corregir totales con diferencias
+"""
+import logging
+import sys
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy import func
+
+import models
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Método de pago -> prefijo de columnas en CashSession
+PAYMENT_METHOD_BUCKETS = {
+    'cash': 'cash',
+    'efectivo': 'cash',  # compatibilidad con ventas antiguas
+    'card': 'card',
+    'transfer': 'transfer'
+}
+
+
+def get_open_session(cash_register_id: int, lock: bool = False) -> Optional[models.CashSession]:
+    """
+    Obtiene la sesión abierta más reciente de una caja registradora
+
+    Args:
+        cash_register_id: ID de la caja
+        lock: Bloquear la fila (SELECT ... FOR UPDATE) para actualizar sus totales
+    """
+    if not cash_register_id:
+        return None
+
+    query = db.session.query(models.CashSession).filter_by(
+        cash_register_id=cash_register_id,
+        status='open'
+    ).order_by(models.CashSession.opened_at.desc())
+
+    if lock:
+        query = query.with_for_update()
+
+    return query.first()
+
+
+def _add_to_bucket(cash_session: models.CashSession, payment_method: str, count: int, amount: float):
+    bucket = PAYMENT_METHOD_BUCKETS.get(payment_method)
+    if not bucket:
+        logger.warning(f"Método de pago '{payment_method}' sin columna en el libro de caja (sesión {cash_session.id})")
+        return
+
+    count_attr = f'{bucket}_sales_count'
+    total_attr = f'{bucket}_sales_total'
+    setattr(cash_session, count_attr, (getattr(cash_session, count_attr) or 0) + count)
+    setattr(cash_session, total_attr, round((getattr(cash_session, total_attr) or 0.0) + amount, 2))
+
+
+def record_finalized_sale(sale: models.Sale, cash_session: Optional[models.CashSession] = None) -> Optional[models.CashSession]:
+    """
+    Enlaza una venta recién completada a la sesión abierta de su caja y suma sus totales
+
+    Debe llamarse dentro de la transacción de finalización, después de asignar
+    sale.cash_register_id, sale.payment_method y sale.total.
+
+    Args:
+        sale: Venta que pasa a 'completed'
+        cash_session: Sesión ya bloqueada por el llamador (opcional)
+
+    Returns:
+        La sesión enlazada, o None si la caja no tiene sesión abierta
+    """
+    if cash_session is None:
+        cash_session = get_open_session(sale.cash_register_id, lock=True)
+    if not cash_session:
+        return None
+
+    sale.cash_session_id = cash_session.id
+    _add_to_bucket(cash_session, sale.payment_method, 1, float(sale.total or 0))
+    return cash_session
+
+
+def record_cancelled_sale(sale: models.Sale) -> Optional[models.CashSession]:
+    """
+    Revierte una venta cancelada de los totales de su sesión y la registra como cancelada
+
+    Debe llamarse dentro de la transacción de cancelación.
+    """
+    if not sale.cash_session_id:
+        return None
+
+    cash_session = db.session.query(models.CashSession).filter_by(
+        id=sale.cash_session_id
+    ).with_for_update().first()
+    if not cash_session:
+        return None
+
+    amount = float(sale.total or 0)
+    _add_to_bucket(cash_session, sale.payment_method, -1, -amount)
+    cash_session.cancelled_count = (cash_session.cancelled_count or 0) + 1
+    cash_session.cancelled_total = round((cash_session.cancelled_total or 0.0) + amount, 2)
+    return cash_session
+
+
+def session_summary(cash_session: models.CashSession) -> Dict[str, Any]:
+    """Resumen de la sesión leído de los totales acumulados (O(1))"""
+    cash_sales = float(cash_session.cash_sales_total or 0)
+    card_sales = float(cash_session.card_sales_total or 0)
+    transfer_sales = float(cash_session.transfer_sales_total or 0)
+    total_transactions = (
+        (cash_session.cash_sales_count or 0) +
+        (cash_session.card_sales_count or 0) +
+        (cash_session.transfer_sales_count or 0)
+    )
+    expected_cash = (cash_session.opening_amount or 0) + cash_sales
+
+    return {
+        'session_id': cash_session.id,
+        'opened_at': cash_session.opened_at.isoformat() if cash_session.opened_at else None,
+        'opening_amount': cash_session.opening_amount,
+        'cash_sales': cash_sales,
+        'cash_count': cash_session.cash_sales_count or 0,
+        'card_sales': card_sales,
+        'card_count': cash_session.card_sales_count or 0,
+        'transfer_sales': transfer_sales,
+        'transfer_count': cash_session.transfer_sales_count or 0,
+        'total_sales': round(cash_sales + card_sales + transfer_sales, 2),
+        'total_transactions': total_transactions,
+        'cancelled_count': cash_session.cancelled_count or 0,
+        'cancelled_total': float(cash_session.cancelled_total or 0),
+        'expected_cash': round(expected_cash, 2)
+    }
+
+
+def compute_session_totals(cash_session_id: int) -> Dict[str, Any]:
+    """Recalcula los totales de una sesión a partir de las ventas enlazadas"""
+    totals = {
+        'cash_sales_count': 0, 'cash_sales_total': 0.0,
+        'card_sales_count': 0, 'card_sales_total': 0.0,
+        'transfer_sales_count': 0, 'transfer_sales_total': 0.0,
+        'cancelled_count': 0, 'cancelled_total': 0.0
+    }
+
+    rows = db.session.query(
+        models.Sale.status,
+        models.Sale.payment_method,
+        func.count(models.Sale.id),
+        func.coalesce(func.sum(models.Sale.total), 0.0)
+    ).filter(
+        models.Sale.cash_session_id == cash_session_id,
+        models.Sale.status.in_(['completed', 'cancelled'])
+    ).group_by(models.Sale.status, models.Sale.payment_method).all()
+
+    for status, payment_method, count, amount in rows:
+        if status == 'cancelled':
+            totals['cancelled_count'] += count
+            totals['cancelled_total'] += float(amount)
+            continue
+        bucket = PAYMENT_METHOD_BUCKETS.get(payment_method)
+        if bucket:
+            totals[f'{bucket}_sales_count'] += count
+            totals[f'{bucket}_sales_total'] += float(amount)
+
+    return {key: round(value, 2) if isinstance(value, float) else value for key, value in totals.items()}
+
+
+def reconcile_sessions(session_id: Optional[int] = None, fix: bool = False) -> List[Dict[str, Any]]:
+    """
+    Verifica los totales acumulados de las sesiones contra las ventas enlazadas
+
+    Args:
+        session_id: Verificar solo esta sesión (None = todas)
+        fix: Sobrescribir los totales que no coincidan
+
+    Returns:
+        Lista de diferencias encontradas: {'session_id', 'field', 'stored', 'expected'}
+    """
+    query = db.session.query(models.CashSession)
+    if session_id is not None:
+        query = query.filter(models.CashSession.id == session_id)
+
+    mismatches = []
+    for cash_session in query.order_by(models.CashSession.id).all():
+        expected = compute_session_totals(cash_session.id)
+        for field, expected_value in expected.items():
+            stored_value = getattr(cash_session, field) or 0
+            if abs(float(stored_value) - float(expected_value)) > 0.005:
+                mismatches.append({
+                    'session_id': cash_session.id,
+                    'field': field,
+                    'stored': stored_value,
+                    'expected': expected_value
+                })
+                if fix:
+                    setattr(cash_session, field, expected_value)
+
+    if fix and mismatches:
+        db.session.commit()
+
+    return mismatches
+
+
+def main(argv: List[str]) -> int:
+    import argparse
+    from main import app
+
+    parser = argparse.ArgumentParser(description='Reconciliación del libro de caja por sesión')
+    parser.add_argument('--session-id', type=int, default=None, help='Verificar solo esta sesión')
+    parser.add_argument('--fix', action='store_true', help='Corregir los totales con diferencias')
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        mismatches = reconcile_sessions(session_id=args.session_id, fix=args.fix)
+
+    if not mismatches:
+        print("✅ Libro de caja consistente con las ventas enlazadas")
+        return 0
+
+    for mismatch in mismatches:
+        print(f"❌ Sesión {mismatch['session_id']}: {mismatch['field']} "
+              f"almacenado={mismatch['stored']} esperado={mismatch['expected']}")
+    if args.fix:
+        print(f"✅ {len(mismatches)} diferencias corregidas")
+        return 0
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,236 @@
+"""
+Motor de base de datos: pool de conexiones, statement_timeout y métricas del pool
+
+- configure(app), antes de db.init_app, arma SQLALCHEMY_ENGINE_OPTIONS. El
+  tamaño del pool sale de DB_POOL_SIZE / DB_MAX_OVERFLOW o, si no se indican,
+  del modelo de worker de gunicorn.conf.py: sync atiende una petición a la vez,
+  gthread una por hilo y gevent muchas por worker (limitadas por el pool).
+- En PostgreSQL cada conexión recibe el statement_timeout del blueprint que la
+  usa (corto para la API del POS, largo para DGII y reportes). El SET solo se
+  envía cuando el valor cambia respecto al que ya tiene la conexión.
+- No se usa pool_pre_ping (una consulta extra en cada cobro). Un error de
+  desconexión invalida el pool y la petición afectada responde 503 con
+  Retry-After para que el cliente reintente con una conexión nueva;
+  pool_recycle descarta las conexiones antes del cierre por inactividad.
+- pool_status() devuelve conexiones en uso, overflow, esperas para obtener una
+  conexión, timeouts del pool y desconexiones de este proceso.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+from models import db
+from utils import error_response
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_TIMEOUT = 10  # segundos esperando una conexión libre
+DEFAULT_POOL_RECYCLE = 300  # segundos
+
+# statement_timeout por blueprint (ms); 0 = sin límite
+DEFAULT_STATEMENT_TIMEOUTS = {
+    'api': 10000,
+    'auth': 10000,
+    'waiter': 10000,
+    'inventory': 30000,
+    'admin': 120000,
+    'dgii': 300000,
+    'fiscal_audit': 300000,
+}
+DEFAULT_STATEMENT_TIMEOUT = 30000  # otras peticiones
+# Fuera de una petición (scripts de migración, CLI) no hay límite
+
+QUERY_CANCELED = '57014'  # SQLSTATE de statement_timeout
+WAIT_THRESHOLD = 0.005  # segundos: a partir de aquí un checkout cuenta como espera
+
+
+class _PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.waited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.pool_timeouts = 0
+        self.disconnects = 0
+        self.statement_timeouts = 0
+
+    def record_wait(self, seconds):
+        with self.lock:
+            self.checkouts += 1
+            if seconds >= WAIT_THRESHOLD:
+                self.waited += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+
+_stats = _PoolStats()
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool que mide cuánto tarda cada petición en obtener una conexión"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with _stats.lock:
+                _stats.pool_timeouts += 1
+            raise
+        finally:
+            _stats.record_wait(time.perf_counter() - started)
+
+
+def _env_int(name) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def worker_pool_size(worker_class: str, threads: int, worker_connections: int) -> Tuple[int, int]:
+    """(pool_size, max_overflow) por worker según la clase de worker de gunicorn"""
+    if worker_class == 'sync':
+        return 2, 2
+    if worker_class == 'gevent':
+        # Greenlets beyond the pool queue for a connection instead of opening hundreds
+        return min(worker_connections, 20), 10
+    return threads, max(2, threads // 2)
+
+
+def engine_options(database_url: Optional[str], config) -> dict:
+    """Opciones de create_engine para la URL y la configuración dadas"""
+    options = {'pool_pre_ping': False}
+    if not database_url or database_url.startswith('sqlite'):
+        return options
+
+    size, overflow = worker_pool_size(
+        os.environ.get('GUNICORN_WORKER_CLASS', 'gthread'),
+        int(os.environ.get('GUNICORN_THREADS', 8)),
+        int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100)),
+    )
+    options.update(
+        poolclass=MeteredQueuePool,
+        pool_size=config.get('DB_POOL_SIZE') or size,
+        max_overflow=config['DB_MAX_OVERFLOW'] if config.get('DB_MAX_OVERFLOW') is not None else overflow,
+        pool_timeout=config.get('DB_POOL_TIMEOUT') or DEFAULT_POOL_TIMEOUT,
+        pool_recycle=config.get('DB_POOL_RECYCLE') or DEFAULT_POOL_RECYCLE,
+    )
+    return options
+
+
+def configure(app):
+    """Arma SQLALCHEMY_ENGINE_OPTIONS; debe llamarse antes de db.init_app(app)"""
+    for name in ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT', 'DB_POOL_RECYCLE'):
+        app.config.setdefault(name, _env_int(name))
+    app.config.setdefault('DB_STATEMENT_TIMEOUTS', dict(DEFAULT_STATEMENT_TIMEOUTS))
+    app.config.setdefault('DB_STATEMENT_TIMEOUT_DEFAULT', DEFAULT_STATEMENT_TIMEOUT)
+
+    options = engine_options(app.config.get('SQLALCHEMY_DATABASE_URI'), app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    if 'pool_size' in options:
+        logger.info(f"Pool de base de datos: {options['pool_size']} conexiones + "
+                    f"{options['max_overflow']} de overflow por worker")
+
+
+def statement_timeout_for(blueprint: Optional[str], config) -> int:
+    """statement_timeout en ms para una petición del blueprint indicado"""
+    return config['DB_STATEMENT_TIMEOUTS'].get(blueprint, config['DB_STATEMENT_TIMEOUT_DEFAULT'])
+
+
+def _current_statement_timeout(config) -> int:
+    if not has_request_context():
+        return 0
+    return statement_timeout_for(request.blueprint, config)
+
+
+def pool_status(engine=None) -> Dict[str, object]:
+    """Estado del pool de este proceso y métricas acumuladas desde el arranque"""
+    pool = (engine or db.engine).pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,
+        )
+    with _stats.lock:
+        status.update(
+            checkouts=_stats.checkouts,
+            waited=_stats.waited,
+            wait_avg_ms=round(_stats.wait_total / _stats.checkouts * 1000, 2) if _stats.checkouts else 0.0,
+            wait_max_ms=round(_stats.wait_max * 1000, 2),
+            pool_timeouts=_stats.pool_timeouts,
+            disconnects=_stats.disconnects,
+            statement_timeouts=_stats.statement_timeouts,
+        )
+    return status
+
+
+def attach(engine, config):
+    """Registra en el motor el manejo de desconexiones y, en PostgreSQL, el statement_timeout"""
+    @event.listens_for(engine, 'handle_error')
+    def _on_database_error(context):
+        if context.is_disconnect:
+            with _stats.lock:
+                _stats.disconnects += 1
+            logger.warning(f"Conexión con la base de datos perdida; se invalida el pool: {context.original_exception}")
+            if has_request_context():
+                g.db_disconnected = True
+        elif getattr(context.original_exception, 'pgcode', None) == QUERY_CANCELED:
+            with _stats.lock:
+                _stats.statement_timeouts += 1
+            endpoint = request.endpoint if has_request_context() else None
+            logger.warning(f"Consulta cancelada por statement_timeout en {endpoint}")
+
+    if engine.dialect.name != 'postgresql':
+        return
+
+    @event.listens_for(engine, 'checkout')
+    def _apply_statement_timeout(dbapi_connection, connection_record, connection_proxy):
+        timeout = _current_statement_timeout(config)
+        if connection_record.info.get('statement_timeout') == timeout:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute('SET statement_timeout = %s', (timeout,))
+        finally:
+            cursor.close()
+        # Committed so the rollback on return to the pool does not undo the SET
+        dbapi_connection.commit()
+        connection_record.info['statement_timeout'] = timeout
+
+
+def retry_after_disconnect(response):
+    """Convierte en 503 + Retry-After la respuesta de error de una petición que perdió la conexión"""
+    if not g.pop('db_disconnected', False) or response.status_code < 500:
+        return response
+    retry, status_code = error_response(
+        error_type='server',
+        message='Base de datos no disponible',
+        details='Se perdió la conexión con la base de datos. Intente de nuevo.',
+        status_code=503
+    )
+    retry.status_code = status_code
+    retry.headers['Retry-After'] = '1'
+    return retry
+
+
+def init_app(app):
+    """Registra los eventos del motor y la respuesta 503 ante desconexiones"""
+    with app.app_context():
+        for engine in db.engines.values():
+            attach(engine, app.config)
+    app.after_request(retry_after_disconnect)
@@ -0,0 +1,172 @@
+"""
+Enrutamiento de lecturas a una réplica (DATABASE_REPLICA_URL)
+
+Los reportes (DGII, auditoría fiscal, reportes de administración) hacen
+recorridos pesados sobre sales/sale_items. Con una réplica configurada, los
+endpoints marcados como de solo lectura consultan la réplica y dejan el
+primario para los cobros; sin réplica todo sigue yendo al primario.
+
+- @read_only marca una vista; read_only_blueprint(bp) marca todo un blueprint.
+- Las escrituras (flush del ORM, INSERT/UPDATE/DELETE) siempre van al primario,
+  aunque ocurran dentro de un endpoint de solo lectura.
+- Control de frescura: el usuario que escribió hace menos de
+  DB_REPLICA_READ_AFTER_WRITE segundos (p. ej. acaba de finalizar una venta)
+  lee del primario; también se lee del primario si el retraso de la réplica
+  supera DB_REPLICA_MAX_LAG segundos, si no responde, o si la vista llama a
+  require_fresh().
+"""
+import functools
+import logging
+import os
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = 'db_replica'
+DEFAULT_READ_AFTER_WRITE = 10.0  # segundos
+DEFAULT_MAX_LAG = 5.0  # segundos
+DEFAULT_CHECK_INTERVAL = 5.0  # segundos entre mediciones del retraso
+UNAVAILABLE_RETRY = 30.0  # segundos sin usar una réplica que no respondió
+
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class _ReplicaState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.lag = 0.0
+        self.available = True
+        self.checked_at = 0.0
+
+
+_state = _ReplicaState()
+
+
+def read_only(view):
+    """Marca una vista como de solo lectura: sus consultas pueden ir a la réplica"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+_read_only_blueprints = set()
+
+
+def read_only_blueprint(blueprint):
+    """Marca todas las vistas del blueprint como de solo lectura"""
+    _read_only_blueprints.add(blueprint.name)
+
+
+def _is_read_only():
+    return g.get('db_read_only') or request.blueprint in _read_only_blueprints
+
+
+def require_fresh():
+    """La petición actual debe leer del primario (datos recién escritos)"""
+    g.db_fresh = True
+
+
+def replica_engine(app=None):
+    return (app or current_app).extensions.get(EXTENSION_KEY)
+
+
+def _measure_lag(engine) -> float:
+    if engine.dialect.name != 'postgresql':
+        return 0.0  # Local stand-in replica: nothing to measure
+    with engine.connect() as connection:
+        return float(connection.execute(LAG_QUERY).scalar() or 0.0)
+
+
+def _replica_is_fresh(engine, config) -> bool:
+    now = time.monotonic()
+    interval = config['DB_REPLICA_CHECK_INTERVAL'] if _state.available else UNAVAILABLE_RETRY
+    if now - _state.checked_at >= interval:
+        with _state.lock:
+            if now - _state.checked_at >= interval:
+                try:
+                    _state.lag = _measure_lag(engine)
+                    if not _state.available:
+                        logger.info("Réplica de lectura disponible nuevamente")
+                    _state.available = True
+                except Exception as e:
+                    logger.warning(f"Réplica de lectura no disponible, se usa el primario: {e}")
+                    _state.available = False
+                _state.checked_at = now
+    return _state.available and _state.lag <= config['DB_REPLICA_MAX_LAG']
+
+
+def _use_replica():
+    """Réplica para la petición actual, o None para usar el primario"""
+    if not has_request_context() or not _is_read_only() or g.get('db_fresh'):
+        return None
+    engine = replica_engine()
+    if engine is None:
+        return None
+    config = current_app.config
+    last_write = session.get('db_last_write')
+    if last_write and time.time() - last_write < config['DB_REPLICA_READ_AFTER_WRITE']:
+        return None
+    if not _replica_is_fresh(engine, config):
+        return None
+    return engine
+
+
+def read_engine():
+    """Motor con el que leería la petición actual: la réplica si aplica, si no el primario"""
+    return _use_replica() or current_app.extensions['sqlalchemy'].engine
+
+
+class RoutingSession(Session):
+    """Session de Flask-SQLAlchemy que envía las lecturas de vistas de solo lectura a la réplica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or getattr(clause, 'is_dml', False):
+                if has_request_context():
+                    g.db_wrote = True
+            else:
+                replica = _use_replica()
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _remember_write(response):
+    # Only needed while a replica is configured: the next reads of this user go to the primary
+    if g.pop('db_wrote', False) and replica_engine() is not None:
+        session['db_last_write'] = time.time()
+    return response
+
+
+def init_app(app):
+    """Crea el motor de la réplica (si DATABASE_REPLICA_URL está definida) y registra el control de frescura"""
+    app.config.setdefault('DATABASE_REPLICA_URL', os.environ.get('DATABASE_REPLICA_URL'))
+    app.config.setdefault('DB_REPLICA_READ_AFTER_WRITE', DEFAULT_READ_AFTER_WRITE)
+    app.config.setdefault('DB_REPLICA_MAX_LAG', DEFAULT_MAX_LAG)
+    app.config.setdefault('DB_REPLICA_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL)
+
+    url = app.config['DATABASE_REPLICA_URL']
+    if url:
+        # Imported here: models imports this module for RoutingSession
+        import db_engine
+        engine = create_engine(url, **db_engine.engine_options(url, app.config))
+        db_engine.attach(engine, app.config)
+        app.extensions[EXTENSION_KEY] = engine
+        logger.info("Réplica de lectura configurada para reportes y exportaciones")
+
+    app.after_request(_remember_write)
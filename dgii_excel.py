@@ -0,0 +1,84 @@
+"""
+Exportación Excel en streaming para los formatos DGII 606 y 607
+El libro se escribe con una hoja write-only de openpyxl: cada fila se serializa
+al agregarla, así la memoria no crece con el número de compras o ventas del
+mes. Las filas vienen de una consulta por columnas leída en lotes (yield_per),
+sin cargar objetos del ORM, y el archivo se escribe en un SpooledTemporaryFile
+que pasa a disco al superar SPOOL_MAX_SIZE.
+
+Los estilos del título y de los encabezados son estilos con nombre creados una
+vez por libro, en lugar de un Font/PatternFill por celda.
+"""
+import tempfile
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle, PatternFill
+from openpyxl.utils import get_column_letter
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+BATCH_SIZE = 1000  # filas por lote leído de la base de datos
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # bytes en memoria antes de pasar a disco
+
+TITLE_STYLE = 'dgii_title'
+HEADER_STYLE = 'dgii_header'
+
+
+def _add_named_styles(workbook):
+    title = NamedStyle(name=TITLE_STYLE)
+    title.font = Font(color='FFFFFF', size=16, bold=True)
+    title.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
+    title.alignment = Alignment(horizontal='center')
+    workbook.add_named_style(title)
+
+    header = NamedStyle(name=HEADER_STYLE)
+    header.font = Font(bold=True)
+    header.fill = PatternFill(start_color='D9E2F3', end_color='D9E2F3', fill_type='solid')
+    workbook.add_named_style(header)
+
+
+def _styled(worksheet, value, style):
+    cell = WriteOnlyCell(worksheet, value=value)
+    cell.style = style
+    return cell
+
+
+def write_report(title, sheet_title, headers, rows, progress=None):
+    """
+    Escribe un reporte DGII (título, encabezados y filas) en un archivo xlsx temporal
+
+    Args:
+        title: Título de la fila 1 (combinada sobre todas las columnas)
+        sheet_title: Nombre de la hoja
+        headers: Encabezados de la fila 3
+        rows: Iterable de filas (listas de valores); se consume una sola vez
+        progress: Función opcional llamada con el número de filas escritas cada BATCH_SIZE filas
+
+    Returns:
+        SpooledTemporaryFile con el libro, posicionado al inicio
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    _add_named_styles(workbook)
+    worksheet = workbook.create_sheet(sheet_title[:31])
+
+    worksheet.merged_cells.add(f'A1:{get_column_letter(len(headers))}1')
+    worksheet.append([_styled(worksheet, title, TITLE_STYLE)])
+    worksheet.append([])
+    worksheet.append([_styled(worksheet, header, HEADER_STYLE) for header in headers])
+
+    for count, row in enumerate(rows, 1):
+        worksheet.append(row)
+        if progress is not None and count % BATCH_SIZE == 0:
+            progress(count)
+
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, suffix='.xlsx')
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+def stream_rows(session, statement, to_row):
+    """Ejecuta una consulta por columnas en lotes de BATCH_SIZE y convierte cada fila con to_row"""
+    result = session.execute(statement.execution_options(yield_per=BATCH_SIZE))
+    for record in result:
+        yield to_row(record)
@@ -0,0 +1,387 @@
+"""
+Particiones mensuales y archivo de períodos fiscales cerrados
+stock_adjustments es una tabla particionada por mes (created_at) en PostgreSQL
+(ver migrate_partitioning.py); ensure_partitions() crea las particiones de los
+próximos meses al arrancar la aplicación y con cada corrida del archivo. Una
+partición DEFAULT recibe cualquier fila fuera de rango, así un insert nunca
+falla por falta de partición.
+
+sales, sale_items y ncf_ledger no se particionan: en PostgreSQL la llave
+primaria y las restricciones únicas de una tabla particionada deben incluir la
+columna de partición, lo que rompería las llaves foráneas hacia sales.id y
+sale_items.id (notas de crédito, NCF anulados, ledger) y la unicidad global de
+sales.ncf y de ncf_ledger (serie, number) que protege contra NCF duplicados.
+Esas tablas se mantienen acotadas con el archivo de períodos.
+
+archive_month() exporta un mes cerrado (ventas, sus artículos, el ledger de
+NCF, los NCF anulados y los ajustes de inventario) a archivos JSONL
+comprimidos con gzip en FISCAL_ARCHIVE_DIR/AAAA-MM/, con un manifest.json de
+conteos y SHA-256, y luego lo elimina de las tablas vivas en la misma
+transacción (la partición del mes de stock_adjustments se separa con DETACH y
+se elimina). archived_sales() lee esos archivos para la vista previa del 607.
+"""
+import enum
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import date, datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from sqlalchemy import and_, delete, func, or_, select, text
+
+import models
+from models import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETENTION_YEARS = 10  # The DGII requires keeping fiscal records for 10 years
+DEFAULT_MONTHS_AHEAD = 3
+
+# Table -> partition key of the tables partitioned by month in PostgreSQL
+PARTITIONED_TABLES = {
+    'stock_adjustments': 'created_at',
+}
+
+# Archived tables, in the order they are written to the month directory
+ARCHIVE_TABLES = ('sales', 'sale_items', 'ncf_ledger', 'cancelled_ncfs', 'stock_adjustments')
+MANIFEST_NAME = 'manifest.json'
+
+
+class ArchiveError(Exception):
+    """El mes no se puede archivar (registros vivos que lo referencian)"""
+
+
+def month_range(year, month):
+    """Inicio (incluido) y fin (excluido) de un mes"""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+
+def _add_months(year, month, count):
+    index = year * 12 + (month - 1) + count
+    return index // 12, index % 12 + 1
+
+
+def partition_name(table, year, month):
+    return f'{table}_p{year}_{month:02d}'
+
+
+# ---------------------------------------------------------------------------
+# Partitions (PostgreSQL only)
+# ---------------------------------------------------------------------------
+
+def is_partitioned(connection, table):
+    """True si la tabla es una tabla particionada de PostgreSQL"""
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text("""
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = :table
+    """), {'table': table}).first() is not None
+
+
+def _partition_exists(connection, name):
+    return connection.execute(text("SELECT to_regclass(:name)"), {'name': name}).scalar() is not None
+
+
+def ensure_partitions(connection, months_ahead=DEFAULT_MONTHS_AHEAD, start=None):
+    """
+    Crea las particiones mensuales que falten desde start (por defecto el mes actual)
+    hasta months_ahead meses después
+
+    Returns:
+        Lista con los nombres de las particiones creadas (vacía fuera de PostgreSQL)
+    """
+    created = []
+    today = date.today()
+    first = (start.year, start.month) if start else (today.year, today.month)
+    last = _add_months(today.year, today.month, months_ahead)
+
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(connection, table):
+            continue
+        year, month = first
+        while (year, month) <= last:
+            name = partition_name(table, year, month)
+            if not _partition_exists(connection, name):
+                lower, upper = month_range(year, month)
+                # Savepoint: rows for this month already in the DEFAULT partition make the CREATE fail
+                try:
+                    with connection.begin_nested():
+                        connection.execute(text(
+                            f"CREATE TABLE {name} PARTITION OF {table} "
+                            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+                        ))
+                    created.append(name)
+                except Exception as e:
+                    logger.warning(f"No se pudo crear la partición {name}: {e}")
+            year, month = _add_months(year, month, 1)
+    return created
+
+
+# ---------------------------------------------------------------------------
+# Archive
+# ---------------------------------------------------------------------------
+
+def archive_dir():
+    from flask import current_app
+    return current_app.config['FISCAL_ARCHIVE_DIR']
+
+
+def _month_dir(directory, year, month):
+    return os.path.join(directory, f'{year}-{month:02d}')
+
+
+def is_archived(year, month, directory=None):
+    """True si el mes ya fue archivado"""
+    return os.path.exists(os.path.join(_month_dir(directory or archive_dir(), year, month), MANIFEST_NAME))
+
+
+def archived_months(directory=None):
+    """Meses archivados, como tuplas (año, mes) ordenadas"""
+    directory = directory or archive_dir()
+    if not os.path.isdir(directory):
+        return []
+    months = []
+    for name in sorted(os.listdir(directory)):
+        if os.path.exists(os.path.join(directory, name, MANIFEST_NAME)):
+            year, month = name.split('-')
+            months.append((int(year), int(month)))
+    return months
+
+
+def read_manifest(year, month, directory=None):
+    with open(os.path.join(_month_dir(directory or archive_dir(), year, month), MANIFEST_NAME)) as manifest:
+        return json.load(manifest)
+
+
+def read_rows(year, month, table, directory=None):
+    """Filas archivadas de una tabla para un mes, como diccionarios"""
+    path = os.path.join(_month_dir(directory or archive_dir(), year, month), f'{table}.jsonl.gz')
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            yield json.loads(line)
+
+
+def archived_sales(year, month, status='completed', directory=None):
+    """
+    Ventas archivadas de un mes con los atributos que usan las vistas DGII
+    (created_at y cancelled_at vuelven a ser datetime)
+    """
+    sales = []
+    for row in read_rows(year, month, 'sales', directory):
+        if status and row.get('status') != status:
+            continue
+        for column in ('created_at', 'cancelled_at'):
+            if row.get(column):
+                row[column] = datetime.fromisoformat(row[column])
+        sales.append(SimpleNamespace(**row))
+    return sales
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Tipo no serializable: {type(value).__name__}')
+
+
+def _month_statements(year, month):
+    """Consultas de cada tabla archivada y del bloqueo por referencias externas"""
+    start, end = month_range(year, month)
+    sales = models.Sale.__table__
+    sale_items = models.SaleItem.__table__
+    ledger = models.NCFLedger.__table__
+    cancelled = models.CancelledNCF.__table__
+    adjustments = models.StockAdjustment.__table__
+
+    sale_ids = select(sales.c.id).where(sales.c.created_at >= start, sales.c.created_at < end)
+    item_ids = select(sale_items.c.id).where(sale_items.c.sale_id.in_(sale_ids))
+    tables = {
+        'sales': (sales, sales.c.id.in_(sale_ids)),
+        'sale_items': (sale_items, sale_items.c.sale_id.in_(sale_ids)),
+        'ncf_ledger': (ledger, or_(ledger.c.sale_id.in_(sale_ids),
+                                   and_(ledger.c.issued_at >= start, ledger.c.issued_at < end))),
+        'cancelled_ncfs': (cancelled, cancelled.c.original_sale_id.in_(sale_ids)),
+        'stock_adjustments': (adjustments, and_(adjustments.c.created_at >= start, adjustments.c.created_at < end)),
+    }
+
+    credit_notes = models.CreditNote.__table__
+    credit_note_items = models.CreditNoteItem.__table__
+    blockers = {
+        'notas de crédito': select(func.count()).select_from(credit_notes).where(
+            credit_notes.c.original_sale_id.in_(sale_ids)),
+        'artículos de notas de crédito': select(func.count()).select_from(credit_note_items).where(
+            credit_note_items.c.original_sale_item_id.in_(item_ids)),
+        'ventas divididas de otro mes': select(func.count()).select_from(sales).where(
+            sales.c.parent_sale_id.in_(sale_ids), ~sales.c.id.in_(sale_ids)),
+    }
+    return tables, blockers
+
+
+def _write_table(connection, path, table, condition):
+    digest = hashlib.sha256()
+    count = 0
+    result = connection.execution_options(stream_results=True).execute(
+        select(table).where(condition).order_by(table.c.id))
+    with gzip.open(path, 'wt', encoding='utf-8') as archive:
+        for row in result.mappings():
+            line = json.dumps(dict(row), default=_json_value, ensure_ascii=False) + '\n'
+            archive.write(line)
+            digest.update(line.encode('utf-8'))
+            count += 1
+    return count, digest.hexdigest()
+
+
+def _delete_month(connection, year, month, tables):
+    sales, sales_condition = tables['sales']
+    adjustments, adjustments_condition = tables['stock_adjustments']
+
+    # Kitchen screen tickets are operational data: dropped, not archived
+    kitchen_tickets = models.KitchenTicket.__table__
+    kitchen_lines = models.KitchenTicketLine.__table__
+    ticket_ids = select(kitchen_tickets.c.id).where(
+        kitchen_tickets.c.sale_id.in_(select(sales.c.id).where(sales_condition)))
+    connection.execute(delete(kitchen_lines).where(kitchen_lines.c.ticket_id.in_(ticket_ids)))
+    connection.execute(delete(kitchen_tickets).where(kitchen_tickets.c.id.in_(ticket_ids)))
+
+    # Children first: items, ledger and cancelled NCFs reference sales; split children reference their parent
+    for name in ('sale_items', 'ncf_ledger', 'cancelled_ncfs'):
+        table, condition = tables[name]
+        connection.execute(delete(table).where(condition))
+    connection.execute(delete(sales).where(sales_condition, sales.c.parent_sale_id.isnot(None)))
+    connection.execute(delete(sales).where(sales_condition))
+
+    partition = partition_name('stock_adjustments', year, month)
+    if is_partitioned(connection, 'stock_adjustments') and _partition_exists(connection, partition):
+        connection.execute(text(f"ALTER TABLE stock_adjustments DETACH PARTITION {partition}"))
+        connection.execute(text(f"DROP TABLE {partition}"))
+    connection.execute(delete(adjustments).where(adjustments_condition))
+
+
+def archive_month(year, month, directory=None, engine=None):
+    """
+    Archiva un mes y lo elimina de las tablas vivas
+
+    Returns:
+        Manifest del mes (conteo y SHA-256 de cada tabla)
+
+    Raises:
+        ArchiveError: si notas de crédito u otras ventas vivas referencian ventas del mes
+    """
+    directory = directory or archive_dir()
+    engine = engine or db.engine
+    tables, blockers = _month_statements(year, month)
+    final_dir = _month_dir(directory, year, month)
+    work_dir = final_dir + '.tmp'
+
+    with engine.begin() as connection:
+        for label, statement in blockers.items():
+            count = connection.execute(statement).scalar()
+            if count:
+                raise ArchiveError(f'{year}-{month:02d}: {count} {label} referencian ventas del mes')
+
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        manifest = {
+            'period': f'{year}-{month:02d}',
+            'archived_at': datetime.utcnow().isoformat(),
+            'format': 'jsonl+gzip',
+            'tables': {},
+        }
+        for name in ARCHIVE_TABLES:
+            table, condition = tables[name]
+            count, sha256 = _write_table(connection, os.path.join(work_dir, f'{name}.jsonl.gz'), table, condition)
+            manifest['tables'][name] = {'file': f'{name}.jsonl.gz', 'rows': count, 'sha256': sha256}
+        with open(os.path.join(work_dir, MANIFEST_NAME), 'w') as output:
+            json.dump(manifest, output, indent=2)
+
+        # The archive is complete on disk before the rows are removed; a failed delete rolls back
+        if os.path.exists(final_dir):
+            shutil.rmtree(final_dir)
+        os.replace(work_dir, final_dir)
+        try:
+            _delete_month(connection, year, month, tables)
+        except Exception:
+            shutil.rmtree(final_dir, ignore_errors=True)
+            raise
+
+    logger.info(f"Período {manifest['period']} archivado en {final_dir}")
+    return manifest
+
+
+def closed_months(years, today=None, engine=None):
+    """Meses con ventas, NCF o ajustes de inventario anteriores al límite de retención"""
+    today = today or date.today()
+    cutoff = datetime(today.year - years, today.month, 1)
+    engine = engine or db.engine
+    sales = models.Sale.__table__
+    ledger = models.NCFLedger.__table__
+    adjustments = models.StockAdjustment.__table__
+
+    with engine.connect() as connection:
+        oldest = [value for value in (
+            connection.execute(select(func.min(sales.c.created_at))).scalar(),
+            connection.execute(select(func.min(ledger.c.issued_at))).scalar(),
+            connection.execute(select(func.min(adjustments.c.created_at))).scalar(),
+        ) if value is not None]
+    if not oldest:
+        return []
+
+    first = min(oldest)
+    months = []
+    year, month = first.year, first.month
+    while datetime(year, month, 1) < cutoff:
+        months.append((year, month))
+        year, month = _add_months(year, month, 1)
+    return months
+
+
+def archive_periods(years=DEFAULT_RETENTION_YEARS, directory=None, dry_run=False, today=None):
+    """
+    Archiva todos los meses cerrados anteriores a years años
+
+    Returns:
+        Diccionario con los meses archivados (manifests) y los omitidos (motivo)
+    """
+    summary = {'archived': [], 'skipped': []}
+    for year, month in closed_months(years, today):
+        if dry_run:
+            summary['archived'].append({'period': f'{year}-{month:02d}'})
+            continue
+        try:
+            summary['archived'].append(archive_month(year, month, directory))
+        except ArchiveError as e:
+            logger.warning(str(e))
+            summary['skipped'].append({'period': f'{year}-{month:02d}', 'reason': str(e)})
+    return summary
+
+
+def init_app(app):
+    """Configura el archivo fiscal y crea las particiones de los próximos meses"""
+    app.config.setdefault('FISCAL_ARCHIVE_DIR', os.environ.get('FISCAL_ARCHIVE_DIR',
+                                                               os.path.join(os.getcwd(), 'fiscal_archive')))
+    app.config.setdefault('FISCAL_PARTITION_MONTHS_AHEAD', DEFAULT_MONTHS_AHEAD)
+
+    with app.app_context():
+        try:
+            if db.engine.dialect.name != 'postgresql':
+                return
+            with db.engine.begin() as connection:
+                created = ensure_partitions(connection, app.config['FISCAL_PARTITION_MONTHS_AHEAD'])
+            if created:
+                logger.info(f"Particiones creadas: {', '.join(created)}")
+        except Exception as e:
+            # Not fatal: the DEFAULT partition takes the rows until the next run
+            logger.warning(f"No se pudieron verificar las particiones mensuales: {e}")
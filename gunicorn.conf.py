@@ -0,0 +1,71 @@
+"""
+Configuración de gunicorn para producción
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Todo se ajusta con variables de entorno:
+
+- GUNICORN_WORKER_CLASS: sync | gthread | gevent (por defecto gthread). gevent
+  necesita sus dependencias: pip install -r requirements-gevent.txt.
+  Con sync cada petición lenta (PDF, exportación DGII, escaneo Bluetooth de 8 s,
+  prueba de impresora de red) ocupa un worker completo; gthread atiende
+  GUNICORN_THREADS peticiones por worker y gevent GUNICORN_WORKER_CONNECTIONS.
+- WEB_CONCURRENCY: número de workers (por defecto 2 x CPU + 1, máximo 8).
+- GUNICORN_THREADS (8), GUNICORN_WORKER_CONNECTIONS (100), GUNICORN_TIMEOUT (120),
+  GUNICORN_KEEPALIVE (5), PORT (5000).
+
+preload_app importa la aplicación una sola vez en el proceso maestro: los
+módulos, los perfiles de impuestos y el mapa de códigos de barras precargados
+se comparten copia-en-escritura con los workers. Las conexiones que el maestro
+abrió al precargar se descartan en post_fork para que ningún worker reutilice
+un socket heredado.
+
+Con gevent se aplica monkey.patch_all() aquí, antes de importar la aplicación,
+para que socket, subprocess, time.sleep y threading sean cooperativos (sondeo de
+impresoras, bluetoothctl), y psycogreen hace cooperativo a psycopg2.
+"""
+import multiprocessing
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        # Without psycogreen every query blocks the whole worker
+        print("⚠️ psycogreen no está instalado: las consultas a PostgreSQL bloquearán el worker gevent")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """Descarta las conexiones del pool heredadas del maestro"""
+    import sys
+
+    main = sys.modules.get('main')
+    if main is None:
+        return
+    with main.app.app_context():
+        engines = list(main.db.engines.values())
+    replica = main.app.extensions.get('db_replica')
+    if replica is not None:
+        engines.append(replica)
+    for engine in engines:
+        # close=False: the parent's sockets stay open for the master, the child just forgets them
+        engine.dispose(close=False)
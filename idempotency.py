@@ -0,0 +1,243 @@
+"""
+Idempotencia de la API del POS (cabecera Idempotency-Key)
+Las tabletas reintentan las peticiones cuando el Wi-Fi falla. Si una petición
+que modifica datos (POST/PUT/PATCH/DELETE) trae la cabecera Idempotency-Key,
+la primera ejecución guarda su respuesta y los reintentos con la misma clave
+reciben esa respuesta guardada sin volver a ejecutar el endpoint.
+
+- La clave se reclama con un INSERT sobre un índice único (usuario + clave):
+  dos reintentos simultáneos no pueden ejecutar ambos el endpoint; el que
+  pierde recibe 409 mientras el otro termina.
+- Reutilizar la clave con otro método, ruta o cuerpo devuelve 422.
+- Las respuestas 5xx, 409 y los archivos no se guardan: la clave se libera y
+  el cliente puede reintentar.
+- Una clave 'processing' más vieja que IDEMPOTENCY_PROCESSING_TIMEOUT segundos
+  se considera abandonada (el worker murió por el timeout de gunicorn o no se
+  pudo guardar la respuesta) y el siguiente reintento la vuelve a reclamar.
+- Los registros vencen a las IDEMPOTENCY_TTL_HOURS horas y se purgan con un
+  DELETE por vencimiento como máximo cada IDEMPOTENCY_PURGE_INTERVAL segundos.
+"""
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta
+
+from flask import Response, g, request, session
+from sqlalchemy.exc import IntegrityError
+
+import models
+from models import db
+from utils import error_response
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 100
+MUTATING_METHODS = frozenset(('POST', 'PUT', 'PATCH', 'DELETE'))
+UNSTORED_STATUSES = frozenset((409, 429))
+
+DEFAULT_TTL_HOURS = 24
+DEFAULT_MAX_BODY = 256 * 1024
+DEFAULT_PURGE_INTERVAL = 600.0  # segundos
+# Longer than the gunicorn timeout (120 s) plus its graceful shutdown
+DEFAULT_PROCESSING_TIMEOUT = 300  # segundos
+
+_last_purge = 0.0
+
+
+def request_fingerprint() -> str:
+    """SHA-256 del método, la ruta con query string y el cuerpo de la petición"""
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(b'\0')
+    digest.update(request.full_path.encode())
+    digest.update(b'\0')
+    digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def purge_expired(now=None) -> int:
+    """Elimina los registros vencidos; devuelve cuántos se borraron"""
+    now = now or datetime.utcnow()
+    deleted = models.IdempotencyRecord.query.filter(
+        models.IdempotencyRecord.expires_at < now
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def _maybe_purge(config):
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge < config['IDEMPOTENCY_PURGE_INTERVAL']:
+        return
+    _last_purge = now
+    try:
+        deleted = purge_expired()
+        if deleted:
+            logger.info(f"Claves de idempotencia vencidas eliminadas: {deleted}")
+    except Exception:
+        db.session.rollback()
+        logger.exception("Error purgando claves de idempotencia")
+
+
+def _reclaimable(record, now, lease) -> bool:
+    """Vencido, o en proceso desde hace más que el plazo de la petición"""
+    if record.expires_at < now:
+        return True
+    return record.status == 'processing' and record.created_at is not None and record.created_at < now - lease
+
+
+def _claim(record_key, fingerprint, ttl, lease):
+    """
+    Reclama la clave con un INSERT; devuelve None si se reclamó o el registro existente
+
+    Un registro vencido que aún no se purgó, o uno 'processing' abandonado, se reemplaza.
+    """
+    for _ in range(2):
+        now = datetime.utcnow()
+        record = models.IdempotencyRecord()
+        record.key = record_key
+        record.fingerprint = fingerprint
+        record.status = 'processing'
+        record.created_at = now
+        record.expires_at = now + ttl
+        db.session.add(record)
+        try:
+            db.session.commit()
+            return None
+        except IntegrityError:
+            db.session.rollback()
+
+        existing = models.IdempotencyRecord.query.filter_by(key=record_key).first()
+        if existing is None:
+            continue  # Released between the insert and the read: claim again
+        if not _reclaimable(existing, now, lease):
+            return existing
+        if existing.status == 'processing':
+            logger.warning(f"Clave de idempotencia {record_key} abandonada desde {existing.created_at}; se reclama")
+        db.session.delete(existing)
+        db.session.commit()
+    return models.IdempotencyRecord.query.filter_by(key=record_key).first()
+
+
+def _stored_response(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return error_response(
+            error_type='validation',
+            message='Clave de idempotencia reutilizada',
+            details=f'La cabecera {HEADER} ya se usó con otra petición (método, ruta o datos distintos)',
+            field=HEADER,
+            status_code=422
+        )
+    if record.status != 'completed':
+        response, status_code = error_response(
+            error_type='business',
+            message='Petición en proceso',
+            details='Una petición con la misma clave de idempotencia todavía se está procesando',
+            field=HEADER,
+            status_code=409
+        )
+        response.headers['Retry-After'] = '1'
+        return response, status_code
+
+    response = Response(record.response_body or b'', status=record.response_status,
+                        content_type=record.response_content_type)
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _release(record_key):
+    models.IdempotencyRecord.query.filter_by(key=record_key, status='processing').delete(
+        synchronize_session=False
+    )
+
+
+def _release_after_error(record_key):
+    """Libera la clave en una transacción aparte para que el cliente pueda reintentar"""
+    try:
+        db.session.rollback()
+        _release(record_key)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception(f"Error liberando clave de idempotencia {record_key}")
+
+
+def init_app(app, blueprint):
+    """Registra la capa de idempotencia en las peticiones del blueprint indicado"""
+    app.config.setdefault('IDEMPOTENCY_ENABLED', True)
+    app.config.setdefault('IDEMPOTENCY_TTL_HOURS', DEFAULT_TTL_HOURS)
+    app.config.setdefault('IDEMPOTENCY_MAX_BODY', DEFAULT_MAX_BODY)
+    app.config.setdefault('IDEMPOTENCY_PURGE_INTERVAL', DEFAULT_PURGE_INTERVAL)
+    app.config.setdefault('IDEMPOTENCY_PROCESSING_TIMEOUT', DEFAULT_PROCESSING_TIMEOUT)
+
+    @blueprint.before_request
+    def claim_idempotency_key():
+        if not app.config['IDEMPOTENCY_ENABLED'] or request.method not in MUTATING_METHODS:
+            return None
+        key = request.headers.get(HEADER)
+        if key is None:
+            return None
+        key = key.strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return error_response(
+                error_type='validation',
+                message='Clave de idempotencia inválida',
+                details=f'La cabecera {HEADER} debe tener entre 1 y {MAX_KEY_LENGTH} caracteres',
+                field=HEADER
+            )
+        user_id = session.get('user_id')
+        if not user_id:
+            return None  # The endpoint answers 401; nothing to protect
+
+        _maybe_purge(app.config)
+        record_key = f'{user_id}:{key}'
+        fingerprint = request_fingerprint()
+        existing = _claim(record_key, fingerprint, timedelta(hours=app.config['IDEMPOTENCY_TTL_HOURS']),
+                          timedelta(seconds=app.config['IDEMPOTENCY_PROCESSING_TIMEOUT']))
+        if existing is not None:
+            return _stored_response(existing, fingerprint)
+        g.idempotency_key = record_key
+        return None
+
+    @blueprint.after_request
+    def store_idempotent_response(response):
+        record_key = g.pop('idempotency_key', None)
+        if record_key is None:
+            return response
+        try:
+            # Whatever the endpoint left uncommitted is discarded at teardown anyway
+            db.session.rollback()
+            storable = (
+                response.status_code < 500
+                and response.status_code not in UNSTORED_STATUSES
+                and not response.direct_passthrough
+                and not response.is_streamed
+            )
+            body = response.get_data() if storable else None
+            if storable and len(body) <= app.config['IDEMPOTENCY_MAX_BODY']:
+                record = models.IdempotencyRecord.query.filter_by(key=record_key).first()
+                if record is not None:
+                    record.status = 'completed'
+                    record.response_status = response.status_code
+                    record.response_content_type = response.content_type
+                    record.response_body = body
+            else:
+                _release(record_key)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception(f"Error guardando respuesta idempotente {record_key}")
+            # Left in 'processing' the key would answer 409 until it expires
+            _release_after_error(record_key)
+        return response
+
+    @blueprint.teardown_request
+    def release_idempotency_key(exception):
+        # after_request did not run (unhandled error): free the key so the client can retry
+        record_key = g.pop('idempotency_key', None)
+        if record_key is None:
+            return
+        _release_after_error(record_key)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Importación del padrón de RNC de la DGII
+
+    python import_rnc_registry.py /ruta/DGII_RNC.zip [--force]
+
+Acepta el .zip que publica la DGII, el DGII_RNC.TXT extraído o un .gz. La
+tabla se actualiza por diferencia: volver a importar el archivo del mes solo
+escribe los contribuyentes nuevos o modificados y elimina los que ya no están.
+Los procesos web recargan su índice de búsqueda en memoria solos.
+"""
+import argparse
+import logging
+
+from main import app
+import rnc_registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Importación del padrón de RNC de la DGII')
+    parser.add_argument('path', help='Archivo DGII_RNC (.zip, .txt o .gz)')
+    parser.add_argument('--force', action='store_true', help='Procesar aunque sea el mismo archivo de la última vez')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    with app.app_context():
+        try:
+            summary = rnc_registry.import_registry(args.path, force=args.force)
+        except ValueError as e:
+            print(f"❌ {e}")
+            raise SystemExit(1)
+
+    if summary['skipped']:
+        print("✅ El archivo es el mismo de la última importación: no hay cambios")
+        return
+    print(f"✅ {summary['rows']} filas leídas en {summary['seconds']} s: "
+          f"{summary['inserted']} nuevas, {summary['updated']} actualizadas, {summary['deleted']} eliminadas")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Worker de trabajos en segundo plano
+
+    python job_worker.py [--threads 2] [--once]
+
+Ejecuta los trabajos encolados por la web (reportes PDF, exportaciones DGII,
+escaneo Bluetooth). Con este proceso en marcha conviene JOBS_IN_PROCESS_WORKERS=0
+en la web para que los workers de gunicorn solo atiendan peticiones.
+"""
+import argparse
+import logging
+import signal
+import threading
+
+from main import app
+import jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker de trabajos en segundo plano')
+    parser.add_argument('--threads', type=int, default=2, help='Trabajos simultáneos')
+    parser.add_argument('--once', action='store_true', help='Ejecutar los trabajos en cola y salir')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.once:
+        with app.app_context():
+            jobs.maintenance(app.config)
+            count = 0
+            while jobs.work_once(jobs.worker_id(0)):
+                count += 1
+        print(f"✅ {count} trabajos ejecutados")
+        return
+
+    stop = threading.Event()
+
+    def shutdown(signum, frame):
+        print("🔄 Deteniendo worker: se terminan los trabajos en curso...")
+        stop.set()
+        jobs._wakeup.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    threads = [
+        threading.Thread(target=jobs.worker_loop, args=(app, jobs.worker_id(index), stop),
+                         name=f'job-worker-{index}')
+        for index in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"✅ Worker de trabajos iniciado con {args.threads} hilos")
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()
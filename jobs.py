@@ -0,0 +1,384 @@
+"""
+Trabajos en segundo plano
+Las operaciones largas de administración (reportes PDF, exportaciones DGII,
+escaneo y vinculación Bluetooth) pueden ejecutarse fuera de la petición para
+que los workers web queden libres para los cobros.
+
+- Los trabajos se guardan en la tabla background_jobs; cualquier proceso del
+  mismo código puede ejecutarlos. Un worker reclama un trabajo con un UPDATE
+  condicional (status='queued'), así dos workers nunca ejecutan el mismo.
+- Las vistas decoradas con @supports_async aceptan async=1 (query string,
+  formulario o JSON): responden 202 con el id del trabajo y el worker ejecuta
+  luego la misma vista con la sesión del usuario. Un archivo de respuesta
+  (send_file) queda como artefacto descargable; un JSON queda como resultado.
+- report_progress() guarda el avance y es el punto de cancelación: si se pidió
+  cancelar, lanza JobCancelled (BaseException, para que los except Exception
+  de las vistas no la atrapen).
+- Workers: `python job_worker.py` como proceso aparte (JOBS_IN_PROCESS_WORKERS=0
+  en la web), o JOBS_IN_PROCESS_WORKERS hilos dentro de cada proceso web, que
+  se inician con el primer trabajo encolado.
+"""
+import functools
+import logging
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, g, has_app_context, jsonify, request, session, url_for
+from sqlalchemy import select, update
+
+import models
+from models import db
+from utils import error_response
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+DEFAULT_IN_PROCESS_WORKERS = 1
+DEFAULT_POLL_INTERVAL = 1.0  # segundos
+DEFAULT_STALE_AFTER = 600  # segundos sin latido: el worker murió
+DEFAULT_RETENTION_HOURS = 24
+MAINTENANCE_INTERVAL = 300.0  # segundos
+
+_handlers = {}
+_wakeup = threading.Event()
+_in_process_lock = threading.Lock()
+_in_process_threads = []
+
+
+class JobCancelled(BaseException):
+    """Se pidió cancelar el trabajo en curso"""
+
+
+def handler(job_type):
+    """Registra la función que ejecuta los trabajos de un tipo: fn(ctx, **params) -> result"""
+    def register(fn):
+        _handlers[job_type] = fn
+        return fn
+    return register
+
+
+class JobContext:
+    """Avance, cancelación y artefacto del trabajo que se está ejecutando"""
+
+    def __init__(self, job_id, artifact_dir):
+        self.job_id = job_id
+        self.artifact_dir = artifact_dir
+        self.artifact = None
+
+    def progress(self, percent, message=None):
+        # Own connection: never commits the view's pending ORM changes
+        table = models.BackgroundJob.__table__
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(table).where(table.c.id == self.job_id).values(
+                    progress=max(0, min(100, int(percent))),
+                    progress_message=message[:200] if message else None,
+                    heartbeat_at=datetime.utcnow()
+                )
+            )
+            cancel = connection.execute(
+                select(table.c.cancel_requested).where(table.c.id == self.job_id)
+            ).scalar()
+        if cancel:
+            raise JobCancelled()
+
+    def save_artifact(self, name, mimetype, chunks):
+        """Escribe el archivo resultado del trabajo; chunks es un iterable de bytes"""
+        name = re.sub(r'[^\w.\-]', '_', name or f'job_{self.job_id}') or f'job_{self.job_id}'
+        directory = os.path.join(self.artifact_dir, str(self.job_id))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.artifact = (path, name, mimetype)
+
+
+def report_progress(percent, message=None):
+    """Avance del trabajo actual; fuera de un trabajo no hace nada"""
+    ctx = g.get('background_job') if has_app_context() else None
+    if ctx is not None:
+        ctx.progress(percent, message)
+
+
+def job_dict(job):
+    return {
+        'id': job.id,
+        'job_type': job.job_type,
+        'status': job.status,
+        'progress': job.progress,
+        'progress_message': job.progress_message,
+        'cancel_requested': job.cancel_requested,
+        'result': job.result,
+        'error': job.error,
+        'artifact_name': job.artifact_name,
+        'artifact_url': url_for('jobs.job_artifact', job_id=job.id) if job.artifact_path else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def enqueue(job_type, params, user_id=None):
+    """Crea un trabajo en cola y despierta a los workers de este proceso"""
+    job = models.BackgroundJob()
+    job.job_type = job_type
+    job.status = 'queued'
+    job.params = params
+    job.progress = 0
+    job.cancel_requested = False
+    job.created_by = user_id
+    db.session.add(job)
+    db.session.commit()
+    _ensure_in_process_workers(current_app._get_current_object())
+    _wakeup.set()
+    return job
+
+
+def cancel(job):
+    """Cancela un trabajo en cola al instante; uno en curso se detiene en su próximo report_progress"""
+    table = models.BackgroundJob.__table__
+    cancelled = db.session.execute(
+        update(table).where(table.c.id == job.id, table.c.status == 'queued').values(
+            status='cancelled', cancel_requested=True, finished_at=datetime.utcnow()
+        )
+    ).rowcount
+    if not cancelled:
+        db.session.execute(
+            update(table).where(table.c.id == job.id, table.c.status == 'running').values(cancel_requested=True)
+        )
+    db.session.commit()
+    db.session.refresh(job)
+    return job
+
+
+# ---------------------------------------------------------------------------
+# Async mode for existing views
+
+
+def _async_requested():
+    # Cache the raw body first: the job replays it after the form has been parsed
+    request.get_data()
+    value = request.args.get('async') or request.form.get('async')
+    if value is None:
+        data = request.get_json(silent=True)
+        value = data.get('async') if isinstance(data, dict) else None
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def supports_async(view):
+    """Con async=1 la vista responde 202 con un trabajo que la ejecuta en segundo plano"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if g.get('background_job') is not None or not _async_requested():
+            return view(*args, **kwargs)
+        if 'user_id' not in session:
+            return error_response(
+                error_type='permission',
+                message='No autorizado',
+                details='Debe iniciar sesión para acceder a este recurso',
+                status_code=401
+            )
+        job = enqueue('view', {
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'query_string': request.query_string.decode('latin-1'),
+            'body': request.get_data(as_text=True),
+            'content_type': request.content_type,
+            'user_id': session['user_id'],
+            'username': session.get('username'),
+            'role': session.get('role'),
+        }, user_id=session['user_id'])
+        response = jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('jobs.job_status', job_id=job.id)
+        })
+        response.status_code = 202
+        return response
+    return wrapper
+
+
+@handler('view')
+def _run_view(ctx, endpoint, method, path, query_string, body, content_type, user_id, username=None, role=None):
+    """Ejecuta la vista con la petición y la sesión guardadas al encolar"""
+    app = current_app._get_current_object()
+    # A fresh app context: its own flask.g and database session, as a real request would have
+    with app.app_context(), app.test_request_context(path, method=method, query_string=query_string,
+                                                     data=body.encode('utf-8'), content_type=content_type):
+        session['user_id'] = user_id
+        session['username'] = username
+        session['role'] = role
+        g.background_job = ctx
+        ctx.progress(5, 'Iniciando')
+
+        response = app.make_response(app.view_functions[endpoint](**(request.view_args or {})))
+        try:
+            if response.status_code >= 300:
+                payload = response.get_json(silent=True) or {}
+                flashes = [message for _, message in session.get('_flashes', [])]
+                raise RuntimeError(payload.get('error') or payload.get('message') or '; '.join(flashes)
+                                   or f'La vista respondió {response.status}')
+
+            if response.is_json:
+                return response.get_json()
+
+            disposition = response.headers.get('Content-Disposition', '')
+            match = re.search(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', disposition)
+            response.direct_passthrough = False
+            ctx.save_artifact(match.group(1) if match else None, response.mimetype, response.iter_encoded())
+            return None
+        finally:
+            response.close()
+
+
+# ---------------------------------------------------------------------------
+# Workers
+
+
+def _claim(worker_id):
+    """Reclama el trabajo en cola más antiguo; devuelve su id o None"""
+    table = models.BackgroundJob.__table__
+    candidates = db.session.execute(
+        select(table.c.id).where(table.c.status == 'queued').order_by(table.c.id).limit(5)
+    ).scalars().all()
+    for job_id in candidates:
+        now = datetime.utcnow()
+        claimed = db.session.execute(
+            update(table).where(table.c.id == job_id, table.c.status == 'queued').values(
+                status='running', worker=worker_id, started_at=now, heartbeat_at=now, progress=0
+            )
+        ).rowcount
+        if claimed:
+            db.session.commit()
+            return job_id
+    db.session.rollback()
+    return None
+
+
+def _finish(job_id, status, **values):
+    table = models.BackgroundJob.__table__
+    db.session.rollback()
+    db.session.execute(
+        update(table).where(table.c.id == job_id).values(status=status, finished_at=datetime.utcnow(), **values)
+    )
+    db.session.commit()
+
+
+def run_job(job_id):
+    """Ejecuta un trabajo ya reclamado y guarda su resultado, error o cancelación"""
+    job = db.session.get(models.BackgroundJob, job_id)
+    ctx = JobContext(job_id, current_app.config['JOBS_ARTIFACT_DIR'])
+    run = _handlers.get(job.job_type)
+    params = dict(job.params or {})
+    db.session.commit()
+    try:
+        if run is None:
+            raise ValueError(f'Tipo de trabajo desconocido: {job.job_type}')
+        result = run(ctx, **params)
+    except JobCancelled:
+        _finish(job_id, 'cancelled', progress_message='Cancelado')
+        logger.info(f"Trabajo {job_id} cancelado")
+    except Exception as e:
+        logger.exception(f"Error en trabajo {job_id} ({job.job_type})")
+        _finish(job_id, 'failed', error=str(e)[:2000])
+    else:
+        values = {'progress': 100, 'progress_message': 'Completado', 'result': result}
+        if ctx.artifact:
+            values.update(artifact_path=ctx.artifact[0], artifact_name=ctx.artifact[1],
+                          artifact_mimetype=ctx.artifact[2])
+        _finish(job_id, 'succeeded', **values)
+    finally:
+        db.session.remove()
+
+
+def work_once(worker_id):
+    """Ejecuta un trabajo en cola si hay; devuelve True si ejecutó alguno"""
+    job_id = _claim(worker_id)
+    if job_id is None:
+        return False
+    run_job(job_id)
+    return True
+
+
+def maintenance(config):
+    """Marca como fallidos los trabajos sin latido y borra los terminados antiguos con sus artefactos"""
+    table = models.BackgroundJob.__table__
+    now = datetime.utcnow()
+    db.session.execute(
+        update(table).where(
+            table.c.status == 'running',
+            table.c.heartbeat_at < now - timedelta(seconds=config['JOBS_STALE_AFTER'])
+        ).values(status='failed', error='El worker se detuvo durante el trabajo', finished_at=now)
+    )
+    old = db.session.execute(
+        select(table.c.id).where(
+            table.c.status.in_(FINISHED_STATUSES),
+            table.c.finished_at < now - timedelta(hours=config['JOBS_RETENTION_HOURS'])
+        )
+    ).scalars().all()
+    for job_id in old:
+        shutil.rmtree(os.path.join(config['JOBS_ARTIFACT_DIR'], str(job_id)), ignore_errors=True)
+    if old:
+        db.session.execute(table.delete().where(table.c.id.in_(old)))
+    db.session.commit()
+    return len(old)
+
+
+def worker_loop(app, worker_id, stop_event):
+    """Bucle de un worker: ejecuta trabajos hasta que stop_event se activa"""
+    poll = app.config['JOBS_POLL_INTERVAL']
+    last_maintenance = 0.0
+    while not stop_event.is_set():
+        with app.app_context():
+            try:
+                if time.monotonic() - last_maintenance >= MAINTENANCE_INTERVAL:
+                    last_maintenance = time.monotonic()
+                    maintenance(app.config)
+                if work_once(worker_id):
+                    continue
+            except Exception:
+                db.session.rollback()
+                logger.exception(f"Error en worker de trabajos {worker_id}")
+            finally:
+                db.session.remove()
+        _wakeup.wait(poll)
+        _wakeup.clear()
+
+
+def worker_id(index):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def _ensure_in_process_workers(app):
+    count = app.config['JOBS_IN_PROCESS_WORKERS']
+    if count <= 0 or len(_in_process_threads) >= count:
+        return
+    with _in_process_lock:
+        while len(_in_process_threads) < count:
+            index = len(_in_process_threads)
+            thread = threading.Thread(target=worker_loop, args=(app, worker_id(index), threading.Event()),
+                                      name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            _in_process_threads.append(thread)
+            logger.info(f"Worker de trabajos en proceso iniciado: {thread.name}")
+
+
+def init_app(app):
+    """Configura los trabajos en segundo plano"""
+    app.config.setdefault('JOBS_IN_PROCESS_WORKERS',
+                          int(os.environ.get('JOBS_IN_PROCESS_WORKERS', DEFAULT_IN_PROCESS_WORKERS)))
+    app.config.setdefault('JOBS_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+    app.config.setdefault('JOBS_STALE_AFTER', DEFAULT_STALE_AFTER)
+    app.config.setdefault('JOBS_RETENTION_HOURS', DEFAULT_RETENTION_HOURS)
+    app.config.setdefault('JOBS_ARTIFACT_DIR', os.environ.get('JOBS_ARTIFACT_DIR',
+                                                              os.path.join(os.getcwd(), 'job_artifacts')))
@@ -0,0 +1,70 @@
+"""
+Serializador JSON compacto para las respuestas de la API
+Reemplaza el proveedor por defecto de Flask: sin indentación, sin ordenar
+claves y, si orjson está instalado, serialización en C (floats incluidos).
+Fechas, Decimal y demás tipos se convierten igual que en Flask, de modo que
+las respuestas son las mismas, solo más pequeñas y rápidas de generar.
+"""
+import json
+import logging
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa json de la librería estándar
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+if orjson is not None:
+    # Datetimes pass through to default() so they keep Flask's HTTP-date format
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class CompactJSONProvider(DefaultJSONProvider):
+    """Proveedor JSON compacto (orjson cuando está disponible)"""
+
+    compact = True
+    sort_keys = False
+
+    def _orjson_default(self, obj):
+        return self.default(obj)
+
+    def dumps_bytes(self, obj) -> bytes:
+        """Serializa a bytes UTF-8 sin espacios"""
+        if orjson is not None:
+            return orjson.dumps(obj, default=self._orjson_default, option=ORJSON_OPTIONS)
+        return json.dumps(
+            obj,
+            default=self.default,
+            ensure_ascii=False,
+            separators=(',', ':'),
+            sort_keys=self.sort_keys
+        ).encode('utf-8')
+
+    def dumps(self, obj, **kwargs) -> str:
+        # Explicit formatting options (indent, cls...) keep the stdlib path
+        if kwargs.keys() - {'separators'}:
+            kwargs.setdefault('default', self.default)
+            kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+            kwargs.setdefault('sort_keys', self.sort_keys)
+            return json.dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def init_app(app):
+    """Registra el proveedor JSON compacto en la aplicación"""
+    app.json_provider_class = CompactJSONProvider
+    app.json = CompactJSONProvider(app)
+    if orjson is None:
+        logger.info("orjson no instalado: JSON compacto con la librería estándar")
@@ -0,0 +1,266 @@
+"""
+Pantalla de cocina (KDS): proyección de pedidos en kitchen_tickets
+Un pedido enviado a cocina se proyecta en un ticket por estación (la estación
+sale de la categoría del producto; sin estación va a DEFAULT_STATION) con una
+línea por cada cantidad enviada. sync_sale() se llama al enviar el pedido y
+cada vez que cambian las líneas de una venta ya enviada: las cantidades nuevas
+se agregan al ticket activo de su estación (o a uno nuevo si ya se despachó) y
+las cantidades quitadas anulan líneas, para que el cocinero vea el cambio.
+
+Cada transacción que modifica tickets toma el siguiente número de
+KitchenCursor y lo guarda en los tickets tocados. La fila del contador queda
+bloqueada hasta el commit, así que las revisiones se confirman en orden y una
+pantalla que pide "revision > cursor" no se salta cambios. changed_since()
+devuelve solo los tickets modificados desde el cursor de la pantalla; los
+despachados o cancelados van reducidos a id y estado.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import selectinload
+
+import models
+from models import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATION = 'cocina'
+ACTIVE = 'active'
+BUMPED = 'bumped'
+CANCELLED = 'cancelled'
+
+# Order statuses that mean the kitchen is done with the order
+DONE_ORDER_STATUSES = (models.OrderStatus.READY, models.OrderStatus.SERVED)
+
+
+def current_revision() -> int:
+    """Última revisión confirmada de los tickets de cocina"""
+    table = models.KitchenCursor.__table__
+    return db.session.execute(select(table.c.revision).where(table.c.id == 1)).scalar() or 0
+
+
+def next_revision() -> int:
+    """Siguiente revisión; bloquea el contador hasta el commit del llamador"""
+    table = models.KitchenCursor.__table__
+    result = db.session.execute(update(table).where(table.c.id == 1).values(revision=table.c.revision + 1))
+    if result.rowcount == 0:
+        db.session.execute(insert(table).values(id=1, revision=1))
+        return 1
+    return db.session.execute(select(table.c.revision).where(table.c.id == 1)).scalar()
+
+
+class _Changes:
+    """Tickets tocados en una transacción; todos comparten una revisión"""
+
+    def __init__(self):
+        self.revision: Optional[int] = None
+        self.tickets: Set[models.KitchenTicket] = set()
+
+    def touch(self, ticket):
+        if self.revision is None:
+            self.revision = next_revision()
+        ticket.revision = self.revision
+        ticket.updated_at = datetime.utcnow()
+        self.tickets.add(ticket)
+
+
+def _stations(product_ids: Iterable[int]) -> dict:
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+    rows = db.session.query(models.Product.id, models.Category.kitchen_station).outerjoin(
+        models.Category, models.Product.category_id == models.Category.id
+    ).filter(models.Product.id.in_(product_ids)).all()
+    return {product_id: station or DEFAULT_STATION for product_id, station in rows}
+
+
+def _new_ticket(sale, station, changes) -> models.KitchenTicket:
+    ticket = models.KitchenTicket()
+    ticket.sale_id = sale.id
+    ticket.station = station
+    ticket.status = ACTIVE
+    ticket.table_label = sale.table.name if sale.table else None
+    ticket.waiter_name = sale.user.name if sale.user else None
+    changes.touch(ticket)
+    db.session.add(ticket)
+    return ticket
+
+
+def _reduce(lines: List[models.KitchenTicketLine], amount: int, changes):
+    """Quita amount unidades de las líneas enviadas, empezando por la más reciente"""
+    for line in sorted(lines, key=lambda line: line.id or 0, reverse=True):
+        if amount <= 0:
+            break
+        if line.quantity <= amount:
+            amount -= line.quantity
+            line.voided = True  # keeps its quantity so the screen shows what was voided
+        else:
+            line.quantity -= amount
+            amount = 0
+        changes.touch(line.ticket)
+
+
+def sync_sale(sale, items=None) -> Set[models.KitchenTicket]:
+    """
+    Actualiza los tickets de cocina de una venta con sus líneas actuales
+
+    No hace nada si la venta no se ha enviado a cocina. Llamar dentro de la
+    transacción que modifica la venta, antes del commit.
+
+    Args:
+        sale: Venta (bloqueada por el llamador)
+        items: Líneas actuales si el llamador acaba de eliminar alguna (por defecto sale.sale_items)
+
+    Returns:
+        Tickets modificados
+    """
+    if sale.order_status in (None, models.OrderStatus.NOT_SENT):
+        return set()
+    if sale.status == 'cancelled':
+        return cancel_sale(sale)
+
+    items = list(sale.sale_items if items is None else items)
+    tickets = models.KitchenTicket.query.filter_by(sale_id=sale.id).options(
+        selectinload(models.KitchenTicket.lines)
+    ).order_by(models.KitchenTicket.id).all()
+
+    sent = defaultdict(list)
+    for ticket in tickets:
+        for line in ticket.lines:
+            if not line.voided:
+                sent[line.sale_item_id].append(line)
+    open_tickets = {ticket.station: ticket for ticket in tickets if ticket.status == ACTIVE}
+    stations = _stations(item.product_id for item in items)
+    changes = _Changes()
+
+    for item in items:
+        lines = sent.pop(item.id, [])
+        delta = item.quantity - sum(line.quantity for line in lines)
+        if delta > 0:
+            station = stations.get(item.product_id, DEFAULT_STATION)
+            ticket = open_tickets.get(station)
+            if ticket is None:
+                ticket = open_tickets[station] = _new_ticket(sale, station, changes)
+            line = models.KitchenTicketLine()
+            line.sale_item_id = item.id
+            line.product_name = item.product.name
+            line.quantity = delta
+            ticket.lines.append(line)
+            changes.touch(ticket)
+        elif delta < 0:
+            _reduce(lines, -delta, changes)
+
+    # Sale lines deleted since they were sent
+    for lines in sent.values():
+        _reduce(lines, sum(line.quantity for line in lines), changes)
+
+    for ticket in changes.tickets:
+        if ticket.status == ACTIVE and ticket.lines and all(line.voided for line in ticket.lines):
+            ticket.status = CANCELLED
+    return changes.tickets
+
+
+def cancel_sale(sale) -> Set[models.KitchenTicket]:
+    """Cancela los tickets activos de una venta cancelada"""
+    changes = _Changes()
+    for ticket in models.KitchenTicket.query.filter_by(sale_id=sale.id, status=ACTIVE).all():
+        ticket.status = CANCELLED
+        changes.touch(ticket)
+    return changes.tickets
+
+
+def order_status_changed(sale) -> Set[models.KitchenTicket]:
+    """Refleja en los tickets un cambio manual de Sale.order_status (listo/servido despacha los tickets)"""
+    if sale.order_status in DONE_ORDER_STATUSES:
+        changes = _Changes()
+        for ticket in models.KitchenTicket.query.filter_by(sale_id=sale.id, status=ACTIVE).all():
+            ticket.status = BUMPED
+            ticket.bumped_at = datetime.utcnow()
+            changes.touch(ticket)
+        return changes.tickets
+    return sync_sale(sale)
+
+
+def bump(ticket):
+    """
+    Despacha un ticket; la venta pasa a lista cuando no le quedan tickets activos
+
+    Raises:
+        ValueError: si el ticket no está activo
+    """
+    if ticket.status != ACTIVE:
+        raise ValueError('Solo se pueden despachar tickets activos')
+    ticket.status = BUMPED
+    ticket.bumped_at = datetime.utcnow()
+    _Changes().touch(ticket)
+    db.session.flush()
+
+    sale = ticket.sale
+    remaining = models.KitchenTicket.query.filter_by(sale_id=sale.id, status=ACTIVE).count()
+    if not remaining and sale.order_status in (models.OrderStatus.SENT_TO_KITCHEN,
+                                               models.OrderStatus.IN_PREPARATION):
+        sale.order_status = models.OrderStatus.READY
+
+
+def recall(ticket):
+    """
+    Devuelve a la pantalla un ticket despachado por error
+
+    Raises:
+        ValueError: si el ticket no está despachado
+    """
+    if ticket.status != BUMPED:
+        raise ValueError('Solo se pueden recuperar tickets despachados')
+    ticket.status = ACTIVE
+    ticket.bumped_at = None
+    _Changes().touch(ticket)
+    if ticket.sale.order_status in DONE_ORDER_STATUSES:
+        ticket.sale.order_status = models.OrderStatus.IN_PREPARATION
+
+
+def changed_since(since: int = 0, station: Optional[str] = None) -> Tuple[int, bool, List[models.KitchenTicket]]:
+    """
+    Tickets modificados desde el cursor de una pantalla
+
+    Con since=0 (o un cursor mayor que el actual, p. ej. tras restaurar la base
+    de datos) devuelve todos los tickets activos.
+
+    Returns:
+        (cursor nuevo, True si es la lista completa, tickets)
+    """
+    cursor = current_revision()
+    full = not since or since > cursor
+    query = models.KitchenTicket.query.options(selectinload(models.KitchenTicket.lines))
+    if full:
+        query = query.filter(models.KitchenTicket.status == ACTIVE)
+    else:
+        # Upper bound: a ticket committed after reading the cursor is sent on the next poll
+        query = query.filter(models.KitchenTicket.revision > since, models.KitchenTicket.revision <= cursor)
+    if station:
+        query = query.filter(models.KitchenTicket.station == station)
+    return cursor, full, query.order_by(models.KitchenTicket.created_at, models.KitchenTicket.id).all()
+
+
+def ticket_dict(ticket) -> dict:
+    """Ticket para la pantalla; los que salen de la pantalla van solo con id y estado"""
+    if ticket.status != ACTIVE:
+        return {'id': ticket.id, 'status': ticket.status}
+    return {
+        'id': ticket.id,
+        'status': ticket.status,
+        'sale_id': ticket.sale_id,
+        'station': ticket.station,
+        'table': ticket.table_label,
+        'waiter': ticket.waiter_name,
+        'created_at': ticket.created_at.isoformat() if ticket.created_at else None,
+        'updated_at': ticket.updated_at.isoformat() if ticket.updated_at else None,
+        'lines': [{
+            'id': line.id,
+            'name': line.product_name,
+            'qty': line.quantity,
+            'voided': line.voided
+        } for line in ticket.lines]
+    }
@@ -0,0 +1,178 @@
+"""
+Alertas de stock bajo: proyección en low_stock_alerts
+Guarda solo los productos inventariables activos con stock en o bajo el
+mínimo (nivel 'low') o en o bajo la mitad del mínimo (nivel 'critical'), para
+que el dashboard y las pantallas de inventario lean O(alertas) en vez de
+recorrer el catálogo.
+
+refresh() se llama dentro de la transacción que mueve el stock: stock_control
+lo hace al descontar y reponer (ventas, cancelaciones, notas de crédito,
+compras) e inventario al ajustar stock o editar un producto. Si el nivel de
+un producto no cambia no se escribe nada; cuando cruza un umbral se
+actualiza su fila y se registra un StockAlertEvent con la siguiente revisión
+de StockAlertCursor. Igual que en la pantalla de cocina, la fila del contador
+queda bloqueada hasta el commit, así que las revisiones se confirman en orden
+y changed_since() no se salta cruces. Los cruces son raros comparados con las
+ventas, así que el bloqueo casi nunca se toma.
+"""
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import contains_eager
+
+import models
+from models import db
+
+logger = logging.getLogger(__name__)
+
+LOW = 'low'
+CRITICAL = 'critical'
+
+
+def level_for(stock: int, min_stock: int, product_type: str = 'inventariable', active: bool = True) -> Optional[str]:
+    """Nivel de alerta de un producto, o None si no está en alerta"""
+    if not active or product_type != 'inventariable' or stock is None or min_stock is None:
+        return None
+    # Same thresholds as before: stock <= min_stock / 2 is critical, stock <= min_stock is low
+    if stock * 2 <= min_stock:
+        return CRITICAL
+    if stock <= min_stock:
+        return LOW
+    return None
+
+
+def current_revision() -> int:
+    """Última revisión confirmada de las alertas de stock"""
+    table = models.StockAlertCursor.__table__
+    return db.session.execute(select(table.c.revision).where(table.c.id == 1)).scalar() or 0
+
+
+def next_revision() -> int:
+    """Siguiente revisión; bloquea el contador hasta el commit del llamador"""
+    table = models.StockAlertCursor.__table__
+    result = db.session.execute(update(table).where(table.c.id == 1).values(revision=table.c.revision + 1))
+    if result.rowcount == 0:
+        db.session.execute(insert(table).values(id=1, revision=1))
+        return 1
+    return db.session.execute(select(table.c.revision).where(table.c.id == 1)).scalar()
+
+
+def refresh(product_ids: Iterable[int]) -> List[models.StockAlertEvent]:
+    """
+    Recalcula el nivel de alerta de los productos tras mover su stock
+
+    Llamar antes de db.session.commit(), después de escribir el stock nuevo.
+    Una sola consulta para los productos; solo escribe si alguno cruza un umbral.
+
+    Returns:
+        Eventos de cruce registrados
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return []
+
+    rows = db.session.query(
+        models.Product.id, models.Product.stock, models.Product.min_stock,
+        models.Product.product_type, models.Product.active, models.LowStockAlert
+    ).outerjoin(
+        models.LowStockAlert, models.LowStockAlert.product_id == models.Product.id
+    ).filter(models.Product.id.in_(product_ids)).order_by(models.Product.id).all()
+
+    revision = None
+    events = []
+    for product_id, stock, min_stock, product_type, active, alert in rows:
+        previous = alert.level if alert else None
+        level = level_for(stock, min_stock, product_type, active)
+        if level == previous:
+            continue
+
+        if revision is None:
+            revision = next_revision()
+        if level is None:
+            db.session.delete(alert)
+        elif alert is None:
+            db.session.add(models.LowStockAlert(product_id=product_id, level=level, revision=revision))
+        else:
+            alert.level = level
+            alert.revision = revision
+
+        event = models.StockAlertEvent(product_id=product_id, previous_level=previous, level=level,
+                                       stock=stock or 0, min_stock=min_stock or 0, revision=revision)
+        db.session.add(event)
+        events.append(event)
+
+    if events:
+        logger.info('Stock alerts: %d threshold crossings at revision %d', len(events), revision)
+    return events
+
+
+def rebuild() -> int:
+    """
+    Recalcula toda la proyección a partir de products (migración o reparación)
+
+    Returns:
+        Número de cruces registrados
+    """
+    candidates = {product_id for (product_id,) in db.session.query(models.Product.id).filter(
+        models.Product.stock <= models.Product.min_stock,
+        models.Product.active == True,
+        models.Product.product_type == 'inventariable'
+    ).all()}
+    candidates.update(product_id for (product_id,) in db.session.query(models.LowStockAlert.product_id).all())
+    return len(refresh(candidates))
+
+
+def alerts() -> List[models.LowStockAlert]:
+    """Alertas vigentes con su producto y categoría, los críticos primero"""
+    return models.LowStockAlert.query.join(models.LowStockAlert.product).options(
+        contains_eager(models.LowStockAlert.product).joinedload(models.Product.category)
+    ).order_by(
+        (models.LowStockAlert.level == CRITICAL).desc(), models.Product.name
+    ).all()
+
+
+def changed_since(since: int) -> Tuple[int, bool, List[models.StockAlertEvent]]:
+    """
+    Cruces de umbral registrados desde el cursor de un cliente
+
+    Con since=0 (o un cursor mayor que el actual, p. ej. tras restaurar la base
+    de datos) no hay historial que enviar: el cliente debe tomar la lista completa.
+
+    Returns:
+        (cursor nuevo, True si el cliente debe reemplazar su lista, eventos)
+    """
+    cursor = current_revision()
+    if not since or since > cursor:
+        return cursor, True, []
+    # Upper bound: a crossing committed after reading the cursor is sent on the next poll
+    events = models.StockAlertEvent.query.filter(
+        models.StockAlertEvent.revision > since,
+        models.StockAlertEvent.revision <= cursor
+    ).order_by(models.StockAlertEvent.id).all()
+    return cursor, False, events
+
+
+def alert_dict(alert) -> dict:
+    product = alert.product
+    return {
+        'id': product.id,
+        'name': product.name,
+        'current_stock': product.stock,
+        'min_stock': product.min_stock,
+        'category': product.category.name if product.category else None,
+        'status': alert.level,
+        'since': alert.since.isoformat() if alert.since else None
+    }
+
+
+def event_dict(event) -> dict:
+    return {
+        'product_id': event.product_id,
+        'from': event.previous_level,
+        'to': event.level,
+        'stock': event.stock,
+        'min_stock': event.min_stock,
+        'revision': event.revision,
+        'at': event.created_at.isoformat() if event.created_at else None
+    }
@@ -113,6 +113,16 @@ app.config['SESSION_COOKIE_SECURE'] = os.environ.get("ENVIRONMENT") == "producti
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # Better UX than 'Strict' while still secure
 
+# Compact JSON (orjson when installed) and negotiated gzip/brotli for text and JSON responses
+import json_provider
+import response_compression
+json_provider.init_app(app)
+response_compression.init_app(app)
+
+# Fingerprinted static assets: url_for('static', ...) resolves through static/dist/asset-manifest.json
+import static_assets
+static_assets.init_app(app)
+
 # Make csrf_token available in all templates
 @app.context_processor
 def inject_csrf_token():
@@ -121,17 +131,22 @@ def inject_csrf_token():
     
 # configure the database, relative to the app instance folder
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
 
 # Import models and get db instance
 import models  # noqa: F401
 from models import db
 
+# Pool sized to the gunicorn worker model, per-blueprint statement_timeout and pool metrics
+import db_engine
+db_engine.configure(app)
+
 # initialize the app with the extension, flask-sqlalchemy >= 3.0.x
 db.init_app(app)
+db_engine.init_app(app)
+
+# Read replica for reports and exports (DATABASE_REPLICA_URL), with read-after-write and lag guards
+import db_routing
+db_routing.init_app(app)
 
 # Database initialization - use proper migration tools for production
 # with app.app_context():
@@ -142,9 +157,36 @@ db.init_app(app)
 # Printer settings are no longer synced to environment variables
 # The system now uses native browser print dialogs exclusively
 
+# Per-product tax profile cache, warmed once at startup
+import tax_profiles
+tax_profiles.init_app(app)
+
+# Barcode/SKU -> product map for the scanner endpoint
+import product_codes
+product_codes.init_app(app)
+
+# DGII RNC registry: in-memory prefix index for customer autocompletion
+import rnc_registry
+rnc_registry.init_app(app)
+
+# Monthly partitions of stock_adjustments and archive of closed fiscal periods
+import fiscal_archive
+fiscal_archive.init_app(app)
+
 # Import routes after app initialization
-from routes import auth, admin, waiter, api, inventory, dgii, test_api, fiscal_audit
+from routes import auth, admin, waiter, api, inventory, dgii, test_api, fiscal_audit, background_jobs, kitchen_display
+
+# Background jobs for reports, DGII exports and Bluetooth scans (?async=1 on those endpoints)
+import jobs
+jobs.init_app(app)
+
+# Transactional outbox of sale, NCF and stock events (delivered by outbox_relay.py)
+import outbox
+outbox.init_app(app)
 
+# Idempotency-Key replay for the POS API (hooks must be added before the blueprint is registered)
+import idempotency
+idempotency.init_app(app, api.bp)
 
 # Register blueprints
 app.register_blueprint(auth.bp)
@@ -155,6 +197,8 @@ app.register_blueprint(inventory.bp)
 app.register_blueprint(dgii.bp)
 app.register_blueprint(test_api.bp)
 app.register_blueprint(fiscal_audit.bp)
+app.register_blueprint(background_jobs.bp)
+app.register_blueprint(kitchen_display.bp)
 
 
 # Main application routes
@@ -183,7 +227,10 @@ def favicon():
 @app.after_request
 def add_cache_headers(response):
     """Add proper cache control headers for static vs dynamic content"""
-    if request.endpoint in ('static', 'favicon', 'service_worker'):
+    if request.endpoint == 'static' and static_assets.is_fingerprinted(request.view_args.get('filename', '')):
+        # Content-hashed filenames never change: cache for a year without revalidation
+        response.headers['Cache-Control'] = static_assets.IMMUTABLE_CACHE_CONTROL
+    elif request.endpoint in ('static', 'favicon', 'service_worker'):
         # Allow caching for static assets in production, but force reload in development
         if os.environ.get("ENVIRONMENT") == "production":
             # Cache static assets for 1 hour in production
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Migration script for background jobs
+Creates the background_jobs table used by the job runner (PDF reports,
+DGII exports and Bluetooth scans executed outside the web request)
+"""
+
+from main import app, db
+from sqlalchemy import text
+
+def create_background_jobs():
+    """Create background_jobs with its status index"""
+    with app.app_context():
+        try:
+            print("🔄 Creating background_jobs table...")
+            db.session.execute(text("""
+                CREATE TABLE IF NOT EXISTS background_jobs (
+                    id SERIAL PRIMARY KEY,
+                    job_type VARCHAR(50) NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                    params JSON,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    progress_message VARCHAR(200),
+                    cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+                    result JSON,
+                    error TEXT,
+                    artifact_path VARCHAR(500),
+                    artifact_name VARCHAR(200),
+                    artifact_mimetype VARCHAR(100),
+                    worker VARCHAR(100),
+                    created_by INTEGER REFERENCES users(id),
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    started_at TIMESTAMP,
+                    heartbeat_at TIMESTAMP,
+                    finished_at TIMESTAMP
+                );
+            """))
+            db.session.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_background_jobs_status ON background_jobs (status);
+            """))
+            db.session.commit()
+            print("✅ Migration completed successfully")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    create_background_jobs()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Migration script for the per-session cash ledger
+Adds sales.cash_session_id and the running totals columns on cash_sessions,
+links existing sales to the session that was open when they were created,
+and fills the running totals from those linked sales
+"""
+
+from main import app, db
+from sqlalchemy import text
+import cash_ledger
+
+LEDGER_COLUMNS = [
+    ('cash_sales_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('cash_sales_total', 'DOUBLE PRECISION NOT NULL DEFAULT 0'),
+    ('card_sales_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('card_sales_total', 'DOUBLE PRECISION NOT NULL DEFAULT 0'),
+    ('transfer_sales_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('transfer_sales_total', 'DOUBLE PRECISION NOT NULL DEFAULT 0'),
+    ('cancelled_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('cancelled_total', 'DOUBLE PRECISION NOT NULL DEFAULT 0'),
+]
+
+def add_cash_session_ledger():
+    """Add ledger columns, link historical sales and backfill running totals"""
+    with app.app_context():
+        try:
+            # sales.cash_session_id
+            result = db.session.execute(text("""
+                SELECT column_name
+                FROM information_schema.columns
+                WHERE table_name='sales' AND column_name='cash_session_id';
+            """))
+            if result.fetchone():
+                print("✅ sales.cash_session_id already exists")
+            else:
+                print("🔄 Adding cash_session_id column to sales table...")
+                db.session.execute(text("""
+                    ALTER TABLE sales
+                    ADD COLUMN cash_session_id INTEGER REFERENCES cash_sessions(id);
+                """))
+                db.session.execute(text("""
+                    CREATE INDEX IF NOT EXISTS ix_sales_cash_session_id ON sales (cash_session_id);
+                """))
+                print("✅ Successfully added cash_session_id column")
+
+            # cash_sessions running totals
+            result = db.session.execute(text("""
+                SELECT column_name
+                FROM information_schema.columns
+                WHERE table_name='cash_sessions';
+            """))
+            existing_columns = {row[0] for row in result.fetchall()}
+
+            for column_name, column_type in LEDGER_COLUMNS:
+                if column_name in existing_columns:
+                    continue
+                print(f"🔄 Adding {column_name} column to cash_sessions table...")
+                db.session.execute(text(f"ALTER TABLE cash_sessions ADD COLUMN {column_name} {column_type};"))
+
+            db.session.commit()
+
+            # Link historical sales to the session open on their register at creation time
+            print("🔄 Linking existing sales to their cash sessions...")
+            result = db.session.execute(text("""
+                UPDATE sales s
+                SET cash_session_id = cs.id
+                FROM cash_sessions cs
+                WHERE s.cash_session_id IS NULL
+                  AND s.status IN ('completed', 'cancelled')
+                  AND s.cash_register_id = cs.cash_register_id
+                  AND s.created_at >= cs.opened_at
+                  AND (cs.closed_at IS NULL OR s.created_at <= cs.closed_at);
+            """))
+            db.session.commit()
+            print(f"✅ {result.rowcount} sales linked")
+
+            print("🔄 Filling running totals from linked sales...")
+            mismatches = cash_ledger.reconcile_sessions(fix=True)
+            print(f"✅ {len(mismatches)} ledger values initialized")
+
+            print("✅ Migration completed successfully")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    add_cash_session_ledger()
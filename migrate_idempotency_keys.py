@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Migration script for API idempotency keys
+Creates the idempotency_keys table used by the Idempotency-Key layer of the
+POS API (stored responses replayed on client retries)
+"""
+
+from main import app, db
+from sqlalchemy import text
+
+def create_idempotency_keys():
+    """Create idempotency_keys with its unique key and expiry indexes"""
+    with app.app_context():
+        try:
+            print("🔄 Creating idempotency_keys table...")
+            db.session.execute(text("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    id SERIAL PRIMARY KEY,
+                    key VARCHAR(140) NOT NULL,
+                    fingerprint VARCHAR(64) NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'processing',
+                    response_status INTEGER,
+                    response_content_type VARCHAR(100),
+                    response_body BYTEA,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    expires_at TIMESTAMP NOT NULL
+                );
+            """))
+            db.session.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idempotency_keys_key_key ON idempotency_keys (key);
+            """))
+            db.session.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys (expires_at);
+            """))
+            db.session.commit()
+            print("✅ Migration completed successfully")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    create_idempotency_keys()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Migration script for the kitchen display (KDS)
+Adds categories.kitchen_station, the kitchen_tickets / kitchen_ticket_lines
+projection and the kitchen_cursor revision counter, then projects the pending
+orders already sent to the kitchen so the screens start with them
+"""
+
+from main import app, db
+from sqlalchemy import text
+import models
+import kitchen
+
+def add_kitchen_tickets():
+    """Create KDS tables and project orders currently in the kitchen"""
+    with app.app_context():
+        try:
+            print("🔄 Adding kitchen_station column to categories...")
+            db.session.execute(text("""
+                ALTER TABLE categories
+                ADD COLUMN IF NOT EXISTS kitchen_station VARCHAR(50);
+            """))
+            db.session.commit()
+            print("✅ Column ready")
+
+            print("🔄 Creating kitchen_tickets, kitchen_ticket_lines and kitchen_cursor tables...")
+            for model in (models.KitchenTicket, models.KitchenTicketLine, models.KitchenCursor):
+                model.__table__.create(db.engine, checkfirst=True)
+            db.session.execute(text("""
+                INSERT INTO kitchen_cursor (id, revision) VALUES (1, 0)
+                ON CONFLICT (id) DO NOTHING;
+            """))
+            db.session.commit()
+            print("✅ Tables ready")
+
+            print("🔄 Projecting pending orders already sent to the kitchen...")
+            sales = models.Sale.query.filter(
+                models.Sale.status == 'pending',
+                models.Sale.order_status.in_([models.OrderStatus.SENT_TO_KITCHEN,
+                                              models.OrderStatus.IN_PREPARATION])
+            ).all()
+            tickets = 0
+            for sale in sales:
+                tickets += len(kitchen.sync_sale(sale))
+            db.session.commit()
+            print(f"✅ {tickets} tickets created for {len(sales)} orders")
+
+            print("✅ Migration completed successfully")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    add_kitchen_tickets()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Migration script for the low-stock alert projection
+Creates low_stock_alerts, stock_alert_events and the stock_alert_cursor
+revision counter, then seeds the alert set from the current products so the
+dashboard and inventory screens read it instead of scanning the catalog
+"""
+
+from main import app, db
+from sqlalchemy import text
+import models
+import low_stock
+
+def add_low_stock_alerts():
+    """Create stock alert tables and seed them from products"""
+    with app.app_context():
+        try:
+            print("🔄 Creating low_stock_alerts, stock_alert_events and stock_alert_cursor tables...")
+            for model in (models.LowStockAlert, models.StockAlertEvent, models.StockAlertCursor):
+                model.__table__.create(db.engine, checkfirst=True)
+            db.session.execute(text("""
+                INSERT INTO stock_alert_cursor (id, revision) VALUES (1, 0)
+                ON CONFLICT (id) DO NOTHING;
+            """))
+            db.session.commit()
+            print("✅ Tables ready")
+
+            print("🔄 Seeding alerts from current stock levels...")
+            crossings = low_stock.rebuild()
+            db.session.commit()
+            total = models.LowStockAlert.query.count()
+            print(f"✅ {total} products in alert ({crossings} changes recorded)")
+
+            print("✅ Migration completed successfully")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    add_low_stock_alerts()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Migration script for the NCF integrity checker
+Creates ncf_integrity_checkpoints / ncf_integrity_issues and the cancelled_ncfs
+ncf index the checker uses to read each sequence by NCF range
+"""
+
+from main import app, db
+from sqlalchemy import text
+
+def add_ncf_integrity():
+    """Create NCF integrity tables and indexes"""
+    with app.app_context():
+        try:
+            print("🔄 Creating ncf_integrity_checkpoints table...")
+            db.session.execute(text("""
+                CREATE TABLE IF NOT EXISTS ncf_integrity_checkpoints (
+                    sequence_id INTEGER PRIMARY KEY REFERENCES ncf_sequences(id),
+                    checked_through INTEGER NOT NULL,
+                    last_run_at TIMESTAMP,
+                    last_full_run_at TIMESTAMP
+                );
+            """))
+            db.session.commit()
+            print("✅ ncf_integrity_checkpoints ready")
+
+            print("🔄 Creating ncf_integrity_issues table...")
+            db.session.execute(text("""
+                CREATE TABLE IF NOT EXISTS ncf_integrity_issues (
+                    id SERIAL PRIMARY KEY,
+                    sequence_id INTEGER NOT NULL REFERENCES ncf_sequences(id),
+                    kind VARCHAR(20) NOT NULL,
+                    number_from INTEGER NOT NULL,
+                    number_to INTEGER NOT NULL,
+                    detail JSON,
+                    detected_at TIMESTAMP DEFAULT NOW()
+                );
+            """))
+            db.session.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_ncf_integrity_issues_sequence_number
+                ON ncf_integrity_issues (sequence_id, number_from);
+            """))
+            db.session.commit()
+            print("✅ ncf_integrity_issues ready")
+
+            # sales.ncf and credit_notes.ncf are UNIQUE (indexed); cancelled_ncfs.ncf only
+            # when migrate_unique_cancelled_ncf.py ran, so make sure range scans have an index
+            print("🔄 Adding cancelled_ncfs.ncf index for range scans...")
+            db.session.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_cancelled_ncfs_ncf ON cancelled_ncfs (ncf);
+            """))
+            db.session.commit()
+            print("✅ Index ready")
+
+            print("✅ Migration completed successfully")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    add_ncf_integrity()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Migration script for offline sale replay
+Adds sales.client_uuid with a unique index so sales queued offline by the POS
+can be replayed idempotently
+"""
+
+from main import app, db
+from sqlalchemy import text
+
+def add_sale_client_uuid():
+    """Add client_uuid column and its unique index to sales table"""
+    with app.app_context():
+        try:
+            result = db.session.execute(text("""
+                SELECT column_name
+                FROM information_schema.columns
+                WHERE table_name='sales' AND column_name='client_uuid';
+            """))
+
+            if result.fetchone():
+                print("✅ sales.client_uuid already exists")
+            else:
+                print("🔄 Adding client_uuid column to sales table...")
+                db.session.execute(text("""
+                    ALTER TABLE sales
+                    ADD COLUMN client_uuid VARCHAR(36);
+                """))
+                print("✅ Successfully added client_uuid column")
+
+            print("🔄 Creating unique index on sales.client_uuid...")
+            db.session.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS sales_client_uuid_key ON sales (client_uuid);
+            """))
+            db.session.commit()
+            print("✅ Migration completed successfully")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    add_sale_client_uuid()
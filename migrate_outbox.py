@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Migration script for the transactional outbox
+Creates outbox_events (BIGSERIAL id: the relay delivers in id order) and
+outbox_consumers (one delivery cursor per downstream consumer)
+"""
+
+from main import app, db
+from sqlalchemy import text
+
+def add_outbox():
+    """Create outbox tables"""
+    with app.app_context():
+        try:
+            print("🔄 Creating outbox_events table...")
+            db.session.execute(text("""
+                CREATE TABLE IF NOT EXISTS outbox_events (
+                    id BIGSERIAL PRIMARY KEY,
+                    event_type VARCHAR(50) NOT NULL,
+                    aggregate_id INTEGER,
+                    payload TEXT NOT NULL,
+                    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+                );
+            """))
+            db.session.commit()
+            print("✅ outbox_events ready")
+
+            print("🔄 Creating outbox_consumers table...")
+            db.session.execute(text("""
+                CREATE TABLE IF NOT EXISTS outbox_consumers (
+                    name VARCHAR(50) PRIMARY KEY,
+                    last_event_id BIGINT NOT NULL DEFAULT 0,
+                    delivered_count BIGINT NOT NULL DEFAULT 0,
+                    failures INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    last_delivered_at TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT NOW()
+                );
+            """))
+            db.session.commit()
+            print("✅ outbox_consumers ready")
+
+            print("✅ Migration completed successfully")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    add_outbox()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Migration script for monthly range partitioning (PostgreSQL)
+Rebuilds stock_adjustments as a table partitioned by month on created_at,
+moves the existing rows into their monthly partitions and creates the
+partitions for the next months plus a DEFAULT partition.
+
+sales, sale_items and ncf_ledger are not partitioned: a partitioned table's
+primary key and unique constraints must include the partition column, which
+would drop the foreign keys to sales.id / sale_items.id and the global
+uniqueness of sales.ncf and ncf_ledger (serie, number). For those tables this
+script adds the indexes used by monthly scans and by the fiscal archive
+(archive_fiscal_periods.py).
+"""
+
+from main import app, db
+from sqlalchemy import text
+import fiscal_archive
+
+def add_partitioning():
+    """Partition stock_adjustments by month and index the archived tables"""
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            print("❌ Partitioning requires PostgreSQL")
+            return
+
+        try:
+            print("🔄 Creating indexes on sale_items (sale_id) and ncf_ledger (issued_at)...")
+            db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_sale_items_sale_id ON sale_items (sale_id);"))
+            db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_ncf_ledger_issued_at ON ncf_ledger (issued_at);"))
+            db.session.commit()
+            print("✅ Indexes ready")
+
+            connection = db.session.connection()
+            if fiscal_archive.is_partitioned(connection, 'stock_adjustments'):
+                print("✅ stock_adjustments is already partitioned")
+                created = fiscal_archive.ensure_partitions(connection)
+                db.session.commit()
+                print(f"✅ {len(created)} future partitions created")
+                return
+
+            print("🔄 Rebuilding stock_adjustments as a partitioned table...")
+            db.session.execute(text("LOCK TABLE stock_adjustments IN ACCESS EXCLUSIVE MODE;"))
+            db.session.execute(text("UPDATE stock_adjustments SET created_at = NOW() WHERE created_at IS NULL;"))
+            db.session.execute(text("ALTER TABLE stock_adjustments RENAME TO stock_adjustments_legacy;"))
+            db.session.execute(text("ALTER INDEX stock_adjustments_pkey RENAME TO stock_adjustments_legacy_pkey;"))
+            db.session.execute(text("""
+                CREATE TABLE stock_adjustments (
+                    LIKE stock_adjustments_legacy INCLUDING DEFAULTS
+                ) PARTITION BY RANGE (created_at);
+            """))
+            # The id sequence now belongs to the new table so dropping the legacy table keeps it
+            db.session.execute(text("ALTER SEQUENCE stock_adjustments_id_seq OWNED BY stock_adjustments.id;"))
+            db.session.execute(text("""
+                ALTER TABLE stock_adjustments
+                    ALTER COLUMN created_at SET NOT NULL,
+                    ADD CONSTRAINT stock_adjustments_pkey PRIMARY KEY (id, created_at),
+                    ADD CONSTRAINT stock_adjustments_product_id_fkey
+                        FOREIGN KEY (product_id) REFERENCES products (id),
+                    ADD CONSTRAINT stock_adjustments_user_id_fkey
+                        FOREIGN KEY (user_id) REFERENCES users (id);
+            """))
+
+            oldest = db.session.execute(text("SELECT MIN(created_at) FROM stock_adjustments_legacy;")).scalar()
+            created = fiscal_archive.ensure_partitions(connection, start=oldest)
+            db.session.execute(text("CREATE TABLE stock_adjustments_default PARTITION OF stock_adjustments DEFAULT;"))
+            print(f"✅ {len(created)} monthly partitions and the DEFAULT partition created")
+
+            print("🔄 Moving existing rows into the monthly partitions...")
+            result = db.session.execute(text("INSERT INTO stock_adjustments SELECT * FROM stock_adjustments_legacy;"))
+            db.session.execute(text("DROP TABLE stock_adjustments_legacy;"))
+            db.session.commit()
+            print(f"✅ {result.rowcount} rows moved")
+
+            print("✅ Migration completed successfully")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    add_partitioning()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Migration script for product barcodes
+Adds products.barcode and products.sku with unique indexes, and the
+product_barcodes table for alternate codes, used by the scanner endpoint
+POST /api/sales/<id>/scan
+"""
+
+from main import app, db
+from sqlalchemy import text
+
+def add_product_codes():
+    """Add barcode/sku columns, their unique indexes and the product_barcodes table"""
+    with app.app_context():
+        try:
+            for column in ('barcode', 'sku'):
+                result = db.session.execute(text("""
+                    SELECT column_name
+                    FROM information_schema.columns
+                    WHERE table_name='products' AND column_name=:column;
+                """), {'column': column})
+
+                if result.fetchone():
+                    print(f"✅ products.{column} already exists")
+                else:
+                    print(f"🔄 Adding {column} column to products table...")
+                    db.session.execute(text(f"""
+                        ALTER TABLE products
+                        ADD COLUMN {column} VARCHAR(64);
+                    """))
+                    print(f"✅ Successfully added {column} column")
+
+                print(f"🔄 Creating unique index on products.{column}...")
+                db.session.execute(text(f"""
+                    CREATE UNIQUE INDEX IF NOT EXISTS products_{column}_key ON products ({column});
+                """))
+
+            print("🔄 Creating product_barcodes table...")
+            db.session.execute(text("""
+                CREATE TABLE IF NOT EXISTS product_barcodes (
+                    id SERIAL PRIMARY KEY,
+                    product_id INTEGER NOT NULL REFERENCES products(id),
+                    code VARCHAR(64) NOT NULL,
+                    created_at TIMESTAMP DEFAULT NOW()
+                );
+            """))
+            db.session.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS product_barcodes_code_key ON product_barcodes (code);
+            """))
+            db.session.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_product_barcodes_product_id ON product_barcodes (product_id);
+            """))
+            db.session.commit()
+            print("✅ Migration completed successfully")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    add_product_codes()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Migration script for the DGII RNC registry
+Creates the rnc_registry table used to autocomplete customers by RNC/cédula or
+name. On PostgreSQL the name index uses varchar_pattern_ops so prefix scans
+work with any database collation. Load the data with import_rnc_registry.py
+"""
+
+from main import app, db
+from sqlalchemy import text
+import models
+
+def add_rnc_registry():
+    """Create rnc_registry and its prefix index"""
+    with app.app_context():
+        try:
+            print("🔄 Creating rnc_registry table...")
+            if db.engine.dialect.name == 'postgresql':
+                db.session.execute(text("""
+                    CREATE TABLE IF NOT EXISTS rnc_registry (
+                        rnc VARCHAR(11) PRIMARY KEY,
+                        name VARCHAR(250) NOT NULL,
+                        trade_name VARCHAR(250),
+                        name_key VARCHAR(250) NOT NULL,
+                        status VARCHAR(30),
+                        digest BIGINT NOT NULL
+                    );
+                """))
+                db.session.execute(text("""
+                    CREATE INDEX IF NOT EXISTS ix_rnc_registry_name_key
+                    ON rnc_registry (name_key varchar_pattern_ops);
+                """))
+                db.session.commit()
+            else:
+                models.RNCRegistry.__table__.create(db.engine, checkfirst=True)
+            print("✅ Table ready")
+
+            print("✅ Migration completed successfully")
+            print("   Next step: python import_rnc_registry.py /path/to/DGII_RNC.zip")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    add_rnc_registry()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Migration script for keyset pagination of the invoices list
+Adds the (created_at, id) index on sales and the sales_daily_aggregates table,
+then backfills the per-day aggregates from existing completed sales
+"""
+
+from main import app, db
+from sqlalchemy import text
+import models
+import sales_aggregates
+
+def add_sales_daily_aggregates():
+    """Create keyset index and per-day aggregates table, then backfill"""
+    with app.app_context():
+        try:
+            print("🔄 Creating index ix_sales_created_at_id on sales (created_at, id)...")
+            db.session.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_sales_created_at_id
+                ON sales (created_at, id);
+            """))
+            db.session.commit()
+            print("✅ Index ready")
+
+            print("🔄 Creating sales_daily_aggregates table...")
+            models.SalesDailyAggregate.__table__.create(db.engine, checkfirst=True)
+            print("✅ Table ready")
+
+            print("🔄 Backfilling per-day aggregates from completed sales...")
+            rows = sales_aggregates.rebuild_daily_aggregates()
+            print(f"✅ {rows} aggregate rows generated")
+
+            print("✅ Migration completed successfully")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during migration: {e}")
+            raise
+
+if __name__ == "__main__":
+    add_sales_daily_aggregates()
@@ -1,16 +1,20 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 
+from db_routing import RoutingSession
+
 
 class Base(DeclarativeBase):
     pass
 
 
-db = SQLAlchemy(model_class=Base)
+# RoutingSession sends reads of read-only views to the replica (DATABASE_REPLICA_URL)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 from datetime import datetime
-from sqlalchemy import String, Integer, Float, DateTime, Boolean, Text, ForeignKey, Enum, JSON
+from sqlalchemy import String, Integer, BigInteger, Float, Date, DateTime, Boolean, Text, ForeignKey, Enum, JSON, LargeBinary
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 import enum
+import tax_engine
 
 
 class UserRole(enum.Enum):
@@ -103,10 +107,20 @@ class CashSession(db.Model):
     opened_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     closed_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     status: Mapped[str] = mapped_column(String(20), default='open')  # open, closed
+    # Running ledger of sales linked to this session (updated in the finalize/cancel transaction)
+    cash_sales_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    cash_sales_total: Mapped[float] = mapped_column(Float, nullable=False, default=0.0, server_default='0')
+    card_sales_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    card_sales_total: Mapped[float] = mapped_column(Float, nullable=False, default=0.0, server_default='0')
+    transfer_sales_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    transfer_sales_total: Mapped[float] = mapped_column(Float, nullable=False, default=0.0, server_default='0')
+    cancelled_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    cancelled_total: Mapped[float] = mapped_column(Float, nullable=False, default=0.0, server_default='0')
     
     # Relationships
     cash_register = relationship("CashRegister", back_populates="cash_sessions")
     user = relationship("User")
+    sales = relationship("Sale", back_populates="cash_session")
 
 
 class NCFSequence(db.Model):
@@ -132,6 +146,7 @@ class Category(db.Model):
     name: Mapped[str] = mapped_column(String(100), nullable=False)
     description: Mapped[str] = mapped_column(Text)
     active: Mapped[bool] = mapped_column(Boolean, default=True)
+    kitchen_station: Mapped[str] = mapped_column(String(50), nullable=True)  # KDS station; NULL = default station
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -189,6 +204,8 @@ class Product(db.Model):
     stock: Mapped[int] = mapped_column(Integer, default=0)
     min_stock: Mapped[int] = mapped_column(Integer, default=5)
     product_type: Mapped[str] = mapped_column(String(20), default='inventariable')  # 'inventariable' o 'consumible'
+    barcode: Mapped[str] = mapped_column(String(64), nullable=True, unique=True)  # EAN/UPC principal (escáner)
+    sku: Mapped[str] = mapped_column(String(64), nullable=True, unique=True)  # Código interno
     active: Mapped[bool] = mapped_column(Boolean, default=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     
@@ -196,6 +213,20 @@ class Product(db.Model):
     category = relationship("Category", back_populates="products")
     sale_items = relationship("SaleItem", back_populates="product")
     product_taxes = relationship("ProductTax", back_populates="product")
+    barcode_aliases = relationship("ProductBarcode", back_populates="product", cascade="all, delete-orphan")
+
+
+class ProductBarcode(db.Model):
+    """Códigos de barras alternos de un producto (otras presentaciones, códigos del proveedor)"""
+    __tablename__ = 'product_barcodes'
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    product_id: Mapped[int] = mapped_column(Integer, ForeignKey('products.id'), nullable=False, index=True)
+    code: Mapped[str] = mapped_column(String(64), nullable=False, unique=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    product = relationship("Product", back_populates="barcode_aliases")
 
 
 class Customer(db.Model):
@@ -214,6 +245,18 @@ class Customer(db.Model):
     sales = relationship("Sale", foreign_keys="Sale.customer_id", back_populates="customer")
 
 
+class RNCRegistry(db.Model):
+    """DGII taxpayer registry (DGII_RNC file) used to autocomplete customers by RNC or name"""
+    __tablename__ = 'rnc_registry'
+    
+    rnc: Mapped[str] = mapped_column(String(11), primary_key=True)
+    name: Mapped[str] = mapped_column(String(250), nullable=False)  # Razón social
+    trade_name: Mapped[str] = mapped_column(String(250), nullable=True)  # Nombre comercial
+    name_key: Mapped[str] = mapped_column(String(250), nullable=False, index=True)  # Normalized name for prefix search
+    status: Mapped[str] = mapped_column(String(30), nullable=True)  # ACTIVO, SUSPENDIDO, ...
+    digest: Mapped[int] = mapped_column(BigInteger, nullable=False)  # Row hash for re-import by diff
+
+
 class Supplier(db.Model):
     __tablename__ = 'suppliers'
     
@@ -280,6 +323,7 @@ class Sale(db.Model):
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     cash_register_id: Mapped[int] = mapped_column(Integer, ForeignKey('cash_registers.id'), nullable=True)
+    cash_session_id: Mapped[int] = mapped_column(Integer, ForeignKey('cash_sessions.id'), nullable=True, index=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'))
     table_id: Mapped[int] = mapped_column(Integer, ForeignKey('tables.id'), nullable=True)
     customer_id: Mapped[int] = mapped_column(Integer, ForeignKey('customers.id'), nullable=True)
@@ -313,6 +357,8 @@ class Sale(db.Model):
     customer_rnc: Mapped[str] = mapped_column(String(20), nullable=True) 
     # Internal reference description (not printed on receipt)
     description: Mapped[str] = mapped_column(Text, nullable=True)
+    # Client-generated key for sales queued offline and replayed (unique: a replay never duplicates a sale)
+    client_uuid: Mapped[str] = mapped_column(String(36), nullable=True, unique=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     # Cancellation fields
     cancellation_reason: Mapped[str] = mapped_column(Text, nullable=True)
@@ -321,6 +367,7 @@ class Sale(db.Model):
     
     # Relationships
     cash_register = relationship("CashRegister", back_populates="sales")
+    cash_session = relationship("CashSession", back_populates="sales")
     user = relationship("User", foreign_keys=[user_id], back_populates="sales")
     cancelled_by_user = relationship("User", foreign_keys=[cancelled_by])
     table = relationship("Table", back_populates="sales")
@@ -332,6 +379,11 @@ class Sale(db.Model):
     parent_sale = relationship("Sale", remote_side=[id], foreign_keys=[parent_sale_id])
     child_sales = relationship("Sale", foreign_keys=[parent_sale_id], remote_side=[parent_sale_id], overlaps="parent_sale")
 
+    # Índice compuesto para paginación por cursor (keyset) en el listado de facturas
+    __table_args__ = (
+        db.Index('ix_sales_created_at_id', 'created_at', 'id'),
+    )
+
     def calculate_totals(self):
         """Calcula totales basado en tax_mode para alineación con módulo de compras"""
         if self.tax_mode == TaxMode.TAX_EXEMPT:
@@ -343,12 +395,9 @@ class Sale(db.Model):
 
     def _calculate_tax_exempt(self):
         """Modo exento de impuestos - similar a módulo de compras"""
-        total_subtotal = sum(item.total_price for item in self.sale_items)
-        return {
-            'subtotal': round(total_subtotal, 2),
-            'tax_amount': 0.0,
-            'total': round(total_subtotal, 2)
-        }
+        return self._totals_dict(tax_engine.compute_sale(
+            tax_engine.lines_from_items(self.sale_items, rate_override=0)
+        ))
 
     def _calculate_uniform_tax(self):
         """Modo impuesto uniforme - aplica el tax_type seleccionado a toda la venta"""
@@ -360,54 +409,24 @@ class Sale(db.Model):
             # Para impuestos de monto fijo, usar modo exento por seguridad
             return self._calculate_tax_exempt()
         
-        items_total = sum(item.total_price for item in self.sale_items)
-        tax_rate = self.tax_type.rate
-        
-        if self.tax_type.is_inclusive:
-            # Impuesto incluido en el precio
-            base_amount = items_total / (1 + tax_rate)
-            tax_amount = items_total - base_amount
-            return {
-                'subtotal': round(base_amount, 2),
-                'tax_amount': round(tax_amount, 2),
-                'total': round(items_total, 2)
-            }
-        else:
-            # Impuesto se agrega al precio
-            tax_amount = items_total * tax_rate
-            return {
-                'subtotal': round(items_total, 2),
-                'tax_amount': round(tax_amount, 2),
-                'total': round(items_total + tax_amount, 2)
-            }
+        totals = tax_engine.compute_sale(tax_engine.lines_from_items(
+            self.sale_items,
+            rate_override=self.tax_type.rate,
+            inclusive_override=self.tax_type.is_inclusive
+        ))
+        return self._totals_dict(totals)
 
     def _calculate_product_based(self):
         """Modo basado en producto - comportamiento actual (mantiene compatibilidad)"""
-        total_subtotal = 0
-        total_tax_included = 0
-        total_tax_added = 0
-        
-        for item in self.sale_items:
-            rate = item.tax_rate if item.tax_rate is not None else 0
-            is_included = item.is_tax_included if hasattr(item, 'is_tax_included') else False
-            
-            if is_included and rate > 0:
-                # Impuesto incluido - calcular monto base e impuesto incluido
-                base_amount = item.total_price / (1 + rate)
-                tax_amount = item.total_price - base_amount
-                total_subtotal += base_amount
-                total_tax_included += tax_amount
-            else:
-                # Impuesto agregado o sin impuesto
-                total_subtotal += item.total_price
-                if rate > 0:
-                    tax_amount = item.total_price * rate
-                    total_tax_added += tax_amount
-        
+        return self._totals_dict(tax_engine.compute_sale_items(self.sale_items))
+
+    @staticmethod
+    def _totals_dict(totals):
+        """subtotal = base sin impuestos, total = base + todos los impuestos"""
         return {
-            'subtotal': round(total_subtotal, 2),
-            'tax_amount': round(total_tax_included + total_tax_added, 2),
-            'total': round(total_subtotal + total_tax_included + total_tax_added, 2)
+            'subtotal': totals.base_amount,
+            'tax_amount': totals.tax_amount,
+            'total': totals.total
         }
 
 
@@ -415,7 +434,7 @@ class SaleItem(db.Model):
     __tablename__ = 'sale_items'
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    sale_id: Mapped[int] = mapped_column(Integer, ForeignKey('sales.id'))
+    sale_id: Mapped[int] = mapped_column(Integer, ForeignKey('sales.id'), index=True)
     product_id: Mapped[int] = mapped_column(Integer, ForeignKey('products.id'))
     quantity: Mapped[int] = mapped_column(Integer, nullable=False)
     unit_price: Mapped[float] = mapped_column(Float, nullable=False)
@@ -501,13 +520,98 @@ class StockAdjustment(db.Model):
     reason: Mapped[str] = mapped_column(Text)
     reference_id: Mapped[int] = mapped_column(Integer, nullable=True)  # Purchase ID, Sale ID, etc.
     reference_type: Mapped[str] = mapped_column(String(50), nullable=True)  # 'purchase', 'sale', etc.
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # Partition key in PostgreSQL (monthly range partitions, see migrate_partitioning.py)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
     
     # Relationships
     product = relationship("Product")
     user = relationship("User")
 
 
+class KitchenTicket(db.Model):
+    """Kitchen display (KDS) projection of an order: one ticket per sale and station"""
+    __tablename__ = 'kitchen_tickets'
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sale_id: Mapped[int] = mapped_column(Integer, ForeignKey('sales.id'), nullable=False, index=True)
+    station: Mapped[str] = mapped_column(String(50), nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default='active')  # active, bumped, cancelled
+    table_label: Mapped[str] = mapped_column(String(100), nullable=True)  # Snapshot for the kitchen screen
+    waiter_name: Mapped[str] = mapped_column(String(100), nullable=True)
+    revision: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)  # Change cursor (KitchenCursor)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    bumped_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    
+    # Relationships
+    sale = relationship("Sale")
+    lines = relationship("KitchenTicketLine", back_populates="ticket", order_by="KitchenTicketLine.id")
+    
+    __table_args__ = (
+        db.Index('ix_kitchen_tickets_status_station', 'status', 'station'),
+    )
+
+
+class KitchenTicketLine(db.Model):
+    """Quantity of a sale line sent to the kitchen; voided when the waiter removes it"""
+    __tablename__ = 'kitchen_ticket_lines'
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    ticket_id: Mapped[int] = mapped_column(Integer, ForeignKey('kitchen_tickets.id'), nullable=False, index=True)
+    sale_item_id: Mapped[int] = mapped_column(Integer, nullable=True)  # No FK: sale lines can be deleted
+    product_name: Mapped[str] = mapped_column(String(200), nullable=False)
+    quantity: Mapped[int] = mapped_column(Integer, nullable=False)
+    voided: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    ticket = relationship("KitchenTicket", back_populates="lines")
+
+
+class KitchenCursor(db.Model):
+    """Single-row counter of kitchen ticket changes (the revision behind the KDS delta cursor)"""
+    __tablename__ = 'kitchen_cursor'
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    revision: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+
+class LowStockAlert(db.Model):
+    """Producto inventariable activo con stock en o bajo el mínimo (proyección mantenida al mover stock)"""
+    __tablename__ = 'low_stock_alerts'
+
+    product_id: Mapped[int] = mapped_column(Integer, ForeignKey('products.id'), primary_key=True)
+    level: Mapped[str] = mapped_column(String(10), nullable=False)  # low, critical (stock <= min_stock / 2)
+    since: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)  # Entered the alert set
+    revision: Mapped[int] = mapped_column(BigInteger, nullable=False)  # Last level change (StockAlertCursor)
+
+    # Relationships
+    product = relationship("Product")
+
+
+class StockAlertEvent(db.Model):
+    """Cruce de umbral de stock mínimo: entra, sale o cambia de nivel de alerta"""
+    __tablename__ = 'stock_alert_events'
+
+    # BIGINT identity on PostgreSQL; SQLite only autoincrements INTEGER primary keys
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True)
+    product_id: Mapped[int] = mapped_column(Integer, ForeignKey('products.id'), nullable=False)
+    previous_level: Mapped[str] = mapped_column(String(10), nullable=True)  # None = above the minimum
+    level: Mapped[str] = mapped_column(String(10), nullable=True)
+    stock: Mapped[int] = mapped_column(Integer, nullable=False)
+    min_stock: Mapped[int] = mapped_column(Integer, nullable=False)
+    revision: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class StockAlertCursor(db.Model):
+    """Single-row counter of stock alert changes (the revision behind the alerts delta cursor)"""
+    __tablename__ = 'stock_alert_cursor'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    revision: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+
 class PasswordResetToken(db.Model):
     __tablename__ = 'password_reset_tokens'
     
@@ -523,6 +627,72 @@ class PasswordResetToken(db.Model):
     user = relationship("User", back_populates="password_reset_tokens")
 
 
+class IdempotencyRecord(db.Model):
+    """Respuesta guardada de una petición de la API enviada con cabecera Idempotency-Key"""
+    __tablename__ = 'idempotency_keys'
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    key: Mapped[str] = mapped_column(String(140), nullable=False, unique=True)  # "<user_id>:<Idempotency-Key>"
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)  # SHA-256 de método, ruta y cuerpo
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default='processing')  # processing, completed
+    response_status: Mapped[int] = mapped_column(Integer, nullable=True)
+    response_content_type: Mapped[str] = mapped_column(String(100), nullable=True)
+    response_body: Mapped[bytes] = mapped_column(LargeBinary, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+
+class BackgroundJob(db.Model):
+    """Trabajo en segundo plano (reportes PDF, exportaciones DGII, escaneo Bluetooth)"""
+    __tablename__ = 'background_jobs'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_type: Mapped[str] = mapped_column(String(50), nullable=False)
+    # queued, running, succeeded, failed, cancelled
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default='queued', index=True)
+    params: Mapped[dict] = mapped_column(JSON, nullable=True)
+    progress: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # 0-100
+    progress_message: Mapped[str] = mapped_column(String(200), nullable=True)
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    result: Mapped[dict] = mapped_column(JSON, nullable=True)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    artifact_path: Mapped[str] = mapped_column(String(500), nullable=True)
+    artifact_name: Mapped[str] = mapped_column(String(200), nullable=True)
+    artifact_mimetype: Mapped[str] = mapped_column(String(100), nullable=True)
+    worker: Mapped[str] = mapped_column(String(100), nullable=True)
+    created_by: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    heartbeat_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+
+class OutboxEvent(db.Model):
+    """Evento de negocio escrito en la misma transacción que lo produce (ventas, NCF, inventario)"""
+    __tablename__ = 'outbox_events'
+
+    # BIGINT identity on PostgreSQL; SQLite only autoincrements INTEGER primary keys
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True)
+    # sale.completed, sale.cancelled, credit_note.created, purchase.created, stock.adjusted
+    event_type: Mapped[str] = mapped_column(String(50), nullable=False)
+    aggregate_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)  # compact JSON, relayed as is
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class OutboxConsumer(db.Model):
+    """Cursor de entrega de un consumidor del outbox (último evento confirmado por su destino)"""
+    __tablename__ = 'outbox_consumers'
+
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    last_event_id: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    delivered_count: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    failures: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    last_delivered_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
 class SystemConfiguration(db.Model):
     __tablename__ = 'system_configuration'
     
@@ -562,7 +732,7 @@ class NCFLedger(db.Model):
     serie: Mapped[str] = mapped_column(String(3), nullable=False)
     number: Mapped[int] = mapped_column(Integer, nullable=False)
     ncf: Mapped[str] = mapped_column(String(20), nullable=False)
-    issued_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    issued_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), nullable=False)
     cash_register_id: Mapped[int] = mapped_column(Integer, ForeignKey('cash_registers.id'), nullable=True)  # Snapshot at time of issuance
     
@@ -578,6 +748,33 @@ class NCFLedger(db.Model):
     )
 
 
+class NCFIntegrityCheckpoint(db.Model):
+    """Hasta qué número se verificó cada secuencia NCF (huecos, duplicados, números sin venta)"""
+    __tablename__ = 'ncf_integrity_checkpoints'
+    
+    sequence_id: Mapped[int] = mapped_column(Integer, ForeignKey('ncf_sequences.id'), primary_key=True)
+    checked_through: Mapped[int] = mapped_column(Integer, nullable=False)  # last number seen by the check
+    last_run_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    last_full_run_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+
+class NCFIntegrityIssue(db.Model):
+    """Hallazgo abierto del verificador de NCF: gap, duplicate o unlinked"""
+    __tablename__ = 'ncf_integrity_issues'
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sequence_id: Mapped[int] = mapped_column(Integer, ForeignKey('ncf_sequences.id'), nullable=False)
+    kind: Mapped[str] = mapped_column(String(20), nullable=False)
+    number_from: Mapped[int] = mapped_column(Integer, nullable=False)
+    number_to: Mapped[int] = mapped_column(Integer, nullable=False)
+    detail: Mapped[dict] = mapped_column(JSON, nullable=True)
+    detected_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_ncf_integrity_issues_sequence_number', 'sequence_id', 'number_from'),
+    )
+
+
 class RegisterReassignmentLog(db.Model):
     """Log of cash register deletions and data reassignments"""
     __tablename__ = 'register_reassignment_log'
@@ -593,4 +790,24 @@ class RegisterReassignmentLog(db.Model):
     
     # Relationships
     to_register = relationship("CashRegister")
-    user = relationship("User")
\ No newline at end of file
+    user = relationship("User")
+
+
+class SalesDailyAggregate(db.Model):
+    """Per-day rollup of completed sales, maintained on finalize/cancel for constant-time invoice stats"""
+    __tablename__ = 'sales_daily_aggregates'
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    day: Mapped[datetime] = mapped_column(Date, nullable=False)
+    cash_register_id: Mapped[int] = mapped_column(Integer, ForeignKey('cash_registers.id'), nullable=True)
+    sales_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    total_amount: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    cash_register = relationship("CashRegister")
+    
+    # One row per day and cash register
+    __table_args__ = (
+        db.UniqueConstraint('day', 'cash_register_id', name='unique_day_register'),
+    )
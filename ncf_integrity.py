@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Verificador de integridad de secuencias NCF
+Cruza los números emitidos de cada secuencia en sales.ncf, credit_notes,
+cancelled_ncfs y ncf_ledger y registra en ncf_integrity_issues:
+
+- gap: números de la secuencia que ningún documento usa
+- duplicate: un número usado por más de una venta o nota
+- unlinked: un número en ncf_ledger o cancelled_ncfs cuya venta no lo tiene
+
+La base de datos hace el trabajo: por cada rango de números, una consulta
+agrupa por número y compara con el anterior (LAG) y solo devuelve los números
+con algún hallazgo. Cada documento se busca por rango de su NCF
+(prefijo + 8 dígitos), así que la consulta usa los índices únicos de ncf y
+el costo es proporcional a los números nuevos, no al total de la tabla.
+
+El avance queda en ncf_integrity_checkpoints: la verificación nocturna solo
+revisa los números posteriores al último verificado y vuelve a comprobar los
+huecos abiertos (una venta que confirmó tarde los cierra). --full reinicia la
+secuencia desde start_number.
+
+Los meses que fiscal_archive sacó de las tablas vivas siguen contando: en una
+corrida completa, una secuencia nueva o al revisar huecos abiertos se leen los
+números de las ventas, el ledger y los NCF anulados archivados y se suman a los
+de la base de datos en los rangos donde aparecen.
+
+Uso como comando:
+    python ncf_integrity.py                  # verificar lo nuevo de todas las secuencias
+    python ncf_integrity.py --sequence-id 3  # una secuencia
+    python ncf_integrity.py --full           # verificar desde el inicio
+"""
+import logging
+import sys
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Integer, case, cast, func, literal, or_, select, union_all
+from sqlalchemy.orm import aliased
+
+import fiscal_archive
+import models
+from models import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50000  # números por consulta
+NUMBER_DIGITS = 8
+
+GAP = 'gap'
+DUPLICATE = 'duplicate'
+UNLINKED = 'unlinked'
+
+
+def sequence_prefixes(sequence: models.NCFSequence) -> List[str]:
+    """Prefijos que consumen números de la secuencia (las notas cambian la B de la serie por A o C)"""
+    prefixes = [sequence.serie]
+    for letter in ('A', 'C'):
+        prefix = sequence.serie.replace('B', letter, 1)
+        if prefix not in prefixes:
+            prefixes.append(prefix)
+    return prefixes
+
+
+def _number(column):
+    return cast(func.substr(column, 4), Integer)
+
+
+def _ncf_range(column, prefixes, lo, hi):
+    return or_(*[column.between(f'{prefix}{lo:0{NUMBER_DIGITS}d}', f'{prefix}{hi:0{NUMBER_DIGITS}d}')
+                 for prefix in prefixes])
+
+
+def _issued(sequence, prefixes, lo, hi):
+    """Un renglón por aparición de un número: documento (venta/nota) o registro (ledger/anulado)"""
+    sales = models.Sale.__table__
+    notes = models.CreditNote.__table__
+    cancelled = models.CancelledNCF.__table__
+    ledger = models.NCFLedger.__table__
+    linked_sale = aliased(sales)
+
+    def linked(record_ncf):
+        return case((linked_sale.c.ncf == record_ncf, 1), else_=0)
+
+    return union_all(
+        select(_number(sales.c.ncf).label('number'), literal(1).label('document'),
+               literal(0).label('record'), literal(0).label('linked'))
+        .where(sales.c.ncf_sequence_id == sequence.id, _ncf_range(sales.c.ncf, prefixes, lo, hi)),
+        select(_number(notes.c.ncf), literal(1), literal(0), literal(0))
+        .where(notes.c.ncf_sequence_id == sequence.id, _ncf_range(notes.c.ncf, prefixes, lo, hi)),
+        select(_number(cancelled.c.ncf), literal(0), literal(1), linked(cancelled.c.ncf))
+        .select_from(cancelled.outerjoin(linked_sale, linked_sale.c.id == cancelled.c.original_sale_id))
+        .where(cancelled.c.ncf_sequence_id == sequence.id, _ncf_range(cancelled.c.ncf, prefixes, lo, hi)),
+        select(ledger.c.number, literal(0), literal(1), linked(ledger.c.ncf))
+        .select_from(ledger.outerjoin(linked_sale, linked_sale.c.id == ledger.c.sale_id))
+        .where(ledger.c.sequence_id == sequence.id, ledger.c.number.between(lo, hi))
+    ).subquery('issued')
+
+
+# A number of the range with its counts, the previous number used and the last one of the range
+Flagged = namedtuple('Flagged', 'number documents records linked previous last')
+
+
+def _per_number(sequence, prefixes, lo, hi):
+    issued = _issued(sequence, prefixes, lo, hi)
+    return select(
+        issued.c.number,
+        func.sum(issued.c.document).label('documents'),
+        func.sum(issued.c.record).label('records'),
+        func.sum(issued.c.linked).label('linked')
+    ).group_by(issued.c.number).subquery('per_number')
+
+
+def _is_flagged(number, documents, records, linked, previous, last) -> bool:
+    return (previous is None or number == last or number - previous > 1
+            or documents != 1 or linked < records)
+
+
+def _flagged(sequence, prefixes, lo, hi, archived=None) -> List[Flagged]:
+    """Números del rango con hallazgo, más el primero y el último (para empalmar con el rango anterior)"""
+    per_number = _per_number(sequence, prefixes, lo, hi)
+    in_archive = {number: counts for number, counts in (archived or {}).items() if lo <= number <= hi}
+    if in_archive:
+        return _flagged_with_archive(per_number, in_archive)
+
+    ordered = select(
+        per_number,
+        func.lag(per_number.c.number).over(order_by=per_number.c.number).label('previous'),
+        func.max(per_number.c.number).over().label('last')
+    ).subquery('ordered')
+    rows = db.session.execute(
+        select(ordered).where(or_(
+            ordered.c.previous.is_(None),
+            ordered.c.number == ordered.c.last,
+            ordered.c.number - ordered.c.previous > 1,
+            ordered.c.documents != 1,
+            ordered.c.linked < ordered.c.records
+        )).order_by(ordered.c.number)
+    ).all()
+    return [Flagged(*row) for row in rows]
+
+
+def _flagged_with_archive(per_number, in_archive) -> List[Flagged]:
+    """Mismo resultado que la consulta con LAG, sumando los números archivados del rango"""
+    counts = {row.number: [row.documents, row.records, row.linked]
+              for row in db.session.execute(select(per_number)).all()}
+    for number, archived_counts in in_archive.items():
+        merged = counts.setdefault(number, [0, 0, 0])
+        for position, value in enumerate(archived_counts):
+            merged[position] += value
+
+    numbers = sorted(counts)
+    flagged = []
+    previous = None
+    for number in numbers:
+        row = Flagged(number, *counts[number], previous, numbers[-1])
+        if _is_flagged(*row):
+            flagged.append(row)
+        previous = number
+    return flagged
+
+
+class ArchivedNumbers:
+    """
+    Números usados en los períodos archivados (fiscal_archive), leídos una vez
+    por corrida y solo si alguna secuencia los necesita
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._entries = None
+
+    def _load(self):
+        directory = self.directory or fiscal_archive.archive_dir()
+        sale_ncfs = {}
+        entries = defaultdict(list)  # sequence_id -> [(prefix, number, document, record, sale_id, ncf)]
+        for year, month in fiscal_archive.archived_months(directory):
+            for row in fiscal_archive.read_rows(year, month, 'sales', directory):
+                sale_ncfs[row['id']] = row.get('ncf')
+                if row.get('ncf') and row.get('ncf_sequence_id'):
+                    entries[row['ncf_sequence_id']].append((row['ncf'][:3], _ncf_number(row['ncf']), 1, 0, None, None))
+            for row in fiscal_archive.read_rows(year, month, 'ncf_ledger', directory):
+                entries[row['sequence_id']].append((None, row['number'], 0, 1, row.get('sale_id'), row['ncf']))
+            for row in fiscal_archive.read_rows(year, month, 'cancelled_ncfs', directory):
+                if row.get('ncf_sequence_id'):
+                    entries[row['ncf_sequence_id']].append((row['ncf'][:3], _ncf_number(row['ncf']), 0, 1,
+                                                            row.get('original_sale_id'), row['ncf']))
+
+        # Records whose sale was not archived are linked against the live sale
+        live_ids = {sale_id for rows in entries.values() for *_, sale_id, _ in rows
+                    if sale_id is not None and sale_id not in sale_ncfs}
+        if live_ids:
+            sale_ncfs.update(db.session.query(models.Sale.id, models.Sale.ncf).filter(
+                models.Sale.id.in_(live_ids)).all())
+        self._entries = {sequence_id: [(prefix, number, document, record,
+                                        int(record == 1 and sale_ncfs.get(sale_id) == ncf))
+                                       for prefix, number, document, record, sale_id, ncf in rows
+                                       if number is not None]
+                         for sequence_id, rows in entries.items()}
+
+    def for_sequence(self, sequence, prefixes) -> Dict[int, list]:
+        """{número: [documentos, registros, enlazados]} archivados de la secuencia"""
+        if self._entries is None:
+            self._load()
+        counts = defaultdict(lambda: [0, 0, 0])
+        for prefix, number, document, record, linked in self._entries.get(sequence.id, ()):
+            if prefix is not None and prefix not in prefixes:
+                continue
+            counts[number][0] += document
+            counts[number][1] += record
+            counts[number][2] += linked
+        return dict(counts)
+
+
+def _ncf_number(ncf) -> Optional[int]:
+    try:
+        return int(ncf[3:])
+    except (TypeError, ValueError):
+        return None
+
+
+def _documents(sequence, prefixes, number, archived=None) -> Dict[str, Any]:
+    """Documentos y registros que usan un número (solo para los hallazgos)"""
+    ncfs = [f'{prefix}{number:0{NUMBER_DIGITS}d}' for prefix in prefixes]
+    detail = {
+        'sales': [row[0] for row in db.session.query(models.Sale.id).filter(
+            models.Sale.ncf_sequence_id == sequence.id, models.Sale.ncf.in_(ncfs)).all()],
+        'credit_notes': [row[0] for row in db.session.query(models.CreditNote.id).filter(
+            models.CreditNote.ncf_sequence_id == sequence.id, models.CreditNote.ncf.in_(ncfs)).all()],
+        'ledger_sales': [row[0] for row in db.session.query(models.NCFLedger.sale_id).filter(
+            models.NCFLedger.sequence_id == sequence.id, models.NCFLedger.number == number).all()],
+        'cancelled_sales': [row[0] for row in db.session.query(models.CancelledNCF.original_sale_id).filter(
+            models.CancelledNCF.ncf_sequence_id == sequence.id, models.CancelledNCF.ncf.in_(ncfs)).all()],
+    }
+    if archived and number in archived:
+        detail['archived_documents'], detail['archived_records'] = archived[number][:2]
+    return detail
+
+
+def _issue(sequence, kind, number_from, number_to, detail=None) -> models.NCFIntegrityIssue:
+    issue = models.NCFIntegrityIssue()
+    issue.sequence_id = sequence.id
+    issue.kind = kind
+    issue.number_from = number_from
+    issue.number_to = number_to
+    issue.detail = detail
+    issue.detected_at = datetime.utcnow()
+    db.session.add(issue)
+    return issue
+
+
+def _scan(sequence, prefixes, lo, hi, previous, archived=None) -> tuple:
+    """
+    Verifica los números lo..hi; previous es el último número usado antes de lo
+    y archived los números de períodos archivados de la secuencia
+
+    Returns:
+        (hallazgos creados, último número usado en el rango o previous si no hay ninguno)
+    """
+    issues = []
+    for row in _flagged(sequence, prefixes, lo, hi, archived):
+        before = row.previous if row.previous is not None else previous
+        if row.number - before > 1:
+            start = before + 1
+            issues.append(_issue(sequence, GAP, start, row.number - 1, {'missing': row.number - start}))
+        if row.documents > 1 or row.documents == 0 or row.linked < row.records:
+            kind = DUPLICATE if row.documents > 1 else UNLINKED
+            issues.append(_issue(sequence, kind, row.number, row.number,
+                                 _documents(sequence, prefixes, row.number, archived)))
+        previous = row.last
+    return issues, previous
+
+
+def _recheck_gaps(sequence, prefixes, gaps, archived) -> int:
+    """Vuelve a verificar los huecos abiertos; devuelve cuántos números aparecieron"""
+    filled = 0
+    for gap in gaps:
+        issues, last = _scan(sequence, prefixes, gap.number_from, gap.number_to, gap.number_from - 1, archived)
+        if not issues and last == gap.number_from - 1:
+            continue  # still entirely missing
+        if last < gap.number_to:
+            issues.append(_issue(sequence, GAP, last + 1, gap.number_to, {'missing': gap.number_to - last}))
+        remaining = sum(issue.number_to - issue.number_from + 1 for issue in issues if issue.kind == GAP)
+        filled += (gap.number_to - gap.number_from + 1) - remaining
+        db.session.delete(gap)
+    return filled
+
+
+def check_sequence(sequence: models.NCFSequence, full: bool = False,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   archive: Optional[ArchivedNumbers] = None) -> Dict[str, Any]:
+    """
+    Verifica los números nuevos de una secuencia desde su checkpoint
+
+    Confirma (commit) después de cada rango: una verificación interrumpida
+    continúa donde quedó.
+
+    Args:
+        sequence: Secuencia NCF
+        full: Borrar los hallazgos y verificar desde start_number
+        chunk_size: Números por consulta
+        archive: Números de los períodos archivados (check_all comparte uno entre secuencias)
+
+    Returns:
+        Resumen: números verificados, hallazgos nuevos por tipo, huecos cerrados
+        y 'pending' (números que el contador ya entregó pero aún no aparecen)
+    """
+    prefixes = sequence_prefixes(sequence)
+    checkpoint = db.session.get(models.NCFIntegrityCheckpoint, sequence.id)
+    from_start = full or checkpoint is None
+    if checkpoint is None:
+        checkpoint = models.NCFIntegrityCheckpoint()
+        checkpoint.sequence_id = sequence.id
+        checkpoint.checked_through = sequence.start_number - 1
+        db.session.add(checkpoint)
+    if full:
+        models.NCFIntegrityIssue.query.filter_by(sequence_id=sequence.id).delete()
+        checkpoint.checked_through = sequence.start_number - 1
+        checkpoint.last_full_run_at = datetime.utcnow()
+
+    gaps = [] if full else models.NCFIntegrityIssue.query.filter_by(sequence_id=sequence.id, kind=GAP).all()
+    # Archived months are old: only a scan from the start or an open gap can reach their numbers
+    archived = {}
+    if from_start or gaps:
+        archived = (archive or ArchivedNumbers()).for_sequence(sequence, prefixes)
+    filled = _recheck_gaps(sequence, prefixes, gaps, archived)
+    db.session.commit()
+
+    found = {GAP: 0, DUPLICATE: 0, UNLINKED: 0}
+    start = checkpoint.checked_through
+    lo = start + 1
+    while lo <= sequence.end_number:
+        # Past the counter nothing should exist: one last range up to end_number catches strays
+        hi = lo + chunk_size - 1 if lo + chunk_size - 1 < sequence.current_number else sequence.end_number
+        issues, checkpoint.checked_through = _scan(sequence, prefixes, lo, hi, checkpoint.checked_through,
+                                                   archived)
+        for issue in issues:
+            found[issue.kind] += 1
+        checkpoint.last_run_at = datetime.utcnow()
+        db.session.commit()
+        lo = hi + 1
+
+    # The counter hands out numbers before the sale commits: the tail stays pending, not a gap
+    counter_last = sequence.current_number - 1
+    pending = max(0, counter_last - checkpoint.checked_through)
+    if pending:
+        logger.info(f"Secuencia {sequence.id}: {pending} números entregados por el contador aún sin documento")
+    return {
+        'sequence_id': sequence.id,
+        'serie': sequence.serie,
+        'checked_from': start + 1,
+        'checked_through': checkpoint.checked_through,
+        'found': found,
+        'gaps_filled': filled,
+        'pending': pending
+    }
+
+
+def check_all(full: bool = False, sequence_id: Optional[int] = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[Dict[str, Any]]:
+    """Verifica todas las secuencias (o una) y devuelve el resumen de cada una"""
+    query = models.NCFSequence.query
+    if sequence_id is not None:
+        query = query.filter(models.NCFSequence.id == sequence_id)
+    archive = ArchivedNumbers()
+    return [check_sequence(sequence, full=full, chunk_size=chunk_size, archive=archive)
+            for sequence in query.order_by(models.NCFSequence.id).all()]
+
+
+def issue_dict(issue: models.NCFIntegrityIssue) -> Dict[str, Any]:
+    return {
+        'id': issue.id,
+        'sequence_id': issue.sequence_id,
+        'kind': issue.kind,
+        'number_from': issue.number_from,
+        'number_to': issue.number_to,
+        'detail': issue.detail,
+        'detected_at': issue.detected_at.isoformat() if issue.detected_at else None
+    }
+
+
+def summary_by_sequence() -> Dict[int, Dict[str, Any]]:
+    """Checkpoint y hallazgos abiertos de cada secuencia verificada"""
+    summary = {
+        checkpoint.sequence_id: {
+            'checked_through': checkpoint.checked_through,
+            'last_run_at': checkpoint.last_run_at.isoformat() if checkpoint.last_run_at else None,
+            GAP: 0, DUPLICATE: 0, UNLINKED: 0
+        }
+        for checkpoint in models.NCFIntegrityCheckpoint.query.all()
+    }
+    counts = db.session.query(
+        models.NCFIntegrityIssue.sequence_id, models.NCFIntegrityIssue.kind, func.count()
+    ).group_by(models.NCFIntegrityIssue.sequence_id, models.NCFIntegrityIssue.kind).all()
+    for sequence_id, kind, count in counts:
+        if sequence_id in summary:
+            summary[sequence_id][kind] = count
+    return summary
+
+
+def main(argv: List[str]) -> int:
+    import argparse
+    from main import app
+
+    parser = argparse.ArgumentParser(description='Verificación de huecos y duplicados en secuencias NCF')
+    parser.add_argument('--sequence-id', type=int, default=None, help='Verificar solo esta secuencia')
+    parser.add_argument('--full', action='store_true', help='Verificar desde el inicio de la secuencia')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Números por consulta')
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        results = check_all(full=args.full, sequence_id=args.sequence_id, chunk_size=args.chunk_size)
+        open_issues = models.NCFIntegrityIssue.query.order_by(
+            models.NCFIntegrityIssue.sequence_id, models.NCFIntegrityIssue.number_from
+        ).all()
+        issues = [issue_dict(issue) for issue in open_issues]
+
+    for result in results:
+        found = result['found']
+        print(f"🔄 {result['serie']} (secuencia {result['sequence_id']}): verificado hasta "
+              f"{result['checked_through']}, nuevos {found[GAP]} huecos / {found[DUPLICATE]} duplicados / "
+              f"{found[UNLINKED]} sin venta, {result['pending']} pendientes")
+
+    if not issues:
+        print("✅ Secuencias NCF sin huecos ni duplicados")
+        return 0
+    for issue in issues:
+        numbers = (str(issue['number_from']) if issue['number_from'] == issue['number_to']
+                   else f"{issue['number_from']}-{issue['number_to']}")
+        print(f"❌ Secuencia {issue['sequence_id']}: {issue['kind']} {numbers} {issue['detail'] or ''}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
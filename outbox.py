@@ -0,0 +1,428 @@
+"""
+Outbox transaccional de eventos de negocio
+Las integraciones (contabilidad, lealtad, BI) reciben los cambios como eventos
+en vez de consultar sales y ncf_ledger por rangos de fecha:
+
+- record_*() agrega una fila a outbox_events en la misma transacción que la
+  venta, la anulación, la nota de crédito, la compra o el ajuste de inventario:
+  si la transacción se revierte, el evento desaparece con ella. El evento es
+  JSON compacto y el relay lo entrega tal cual, sin volver a leer las tablas
+  de operación.
+- El relay (`python outbox_relay.py`) entrega los eventos en orden de id, por
+  lotes, a cada consumidor configurado en OUTBOX_CONSUMERS. Cada consumidor
+  tiene su cursor en outbox_consumers y solo avanza después de que su destino
+  acepta el lote: la entrega es al-menos-una-vez y el consumidor descarta
+  repetidos por id.
+- Un id que falta puede ser una transacción que aún no confirma (los ids se
+  asignan al insertar, no al confirmar). El relay se detiene antes del hueco
+  hasta OUTBOX_GAP_TIMEOUT segundos; pasado ese tiempo lo da por revertido.
+- Destinos (@sink): jsonl (un archivo por día), webhook (POST firmado con
+  HMAC) y queue (cola en memoria del proceso, sustituto local de un broker).
+
+    OUTBOX_CONSUMERS='{"contabilidad": {"sink": "webhook", "url": "https://...", "secret": "..."},
+                       "bi": {"sink": "jsonl", "directory": "/var/lib/pos/outbox"}}'
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+import models
+from models import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_GAP_TIMEOUT = 30  # segundos: más que la transacción de venta más larga
+DEFAULT_POLL_INTERVAL = 1.0  # segundos
+DEFAULT_RETENTION_DAYS = 7
+MAX_RETRY_DELAY = 300  # segundos
+
+_sinks = {}
+_queues: Dict[str, queue.Queue] = {}
+# First missing id -> monotonic time it was first seen by this relay
+_gaps: Dict[int, float] = {}
+# Consumer -> monotonic time of its next attempt after a failed delivery
+_retry_at: Dict[str, float] = {}
+
+
+# ---------------------------------------------------------------------------
+# Writing events (inside the caller's transaction)
+
+
+def _dumps(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def _iso(value: Optional[datetime]) -> str:
+    return (value or datetime.utcnow()).isoformat(timespec='seconds')
+
+
+def emit(event_type: str, aggregate_id: Optional[int], data: dict) -> models.OutboxEvent:
+    """
+    Agrega un evento a la transacción en curso; el llamador hace el commit
+
+    Las claves con valor None se omiten para que el evento sea lo más pequeño posible.
+    """
+    event = models.OutboxEvent()
+    event.event_type = event_type
+    event.aggregate_id = aggregate_id
+    event.payload = _dumps({key: value for key, value in data.items() if value is not None})
+    event.created_at = datetime.utcnow()
+    db.session.add(event)
+    return event
+
+
+def record_completed_sale(sale: models.Sale, items=None) -> models.OutboxEvent:
+    """
+    Evento sale.completed con el NCF asignado y sus líneas
+
+    Las líneas van como [product_id, cantidad, precio unitario, total]; la
+    cantidad es también el descuento de inventario de la venta.
+    """
+    items = sale.sale_items if items is None else items
+    return emit('sale.completed', sale.id, {
+        'ncf': sale.ncf,
+        'ncf_type': sale.ncf_sequence.ncf_type.value if sale.ncf_sequence else None,
+        'subtotal': sale.subtotal,
+        'tax': sale.tax_amount,
+        'total': sale.total,
+        'payment': sale.payment_method,
+        'register': sale.cash_register_id,
+        'user': sale.user_id,
+        'rnc': sale.customer_rnc,
+        'at': _iso(sale.created_at),
+        'items': [[item.product_id, item.quantity, item.unit_price, item.total_price] for item in items]
+    })
+
+
+def record_cancelled_sale(sale: models.Sale, restored: Dict[int, int]) -> models.OutboxEvent:
+    """Evento sale.cancelled: NCF anulado y unidades devueltas al inventario por producto"""
+    return emit('sale.cancelled', sale.id, {
+        'ncf': sale.ncf,
+        'total': sale.total,
+        'reason': sale.cancellation_reason,
+        'user': sale.cancelled_by,
+        'at': _iso(sale.cancelled_at),
+        'restock': [[product_id, quantity] for product_id, quantity in restored.items()]
+    })
+
+
+def record_credit_note(note: models.CreditNote, items: List[dict], restored: Dict[int, int]) -> models.OutboxEvent:
+    """Evento credit_note.created (nota de crédito o débito con su NCF)"""
+    return emit('credit_note.created', note.id, {
+        'ncf': note.ncf,
+        'type': note.note_type.value,
+        'sale': note.original_sale_id,
+        'amount': note.amount,
+        'tax': note.tax_amount,
+        'total': note.total,
+        'rnc': note.customer_rnc,
+        'user': note.created_by,
+        'at': _iso(note.created_at),
+        'items': [[item['product_id'], item['quantity'], item['unit_price'], item['total_price']]
+                  for item in items],
+        'restock': [[product_id, quantity] for product_id, quantity in restored.items()] or None
+    })
+
+
+def record_purchase(purchase: models.Purchase, items: List[dict], user_id: int) -> models.OutboxEvent:
+    """Evento purchase.created; las líneas van como [product_id, cantidad, costo unitario]"""
+    return emit('purchase.created', purchase.id, {
+        'supplier': purchase.supplier_id,
+        'ncf': purchase.ncf_supplier or None,
+        'total': purchase.total_amount,
+        'tax': purchase.tax_amount,
+        'user': user_id,
+        'at': _iso(purchase.created_at),
+        'items': [[item['product'].id, item['quantity'], item['unit_cost']] for item in items]
+    })
+
+
+def record_stock_adjustment(adjustment: models.StockAdjustment) -> models.OutboxEvent:
+    """Evento stock.adjusted para un ajuste manual de inventario"""
+    return emit('stock.adjusted', adjustment.product_id, {
+        'type': adjustment.adjustment_type,
+        'old': adjustment.old_stock,
+        'delta': adjustment.adjustment,
+        'new': adjustment.new_stock,
+        'reason': adjustment.reason,
+        'user': adjustment.user_id,
+        'at': _iso(adjustment.created_at)
+    })
+
+
+# ---------------------------------------------------------------------------
+# Sinks
+
+
+class Event(namedtuple('Event', 'id type aggregate_id created_at payload')):
+    """Evento leído del outbox; line es su JSON sin volver a serializar el payload"""
+
+    __slots__ = ()
+
+    @property
+    def line(self) -> str:
+        aggregate = 'null' if self.aggregate_id is None else int(self.aggregate_id)
+        return (f'{{"id":{self.id},"type":{json.dumps(self.type)},"aggregate_id":{aggregate},'
+                f'"created_at":"{_iso(self.created_at)}","data":{self.payload}}}')
+
+    def as_dict(self) -> dict:
+        return json.loads(self.line)
+
+
+def sink(kind):
+    """Registra la clase de un destino: cls(name, **opciones) con deliver(events)"""
+    def register(cls):
+        _sinks[kind] = cls
+        return cls
+    return register
+
+
+@sink('jsonl')
+class JsonlSink:
+    """Un archivo <consumidor>-AAAA-MM-DD.jsonl por día; el lote se sincroniza a disco antes de avanzar"""
+
+    def __init__(self, name, directory):
+        self.name = name
+        self.directory = directory
+
+    def deliver(self, events: List[Event]):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self.name}-{datetime.utcnow():%Y-%m-%d}.jsonl")
+        with open(path, 'a', encoding='utf-8') as output:
+            output.write(''.join(event.line + '\n' for event in events))
+            output.flush()
+            os.fsync(output.fileno())
+
+
+@sink('webhook')
+class WebhookSink:
+    """POST {"consumer", "events"} a una URL; con secret, firma X-Outbox-Signature: sha256=<hmac>"""
+
+    def __init__(self, name, url, secret=None, timeout=10):
+        self.name = name
+        self.url = url
+        self.secret = secret
+        self.timeout = timeout
+        self._http = None
+
+    def deliver(self, events: List[Event]):
+        import requests
+
+        if self._http is None:
+            self._http = requests.Session()
+        body = f'{{"consumer":{json.dumps(self.name)},"events":[{",".join(event.line for event in events)}]}}'
+        body = body.encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.secret:
+            signature = hmac.new(self.secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+            headers['X-Outbox-Signature'] = f'sha256={signature}'
+        response = self._http.post(self.url, data=body, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+
+@sink('queue')
+class QueueSink:
+    """Cola en memoria del proceso del relay (local_queue(nombre)); sustituto de un broker externo"""
+
+    def __init__(self, name, queue_name=None):
+        self.queue = local_queue(queue_name or name)
+
+    def deliver(self, events: List[Event]):
+        for event in events:
+            self.queue.put(event.as_dict())
+
+
+def local_queue(name: str) -> queue.Queue:
+    return _queues.setdefault(name, queue.Queue())
+
+
+def build_sinks(consumers: dict) -> Dict[str, object]:
+    """Crea los destinos de OUTBOX_CONSUMERS ({nombre: {"sink": tipo, ...opciones}})"""
+    built = {}
+    for name, options in (consumers or {}).items():
+        options = dict(options)
+        kind = options.pop('sink', None)
+        if kind not in _sinks:
+            raise ValueError(f'Destino de outbox desconocido para {name}: {kind}')
+        built[name] = _sinks[kind](name, **options)
+    return built
+
+
+# ---------------------------------------------------------------------------
+# Relay
+
+
+def _consumer(name: str) -> Optional[models.OutboxConsumer]:
+    """Bloquea el cursor del consumidor (otro relay lo salta); lo crea en el primer evento retenido"""
+    consumer = db.session.query(models.OutboxConsumer).filter_by(name=name).with_for_update(
+        skip_locked=True
+    ).first()
+    if consumer is not None:
+        return consumer
+    if db.session.query(models.OutboxConsumer.name).filter_by(name=name).first() is not None:
+        return None  # locked by another relay
+    first = db.session.execute(select(func.min(models.OutboxEvent.id))).scalar()
+    consumer = models.OutboxConsumer()
+    consumer.name = name
+    consumer.last_event_id = first - 1 if first else 0
+    consumer.delivered_count = 0
+    consumer.failures = 0
+    db.session.add(consumer)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return None
+    return consumer
+
+
+def _ready(rows, cursor: int, gap_timeout: float) -> list:
+    """Prefijo de eventos que se puede entregar sin saltar una transacción aún abierta"""
+    ready = []
+    expected = cursor + 1
+    now = time.monotonic()
+    for row in rows:
+        if row.id != expected:
+            first_seen = _gaps.setdefault(expected, now)
+            if now - first_seen < gap_timeout:
+                break
+            logger.info(f"Outbox: ids {expected}-{row.id - 1} no aparecieron en {gap_timeout}s, se omiten")
+        _gaps.pop(expected, None)
+        ready.append(row)
+        expected = row.id + 1
+    return ready
+
+
+def relay_once(name: str, destination, batch_size: int = DEFAULT_BATCH_SIZE,
+               gap_timeout: float = DEFAULT_GAP_TIMEOUT) -> int:
+    """
+    Entrega al destino el siguiente lote de eventos de un consumidor
+
+    El cursor solo avanza si deliver() termina sin error; un error queda en
+    outbox_consumers.last_error y el mismo lote se reintenta después.
+
+    Returns:
+        Número de eventos entregados
+    """
+    try:
+        consumer = _consumer(name)
+        if consumer is None:
+            db.session.rollback()
+            return 0
+        table = models.OutboxEvent.__table__
+        rows = db.session.execute(
+            select(table.c.id, table.c.event_type, table.c.aggregate_id, table.c.created_at, table.c.payload)
+            .where(table.c.id > consumer.last_event_id).order_by(table.c.id).limit(batch_size)
+        ).all()
+        events = [Event(*row) for row in _ready(rows, consumer.last_event_id, gap_timeout)]
+        if not events:
+            db.session.commit()
+            return 0
+
+        try:
+            destination.deliver(events)
+        except Exception as e:
+            consumer.failures = (consumer.failures or 0) + 1
+            consumer.last_error = str(e)[:2000]
+            consumer.updated_at = datetime.utcnow()
+            db.session.commit()
+            _retry_at[name] = time.monotonic() + min(2 ** consumer.failures, MAX_RETRY_DELAY)
+            logger.warning(f"Outbox: entrega fallida a {name} (intento {consumer.failures}): {e}")
+            return 0
+
+        now = datetime.utcnow()
+        consumer.last_event_id = events[-1].id
+        consumer.delivered_count = (consumer.delivered_count or 0) + len(events)
+        consumer.failures = 0
+        consumer.last_error = None
+        consumer.last_delivered_at = now
+        consumer.updated_at = now
+        db.session.commit()
+        _retry_at.pop(name, None)
+        return len(events)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def relay_all(destinations: Dict[str, object], config) -> int:
+    """Entrega a cada consumidor hasta ponerlo al día (o hasta un hueco); devuelve el total entregado"""
+    total = 0
+    for name, destination in destinations.items():
+        if _retry_at.get(name, 0) > time.monotonic():
+            continue
+        while True:
+            delivered = relay_once(name, destination, config['OUTBOX_BATCH_SIZE'], config['OUTBOX_GAP_TIMEOUT'])
+            total += delivered
+            if delivered < config['OUTBOX_BATCH_SIZE']:
+                break
+    return total
+
+
+def maintenance(config) -> int:
+    """Borra los eventos antiguos que ya recibieron todos los consumidores"""
+    table = models.OutboxEvent.__table__
+    delivered = db.session.execute(select(func.min(models.OutboxConsumer.last_event_id))).scalar()
+    condition = table.c.created_at < datetime.utcnow() - timedelta(days=config['OUTBOX_RETENTION_DAYS'])
+    if delivered is not None:
+        condition = condition & (table.c.id <= delivered)
+    deleted = db.session.execute(table.delete().where(condition)).rowcount
+    db.session.commit()
+    return deleted
+
+
+def relay_loop(app, stop_event):
+    """Bucle del relay: entrega eventos hasta que stop_event se activa"""
+    destinations = build_sinks(app.config['OUTBOX_CONSUMERS'])
+    poll = app.config['OUTBOX_POLL_INTERVAL']
+    last_maintenance = 0.0
+    while not stop_event.is_set():
+        delivered = 0
+        with app.app_context():
+            try:
+                if time.monotonic() - last_maintenance >= 3600:
+                    last_maintenance = time.monotonic()
+                    maintenance(app.config)
+                delivered = relay_all(destinations, app.config)
+            except Exception:
+                db.session.rollback()
+                logger.exception("Error en el relay del outbox")
+            finally:
+                db.session.remove()
+        if not delivered:
+            stop_event.wait(poll)
+
+
+def status() -> List[dict]:
+    """Cursor y atraso de cada consumidor"""
+    last = db.session.execute(select(func.max(models.OutboxEvent.id))).scalar() or 0
+    return [{
+        'name': consumer.name,
+        'last_event_id': consumer.last_event_id,
+        'lag': max(0, last - consumer.last_event_id),
+        'delivered_count': consumer.delivered_count,
+        'failures': consumer.failures,
+        'last_error': consumer.last_error,
+        'last_delivered_at': consumer.last_delivered_at.isoformat() if consumer.last_delivered_at else None
+    } for consumer in models.OutboxConsumer.query.order_by(models.OutboxConsumer.name).all()]
+
+
+def init_app(app):
+    """Configura los consumidores y el relay del outbox"""
+    consumers = os.environ.get('OUTBOX_CONSUMERS')
+    app.config.setdefault('OUTBOX_CONSUMERS', json.loads(consumers) if consumers else {})
+    app.config.setdefault('OUTBOX_BATCH_SIZE', int(os.environ.get('OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE)))
+    app.config.setdefault('OUTBOX_GAP_TIMEOUT', float(os.environ.get('OUTBOX_GAP_TIMEOUT', DEFAULT_GAP_TIMEOUT)))
+    app.config.setdefault('OUTBOX_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+    app.config.setdefault('OUTBOX_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
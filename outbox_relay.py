@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Relay del outbox de eventos
+
+    python outbox_relay.py            # entregar eventos continuamente
+    python outbox_relay.py --once     # entregar lo pendiente y salir
+    python outbox_relay.py --status   # cursor y atraso de cada consumidor
+
+Entrega los eventos de outbox_events a los consumidores de OUTBOX_CONSUMERS
+(archivo JSONL, webhook o cola local). Se puede correr más de un relay: cada
+consumidor lo atiende uno a la vez.
+"""
+import argparse
+import logging
+import signal
+import threading
+
+from main import app
+import outbox
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Relay del outbox de eventos')
+    parser.add_argument('--once', action='store_true', help='Entregar los eventos pendientes y salir')
+    parser.add_argument('--status', action='store_true', help='Mostrar el cursor de cada consumidor')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.status:
+        with app.app_context():
+            for consumer in outbox.status():
+                error = f" ❌ {consumer['last_error']}" if consumer['last_error'] else ''
+                print(f"{consumer['name']}: evento {consumer['last_event_id']}, "
+                      f"{consumer['lag']} pendientes{error}")
+        return
+
+    if not app.config['OUTBOX_CONSUMERS']:
+        print("❌ No hay consumidores configurados (OUTBOX_CONSUMERS)")
+        return
+
+    if args.once:
+        with app.app_context():
+            delivered = outbox.relay_all(outbox.build_sinks(app.config['OUTBOX_CONSUMERS']), app.config)
+            outbox.maintenance(app.config)
+        print(f"✅ {delivered} eventos entregados")
+        return
+
+    stop = threading.Event()
+
+    def shutdown(signum, frame):
+        print("🔄 Deteniendo relay: se termina el lote en curso...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    print(f"✅ Relay del outbox iniciado para: {', '.join(app.config['OUTBOX_CONSUMERS'])}")
+    outbox.relay_loop(app, stop)
+
+
+if __name__ == '__main__':
+    main()
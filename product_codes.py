@@ -0,0 +1,256 @@
+"""
+Códigos de barras y SKU de productos (caché en memoria para el escáner)
+Mantiene un mapa código -> product_id con el código de barras principal, el SKU
+y los códigos alternos (ProductBarcode) de todos los productos activos, para
+que escanear un artículo no tenga que consultar la base de datos.
+
+Los códigos se normalizan (sin espacios a los lados, en mayúsculas) al
+guardarlos y al buscarlos; son únicos entre los tres tipos.
+
+El mapa se carga completo al arrancar y se refresca igual que tax_profiles:
+- en este proceso, cuando inventario llama a products_changed();
+- en los demás procesos, comparando la versión guardada en
+  SystemConfiguration como máximo cada PRODUCT_CODE_CHECK_INTERVAL segundos.
+Un código que no está en el mapa se busca en la base de datos antes de darlo
+por inexistente, así que un producto recién creado se puede escanear de
+inmediato en cualquier worker.
+"""
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, or_
+
+import models
+from models import db
+
+logger = logging.getLogger(__name__)
+
+MAX_CODE_LENGTH = 64
+VERSION_KEY = 'product_codes_version'
+DEFAULT_CHECK_INTERVAL = 5.0  # segundos entre comprobaciones de versión
+
+
+class _Cache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.codes: Dict[str, int] = {}
+        self.loaded = False
+        self.version: Optional[str] = None
+        self.checked_at = 0.0
+        self.check_interval = DEFAULT_CHECK_INTERVAL
+
+    def clear(self):
+        with self.lock:
+            self.codes = {}
+            self.loaded = False
+
+
+_cache = _Cache()
+
+
+def normalize_code(code) -> Optional[str]:
+    """Código limpio para guardar o buscar (None si viene vacío)"""
+    if code is None:
+        return None
+    code = str(code).strip().upper()
+    return code or None
+
+
+def _load_codes(product_ids: Optional[List[int]] = None) -> Dict[str, int]:
+    """Códigos de los productos activos indicados (o de todos)"""
+    product_query = db.session.query(models.Product.id, models.Product.barcode, models.Product.sku).filter(
+        models.Product.active == True
+    )
+    alias_query = db.session.query(models.ProductBarcode.code, models.ProductBarcode.product_id).join(
+        models.Product, models.ProductBarcode.product_id == models.Product.id
+    ).filter(models.Product.active == True)
+    if product_ids is not None:
+        product_query = product_query.filter(models.Product.id.in_(product_ids))
+        alias_query = alias_query.filter(models.ProductBarcode.product_id.in_(product_ids))
+
+    codes: Dict[str, int] = {}
+    for product_id, barcode, sku in product_query.all():
+        for code in (barcode, sku):
+            if code:
+                codes[code] = product_id
+    for code, product_id in alias_query.all():
+        codes[code] = product_id
+    return codes
+
+
+def _read_version() -> Optional[str]:
+    return db.session.query(models.SystemConfiguration.value).filter_by(key=VERSION_KEY).scalar()
+
+
+def _check_version():
+    """Descarta el mapa si otro proceso cambió códigos (como máximo cada check_interval)"""
+    now = time.monotonic()
+    if now - _cache.checked_at < _cache.check_interval:
+        return
+    _cache.checked_at = now
+    version = _read_version()
+    if version != _cache.version:
+        _cache.clear()
+        _cache.version = version
+
+
+def warm():
+    """Carga los códigos de todos los productos activos"""
+    codes = _load_codes()
+    version = _read_version()
+    with _cache.lock:
+        _cache.codes = codes
+        _cache.loaded = True
+        _cache.version = version
+        _cache.checked_at = time.monotonic()
+    return len(codes)
+
+
+def _find_in_database(code: str) -> Optional[int]:
+    product_id = db.session.query(models.Product.id).filter(
+        models.Product.active == True,
+        or_(models.Product.barcode == code, models.Product.sku == code)
+    ).limit(1).scalar()
+    if product_id is None:
+        product_id = db.session.query(models.ProductBarcode.product_id).join(
+            models.Product, models.ProductBarcode.product_id == models.Product.id
+        ).filter(models.ProductBarcode.code == code, models.Product.active == True).scalar()
+    return product_id
+
+
+def lookup(code) -> Optional[int]:
+    """ID del producto activo con ese código de barras, SKU o código alterno"""
+    code = normalize_code(code)
+    if not code or len(code) > MAX_CODE_LENGTH:
+        return None
+
+    _check_version()
+    if not _cache.loaded:
+        warm()
+
+    product_id = _cache.codes.get(code)
+    if product_id is None:
+        product_id = _find_in_database(code)
+        if product_id is not None:
+            with _cache.lock:
+                _cache.codes[code] = product_id
+    return product_id
+
+
+def _validate_code(code, label: str) -> Optional[str]:
+    code = normalize_code(code)
+    if code and len(code) > MAX_CODE_LENGTH:
+        raise ValueError(f'El {label} no puede tener más de {MAX_CODE_LENGTH} caracteres')
+    return code
+
+
+def _code_owner(code: str, product_id: Optional[int]) -> Optional[str]:
+    """Nombre del otro producto que ya usa el código (None si está libre)"""
+    query = db.session.query(models.Product.name).filter(
+        or_(models.Product.barcode == code, models.Product.sku == code)
+    )
+    alias_query = db.session.query(models.Product.name).join(
+        models.ProductBarcode, models.ProductBarcode.product_id == models.Product.id
+    ).filter(models.ProductBarcode.code == code)
+    if product_id is not None:
+        query = query.filter(models.Product.id != product_id)
+        alias_query = alias_query.filter(models.Product.id != product_id)
+    return query.limit(1).scalar() or alias_query.limit(1).scalar()
+
+
+def set_product_codes(product, barcode=None, sku=None, aliases: Optional[Iterable[str]] = None):
+    """
+    Asigna código de barras, SKU y (si se envían) códigos alternos a un producto
+
+    Valida que ningún código se repita en el producto ni lo use otro producto.
+    Llamar antes de products_changed() y del commit.
+
+    Raises:
+        ValueError: Código demasiado largo, repetido o en uso por otro producto
+    """
+    barcode = _validate_code(barcode, 'código de barras')
+    sku = _validate_code(sku, 'SKU')
+    alias_codes = None
+    if aliases is not None:
+        alias_codes = list(dict.fromkeys(
+            code for code in (_validate_code(alias, 'código alterno') for alias in aliases) if code
+        ))
+
+    codes = [code for code in [barcode, sku] + (alias_codes or []) if code]
+    if len(codes) != len(set(codes)):
+        raise ValueError('El código de barras, el SKU y los códigos alternos no se pueden repetir')
+    for code in codes:
+        owner = _code_owner(code, product.id)
+        if owner:
+            raise ValueError(f'El código {code} ya está asignado al producto {owner}')
+
+    product.barcode = barcode
+    product.sku = sku
+    if alias_codes is not None:
+        # Keep the rows whose code stays: the unit of work inserts before it deletes,
+        # so re-adding the same code as a new row would hit the unique index
+        kept = {alias.code: alias for alias in product.barcode_aliases if alias.code in alias_codes}
+        product.barcode_aliases = [kept.get(code) or models.ProductBarcode(code=code) for code in alias_codes]
+
+
+def product_codes_dict(product) -> dict:
+    """Códigos del producto para las respuestas de inventario"""
+    return {
+        'barcode': product.barcode,
+        'sku': product.sku,
+        'barcode_aliases': [alias.code for alias in product.barcode_aliases]
+    }
+
+
+def _bump_version():
+    """Nueva versión en SystemConfiguration (se confirma con la transacción del llamador)"""
+    version = uuid.uuid4().hex
+    config = models.SystemConfiguration.query.filter_by(key=VERSION_KEY).first()
+    if not config:
+        config = models.SystemConfiguration()
+        config.key = VERSION_KEY
+        config.description = 'Versión de la caché de códigos de barras y SKU'
+        db.session.add(config)
+    config.value = version
+    return version
+
+
+def products_changed(product_ids: Iterable[int]):
+    """
+    Registrar altas, cambios de códigos o activación/desactivación de productos
+
+    Llamar antes de db.session.commit(). Los códigos de esos productos salen del
+    mapa local; sus códigos nuevos se cargan en la primera búsqueda.
+    """
+    product_ids = set(product_ids)
+    _cache.version = _bump_version()
+    with _cache.lock:
+        _cache.codes = {code: product_id for code, product_id in _cache.codes.items()
+                        if product_id not in product_ids}
+
+
+def init_app(app):
+    """Configura el intervalo de comprobación y precarga los códigos al arrancar"""
+    app.config.setdefault('PRODUCT_CODE_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL)
+    _cache.check_interval = float(app.config['PRODUCT_CODE_CHECK_INTERVAL'])
+
+    with app.app_context():
+        try:
+            count = warm()
+            logger.info(f"Códigos de productos precargados: {count}")
+        except Exception as e:
+            # Base de datos sin migrar o no disponible: se cargará en el primer uso
+            db.session.rollback()
+            logger.info(f"Códigos de productos no precargados: {e}")
+        finally:
+            db.session.remove()
+
+
+@event.listens_for(models.ProductBarcode.__table__, 'after_create')
+def _on_tables_created(target, connection, **kw):
+    # A freshly created schema (db.create_all) invalidates any cached ids
+    _cache.clear()
+    _cache.version = None
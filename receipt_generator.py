@@ -21,6 +21,35 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.colors import black, blue, red
 
 from utils import format_currency_rd, calculate_itbis, get_company_info_for_receipt
+import tax_engine
+import report_pdf
+
+
+def _item_taxes(item: Dict[str, Any]):
+    """
+    Impuestos de una línea del recibo calculados con tax_engine
+
+    Returns:
+        (total de la línea, [(nombre, tasa, LineTax), ...]) solo con tasas > 0
+    """
+    qty = item.get('quantity', 1)
+    total = qty * item.get('price', 0)
+
+    tax_types = item.get('tax_types', [])
+    if tax_types:
+        # NEW ENHANCED SYSTEM: each tax type applies to the full line
+        configured = [(tax_type.get('name', 'ITBIS'), tax_type.get('rate', 0), tax_type.get('is_inclusive', False))
+                      for tax_type in tax_types]
+    else:
+        # Fallback to legacy system for backward compatibility
+        configured = [('ITBIS', item.get('tax_rate', 0), item.get('is_tax_included', False))]
+
+    taxes = []
+    for name, rate, is_inclusive in configured:
+        if rate and rate > 0:
+            line = tax_engine.compute_line(tax_engine.make_line(qty, item.get('price', 0), rate, is_inclusive))
+            taxes.append((name, rate, line))
+    return total, taxes
 
 
 class DominicanReceiptGenerator:
@@ -209,40 +238,13 @@ class DominicanReceiptGenerator:
             content.append(Paragraph(f"{qty}x {name}", self.styles['Item']))
             content.append(Paragraph(f"    {format_currency_rd(price)} c/u = {format_currency_rd(total)}", self.styles['Item']))
             
-            # Show tax calculation for each product (NEW ENHANCED SYSTEM)
-            tax_types = item.get('tax_types', [])
-            if tax_types:
-                for tax_type in tax_types:
-                    rate = tax_type.get('rate', 0)
-                    if rate > 0:
-                        tax_name = tax_type.get('name', 'ITBIS')
-                        tax_percentage = int(rate * 100)
-                        
-                        if tax_type.get('is_inclusive', False):
-                            # Inclusive tax - extract from total
-                            tax_amount = total - (total / (1 + rate))
-                            base_amount = total / (1 + rate)
-                            content.append(Paragraph(f"    Base: {format_currency_rd(base_amount)} + {tax_name} {tax_percentage}%: {format_currency_rd(tax_amount)}", self.styles['Item']))
-                        else:
-                            # Exclusive tax - add to total  
-                            tax_amount = total * rate
-                            content.append(Paragraph(f"    Subtotal: {format_currency_rd(total)} + {tax_name} {tax_percentage}%: {format_currency_rd(tax_amount)}", self.styles['Item']))
-            else:
-                # Fallback to legacy system for backward compatibility
-                tax_rate = item.get("tax_rate", 0)
-                if tax_rate > 0:
-                    is_tax_included = item.get("is_tax_included", False)
-                    tax_percentage = int(tax_rate * 100)
-                    
-                    if is_tax_included:
-                        # Calculate included tax amount per line
-                        tax_amount = total - (total / (1 + tax_rate))
-                        base_amount = total / (1 + tax_rate)
-                        content.append(Paragraph(f"    Base: {format_currency_rd(base_amount)} + ITBIS {tax_percentage}%: {format_currency_rd(tax_amount)}", self.styles['Item']))
-                    else:
-                        # Exclusive tax
-                        tax_amount = total * tax_rate
-                        content.append(Paragraph(f"    Subtotal: {format_currency_rd(total)} + ITBIS {tax_percentage}%: {format_currency_rd(tax_amount)}", self.styles['Item']))
+            # Show tax calculation for each product
+            for tax_name, rate, line in _item_taxes(item)[1]:
+                tax_percentage = int(rate * 100)
+                if line.is_inclusive:
+                    content.append(Paragraph(f"    Base: {format_currency_rd(line.base_amount)} + {tax_name} {tax_percentage}%: {format_currency_rd(line.tax_amount)}", self.styles['Item']))
+                else:
+                    content.append(Paragraph(f"    Subtotal: {format_currency_rd(total)} + {tax_name} {tax_percentage}%: {format_currency_rd(line.tax_amount)}", self.styles['Item']))
         
         content.append(Paragraph("-" * (self.text_width if hasattr(self, 'text_width') else 32), self.styles['Item']))
         return content
@@ -260,36 +262,13 @@ class DominicanReceiptGenerator:
         
         # Calculate taxes by type
         for item in items:
-            qty = item.get('quantity', 1)
-            price = item.get('price', 0)
-            item_total = qty * price
-            
-            tax_types = item.get('tax_types', [])
-            if tax_types:
-                for tax_type in tax_types:
-                    rate = tax_type.get('rate', 0)
-                    name = tax_type.get('name', 'ITBIS')
-                    
-                    if rate > 0:
-                        if tax_type.get('is_inclusive', False):
-                            # Included tax - extract from price
-                            tax_amount = item_total - (item_total / (1 + rate))
-                            inclusive_taxes[name] = inclusive_taxes.get(name, 0) + tax_amount
-                        else:
-                            # Exclusive tax - add to price
-                            tax_amount = item_total * rate
-                            exclusive_taxes[name] = exclusive_taxes.get(name, 0) + tax_amount
-            else:
-                # Fallback to legacy system
-                tax_rate = item.get('tax_rate', 0)
-                is_tax_included = item.get('is_tax_included', False)
-                if tax_rate > 0:
-                    if is_tax_included:
-                        tax_amount = item_total - (item_total / (1 + tax_rate))
-                        inclusive_taxes['ITBIS'] = inclusive_taxes.get('ITBIS', 0) + tax_amount
-                    else:
-                        tax_amount = item_total * tax_rate
-                        exclusive_taxes['ITBIS'] = exclusive_taxes.get('ITBIS', 0) + tax_amount
+            for name, _, line in _item_taxes(item)[1]:
+                if line.is_inclusive:
+                    # Included tax - extracted from price
+                    inclusive_taxes[name] = round(inclusive_taxes.get(name, 0) + line.tax_amount, 2)
+                else:
+                    # Exclusive tax - added to price
+                    exclusive_taxes[name] = round(exclusive_taxes.get(name, 0) + line.tax_amount, 2)
         
         content.append(Paragraph(f"Subtotal: {format_currency_rd(subtotal)}", self.styles['Item']))
         
@@ -388,20 +367,17 @@ class DominicanReceiptGenerator:
         for item in sale_data.get('items', []):
             qty = item.get('quantity', 1)
             name = item.get('product_name', item.get('name', 'Producto'))[:18]
-            total = qty * item.get('price', 0)
-            tax_rate = item.get('tax_rate', 0)
-            is_tax_included = item.get('is_tax_included', False)
+            total, taxes = _item_taxes(item)
             
             line = f"{qty:<3} {name:<18}{format_currency_rd(total):>8}"
             r.append(line)
             
             # Show tax line for included taxes
-            if is_tax_included and tax_rate > 0:
-                # Calculate included tax amount per line
-                tax_amount = total - (total / (1 + tax_rate))
-                tax_percentage = int(tax_rate * 100)
-                tax_line = f"   (ITBIS {tax_percentage}%)       {format_currency_rd(tax_amount):>8}"
-                r.append(tax_line)
+            for _, tax_rate, item_tax in taxes:
+                if item_tax.is_inclusive:
+                    tax_percentage = int(tax_rate * 100)
+                    tax_line = f"   (ITBIS {tax_percentage}%)       {format_currency_rd(item_tax.tax_amount):>8}"
+                    r.append(tax_line)
 
         r.append("-" * self.text_width)
         subtotal = sale_data.get('subtotal', 0)
@@ -501,15 +477,6 @@ def generate_sales_report_pdf(sales: List[Any], period_name: str, start_date: da
     output_path = os.path.join('static', 'receipts', filename)
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
-    doc = SimpleDocTemplate(
-        output_path,
-        pagesize=letter,
-        rightMargin=40,
-        leftMargin=40,
-        topMargin=40,
-        bottomMargin=40
-    )
-    
     content = []
     styles = getSampleStyleSheet()
     
@@ -624,12 +591,10 @@ def generate_sales_report_pdf(sales: List[Any], period_name: str, start_date: da
         content.append(payment_table)
         content.append(Spacer(1, 20))
     
-    content.append(Paragraph("Detalle de Ventas", styles['SectionHeader']))
-    
-    sales_data = [['#', 'Fecha/Hora', 'NCF', 'Cliente', 'Subtotal', 'ITBIS', 'Total']]
+    sales_rows = []
     
     for idx, sale in enumerate(sales, 1):
-        sales_data.append([
+        sales_rows.append([
             str(idx),
             sale.created_at.strftime('%d/%m/%Y %H:%M'),
             sale.ncf[:13] + '...' if sale.ncf and len(sale.ncf) > 15 else sale.ncf or 'N/A',
@@ -639,27 +604,32 @@ def generate_sales_report_pdf(sales: List[Any], period_name: str, start_date: da
             format_currency_rd(sale.total)
         ])
     
-    sales_table = Table(sales_data, colWidths=[0.4*inch, 1.3*inch, 1.2*inch, 1.5*inch, 1*inch, 0.9*inch, 1*inch])
-    sales_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
-        ('TOPPADDING', (0, 0), (-1, -1), 4),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.beige])
-    ]))
-    
-    content.append(sales_table)
-    content.append(Spacer(1, 30))
+    # Sale detail grows with the period: large reports are rendered in parallel chunks
+    sales_detail = report_pdf.DetailTable(
+        ['#', 'Fecha/Hora', 'NCF', 'Cliente', 'Subtotal', 'ITBIS', 'Total'],
+        sales_rows,
+        [0.4*inch, 1.3*inch, 1.2*inch, 1.5*inch, 1*inch, 0.9*inch, 1*inch],
+        [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+            ('TOPPADDING', (0, 0), (-1, -1), 4),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.beige])
+        ],
+        intro=[Paragraph("Detalle de Ventas", styles['SectionHeader'])]
+    )
     
-    content.append(Paragraph("_" * 50, styles['NormalText']))
-    content.append(Paragraph("Firma Autorizada", styles['NormalText']))
+    closing = [
+        Spacer(1, 30),
+        Paragraph("_" * 50, styles['NormalText']),
+        Paragraph("Firma Autorizada", styles['NormalText'])
+    ]
     
-    doc.build(content)
-    return output_path
+    return report_pdf.build_report(output_path, content, sales_detail, closing)
 
 
 def generate_products_report_pdf(product_stats: List[Any], period_name: str, start_date: datetime, end_date: datetime, limit: int = 50) -> str:
@@ -895,15 +865,6 @@ def generate_ncf_report_pdf(sequences: List[Any], ledger_entries: List[Any], per
     output_path = os.path.join('static', 'receipts', filename)
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
-    doc = SimpleDocTemplate(
-        output_path,
-        pagesize=letter,
-        rightMargin=40,
-        leftMargin=40,
-        topMargin=40,
-        bottomMargin=40
-    )
-    
     content = []
     styles = getSampleStyleSheet()
     
@@ -1089,10 +1050,9 @@ def generate_ncf_report_pdf(sequences: List[Any], ledger_entries: List[Any], per
     content.append(stats_table)
     content.append(Spacer(1, 15))
     
+    ledger_detail = None
     if ledger_entries:
-        content.append(Paragraph(f"Comprobantes Emitidos Recientes (Mostrando {min(len(ledger_entries), 100)})", styles['SectionHeader']))
-        
-        ledger_data = [['NCF', 'Tipo', 'Fecha', 'Cliente', 'RNC', 'Monto', 'Estado']]
+        ledger_rows = []
         
         for ledger in ledger_entries[:100]:
             cancelled = models.CancelledNCF.query.filter_by(ncf=ledger.ncf).first()
@@ -1107,7 +1067,7 @@ def generate_ncf_report_pdf(sequences: List[Any], ledger_entries: List[Any], per
                 client_rnc = ledger.sale.client_rnc or 'N/A'
                 amount = ledger.sale.final_total
             
-            ledger_data.append([
+            ledger_rows.append([
                 ledger.ncf[-8:],
                 ncf_type_names.get(ledger.sequence.ncf_type.value, ledger.sequence.ncf_type.value)[:10],
                 ledger.issued_at.strftime('%d/%m/%y'),
@@ -1117,28 +1077,32 @@ def generate_ncf_report_pdf(sequences: List[Any], ledger_entries: List[Any], per
                 status
             ])
         
-        ledger_table = Table(ledger_data, colWidths=[0.9*inch, 0.9*inch, 0.8*inch, 1.4*inch, 1*inch, 0.9*inch, 0.7*inch])
-        ledger_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 7),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 3),
-            ('TOPPADDING', (0, 0), (-1, -1), 3),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
-            ('ALIGN', (3, 1), (3, -1), 'LEFT'),
-        ]))
-        
-        content.append(ledger_table)
+        ledger_detail = report_pdf.DetailTable(
+            ['NCF', 'Tipo', 'Fecha', 'Cliente', 'RNC', 'Monto', 'Estado'],
+            ledger_rows,
+            [0.9*inch, 0.9*inch, 0.8*inch, 1.4*inch, 1*inch, 0.9*inch, 0.7*inch],
+            [
+                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, 0), (-1, -1), 7),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 3),
+                ('TOPPADDING', (0, 0), (-1, -1), 3),
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+                ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
+                ('ALIGN', (3, 1), (3, -1), 'LEFT'),
+            ],
+            intro=[Paragraph(f"Comprobantes Emitidos Recientes (Mostrando {min(len(ledger_entries), 100)})", styles['SectionHeader'])]
+        )
     
-    content.append(Spacer(1, 30))
-    content.append(Paragraph("_" * 50, styles['NormalText']))
-    content.append(Paragraph("Firma Autorizada", styles['NormalText']))
+    closing = [
+        Spacer(1, 30),
+        Paragraph("_" * 50, styles['NormalText']),
+        Paragraph("Firma Autorizada", styles['NormalText'])
+    ]
     
-    doc.build(content)
-    return output_path
+    return report_pdf.build_report(output_path, content, ledger_detail, closing)
 
 
 def generate_users_sales_report_pdf(users_data: List[dict], period_name: str, start_date: datetime, end_date: datetime, role_filter: str = 'all') -> str:
@@ -1165,15 +1129,6 @@ def generate_users_sales_report_pdf(users_data: List[dict], period_name: str, st
     output_path = os.path.join('static', 'receipts', filename)
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
-    doc = SimpleDocTemplate(
-        output_path,
-        pagesize=letter,
-        rightMargin=40,
-        leftMargin=40,
-        topMargin=40,
-        bottomMargin=40
-    )
-    
     content = []
     styles = getSampleStyleSheet()
     
@@ -1233,8 +1188,7 @@ def generate_users_sales_report_pdf(users_data: List[dict], period_name: str, st
     
     if not users_data:
         content.append(Paragraph("No se encontraron datos para el período seleccionado.", styles['NormalText']))
-        doc.build(content)
-        return output_path
+        return report_pdf.build_report(output_path, content)
     
     total_sales = sum(u['num_sales'] for u in users_data)
     total_amount = sum(u['total_amount'] for u in users_data)
@@ -1268,15 +1222,12 @@ def generate_users_sales_report_pdf(users_data: List[dict], period_name: str, st
     
     users_sorted = sorted(users_data, key=lambda x: x['total_amount'], reverse=True)
     
-    content.append(Paragraph("Detalle de Ventas por Usuario", styles['SectionHeader']))
-    content.append(Spacer(1, 6))
-    
-    users_table_data = [['#', 'Usuario', 'Rol', 'Ventas', 'Monto Total', 'Ticket Prom.', 'Productos']]
+    users_rows = []
     
     for idx, user in enumerate(users_sorted, 1):
         role_short = user['role'][:10] if len(user['role']) > 10 else user['role']
         
-        users_table_data.append([
+        users_rows.append([
             str(idx),
             user['name'][:18] if len(user['name']) > 18 else user['name'],
             role_short,
@@ -1286,21 +1237,26 @@ def generate_users_sales_report_pdf(users_data: List[dict], period_name: str, st
             str(user['total_products'])
         ])
     
-    users_table = Table(users_table_data, colWidths=[0.4*inch, 1.8*inch, 1*inch, 0.8*inch, 1.1*inch, 1.1*inch, 0.8*inch])
-    users_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
-        ('TOPPADDING', (0, 0), (-1, -1), 4),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
-        ('ALIGN', (1, 1), (1, -1), 'LEFT'),
-    ]))
+    users_detail = report_pdf.DetailTable(
+        ['#', 'Usuario', 'Rol', 'Ventas', 'Monto Total', 'Ticket Prom.', 'Productos'],
+        users_rows,
+        [0.4*inch, 1.8*inch, 1*inch, 0.8*inch, 1.1*inch, 1.1*inch, 0.8*inch],
+        [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+            ('TOPPADDING', (0, 0), (-1, -1), 4),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
+            ('ALIGN', (1, 1), (1, -1), 'LEFT'),
+        ],
+        intro=[Paragraph("Detalle de Ventas por Usuario", styles['SectionHeader']), Spacer(1, 6)]
+    )
     
-    content.append(users_table)
+    closing = []
     
     role_stats = {}
     for user in users_data:
@@ -1312,9 +1268,9 @@ def generate_users_sales_report_pdf(users_data: List[dict], period_name: str, st
         role_stats[role]['total_amount'] += user['total_amount']
     
     if len(role_stats) > 1:
-        content.append(Spacer(1, 20))
-        content.append(Paragraph("Estadísticas por Rol", styles['SectionHeader']))
-        content.append(Spacer(1, 6))
+        closing.append(Spacer(1, 20))
+        closing.append(Paragraph("Estadísticas por Rol", styles['SectionHeader']))
+        closing.append(Spacer(1, 6))
         
         role_table_data = [['Rol', 'Usuarios', 'Ventas', 'Monto Total', 'Promedio/Usuario']]
         
@@ -1341,11 +1297,10 @@ def generate_users_sales_report_pdf(users_data: List[dict], period_name: str, st
             ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
         ]))
         
-        content.append(role_table)
+        closing.append(role_table)
     
-    content.append(Spacer(1, 30))
-    content.append(Paragraph("_" * 50, styles['NormalText']))
-    content.append(Paragraph("Firma Autorizada", styles['NormalText']))
+    closing.append(Spacer(1, 30))
+    closing.append(Paragraph("_" * 50, styles['NormalText']))
+    closing.append(Paragraph("Firma Autorizada", styles['NormalText']))
     
-    doc.build(content)
-    return output_path
\ No newline at end of file
+    return report_pdf.build_report(output_path, content, users_detail, closing)
\ No newline at end of file
@@ -0,0 +1,188 @@
+"""
+Renderizado en paralelo de reportes PDF grandes
+Los reportes de ventas de un año tienen decenas de miles de filas: un solo
+doc.build de ReportLab tarda segundos de CPU y retiene el GIL del worker web.
+build_report() divide la tabla de detalle en bloques de REPORT_PDF_CHUNK_ROWS
+filas, los renderiza en un ProcessPoolExecutor y une los PDF parciales con
+pypdf en un solo archivo.
+
+- Los reportes con menos de REPORT_PDF_PARALLEL_MIN_ROWS filas, o sin pypdf
+  instalado, se generan como antes con un solo doc.build.
+- REPORT_PDF_WORKERS procesos (por defecto uno por CPU); con 1 los bloques se
+  renderizan en este proceso. Dividir ya acelera por sí solo: ReportLab parte
+  una tabla larga página por página recorriendo las filas restantes, así que
+  un build único crece más que linealmente con las filas.
+- Cada proceso tiene un límite de memoria (REPORT_PDF_WORKER_MEMORY_MB, vía
+  RLIMIT_AS) y se recicla tras REPORT_PDF_TASKS_PER_CHILD bloques.
+- Cada bloque empieza en una página nueva y repite la fila de encabezado.
+
+Este módulo no importa Flask ni los modelos: los procesos del pool solo cargan
+ReportLab.
+"""
+import atexit
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+
+try:
+    from pypdf import PdfWriter
+except ImportError:  # pragma: no cover - optional dependency
+    PdfWriter = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = 2000
+DEFAULT_PARALLEL_MIN_ROWS = 4000
+DEFAULT_WORKER_MEMORY_MB = 1024
+DEFAULT_TASKS_PER_CHILD = 50
+
+# Same page setup as every report in receipt_generator
+PAGE_OPTIONS = dict(pagesize=letter, rightMargin=40, leftMargin=40, topMargin=40, bottomMargin=40)
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+class DetailTable:
+    """Tabla de detalle de un reporte: filas ya formateadas como texto"""
+
+    def __init__(self, header, rows, col_widths, style, intro=None):
+        self.header = header
+        self.rows = rows
+        self.col_widths = col_widths
+        self.style = style
+        self.intro = intro or []  # Flowables placed right before the table (section title)
+
+    def table(self, rows):
+        table = Table([self.header] + rows, colWidths=self.col_widths, repeatRows=1)
+        table.setStyle(TableStyle(self.style))
+        return table
+
+
+def settings():
+    """Configuración del renderizado en paralelo, leída del entorno"""
+    return {
+        'workers': int(os.environ.get('REPORT_PDF_WORKERS', os.cpu_count() or 1)),
+        'chunk_rows': int(os.environ.get('REPORT_PDF_CHUNK_ROWS', DEFAULT_CHUNK_ROWS)),
+        'parallel_min_rows': int(os.environ.get('REPORT_PDF_PARALLEL_MIN_ROWS', DEFAULT_PARALLEL_MIN_ROWS)),
+        'worker_memory_mb': int(os.environ.get('REPORT_PDF_WORKER_MEMORY_MB', DEFAULT_WORKER_MEMORY_MB)),
+        'tasks_per_child': int(os.environ.get('REPORT_PDF_TASKS_PER_CHILD', DEFAULT_TASKS_PER_CHILD)),
+    }
+
+
+def render_flowables(flowables) -> bytes:
+    """Renderiza una lista de flowables a un PDF en memoria (se ejecuta en los procesos del pool)"""
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, **PAGE_OPTIONS).build(flowables)
+    return buffer.getvalue()
+
+
+def _limit_memory(megabytes):
+    # Pool initializer: a runaway report kills its worker with MemoryError, not the web process
+    try:
+        import resource
+    except ImportError:  # pragma: no cover - not available on Windows
+        return
+    limit = megabytes * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _get_executor(config):
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != config['workers']:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            methods = multiprocessing.get_all_start_methods()
+            # Never fork a threaded web worker: forkserver/spawn children start clean
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            if context.get_start_method() == 'forkserver':
+                context.set_forkserver_preload(['report_pdf'])
+            _executor = ProcessPoolExecutor(
+                max_workers=config['workers'],
+                mp_context=context,
+                initializer=_limit_memory,
+                initargs=(config['worker_memory_mb'],),
+                max_tasks_per_child=config['tasks_per_child']
+            )
+            _executor_workers = config['workers']
+        return _executor
+
+
+def shutdown(wait=False):
+    """Detiene el pool de renderizado (se vuelve a crear con el próximo reporte grande)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait, cancel_futures=True)
+            _executor = None
+
+
+atexit.register(shutdown)
+
+
+def _parts(head, detail, tail, chunk_rows):
+    """Listas de flowables de cada PDF parcial: encabezado, bloques de la tabla (el último con el cierre)"""
+    chunks = [detail.rows[start:start + chunk_rows] for start in range(0, len(detail.rows), chunk_rows)]
+    parts = [list(head)]
+    for index, rows in enumerate(chunks):
+        part = list(detail.intro) if index == 0 else []
+        part.append(detail.table(rows))
+        if index == len(chunks) - 1:
+            part.extend(tail)
+        parts.append(part)
+    return parts
+
+
+def _render_parts(parts, config):
+    if config['workers'] <= 1:
+        return [render_flowables(part) for part in parts]
+    try:
+        executor = _get_executor(config)
+        return list(executor.map(render_flowables, parts))
+    except (BrokenProcessPool, OSError) as e:
+        # A worker died (memory limit, OOM killer) or the pool could not start
+        logger.warning(f"Pool de renderizado PDF no disponible, se renderiza en este proceso: {e}")
+        shutdown()
+        return [render_flowables(part) for part in parts]
+
+
+def build_report(output_path, head, detail=None, tail=None):
+    """
+    Genera el PDF de un reporte en output_path
+
+    Args:
+        output_path: Ruta del PDF final
+        head: Flowables del encabezado y resúmenes
+        detail: DetailTable con la tabla de detalle (la parte que crece con el período)
+        tail: Flowables posteriores a la tabla (estadísticas, firma)
+    """
+    tail = tail or []
+    config = settings()
+    rows = len(detail.rows) if detail is not None else 0
+
+    if rows < max(config['parallel_min_rows'], 1) or PdfWriter is None:
+        content = list(head)
+        if detail is not None:
+            content.extend(detail.intro)
+            content.append(detail.table(detail.rows))
+        content.extend(tail)
+        SimpleDocTemplate(output_path, **PAGE_OPTIONS).build(content)
+        return output_path
+
+    pdf_parts = _render_parts(_parts(head, detail, tail, max(config['chunk_rows'], 1)), config)
+
+    writer = PdfWriter()
+    for pdf in pdf_parts:
+        writer.append(io.BytesIO(pdf))
+    with open(output_path, 'wb') as output:
+        writer.write(output)
+    return output_path
@@ -0,0 +1,140 @@
+"""
+Compresión de respuestas HTTP (gzip / brotli)
+Comprime en after_request las respuestas de texto y JSON según Accept-Encoding.
+Las respuestas pequeñas (bajo COMPRESS_MIN_SIZE) se envían tal cual. Las
+respuestas en streaming se comprimen por fragmento, sin acumular el cuerpo.
+Los archivos servidos con send_file (direct_passthrough) no se tocan.
+"""
+import gzip
+import logging
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se negocia gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/css',
+    'text/csv',
+    'text/plain',
+    'text/javascript',
+    'image/svg+xml',
+}
+
+DEFAULT_MIN_SIZE = 500  # bytes; por debajo la cabecera gzip no compensa
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 5  # buen equilibrio CPU/tamaño para respuestas dinámicas
+
+
+def _supported_encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def choose_encoding(accept_encodings):
+    """Mejor codificación aceptada por el cliente (br antes que gzip a igual calidad)"""
+    return accept_encodings.best_match(_supported_encodings())
+
+
+def compress_bytes(data: bytes, encoding: str, config) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+
+def _stream_compressor(encoding: str, config):
+    """Devuelve (compress, flush, finish) para comprimir fragmento a fragmento"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=config['COMPRESS_BROTLI_QUALITY'])
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _compress_stream(chunks, encoding: str, config):
+    compress, flush, finish = _stream_compressor(encoding, config)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk) + flush()  # flush so each chunk reaches the client right away
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def _add_vary(response):
+    vary = {value.strip().lower() for value in response.headers.get('Vary', '').split(',') if value.strip()}
+    if 'accept-encoding' not in vary:
+        response.vary.add('Accept-Encoding')
+
+
+def compress_response(response, config):
+    """Comprime la respuesta en sitio si aplica; devuelve la misma respuesta"""
+    if (response.direct_passthrough
+            or response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or request.method == 'HEAD'):
+        return response
+
+    _add_vary(response)
+
+    encoding = choose_encoding(request.accept_encodings)
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding, config)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    compressed = compress_bytes(data, encoding, config)
+    if len(compressed) >= len(data):
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if response.headers.get('ETag'):
+        # The representation changed: a strong validator must not match the identity body
+        etag, weak = response.get_etag()
+        response.set_etag(f"{etag}-{encoding}", weak=weak)
+    return response
+
+
+def init_app(app):
+    """Registra la compresión de respuestas en la aplicación"""
+    app.config.setdefault('COMPRESS_ENABLED', True)
+    app.config.setdefault('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE)
+    app.config.setdefault('COMPRESS_GZIP_LEVEL', DEFAULT_GZIP_LEVEL)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY)
+
+    @app.after_request
+    def compress_after_request(response):
+        if not app.config['COMPRESS_ENABLED']:
+            return response
+        try:
+            return compress_response(response, app.config)
+        except Exception:
+            # Never fail a request because of compression: send it uncompressed
+            logger.exception("Error comprimiendo respuesta para %s", request.path)
+            return response
+
+    if brotli is None:
+        logger.info("brotli no instalado: compresión de respuestas solo con gzip")
@@ -0,0 +1,501 @@
+"""
+Padrón de contribuyentes de la DGII (RNC) para autocompletar clientes
+Importa el archivo DGII_RNC.TXT (o el .zip que publica la DGII) en la tabla
+rnc_registry y responde búsquedas por prefijo de RNC/cédula o de nombre.
+
+Importación (import_rnc_registry.py):
+- El archivo se lee en streaming y se carga en una tabla temporal: en
+  PostgreSQL con COPY, en otros motores por lotes.
+- La tabla viva se actualiza por diferencia en una sola transacción: solo se
+  escriben las filas nuevas o cuyo digest cambió y se eliminan los RNC que ya
+  no están en el archivo. Un archivo idéntico al último importado (SHA-256)
+  no se vuelve a procesar.
+
+Búsqueda (search):
+- Cada proceso mantiene un índice en memoria con arreglos ordenados: los RNC
+  en un bloque de ancho fijo y las claves de nombre (razón social y nombre
+  comercial normalizados) en un bloque con desplazamientos. Un prefijo se
+  resuelve con búsqueda binaria; los datos de los pocos resultados se leen de
+  la base de datos por llave primaria.
+- El índice se carga en un hilo con la primera búsqueda y se recarga cuando
+  se importa el padrón (versión en SystemConfiguration, igual que
+  product_codes). Mientras no está cargado, o con RNC_REGISTRY_CACHE=0, se
+  consulta la tabla con sus índices.
+"""
+import bisect
+import gzip
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+import uuid
+import zipfile
+from array import array
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, text
+
+import models
+from models import db
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'rnc_registry_version'
+FILE_HASH_KEY = 'rnc_registry_file_sha256'
+DEFAULT_CHECK_INTERVAL = 30.0  # segundos entre comprobaciones de versión
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 25
+MIN_QUERY_LENGTH = 2
+RNC_WIDTH = 11  # cédulas have 11 digits, company RNCs 9
+NAME_LENGTH = 250
+BATCH_SIZE = 5000
+
+COLUMNS = ('rnc', 'name', 'trade_name', 'name_key', 'status', 'digest')
+
+_non_alnum = re.compile(r'[^A-Z0-9]+')
+_digits = re.compile(r'^[\d\-\s]+$')
+
+
+def normalize_name(value) -> str:
+    """Clave de búsqueda de un nombre: mayúsculas, sin acentos ni signos, espacios simples"""
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKD', str(value)).encode('ascii', 'ignore').decode('ascii')
+    return _non_alnum.sub(' ', value.upper()).strip()[:NAME_LENGTH]
+
+
+def _clean(value) -> Optional[str]:
+    value = ' '.join((value or '').split())
+    return value[:NAME_LENGTH] or None
+
+
+def _digest(fields) -> int:
+    digest = hashlib.blake2b('\x1f'.join(field or '' for field in fields).encode('utf-8'), digest_size=8)
+    return int.from_bytes(digest.digest(), 'big', signed=True)
+
+
+def parse_line(line: str) -> Optional[Tuple]:
+    """
+    Fila del padrón a partir de una línea del archivo DGII_RNC.TXT
+
+    Formato separado por '|': RNC, razón social, nombre comercial, actividad,
+    ..., fecha, estado, régimen. Las líneas sin un RNC de 9 u 11 dígitos se omiten.
+    """
+    fields = line.rstrip('\r\n').split('|')
+    if len(fields) < 2:
+        return None
+    rnc = re.sub(r'\D', '', fields[0])
+    name = _clean(fields[1])
+    if len(rnc) not in (9, 11) or not name:
+        return None
+    trade_name = _clean(fields[2]) if len(fields) > 2 else None
+    if trade_name == name:
+        trade_name = None
+    status = (_clean(fields[9]) or '')[:30] if len(fields) > 9 else ''
+    return (rnc, name, trade_name, normalize_name(name), status, _digest((rnc, name, trade_name, status)))
+
+
+def _open_lines(path) -> Iterator[str]:
+    """Líneas del archivo del padrón (texto, .gz o el .zip de la DGII); el archivo usa latin-1"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            member = next((info for info in archive.infolist() if not info.is_dir()), None)
+            if member is None:
+                return
+            with archive.open(member) as raw:
+                yield from io.TextIOWrapper(raw, encoding='latin-1', errors='replace')
+        return
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='latin-1', errors='replace') as lines:
+        yield from lines
+
+
+def read_registry(path) -> Iterator[Tuple]:
+    """Filas válidas del archivo, en el orden de COLUMNS"""
+    for line in _open_lines(path):
+        row = parse_line(line)
+        if row is not None:
+            yield row
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+def _copy_field(value) -> str:
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', ' ').replace('\n', ' ').replace('\r', ' ')
+
+
+class _CopyStream:
+    """Archivo de solo lectura sobre las filas, en el formato de texto de COPY"""
+
+    def __init__(self, rows: Iterable[Tuple]):
+        self._lines = ('\t'.join(_copy_field(value) for value in row) + '\n' for row in rows)
+        self._buffer = ''
+        self.rows = 0
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+        data = ''.join(chunks)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _load_staging(connection, rows: Iterable[Tuple]) -> int:
+    """Carga las filas del archivo en rnc_registry_staging (sin RNC repetidos)"""
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text("""
+            CREATE TEMP TABLE rnc_registry_staging (
+                rnc VARCHAR(11), name VARCHAR(250), trade_name VARCHAR(250),
+                name_key VARCHAR(250), status VARCHAR(30), digest BIGINT
+            ) ON COMMIT DROP
+        """))
+        stream = _CopyStream(rows)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY rnc_registry_staging ({', '.join(COLUMNS)}) FROM STDIN", stream)
+        finally:
+            cursor.close()
+        # The last occurrence of a repeated RNC wins, as with the batched load
+        connection.execute(text("""
+            DELETE FROM rnc_registry_staging a USING rnc_registry_staging b
+            WHERE a.rnc = b.rnc AND a.ctid < b.ctid
+        """))
+        connection.execute(text("ANALYZE rnc_registry_staging"))
+        return stream.rows
+
+    connection.execute(text("DROP TABLE IF EXISTS rnc_registry_staging"))
+    connection.execute(text("""
+        CREATE TEMP TABLE rnc_registry_staging (
+            rnc VARCHAR(11) PRIMARY KEY, name VARCHAR(250), trade_name VARCHAR(250),
+            name_key VARCHAR(250), status VARCHAR(30), digest BIGINT
+        )
+    """))
+    insert = text(f"INSERT OR REPLACE INTO rnc_registry_staging ({', '.join(COLUMNS)}) "
+                  f"VALUES ({', '.join(':' + column for column in COLUMNS)})")
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(dict(zip(COLUMNS, row)))
+        if len(batch) >= BATCH_SIZE:
+            connection.execute(insert, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        connection.execute(insert, batch)
+        count += len(batch)
+    return count
+
+
+def _apply_diff(connection) -> dict:
+    """Aplica la diferencia entre rnc_registry_staging y rnc_registry"""
+    inserted = connection.execute(text("""
+        SELECT COUNT(*) FROM rnc_registry_staging s
+        WHERE NOT EXISTS (SELECT 1 FROM rnc_registry r WHERE r.rnc = s.rnc)
+    """)).scalar()
+    updated = connection.execute(text("""
+        SELECT COUNT(*) FROM rnc_registry_staging s
+        JOIN rnc_registry r ON r.rnc = s.rnc
+        WHERE r.digest <> s.digest
+    """)).scalar()
+    connection.execute(text(f"""
+        INSERT INTO rnc_registry ({', '.join(COLUMNS)})
+        SELECT {', '.join(COLUMNS)} FROM rnc_registry_staging WHERE true
+        ON CONFLICT (rnc) DO UPDATE SET
+            name = excluded.name, trade_name = excluded.trade_name, name_key = excluded.name_key,
+            status = excluded.status, digest = excluded.digest
+        WHERE rnc_registry.digest <> excluded.digest
+    """))
+    deleted = connection.execute(text("""
+        DELETE FROM rnc_registry
+        WHERE NOT EXISTS (SELECT 1 FROM rnc_registry_staging s WHERE s.rnc = rnc_registry.rnc)
+    """)).rowcount
+    return {'inserted': inserted, 'updated': updated, 'deleted': deleted}
+
+
+def _set_config(connection, key, value, description):
+    table = models.SystemConfiguration.__table__
+    result = connection.execute(table.update().where(table.c.key == key).values(value=value))
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(key=key, value=value, description=description))
+
+
+def import_registry(path, force=False) -> dict:
+    """
+    Importa el archivo del padrón de la DGII por diferencia con la tabla actual
+
+    Args:
+        path: Archivo DGII_RNC.TXT, .gz o el .zip publicado por la DGII
+        force: Procesar aunque el archivo sea idéntico al último importado
+
+    Returns:
+        Diccionario con las filas leídas, insertadas, actualizadas y eliminadas
+
+    Raises:
+        ValueError: si el archivo no tiene ninguna fila válida
+    """
+    sha256 = file_sha256(path)
+    config = models.SystemConfiguration.__table__
+    started = time.monotonic()
+
+    with db.engine.begin() as connection:
+        previous = connection.execute(select(config.c.value).where(config.c.key == FILE_HASH_KEY)).scalar()
+        if previous == sha256 and not force:
+            return {'skipped': True, 'rows': 0, 'inserted': 0, 'updated': 0, 'deleted': 0}
+
+        rows = _load_staging(connection, read_registry(path))
+        if rows == 0:
+            # Never empty the registry because of a truncated or wrong file
+            raise ValueError('El archivo no contiene filas válidas del padrón de RNC')
+
+        summary = _apply_diff(connection)
+        if connection.dialect.name != 'postgresql':
+            connection.execute(text("DROP TABLE IF EXISTS rnc_registry_staging"))
+
+        _set_config(connection, FILE_HASH_KEY, sha256, 'SHA-256 del último archivo del padrón de RNC importado')
+        if summary['inserted'] or summary['updated'] or summary['deleted']:
+            version = uuid.uuid4().hex
+            _set_config(connection, VERSION_KEY, version, 'Versión del índice en memoria del padrón de RNC')
+
+    # Every process, this one included, reloads its index on its next search
+    _cache.checked_at = 0.0
+    summary.update({'skipped': False, 'rows': rows, 'seconds': round(time.monotonic() - started, 2)})
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# In-memory index
+# ---------------------------------------------------------------------------
+
+class _Index:
+    """Arreglos ordenados para búsqueda binaria por prefijo"""
+
+    def __init__(self, rncs: bytes, names: bytes, name_offsets: array):
+        self.rncs = rncs  # RNCs padded to RNC_WIDTH, sorted
+        self.names = names  # b'KEY\x1fRNC\n' records sorted by key
+        self.name_offsets = name_offsets
+        self.count = len(rncs) // RNC_WIDTH
+
+    def _rnc_at(self, index):
+        start = index * RNC_WIDTH
+        return self.rncs[start:start + RNC_WIDTH]
+
+    def by_rnc(self, prefix: str, limit: int) -> List[str]:
+        key = prefix.encode('ascii')
+        size = len(key)
+        positions = range(self.count)
+        start = bisect.bisect_left(positions, key, key=lambda index: self._rnc_at(index)[:size])
+        found = []
+        for index in range(start, min(start + limit, self.count)):
+            value = self._rnc_at(index)
+            if value[:size] != key:
+                break
+            found.append(value.rstrip().decode('ascii'))
+        return found
+
+    def by_name(self, prefix: str, limit: int) -> List[str]:
+        key = prefix.encode('ascii')
+        size = len(key)
+        names = self.names
+        offsets = self.name_offsets
+        start = bisect.bisect_left(offsets, key, key=lambda offset: names[offset:offset + size])
+        found = []
+        for offset in offsets[start:]:
+            if names[offset:offset + size] != key:
+                break
+            end = names.index(b'\n', offset)
+            rnc = names[names.rindex(b'\x1f', offset, end) + 1:end].decode('ascii')
+            if rnc not in found:
+                found.append(rnc)
+                if len(found) >= limit:
+                    break
+        return found
+
+
+class _Cache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index: Optional[_Index] = None
+        self.loading = False
+        self.enabled = True
+        self.app = None
+        self.version: Optional[str] = None
+        self.checked_at = 0.0
+        self.check_interval = DEFAULT_CHECK_INTERVAL
+
+
+_cache = _Cache()
+
+
+def build_index() -> _Index:
+    """Lee rnc, razón social y nombre comercial de todo el padrón y arma el índice"""
+    table = models.RNCRegistry.__table__
+    rncs = []
+    records = []
+    result = db.session.execute(
+        select(table.c.rnc, table.c.name_key, table.c.trade_name).execution_options(yield_per=BATCH_SIZE)
+    )
+    for rnc, name_key, trade_name in result:
+        rncs.append(rnc.ljust(RNC_WIDTH).encode('ascii'))
+        if name_key:
+            records.append(f'{name_key}\x1f{rnc}\n'.encode('ascii'))
+        trade_key = normalize_name(trade_name)
+        if trade_key and trade_key != name_key:
+            records.append(f'{trade_key}\x1f{rnc}\n'.encode('ascii'))
+
+    rncs.sort()
+    records.sort()
+    names = b''.join(records)
+    offsets = array('I')
+    position = 0
+    for record in records:
+        offsets.append(position)
+        position += len(record)
+    return _Index(b''.join(rncs), names, offsets)
+
+
+def _read_version() -> Optional[str]:
+    return db.session.query(models.SystemConfiguration.value).filter_by(key=VERSION_KEY).scalar()
+
+
+def warm():
+    """Carga el índice en memoria en este hilo; devuelve el número de RNC"""
+    version = _read_version()
+    index = build_index()
+    with _cache.lock:
+        _cache.index = index
+        _cache.version = version
+        _cache.checked_at = time.monotonic()
+    return index.count
+
+
+def _load_in_background(app):
+    try:
+        with app.app_context():
+            count = warm()
+            logger.info(f"Padrón de RNC cargado en memoria: {count} contribuyentes")
+    except Exception as e:
+        # Registry table not migrated yet or database unavailable: searches use the database
+        logger.info(f"Padrón de RNC no cargado en memoria: {e}")
+    finally:
+        with _cache.lock:
+            _cache.loading = False
+
+
+def _schedule_load():
+    if not _cache.enabled or _cache.app is None:
+        return
+    with _cache.lock:
+        if _cache.loading:
+            return
+        _cache.loading = True
+    threading.Thread(target=_load_in_background, args=(_cache.app,), name='rnc-registry-load',
+                     daemon=True).start()
+
+
+def _check_version():
+    """Recarga el índice si otro proceso importó el padrón (como máximo cada check_interval)"""
+    now = time.monotonic()
+    if now - _cache.checked_at < _cache.check_interval:
+        return
+    _cache.checked_at = now
+    if _read_version() != _cache.version:
+        # The current index keeps answering until the new one is ready
+        _schedule_load()
+
+
+def _search_database(query: str, by_rnc: bool, limit: int) -> List[str]:
+    registry = models.RNCRegistry
+    column = registry.rnc if by_rnc else registry.name_key
+    # Range instead of LIKE: uses the btree index whatever the collation
+    upper = query[:-1] + chr(ord(query[-1]) + 1)
+    return [rnc for (rnc,) in db.session.query(registry.rnc).filter(
+        column >= query, column < upper
+    ).order_by(column).limit(limit).all()]
+
+
+def _rows(rncs: List[str]) -> List[dict]:
+    if not rncs:
+        return []
+    rows = {row.rnc: row for row in models.RNCRegistry.query.filter(models.RNCRegistry.rnc.in_(rncs)).all()}
+    return [{
+        'rnc': rnc,
+        'name': rows[rnc].name,
+        'trade_name': rows[rnc].trade_name,
+        'status': rows[rnc].status
+    } for rnc in rncs if rnc in rows]
+
+
+def search(query, limit=DEFAULT_LIMIT) -> dict:
+    """
+    Contribuyentes cuyo RNC/cédula o nombre empieza por query
+
+    Una consulta de solo dígitos (se ignoran guiones y espacios) busca por RNC;
+    cualquier otra, por razón social o nombre comercial.
+
+    Returns:
+        {'results': [...], 'source': 'memory' | 'database'}
+    """
+    query = (query or '').strip()
+    limit = max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+    by_rnc = bool(_digits.match(query))
+    key = re.sub(r'\D', '', query)[:RNC_WIDTH] if by_rnc else normalize_name(query)
+    if len(key) < MIN_QUERY_LENGTH:
+        return {'results': [], 'source': 'memory'}
+
+    if _cache.enabled:
+        _check_version()
+        if _cache.index is None:
+            _schedule_load()
+    index = _cache.index if _cache.enabled else None
+
+    if index is not None:
+        rncs = index.by_rnc(key, limit) if by_rnc else index.by_name(key, limit)
+        source = 'memory'
+    else:
+        rncs = _search_database(key, by_rnc, limit)
+        source = 'database'
+    return {'results': _rows(rncs), 'source': source}
+
+
+def lookup(rnc) -> Optional[dict]:
+    """Contribuyente con ese RNC/cédula exacto (None si no está en el padrón)"""
+    rnc = re.sub(r'\D', '', rnc or '')
+    row = db.session.get(models.RNCRegistry, rnc) if rnc else None
+    if row is None:
+        return None
+    return {'rnc': row.rnc, 'name': row.name, 'trade_name': row.trade_name, 'status': row.status}
+
+
+def init_app(app):
+    """Configura el índice en memoria (se carga en segundo plano con la primera búsqueda)"""
+    app.config.setdefault('RNC_REGISTRY_CACHE', os.environ.get('RNC_REGISTRY_CACHE', '1') != '0')
+    app.config.setdefault('RNC_REGISTRY_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL)
+    _cache.enabled = bool(app.config['RNC_REGISTRY_CACHE'])
+    _cache.check_interval = float(app.config['RNC_REGISTRY_CHECK_INTERVAL'])
+    _cache.app = app
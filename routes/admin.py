@@ -12,8 +12,17 @@ from utils import (
     initialize_company_settings, 
     get_company_settings, 
     update_company_setting,
-    get_company_info_for_receipt
+    get_company_info_for_receipt,
+    keyset_paginate,
+    decode_keyset_cursor
 )
+import db_engine
+import db_routing
+import jobs
+import sales_aggregates
+import low_stock
+import tax_profiles
+import ncf_integrity
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 logger = logging.getLogger(__name__)
@@ -154,11 +163,8 @@ def dashboard():
     else:
         sales_change_percent = 100 if daily_sales > 0 else 0
     
-    low_stock_products = models.Product.query.filter(
-        models.Product.stock <= models.Product.min_stock,
-        models.Product.active == True,
-        models.Product.product_type == 'inventariable'
-    ).all()
+    # Maintained on every stock change: reads the alerts, not the whole catalog
+    low_stock_products = [alert.product for alert in low_stock.alerts()]
     
     # Most sold product today
     top_product = db.session.query(
@@ -745,118 +751,181 @@ def reports():
     return render_template('admin/reports.html')
 
 
-@bp.route('/invoices')
-def invoices():
-    """Vista para mostrar la lista de facturas/ventas"""
-    user = require_admin_or_cashier()
-    if not isinstance(user, models.User):
-        return user
+def _parse_invoice_filters():
+    """Lee los filtros del listado de facturas desde los parámetros de la petición"""
+    filters = {
+        'search': request.args.get('search', '', type=str),
+        'status_filter': request.args.get('status', '', type=str),
+        'date_from': request.args.get('date_from', '', type=str),
+        'date_to': request.args.get('date_to', '', type=str),
+        'from_date': None,
+        'to_date': None
+    }
+    
+    if filters['date_from']:
+        try:
+            filters['from_date'] = datetime.strptime(filters['date_from'], '%Y-%m-%d')
+        except ValueError:
+            pass
     
-    # Obtener parámetros de filtro
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
-    search = request.args.get('search', '', type=str)
-    status_filter = request.args.get('status', '', type=str)
-    date_from = request.args.get('date_from', '', type=str)
-    date_to = request.args.get('date_to', '', type=str)
+    if filters['date_to']:
+        try:
+            # Incluir todo el día seleccionado
+            filters['to_date'] = datetime.strptime(filters['date_to'], '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+        except ValueError:
+            pass
     
-    # Construir query base
+    return filters
+
+
+def _filtered_invoices_query(filters, cash_register_id=None):
+    """Construye la query de ventas con los filtros del listado de facturas (sin ORDER BY)"""
     query = models.Sale.query
     
-    # Aplicar filtros
-    if search:
+    if filters['search']:
+        search = filters['search']
         query = query.filter(
             models.Sale.ncf.ilike(f'%{search}%') |
             models.Sale.customer_name.ilike(f'%{search}%') |
             models.Sale.customer_rnc.ilike(f'%{search}%')
         )
     
-    if status_filter:
-        query = query.filter(models.Sale.status == status_filter)
+    if filters['status_filter']:
+        query = query.filter(models.Sale.status == filters['status_filter'])
     
-    if date_from:
-        try:
-            from_date = datetime.strptime(date_from, '%Y-%m-%d')
-            query = query.filter(models.Sale.created_at >= from_date)
-        except ValueError:
-            pass
+    if filters['from_date']:
+        query = query.filter(models.Sale.created_at >= filters['from_date'])
     
-    if date_to:
-        try:
-            to_date = datetime.strptime(date_to, '%Y-%m-%d')
-            # Agregar un día para incluir todo el día seleccionado
-            to_date = to_date.replace(hour=23, minute=59, second=59)
-            query = query.filter(models.Sale.created_at <= to_date)
-        except ValueError:
-            pass
+    if filters['to_date']:
+        query = query.filter(models.Sale.created_at <= filters['to_date'])
     
-    # Para cajeros, solo mostrar ventas de su caja registradora
-    if user.role.value == 'CAJERO':
-        cash_register = models.CashRegister.query.filter_by(user_id=user.id, active=True).first()
-        if not cash_register:
-            # Si el cajero no tiene caja registradora activa, no puede ver ninguna venta
-            flash('No tienes una caja registradora asignada. Contacta al administrador.', 'error')
-            return redirect(url_for('admin.dashboard'))
-        query = query.filter(models.Sale.cash_register_id == cash_register.id)
-    
-    # Ordenar por fecha de creación (más recientes primero)
-    query = query.order_by(models.Sale.created_at.desc())
+    if cash_register_id is not None:
+        query = query.filter(models.Sale.cash_register_id == cash_register_id)
     
-    # Paginación
-    sales = query.paginate(
-        page=page,
-        per_page=per_page,
-        error_out=False
-    )
+    return query
+
+
+def _invoice_stats(filters, cash_register_id=None):
+    """
+    Estadísticas de ventas completadas para el listado de facturas
     
-    # Crear una consulta para estadísticas que respete todos los filtros aplicados
-    stats_query = models.Sale.query
+    Sin búsqueda de texto se leen de los agregados diarios (costo por día, no por venta);
+    con búsqueda se cuentan sobre las ventas filtradas.
+    """
+    if filters['status_filter'] and filters['status_filter'] != 'completed':
+        # Las estadísticas solo consideran ventas completadas
+        return 0, 0
     
-    # Aplicar todos los mismos filtros que se usaron para la consulta principal
-    if search:
-        stats_query = stats_query.filter(
-            models.Sale.ncf.ilike(f'%{search}%') |
-            models.Sale.customer_name.ilike(f'%{search}%') |
-            models.Sale.customer_rnc.ilike(f'%{search}%')
+    if not filters['search']:
+        return sales_aggregates.get_completed_totals(
+            date_from=filters['from_date'],
+            date_to=filters['to_date'],
+            cash_register_id=cash_register_id
         )
     
-    if status_filter:
-        stats_query = stats_query.filter(models.Sale.status == status_filter)
-    
-    if date_from:
-        try:
-            from_date = datetime.strptime(date_from, '%Y-%m-%d')
-            stats_query = stats_query.filter(models.Sale.created_at >= from_date)
-        except ValueError:
-            pass
+    completed_stats_query = _filtered_invoices_query(filters, cash_register_id).filter(
+        models.Sale.status == 'completed'
+    )
+    total_sales = completed_stats_query.count()
+    total_amount = completed_stats_query.with_entities(func.sum(models.Sale.total)).scalar() or 0
+    return total_sales, total_amount
+
+
+@bp.route('/invoices')
+def invoices():
+    """Vista para mostrar la lista de facturas/ventas"""
+    user = require_admin_or_cashier()
+    if not isinstance(user, models.User):
+        return user
     
-    if date_to:
-        try:
-            to_date = datetime.strptime(date_to, '%Y-%m-%d')
-            to_date = to_date.replace(hour=23, minute=59, second=59)
-            stats_query = stats_query.filter(models.Sale.created_at <= to_date)
-        except ValueError:
-            pass
+    # Obtener parámetros de filtro y de paginación por cursor
+    filters = _parse_invoice_filters()
+    cursor = request.args.get('cursor', '', type=str)
+    direction = request.args.get('direction', 'next', type=str)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
     
-    # Para cajeros, aplicar mismo filtro de caja registradora
+    # Para cajeros, solo mostrar ventas de su caja registradora
+    cash_register_id = None
     if user.role.value == 'CAJERO':
         cash_register = models.CashRegister.query.filter_by(user_id=user.id, active=True).first()
-        if cash_register:
-            stats_query = stats_query.filter(models.Sale.cash_register_id == cash_register.id)
+        if not cash_register:
+            # Si el cajero no tiene caja registradora activa, no puede ver ninguna venta
+            flash('No tienes una caja registradora asignada. Contacta al administrador.', 'error')
+            return redirect(url_for('admin.dashboard'))
+        cash_register_id = cash_register.id
     
-    # Calcular estadísticas solo de ventas completadas con los filtros aplicados
-    completed_stats_query = stats_query.filter(models.Sale.status == 'completed')
-    total_sales = completed_stats_query.count()
-    total_amount = completed_stats_query.with_entities(func.sum(models.Sale.total)).scalar() or 0
+    # Paginación keyset sobre (created_at, id), más recientes primero
+    query = _filtered_invoices_query(filters, cash_register_id)
+    sales = keyset_paginate(query, models.Sale, cursor=cursor, direction=direction, per_page=per_page)
+    
+    total_sales, total_amount = _invoice_stats(filters, cash_register_id)
     
     return render_template('admin/invoices.html',
                          sales=sales,
                          total_sales=total_sales,
                          total_amount=total_amount,
-                         search=search,
-                         status_filter=status_filter,
-                         date_from=date_from,
-                         date_to=date_to)
+                         per_page=per_page,
+                         search=filters['search'],
+                         status_filter=filters['status_filter'],
+                         date_from=filters['date_from'],
+                         date_to=filters['date_to'])
+
+
+@bp.route('/api/invoices')
+def invoices_api():
+    """API JSON del listado de facturas con paginación por cursor"""
+    user = require_admin_or_cashier()
+    if not isinstance(user, models.User):
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    filters = _parse_invoice_filters()
+    cursor = request.args.get('cursor', '', type=str)
+    direction = request.args.get('direction', 'next', type=str)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    include_stats = request.args.get('include_stats', 'true').lower() != 'false'
+    
+    cash_register_id = None
+    if user.role.value == 'CAJERO':
+        cash_register = models.CashRegister.query.filter_by(user_id=user.id, active=True).first()
+        if not cash_register:
+            return jsonify({'error': 'No tienes una caja registradora asignada'}), 400
+        cash_register_id = cash_register.id
+    
+    if cursor and not decode_keyset_cursor(cursor):
+        return jsonify({'error': 'Cursor inválido'}), 400
+    
+    query = _filtered_invoices_query(filters, cash_register_id)
+    page = keyset_paginate(query, models.Sale, cursor=cursor, direction=direction, per_page=per_page)
+    
+    response = {
+        'sales': [{
+            'id': sale.id,
+            'ncf': sale.ncf,
+            'customer_name': sale.customer_name,
+            'customer_rnc': sale.customer_rnc,
+            'created_at': sale.created_at.isoformat() if sale.created_at else None,
+            'subtotal': float(sale.subtotal or 0),
+            'tax_amount': float(sale.tax_amount or 0),
+            'total': float(sale.total or 0),
+            'payment_method': sale.payment_method,
+            'status': sale.status,
+            'cash_register_id': sale.cash_register_id
+        } for sale in page.items],
+        'per_page': per_page,
+        'has_next': page.has_next,
+        'has_prev': page.has_prev,
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor
+    }
+    
+    if include_stats:
+        total_sales, total_amount = _invoice_stats(filters, cash_register_id)
+        response['stats'] = {
+            'total_sales': total_sales,
+            'total_amount': float(total_amount)
+        }
+    
+    return jsonify(response)
 
 
 @bp.route('/ncf-sequences')
@@ -1925,6 +1994,7 @@ def api_create_tax_type():
         tax_type.active = True
         
         db.session.add(tax_type)
+        tax_profiles.tax_types_changed()
         db.session.commit()
         
         return jsonify({
@@ -1988,6 +2058,7 @@ def api_update_tax_type(tax_type_id):
         if 'active' in data:
             tax_type.active = data['active']
         
+        tax_profiles.tax_types_changed()
         db.session.commit()
         
         return jsonify({
@@ -2032,6 +2103,7 @@ def api_delete_tax_type(tax_type_id):
             return jsonify({'error': f'No se puede eliminar. Este tipo de impuesto está siendo usado por {product_count} producto(s)'}), 400
         
         db.session.delete(tax_type)
+        tax_profiles.tax_types_changed()
         db.session.commit()
         
         return jsonify({
@@ -2363,6 +2435,7 @@ def delete_supplier(supplier_id):
 
 
 @bp.route('/api/sales-report')
+@db_routing.read_only
 def sales_report_api():
     """API endpoint para obtener datos de ventas por período"""
     user = require_admin_or_manager_or_cashier()
@@ -2498,6 +2571,8 @@ def sales_report_api():
 
 
 @bp.route('/api/sales-report/pdf')
+@db_routing.read_only
+@jobs.supports_async
 def download_sales_report_pdf():
     """Generar y descargar PDF de reporte de ventas"""
     user = require_admin_or_manager_or_cashier()
@@ -2557,6 +2632,7 @@ def download_sales_report_pdf():
         sales = query.order_by(models.Sale.created_at.desc()).all()
         
         # Generar PDF
+        jobs.report_progress(50, 'Generando PDF')
         pdf_path = generate_sales_report_pdf(sales, period_name, start, end)
         
         # Enviar archivo
@@ -2573,6 +2649,7 @@ def download_sales_report_pdf():
 
 
 @bp.route('/api/products-report')
+@db_routing.read_only
 def products_report_api():
     """API endpoint para obtener datos de productos más vendidos por período"""
     user = require_admin_or_manager_or_cashier()
@@ -2744,6 +2821,8 @@ def products_report_api():
 
 
 @bp.route('/api/products-report/pdf')
+@db_routing.read_only
+@jobs.supports_async
 def download_products_report_pdf():
     """Generar y descargar PDF de reporte de productos más vendidos"""
     user = require_admin_or_manager_or_cashier()
@@ -2834,6 +2913,7 @@ def download_products_report_pdf():
         products_sorted = sorted(product_stats, key=lambda x: x.total_quantity, reverse=True)[:limit]
         
         # Generar PDF
+        jobs.report_progress(50, 'Generando PDF')
         pdf_path = generate_products_report_pdf(products_sorted, period_name, start, end, limit)
         
         # Enviar archivo
@@ -2852,6 +2932,7 @@ def download_products_report_pdf():
 
 
 @bp.route('/api/ncf-report')
+@db_routing.read_only
 def ncf_report_api():
     """API endpoint para obtener reporte de comprobantes NCF"""
     user = require_admin_or_manager_or_cashier()
@@ -2920,6 +3001,8 @@ def ncf_report_api():
         # Estadísticas por tipo de NCF
         stats_by_type = {}
         alerts = []
+        # Último resultado del verificador nocturno (ncf_integrity.py): huecos y duplicados reales
+        integrity = ncf_integrity.summary_by_sequence()
         
         for sequence in sequences:
             ncf_type = sequence.ncf_type.value
@@ -2958,9 +3041,21 @@ def ncf_report_api():
                 'available': available,
                 'cancelled': cancelled_count,
                 'utilization': round(utilization, 2),
-                'active': sequence.active
+                'active': sequence.active,
+                'integrity': integrity.get(sequence.id)
             })
             
+            sequence_integrity = integrity.get(sequence.id)
+            if sequence_integrity and (sequence_integrity['gap'] or sequence_integrity['duplicate']):
+                alerts.append({
+                    'level': 'critical',
+                    'type': ncf_type,
+                    'type_display': ncf_type_names.get(ncf_type, ncf_type),
+                    'serie': sequence.serie,
+                    'message': f'CRÍTICO: La serie {sequence.serie} tiene {sequence_integrity["gap"]} huecos y '
+                               f'{sequence_integrity["duplicate"]} duplicados sin resolver'
+                })
+            
             stats_by_type[ncf_type]['total_in_range'] += total_in_range
             stats_by_type[ncf_type]['total_used'] += total_used
             stats_by_type[ncf_type]['total_cancelled'] += cancelled_count
@@ -3092,6 +3187,8 @@ def ncf_report_api():
 
 
 @bp.route('/api/ncf-report/pdf')
+@db_routing.read_only
+@jobs.supports_async
 def download_ncf_report_pdf():
     """Generar y descargar PDF de reporte de comprobantes NCF"""
     user = require_admin_or_manager_or_cashier()
@@ -3170,6 +3267,7 @@ def download_ncf_report_pdf():
         
         ledger_entries = ledger_query.order_by(models.NCFLedger.issued_at.desc()).limit(500).all()
         
+        jobs.report_progress(50, 'Generando PDF')
         pdf_path = generate_ncf_report_pdf(sequences, ledger_entries, period_name, start, end)
         
         return send_file(
@@ -3187,6 +3285,7 @@ def download_ncf_report_pdf():
 
 
 @bp.route('/api/users-sales-report')
+@db_routing.read_only
 def users_sales_report_api():
     """API endpoint para obtener datos de ventas por usuario"""
     user = require_admin_or_manager_or_cashier()
@@ -3378,6 +3477,8 @@ def users_sales_report_api():
 
 
 @bp.route('/api/users-sales-report/pdf')
+@db_routing.read_only
+@jobs.supports_async
 def download_users_sales_report_pdf():
     """Generar y descargar PDF de reporte de ventas por usuario"""
     user = require_admin_or_manager_or_cashier()
@@ -3490,6 +3591,7 @@ def download_users_sales_report_pdf():
             })
         
         # Generar PDF
+        jobs.report_progress(50, 'Generando PDF')
         pdf_path = generate_users_sales_report_pdf(users_data, period_name, start, end, role_filter)
         
         return send_file(
@@ -3506,6 +3608,16 @@ def download_users_sales_report_pdf():
         return redirect(url_for('admin.reports'))
 
 
+@bp.route('/api/system/db-pool', methods=['GET'])
+def get_db_pool_status():
+    """Estado del pool de conexiones de este worker (en uso, overflow, esperas, timeouts)"""
+    user = require_admin()
+    if not isinstance(user, models.User):
+        return jsonify({'error': 'No autorizado'}), 401
+
+    return jsonify(db_engine.pool_status())
+
+
 @bp.route('/api/bluetooth/status', methods=['GET'])
 def get_bluetooth_status():
     """Verificar disponibilidad de Bluetooth en el sistema"""
@@ -3526,6 +3638,7 @@ def get_bluetooth_status():
 
 
 @bp.route('/api/bluetooth/scan', methods=['POST'])
+@jobs.supports_async
 def scan_bluetooth_devices_endpoint():
     """Escanear dispositivos Bluetooth cercanos"""
     user = require_admin()
@@ -3537,6 +3650,7 @@ def scan_bluetooth_devices_endpoint():
         scan_duration = data.get('scan_duration', 8)
         
         from thermal_printer import scan_bluetooth_devices
+        jobs.report_progress(10, 'Escaneando dispositivos Bluetooth')
         devices = scan_bluetooth_devices(scan_duration=scan_duration)
         
         return jsonify({
@@ -3553,6 +3667,7 @@ def scan_bluetooth_devices_endpoint():
 
 
 @bp.route('/api/bluetooth/connect', methods=['POST'])
+@jobs.supports_async
 def connect_bluetooth_printer():
     """Conectar una impresora Bluetooth"""
     user = require_admin()
@@ -4,13 +4,22 @@ from models import db
 from datetime import datetime
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import text
-from sqlalchemy.orm import joinedload
 import time
 import random
+import uuid
 import os
 import logging
 from receipt_generator import generate_pdf_receipt, generate_thermal_receipt_text
 import utils
+import sales_aggregates
+import cash_ledger
+import tax_engine
+import tax_profiles
+import stock_control
+import product_codes
+import rnc_registry
+import kitchen
+import outbox
 from utils import (get_company_info_for_receipt, validate_ncf, error_response,
                   log_error, log_success, generate_error_id)
 from flask_wtf.csrf import validate_csrf
@@ -135,23 +144,8 @@ def get_categories():
 # REMOVED: GLOBAL_TAX_TYPES hardcoded list - now using database queries
 
 def get_tax_type_by_id(tax_type_id):
-    """Helper function to get tax type from database by ID"""
-    if not tax_type_id:
-        return None
-    
-    tax_type = models.TaxType.query.filter_by(id=int(tax_type_id), active=True).first()
-    if not tax_type:
-        return None
-    
-    return {
-        'id': tax_type.id,
-        'name': tax_type.name,
-        'rate': tax_type.rate,
-        'is_inclusive': tax_type.is_inclusive,
-        'description': getattr(tax_type, 'description', ''),
-        'is_percentage': True,
-        'display_order': tax_type.id
-    }
+    """Helper function to get an active tax type by ID (cached in tax_profiles)"""
+    return tax_profiles.get_tax_type(tax_type_id)
 
 @bp.route('/tax-types')
 def get_tax_types():
@@ -355,6 +349,112 @@ def create_sale():
         )
 
 
+def _resolve_line_tax(product_id, tax_type_id=None, is_inclusive=None, profile=None):
+    """
+    Impuesto de una línea: (tax_rate, is_tax_included, tax_types)
+
+    ENHANCED TAX CALCULATION LOGIC with proper fallback hierarchy
+    1. Use tax_type_id and is_inclusive from frontend payload (if provided)
+    2. Fallback to the product's tax profile (cached product_taxes)
+    3. Final fallback to default ITBIS 18% included for fiscal compliance
+    """
+    product_tax_types = []
+
+    if tax_type_id:
+        # Use tax information explicitly provided by frontend from global variable
+        tax_type = get_tax_type_by_id(tax_type_id)
+        if tax_type:
+            total_tax_rate = tax_type['rate']
+            has_inclusive_tax = is_inclusive if is_inclusive is not None else tax_type['is_inclusive']
+        else:
+            # Invalid tax_type_id provided, use default fallback
+            total_tax_rate = 0.18  # Default ITBIS 18%
+            has_inclusive_tax = True
+    else:
+        profile = profile or tax_profiles.get_profile(product_id)
+        total_tax_rate, has_inclusive_tax = profile.rate, profile.is_inclusive
+        product_tax_types = list(profile.tax_types)
+
+    # Use 0.0 instead of None for tax_rate field
+    tax_rate = float(total_tax_rate) if total_tax_rate and total_tax_rate > 0 else 0.0
+    return tax_rate, has_inclusive_tax, product_tax_types
+
+
+def _add_product_to_sale(sale, product, quantity, tax_type_id=None, is_inclusive=None):
+    """
+    Agrega un producto a una venta ya bloqueada o suma la cantidad a su línea (sin commit)
+
+    Compartido por agregar producto y escanear código. Valida el stock del
+    total en carrito (solo lectura, el descuento real es al finalizar) y
+    recalcula los totales de la venta.
+
+    Returns:
+        (sale_item, product_tax_types)
+
+    Raises:
+        SaleFinalizationError: Stock insuficiente
+    """
+    # Existing lines of the same product in this sale (quantities are merged into the first one)
+    existing_items = models.SaleItem.query.filter_by(sale_id=sale.id, product_id=product.id).order_by(
+        models.SaleItem.id
+    ).all()
+    existing_quantity = sum(item.quantity for item in existing_items)
+
+    # Calculate total quantity (existing + new) - needed for all products
+    total_quantity = existing_quantity + quantity
+
+    # Only validate stock for inventariable products, not consumables
+    if product.product_type == 'inventariable':
+        # Check stock availability against total quantity
+        if product.stock < total_quantity:
+            shortage = total_quantity - product.stock
+            raise SaleFinalizationError(
+                error_type='business',
+                message='Stock insuficiente',
+                details=f'No hay suficiente stock de {product.name}. Disponible: {product.stock}, ya en carrito: {existing_quantity}, solicitado ahora: {quantity}, total necesario: {total_quantity}',
+                field='quantity',
+                product_id=product.id,
+                product_name=product.name,
+                stock_available=product.stock,
+                quantity_in_cart=int(existing_quantity),
+                quantity_requested=quantity,
+                total_needed=total_quantity,
+                shortage=shortage,
+                user_message=f'No hay suficiente stock de {product.name}. Disponible: {product.stock}, necesario: {total_quantity}'
+            )
+    # For consumable products, skip stock validation entirely
+
+    # Check if product already exists in this sale - merge quantities instead of creating duplicate lines
+    existing_item = existing_items[0] if existing_items else None
+
+    total_tax_rate, has_inclusive_tax, product_tax_types = _resolve_line_tax(product.id, tax_type_id, is_inclusive)
+
+    if existing_item:
+        # Update existing item quantity
+        existing_item.quantity = total_quantity
+        existing_item.total_price = product.price * total_quantity
+        existing_item.tax_rate = total_tax_rate
+        existing_item.is_tax_included = has_inclusive_tax
+        sale_item = existing_item
+    else:
+        # Create new sale item
+        sale_item = models.SaleItem()
+        sale_item.sale_id = sale.id
+        sale_item.product_id = product.id
+        sale_item.quantity = quantity
+        sale_item.unit_price = product.price
+        sale_item.total_price = product.price * quantity
+        sale_item.tax_rate = total_tax_rate
+        sale_item.is_tax_included = has_inclusive_tax
+
+        db.session.add(sale_item)
+
+    # Recalculate sale totals with the shared tax engine (same figures as finalize_sale)
+    tax_engine.apply_to_sale(sale)
+    
+    return sale_item, product_tax_types
+
+
 @bp.route('/sales/<int:sale_id>/items', methods=['POST'])
 def add_sale_item(sale_id):
     user = require_login()
@@ -435,10 +535,9 @@ def add_sale_item(sale_id):
                 allowed_statuses=['pending', 'tab_open']
             )
         
-        # Lock product to ensure consistent stock validation and load tax relationships
-        product = db.session.query(models.Product).options(
-            joinedload(models.Product.product_taxes).joinedload(models.ProductTax.tax_type)
-        ).filter_by(id=data['product_id']).with_for_update(of=models.Product).first()
+        # Read-only stock check: no product row lock here, the authoritative check is the
+        # conditional decrement at finalize (taxes come from the tax profile cache)
+        product = db.session.get(models.Product, data['product_id'])
         if not product:
             return error_response(
                 error_type='not_found',
@@ -449,141 +548,16 @@ def add_sale_item(sale_id):
                 status_code=404
             )
 
-        # Check for existing sale items of the same product in this sale (always needed)
-        existing_quantity = db.session.query(db.func.sum(models.SaleItem.quantity)).filter_by(
-            sale_id=sale_id, 
-            product_id=product.id
-        ).scalar() or 0
-        
-        # Calculate total quantity (existing + new) - needed for all products
-        total_quantity = existing_quantity + quantity
-        
-        # Only validate stock for inventariable products, not consumables
-        if product.product_type == 'inventariable':
-            # Check stock availability against total quantity
-            if product.stock < total_quantity:
-                shortage = total_quantity - product.stock
-                return error_response(
-                    error_type='business',
-                    message='Stock insuficiente',
-                    details=f'No hay suficiente stock de {product.name}. Disponible: {product.stock}, ya en carrito: {existing_quantity}, solicitado ahora: {quantity}, total necesario: {total_quantity}',
-                    field='quantity',
-                    product_id=product.id,
-                    product_name=product.name,
-                    stock_available=product.stock,
-                    quantity_in_cart=int(existing_quantity),
-                    quantity_requested=quantity,
-                    total_needed=total_quantity,
-                    shortage=shortage,
-                    user_message=f'No hay suficiente stock de {product.name}. Disponible: {product.stock}, necesario: {total_quantity}'
-                )
-        # For consumable products, skip stock validation entirely
-
-        # Check if product already exists in this sale - merge quantities instead of creating duplicate lines
-        existing_item = models.SaleItem.query.filter_by(sale_id=sale_id, product_id=product.id).first()
-        
-        # ENHANCED TAX CALCULATION LOGIC with proper fallback hierarchy
-        # 1. Use tax_type_id and is_inclusive from frontend payload (if provided)
-        # 2. Fallback to product.product_taxes (if configured)
-        # 3. Final fallback to default ITBIS 18% included for fiscal compliance
-        
-        # Get product's tax types for NEW TAX SYSTEM (always initialize)
-        product_tax_types = []
-        for product_tax in product.product_taxes:
-            if product_tax.tax_type.active:
-                # Defensive fallback for tax_category (handles NULL/missing values)
-                tax_category = 'tax'  # Default to 'tax' for fiscal compliance
-                if hasattr(product_tax.tax_type, 'tax_category') and product_tax.tax_type.tax_category:
-                    tax_category = product_tax.tax_type.tax_category.value if hasattr(product_tax.tax_type.tax_category, 'value') else str(product_tax.tax_type.tax_category)
-                
-                product_tax_types.append({
-                    'name': product_tax.tax_type.name,
-                    'rate': product_tax.tax_type.rate,
-                    'is_inclusive': product_tax.tax_type.is_inclusive,
-                    'tax_category': tax_category
-                })
-        
-        # Check if frontend provided specific tax information
-        frontend_tax_type_id = data.get('tax_type_id')
-        frontend_is_inclusive = data.get('is_inclusive')
-        
-        if frontend_tax_type_id:
-            # Use tax information explicitly provided by frontend from global variable
-            tax_type = get_tax_type_by_id(frontend_tax_type_id)
-            if tax_type:
-                total_tax_rate = tax_type['rate']
-                has_inclusive_tax = frontend_is_inclusive if frontend_is_inclusive is not None else tax_type['is_inclusive']
-            else:
-                # Invalid tax_type_id provided, use default fallback
-                total_tax_rate = 0.18  # Default ITBIS 18%
-                has_inclusive_tax = True
-        else:
-            if product_tax_types:
-                # Use product-specific tax configuration
-                # CRITICAL FIX: Only sum tax_types with category 'tax' (not service_charge)
-                tax_only = [tax for tax in product_tax_types if tax.get('tax_category') == 'tax']
-                total_tax_rate = sum(tax['rate'] for tax in tax_only)
-                has_inclusive_tax = any(tax['is_inclusive'] for tax in tax_only)
-            else:
-                # CRITICAL FIX: Default fallback for fiscal compliance (level 3)
-                # If no product_taxes configured, use default ITBIS 18% included
-                # This ensures products aren't saved with 0% tax rate
-                total_tax_rate = 0.18  # Default ITBIS 18%
-                has_inclusive_tax = True  # ITBIS is typically included in Dominican Republic
-        
-        if existing_item:
-            # Update existing item quantity
-            existing_item.quantity = total_quantity
-            existing_item.total_price = product.price * total_quantity
-            # Use 0.0 instead of None for tax_rate field  
-            existing_item.tax_rate = float(total_tax_rate) if total_tax_rate and total_tax_rate > 0 else 0.0
-            existing_item.is_tax_included = has_inclusive_tax
-            sale_item = existing_item
-        else:
-            # Create new sale item
-            sale_item = models.SaleItem()
-            sale_item.sale_id = sale_id
-            sale_item.product_id = product.id
-            sale_item.quantity = quantity
-            sale_item.unit_price = product.price
-            sale_item.total_price = product.price * quantity
-            # Use 0.0 instead of None for tax_rate field
-            sale_item.tax_rate = float(total_tax_rate) if total_tax_rate and total_tax_rate > 0 else 0.0
-            sale_item.is_tax_included = has_inclusive_tax
-            
-            db.session.add(sale_item)
-        
-        # Recalculate sale totals (aligned with finalize_sale's simplified logic)
-        # subtotal = sum of all item prices, tax_amount = all taxes for reporting
-        # total = subtotal + exclusive taxes only
-        
-        subtotal = sum(item.total_price for item in sale.sale_items)
-        
-        # Calculate exclusive taxes (to be added to total)
-        tax_exclusive = 0
-        for item in sale.sale_items:
-            rate = item.tax_rate if item.tax_rate is not None else item.product.tax_rate
-            is_included = item.is_tax_included if hasattr(item, 'is_tax_included') else item.product.is_tax_included
-            
-            if not is_included and rate > 0:
-                tax_exclusive += round(item.total_price * rate, 2)
-        
-        # Calculate all taxes for reporting
-        tax_all = 0
-        for item in sale.sale_items:
-            rate = item.tax_rate if item.tax_rate is not None else item.product.tax_rate
-            is_included = item.is_tax_included if hasattr(item, 'is_tax_included') else item.product.is_tax_included
-            
-            if rate > 0:
-                if is_included:
-                    tax_all += round(item.total_price - (item.total_price / (1 + rate)), 2)
-                else:
-                    tax_all += round(item.total_price * rate, 2)
+        try:
+            sale_item, product_tax_types = _add_product_to_sale(
+                sale, product, quantity, data.get('tax_type_id'), data.get('is_inclusive')
+            )
+        except SaleFinalizationError as e:
+            db.session.rollback()
+            return e.to_response()
         
-        # Set sale totals (consistent with finalize_sale)
-        sale.subtotal = round(subtotal, 2)
-        sale.tax_amount = round(tax_all, 2)
-        sale.total = round(subtotal + tax_exclusive)
+        # Orders already in the kitchen get the new quantity on their ticket
+        kitchen.sync_sale(sale)
         
         # Commit the transaction
         db.session.commit()
@@ -610,7 +584,7 @@ def add_sale_item(sale_id):
             'total_price': sale_item.total_price,
             'tax_rate': sale_item.tax_rate,
             'is_tax_included': sale_item.is_tax_included,
-            'tax_types': product_tax_types if 'product_tax_types' in locals() else []  # NEW: Include detailed tax types for receipt generation
+            'tax_types': product_tax_types  # NEW: Include detailed tax types for receipt generation
         })
         
     except ValueError as e:
@@ -661,48 +635,219 @@ def add_sale_item(sale_id):
         )
 
 
-@bp.route('/sales/<int:sale_id>/finalize', methods=['POST'])
-def finalize_sale(sale_id):
-    print(f"[DEBUG FINALIZE START] Finalize sale {sale_id} called")
-    
+@bp.route('/sales/<int:sale_id>/scan', methods=['POST'])
+def scan_sale_item(sale_id):
+    """
+    Agregar un producto por código de barras, SKU o código alterno
+
+    Resuelve el código en el mapa en memoria (product_codes), agrega la línea o
+    suma a la existente y devuelve la línea y los totales de la venta en una
+    sola respuesta. Payload: {"code": "7460123456789", "quantity": 1}
+    """
     user = require_login()
     if not isinstance(user, models.User):
-        print(f"[DEBUG FINALIZE] User login failed")
         return user
     
-    print(f"[DEBUG FINALIZE] User logged in: {user.username}, role: {user.role.value}")
-    
-    # Validate CSRF token  
+    # Validate CSRF token
     csrf_error = validate_csrf_token()
     if csrf_error:
-        print(f"[DEBUG FINALIZE] CSRF validation failed")
         return csrf_error
     
-    print(f"[DEBUG FINALIZE] CSRF validation passed")
+    data = request.get_json(silent=True) or {}
+    code = product_codes.normalize_code(data.get('code'))
+    if not code:
+        return error_response(
+            error_type='validation',
+            message='Código requerido',
+            details='Debe enviar el código de barras o SKU escaneado',
+            field='code'
+        )
     
-    # ROLE RESTRICTION: Only cashiers and administrators can finalize sales
-    if user.role.value not in ['ADMINISTRADOR', 'CAJERO']:
-        logger.warning(f"User {user.username} (role: {user.role.value}) attempted to finalize sale {sale_id}")
+    quantity_validation = utils.validate_integer_range(
+        data.get('quantity', 1),
+        min_val=1,
+        max_val=1000,
+        field_name='Cantidad'
+    )
+    if not quantity_validation['valid']:
         return error_response(
-            error_type='permission',
-            message='Permisos insuficientes',
-            details=f'Solo cajeros y administradores pueden finalizar ventas. Su rol actual es: {user.role.value}',
-            user_role=user.role.value,
-            required_roles=['ADMINISTRADOR', 'CAJERO'],
-            status_code=403
+            error_type='validation',
+            message=quantity_validation['message'],
+            details='La cantidad debe ser un número entero entre 1 y 1000 unidades',
+            field='quantity',
+            value_received=data.get('quantity')
         )
+    quantity = quantity_validation['value']
     
-    data = request.get_json()
+    product_id = product_codes.lookup(code)
+    if product_id is None:
+        return error_response(
+            error_type='not_found',
+            message='Código no encontrado',
+            details=f'Ningún producto activo tiene el código {code}',
+            field='code',
+            value_received=code,
+            user_message=f'Código {code} no registrado',
+            status_code=404
+        )
     
+    try:
+        sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
+        if not sale:
+            return error_response(
+                error_type='not_found',
+                message='Venta no encontrada',
+                details=f'No existe una venta con ID {sale_id}',
+                sale_id=sale_id,
+                status_code=404
+            )
+        
+        if sale.status not in ['pending', 'tab_open']:
+            return error_response(
+                error_type='business',
+                message='Venta no modificable',
+                details=f'Solo se pueden modificar ventas pendientes o tabs abiertos. Estado actual: {sale.status}',
+                sale_id=sale_id,
+                sale_status=sale.status,
+                allowed_statuses=['pending', 'tab_open']
+            )
+        
+        # The code map may be stale in this worker until the next version check
+        product = db.session.get(models.Product, product_id)
+        if not product:
+            return error_response(
+                error_type='not_found',
+                message='Producto no encontrado',
+                details=f'No existe un producto con ID {product_id}',
+                field='code',
+                value_received=code,
+                status_code=404
+            )
+        if not product.active:
+            return error_response(
+                error_type='business',
+                message='Producto inactivo',
+                details=f'El producto {product.name} está desactivado y no se puede vender',
+                field='code',
+                value_received=code,
+                user_message=f'{product.name} no está disponible'
+            )
+        
+        try:
+            sale_item, product_tax_types = _add_product_to_sale(sale, product, quantity)
+        except SaleFinalizationError as e:
+            db.session.rollback()
+            return e.to_response()
+        
+        # Orders already in the kitchen get the new quantity on their ticket
+        kitchen.sync_sale(sale)
+        
+        db.session.commit()
+        
+        return jsonify({
+            'id': sale_item.id,
+            'code': code,
+            'product_id': product.id,
+            'product_name': product.name,
+            'quantity': sale_item.quantity,
+            'unit_price': sale_item.unit_price,
+            'total_price': sale_item.total_price,
+            'tax_rate': sale_item.tax_rate,
+            'is_tax_included': sale_item.is_tax_included,
+            'tax_types': product_tax_types,
+            'sale': {
+                'id': sale.id,
+                'subtotal': sale.subtotal,
+                'tax_amount': sale.tax_amount,
+                'total': sale.total
+            }
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        log_error(
+            error_type='server',
+            message=f'Error inesperado al escanear código {code} en venta {sale_id}: {str(e)}',
+            context={'sale_id': sale_id, 'code': code},
+            exc_info=True
+        )
+        return error_response(
+            error_type='server',
+            message='Error interno del servidor',
+            details='Ocurrió un error inesperado. Por favor contacte al administrador.',
+            log_context={'sale_id': sale_id},
+            status_code=500
+        )
+
+
+# FASE 2: Métodos de pago permitidos al finalizar una venta
+VALID_PAYMENT_METHODS = ['cash', 'card', 'transfer']
+
+NCF_TYPE_NAMES = {
+    'CONSUMO': 'Consumo',
+    'CREDITO_FISCAL': 'Crédito Fiscal',
+    'GUBERNAMENTAL': 'Gubernamental',
+    'NOTA_CREDITO': 'Nota de Crédito',
+    'NOTA_DEBITO': 'Nota de Débito'
+}
+
+
+class SaleFinalizationError(Exception):
+    """
+    Error de validación o de negocio al finalizar una venta
+
+    Guarda los argumentos de error_response() para que la finalización normal,
+    la reproducción de ventas offline y el cobro express reporten el mismo error.
+    """
+
+    def __init__(self, error_type, message, details=None, field=None, status_code=400, **extra):
+        super().__init__(message)
+        self.error_type = error_type
+        self.message = message
+        self.details = details
+        self.field = field
+        self.status_code = status_code
+        self.extra = extra
+
+    def to_response(self):
+        return error_response(
+            error_type=self.error_type,
+            message=self.message,
+            details=self.details,
+            field=self.field,
+            status_code=self.status_code,
+            **self.extra
+        )
+
+    def to_dict(self):
+        result = {'error': self.message, 'type': self.error_type}
+        if self.details:
+            result['details'] = self.details
+        if self.field:
+            result['field'] = self.field
+        result.update(self.extra)
+        return result
+
+
+def _parse_finalize_payload(data, sale_id=None):
+    """
+    Valida los datos de pago/comprobante de una finalización antes de bloquear filas
+
+    Returns:
+        dict con ncf_type, skip_ncf, payment_method, cash_received, change_amount,
+        customer_name, customer_rnc y apply_service_charge
+
+    Raises:
+        SaleFinalizationError: si algún dato no es válido
+    """
     # Get NCF type from request (default to consumo)
     ncf_type_raw = data.get('ncf_type', 'consumo')
     payment_method = data.get('payment_method', 'cash')
     
     # FASE 2: Validar método de pago contra lista permitida
-    VALID_PAYMENT_METHODS = ['cash', 'card', 'transfer']
     if payment_method not in VALID_PAYMENT_METHODS:
         logger.warning(f"Invalid payment method '{payment_method}' attempted for sale {sale_id}")
-        return error_response(
+        raise SaleFinalizationError(
             error_type='validation',
             message='Método de pago inválido',
             details=f'El método de pago debe ser uno de: {", ".join(VALID_PAYMENT_METHODS)}. Recibido: {payment_method}',
@@ -724,7 +869,7 @@ def finalize_sale(sale_id):
             field_name='Efectivo recibido'
         )
         if not cash_validation['valid']:
-            return error_response(
+            raise SaleFinalizationError(
                 error_type='validation',
                 message=cash_validation['message'],
                 details=f'El monto de efectivo recibido debe estar entre RD$ 0 y RD$ 1,000,000',
@@ -751,7 +896,7 @@ def finalize_sale(sale_id):
         rnc_validation = utils.validate_rnc(customer_rnc)
         if not rnc_validation['valid']:
             logger.warning(f"Invalid customer RNC '{customer_rnc}' attempted for sale {sale_id}")
-            return error_response(
+            raise SaleFinalizationError(
                 error_type='validation',
                 message='RNC inválido',
                 details=rnc_validation['message'],
@@ -767,7 +912,7 @@ def finalize_sale(sale_id):
         # Para comprobantes de crédito fiscal es OBLIGATORIO tener datos del cliente
         if not customer_name or not customer_name.strip():
             logger.warning(f"Missing customer name for credito_fiscal NCF in sale {sale_id}")
-            return error_response(
+            raise SaleFinalizationError(
                 error_type='validation',
                 message='Cliente requerido para Crédito Fiscal',
                 details='Los comprobantes de Crédito Fiscal requieren el nombre del cliente para cumplir con las normas de la DGII',
@@ -778,7 +923,7 @@ def finalize_sale(sale_id):
         
         if not customer_rnc or not customer_rnc.strip():
             logger.warning(f"Missing customer RNC for credito_fiscal NCF in sale {sale_id}")
-            return error_response(
+            raise SaleFinalizationError(
                 error_type='validation',
                 message='RNC requerido para Crédito Fiscal',
                 details='Los comprobantes de Crédito Fiscal requieren el RNC/Cédula del cliente para cumplir con las normas de la DGII',
@@ -787,435 +932,470 @@ def finalize_sale(sale_id):
                 user_message='Debe proporcionar el RNC/Cédula del cliente para emitir un Comprobante de Crédito Fiscal'
             )
     
-    # NEW: Get service charge (propina) option
-    apply_service_charge = data.get('apply_service_charge', False)
-    service_charge_rate = 0.10  # 10% standard tip rate in Dominican Republic
+    return {
+        'ncf_type': ncf_type,
+        'skip_ncf': skip_ncf,
+        'payment_method': payment_method,
+        'cash_received': cash_received,
+        'change_amount': change_amount,
+        'customer_name': customer_name,
+        'customer_rnc': customer_rnc,
+        # NEW: Get service charge (propina) option
+        'apply_service_charge': data.get('apply_service_charge', False)
+    }
+
+
+def _insufficient_stock_error(sale_id, error):
+    logger.warning(f"Insufficient stock for product {error.product_id} ({error.product_name}) in sale {sale_id}")
+    return SaleFinalizationError(
+        error_type='business',
+        message='Stock insuficiente',
+        details=f'No hay suficiente stock de {error.product_name} para completar la venta. Disponible: {error.available}, requerido: {error.required}, faltante: {error.shortage}',
+        sale_id=sale_id,
+        product_id=error.product_id,
+        product_name=error.product_name,
+        stock_available=error.available,
+        quantity_required=error.required,
+        shortage=error.shortage,
+        user_message=f'Stock insuficiente de {error.product_name}. Disponible: {error.available}, necesario: {error.required}'
+    )
+
+
+def _finalize_pending_sale(sale, user, payment):
+    """
+    Finaliza una venta 'pending' ya bloqueada dentro de la transacción actual (sin commit)
+
+    Valida productos y stock, asigna caja y NCF, calcula totales, descuenta stock
+    (UPDATE condicional, sin bloquear productos antes) y actualiza los agregados
+    diarios y el libro de caja. Si algo falla se lanza SaleFinalizationError y el
+    llamador hace rollback: no se consume ningún NCF.
+
+    Args:
+        sale: Venta bloqueada con with_for_update() y en estado 'pending'
+        user: Usuario que finaliza (su caja se asigna si la venta no tiene)
+        payment: Resultado de _parse_finalize_payload()
+    """
+    sale_id = sale.id
+    ncf_type = payment['ncf_type']
+    payment_method = payment['payment_method']
+    
+    # PREVENT EMPTY SALES: Validate that sale has items before proceeding with NCF allocation
+    if not sale.sale_items:
+        logger.warning(f"Attempted to finalize empty sale {sale_id}")
+        raise SaleFinalizationError(
+            error_type='business',
+            message='Venta sin productos',
+            details='No se puede finalizar una venta que no tiene productos. Agregue al menos un producto antes de finalizar.',
+            sale_id=sale_id,
+            user_message='Debe agregar al menos un producto a la venta'
+        )
     
-    # CRITICAL FIX: Idempotent sale finalization with proper locking to prevent NCF race conditions
-    # This ensures exactly one NCF per sale even under concurrent finalization requests
-    try:
-        print(f"[DEBUG FINALIZE] Attempting to finalize sale {sale_id} with NCF type {ncf_type}")
-        print(f"[DEBUG FINALIZE] Payment method: {payment_method}")
-        print(f"[DEBUG FINALIZE] Customer info: name={customer_name}, rnc={customer_rnc}")
-        
-        # Get sale with row-level lock to prevent concurrent modifications
-        sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
-        
-        if not sale:
-            logger.error(f"Sale {sale_id} not found during finalization")
-            return error_response(
-                error_type='not_found',
-                message='Venta no encontrada',
-                details=f'No existe una venta con ID {sale_id}',
-                sale_id=sale_id,
-                status_code=404
+    logger.debug(f"Finalizing sale {sale.id} with {len(sale.sale_items)} items")
+    
+    # Group sale items by product ID and calculate total quantity per product
+    product_quantities = {}
+    for sale_item in sale.sale_items:
+        product_quantities[sale_item.product_id] = product_quantities.get(sale_item.product_id, 0) + sale_item.quantity
+    
+    # Fail fast before touching the NCF sequence: lock-free read of current stock.
+    # The authoritative check is the conditional decrement right before commit.
+    products = db.session.query(models.Product).filter(
+        models.Product.id.in_(list(product_quantities))
+    ).all()
+    for product in products:
+        # Skip stock validation for consumible products (food, drinks, services)
+        if product.product_type != 'consumible' and product.stock < product_quantities[product.id]:
+            raise _insufficient_stock_error(
+                sale_id,
+                stock_control.InsufficientStockError(product.id, product.name, product.stock,
+                                                     product_quantities[product.id])
             )
+    
+    # SALE REASSIGNMENT: If sale doesn't have cash register (waiter-created), assign finalizing user's cash register
+    if not sale.cash_register_id:
+        logger.debug("Sale has no cash register, searching for user's cash register")
+        # Get cash register for the finalizing user (must be cashier/admin)
+        user_cash_register = db.session.query(models.CashRegister).filter_by(
+            user_id=user.id, 
+            active=True
+        ).first()
         
-        print(f"[DEBUG FINALIZE] Sale found: ID={sale.id}, status={sale.status}, cash_register_id={sale.cash_register_id}")
-        
-        # IDEMPOTENCY CHECK: If sale is already completed, return existing data
-        # This prevents duplicate NCF allocation for the same sale
-        if sale.status == 'completed':
-            print(f"[DEBUG FINALIZE] Sale {sale_id} already completed with NCF {sale.ncf}")
-            return jsonify({
-                'id': sale.id,
-                'ncf': sale.ncf,
-                'total': sale.total,
-                'status': sale.status,
-                'payment_method': sale.payment_method,
-                'created_at': sale.created_at.isoformat(),
-                'message': 'Venta ya estaba finalizada'
-            })
-        
-        # Validate that sale is in pending status (only pending sales can be finalized)
-        if sale.status != 'pending':
-            logger.warning(f"Attempted to finalize sale {sale_id} with status {sale.status}")
-            return error_response(
+        if not user_cash_register:
+            logger.error(f"User {user.username} has no active cash register for finalizing sale {sale_id}")
+            raise SaleFinalizationError(
                 error_type='business',
-                message='Estado de venta inválido',
-                details=f'Solo se pueden finalizar ventas con estado "pending". Estado actual: {sale.status}',
+                message='Sin caja asignada',
+                details='Solo usuarios con caja asignada pueden finalizar ventas. Contacte al administrador para que le asigne una caja.',
                 sale_id=sale_id,
-                current_status=sale.status,
-                required_status='pending'
+                user_id=user.id,
+                user_message='No tiene una caja asignada. Contacte al administrador.'
             )
         
-        logger.debug(f"Sale {sale_id} status validation passed")
-        
-        # PREVENT EMPTY SALES: Validate that sale has items before proceeding with NCF allocation
-        if not sale.sale_items:
-            logger.warning(f"Attempted to finalize empty sale {sale_id}")
-            return error_response(
-                error_type='business',
-                message='Venta sin productos',
-                details='No se puede finalizar una venta que no tiene productos. Agregue al menos un producto antes de finalizar.',
+        # Assign the cash register to the sale for NCF generation
+        sale.cash_register_id = user_cash_register.id
+        logger.debug(f"Assigned cash register {user_cash_register.id} ({user_cash_register.name}) to sale")
+    else:
+        logger.debug(f"Sale already has cash register: {sale.cash_register_id}")
+    
+    # NCF generation logic - only if not skipping NCF
+    ncf_number = None
+    ncf_sequence = None
+    
+    if payment['skip_ncf']:
+        logger.debug("Skipping NCF generation (Sin Comprobante selected)")
+    elif ncf_type:
+        # Get NCF sequence - now global and independent of cash registers
+        logger.debug(f"Looking for active global NCF sequences for type {ncf_type}")
+        
+        # Search for active NCF sequence of the required type (with row-level lock for thread safety)
+        # Order by ID for deterministic selection and validate uniqueness
+        active_sequences = db.session.query(models.NCFSequence).filter_by(
+            ncf_type=models.NCFType(ncf_type.upper()),
+            active=True
+        ).order_by(models.NCFSequence.id).with_for_update().all()
+        
+        if len(active_sequences) > 1:
+            sequence_ids = [str(seq.id) for seq in active_sequences]
+            logger.error(f"Multiple active NCF sequences for type {ncf_type}: {sequence_ids}")
+            raise SaleFinalizationError(
+                error_type='server',
+                message='Error de configuración del sistema',
+                details=f'Hay múltiples secuencias NCF activas para tipo {ncf_type} (IDs: {", ".join(sequence_ids)}). Solo debe haber una secuencia activa por tipo. Contacte al administrador.',
                 sale_id=sale_id,
-                user_message='Debe agregar al menos un producto a la venta'
+                ncf_type=ncf_type,
+                sequence_ids=sequence_ids,
+                user_message='Error de configuración del sistema. Contacte al administrador.',
+                status_code=500
             )
         
-        print(f"[DEBUG FINALIZE] Sale has {len(sale.sale_items)} items")
-        
-        # Validate stock availability before proceeding with NCF allocation with concurrent safety
-        # Load sale items and group by product for aggregate validation
-        sale_items = db.session.query(models.SaleItem).filter_by(sale_id=sale_id).all()
-        
-        # Group sale items by product ID and calculate total quantity per product
-        product_quantities = {}
-        product_ids = []
-        
-        for sale_item in sale_items:
-            product_id = sale_item.product_id
-            if product_id not in product_quantities:
-                product_quantities[product_id] = 0
-                product_ids.append(product_id)
-            product_quantities[product_id] += sale_item.quantity
-        
-        # Lock all involved products to prevent concurrent modifications (CRITICAL for fiscal compliance)
-        locked_products = db.session.query(models.Product).filter(
-            models.Product.id.in_(product_ids)
-        ).with_for_update().all()
-        
-        # Validate stock availability per product (aggregated quantities)
-        # Only validate stock for inventariable products, not consumible ones
-        for product in locked_products:
-            required_quantity = product_quantities[product.id]
-            # Skip stock validation for consumible products (food, drinks, services)
-            if product.product_type == 'consumible':
-                continue
-            # Only validate stock for inventariable products
-            if product.stock < required_quantity:
-                shortage = required_quantity - product.stock
-                logger.warning(f"Insufficient stock for product {product.id} ({product.name}) in sale {sale_id}")
-                return error_response(
-                    error_type='business',
-                    message='Stock insuficiente',
-                    details=f'No hay suficiente stock de {product.name} para completar la venta. Disponible: {product.stock}, requerido: {required_quantity}, faltante: {shortage}',
-                    sale_id=sale_id,
-                    product_id=product.id,
-                    product_name=product.name,
-                    stock_available=product.stock,
-                    quantity_required=required_quantity,
-                    shortage=shortage,
-                    user_message=f'Stock insuficiente de {product.name}. Disponible: {product.stock}, necesario: {required_quantity}'
-                )
+        ncf_sequence = active_sequences[0] if active_sequences else None
         
-        # SALE REASSIGNMENT: If sale doesn't have cash register (waiter-created), assign finalizing user's cash register
-        if not sale.cash_register_id:
-            print(f"[DEBUG FINALIZE] Sale has no cash register, searching for user's cash register")
-            # Get cash register for the finalizing user (must be cashier/admin)
-            user_cash_register = db.session.query(models.CashRegister).filter_by(
-                user_id=user.id, 
-                active=True
-            ).first()
-            
-            if not user_cash_register:
-                logger.error(f"User {user.username} has no active cash register for finalizing sale {sale_id}")
-                return error_response(
-                    error_type='business',
-                    message='Sin caja asignada',
-                    details='Solo usuarios con caja asignada pueden finalizar ventas. Contacte al administrador para que le asigne una caja.',
-                    sale_id=sale_id,
-                    user_id=user.id,
-                    user_message='No tiene una caja asignada. Contacte al administrador.'
-                )
-            
-            # Assign the cash register to the sale for NCF generation
-            sale.cash_register_id = user_cash_register.id
-            print(f"[DEBUG FINALIZE] Assigned cash register {user_cash_register.id} ({user_cash_register.name}) to sale")
+        if ncf_sequence:
+            logger.debug(f"Found global NCF sequence: {ncf_sequence.id} (serie: {ncf_sequence.serie})")
         else:
-            print(f"[DEBUG FINALIZE] Sale already has cash register: {sale.cash_register_id}")
-        
-        # NCF generation logic - only if not skipping NCF
-        ncf_number = None
-        ncf_sequence = None
-        
-        if skip_ncf:
-            print(f"[DEBUG FINALIZE] Skipping NCF generation (Sin Comprobante selected)")
-        elif ncf_type:
-            # Get NCF sequence - now global and independent of cash registers
-            print(f"[DEBUG FINALIZE] Looking for active global NCF sequences for type {ncf_type}")
+            logger.debug(f"No active NCF sequence found for type {ncf_type}")
             
-            # Search for active NCF sequence of the required type (with row-level lock for thread safety)
-            # Order by ID for deterministic selection and validate uniqueness
-            active_sequences = db.session.query(models.NCFSequence).filter_by(
-                ncf_type=models.NCFType(ncf_type.upper()),
-                active=True
-            ).order_by(models.NCFSequence.id).with_for_update().all()
+            # Get all available sequences for debugging
+            all_sequences = db.session.query(models.NCFSequence).filter_by(active=True).all()
+            logger.debug(f"Active NCF sequences: {[(seq.id, seq.ncf_type.value, seq.serie) for seq in all_sequences]}")
             
-            if len(active_sequences) > 1:
-                sequence_ids = [str(seq.id) for seq in active_sequences]
-                logger.error(f"Multiple active NCF sequences for type {ncf_type}: {sequence_ids}")
-                return error_response(
-                    error_type='server',
-                    message='Error de configuración del sistema',
-                    details=f'Hay múltiples secuencias NCF activas para tipo {ncf_type} (IDs: {", ".join(sequence_ids)}). Solo debe haber una secuencia activa por tipo. Contacte al administrador.',
+            available_types = [str(s.ncf_type.value) for s in all_sequences]
+            ncf_type_display = NCF_TYPE_NAMES.get(ncf_type.upper(), ncf_type)
+            
+            if available_types:
+                available_display = [NCF_TYPE_NAMES.get(t, t) for t in set(available_types)]
+                logger.warning(f"No NCF sequence for type {ncf_type} in sale {sale_id}. Available: {available_types}")
+                raise SaleFinalizationError(
+                    error_type='business',
+                    message='Secuencia NCF no disponible',
+                    details=f'No hay secuencia de NCF configurada para comprobantes de tipo "{ncf_type_display}". Por favor, seleccione otro tipo de comprobante o contacte al administrador.',
                     sale_id=sale_id,
                     ncf_type=ncf_type,
-                    sequence_ids=sequence_ids,
-                    user_message='Error de configuración del sistema. Contacte al administrador.',
-                    status_code=500
+                    available_types=available_display,
+                    user_message=f'No hay comprobantes de tipo "{ncf_type_display}" disponibles. Tipos disponibles: {", ".join(available_display)}'
                 )
-            
-            ncf_sequence = active_sequences[0] if active_sequences else None
-            
-            if ncf_sequence:
-                print(f"[DEBUG FINALIZE] Found global NCF sequence: {ncf_sequence.id} (serie: {ncf_sequence.serie})")
             else:
-                print(f"[DEBUG FINALIZE] No active NCF sequence found for type {ncf_type}")
-                
-                # Get all available sequences for debugging
-                all_sequences = db.session.query(models.NCFSequence).filter_by(active=True).all()
-                print(f"[DEBUG FINALIZE] Available NCF sequences:")
-                for seq in all_sequences:
-                    print(f"  - ID: {seq.id}, Type: {seq.ncf_type}, Serie: {seq.serie}, Active: {seq.active}")
-                
-                available_types = [str(s.ncf_type.value) for s in all_sequences]
-                ncf_type_names = {
-                    'CONSUMO': 'Consumo',
-                    'CREDITO_FISCAL': 'Crédito Fiscal',
-                    'GUBERNAMENTAL': 'Gubernamental',
-                    'NOTA_CREDITO': 'Nota de Crédito',
-                    'NOTA_DEBITO': 'Nota de Débito'
-                }
-                ncf_type_display = ncf_type_names.get(ncf_type.upper(), ncf_type)
-                
-                if available_types:
-                    available_display = [ncf_type_names.get(t, t) for t in set(available_types)]
-                    logger.warning(f"No NCF sequence for type {ncf_type} in sale {sale_id}. Available: {available_types}")
-                    return error_response(
-                        error_type='business',
-                        message='Secuencia NCF no disponible',
-                        details=f'No hay secuencia de NCF configurada para comprobantes de tipo "{ncf_type_display}". Por favor, seleccione otro tipo de comprobante o contacte al administrador.',
-                        sale_id=sale_id,
-                        ncf_type=ncf_type,
-                        available_types=available_display,
-                        user_message=f'No hay comprobantes de tipo "{ncf_type_display}" disponibles. Tipos disponibles: {", ".join(available_display)}'
-                    )
-                else:
-                    logger.error(f"No active NCF sequences in the system")
-                    return error_response(
-                        error_type='server',
-                        message='Sistema de facturación no configurado',
-                        details='No hay secuencias NCF activas en el sistema. Contacte al administrador para configurar las secuencias fiscales antes de procesar ventas.',
-                        sale_id=sale_id,
-                        user_message='Sistema de facturación no configurado. Contacte al administrador.',
-                        status_code=500
-                    )
-            
-            # Check if sequence is exhausted (treat end_number as inclusive)
-            logger.debug(f"NCF sequence status: current={ncf_sequence.current_number}, end={ncf_sequence.end_number}")
-            if ncf_sequence.current_number > ncf_sequence.end_number:
-                ncf_type_names = {
-                    'CONSUMO': 'Consumo',
-                    'CREDITO_FISCAL': 'Crédito Fiscal',
-                    'GUBERNAMENTAL': 'Gubernamental',
-                    'NOTA_CREDITO': 'Nota de Crédito',
-                    'NOTA_DEBITO': 'Nota de Débito'
-                }
-                ncf_type_display = ncf_type_names.get(ncf_type.upper(), ncf_type)
-                logger.error(f"NCF sequence exhausted for type {ncf_type} (seq: {ncf_sequence.id})")
-                return error_response(
-                    error_type='business',
-                    message='Secuencia NCF agotada',
-                    details=f'Se han agotado los comprobantes de tipo "{ncf_type_display}". Contacte al administrador para configurar una nueva secuencia fiscal.',
+                logger.error(f"No active NCF sequences in the system")
+                raise SaleFinalizationError(
+                    error_type='server',
+                    message='Sistema de facturación no configurado',
+                    details='No hay secuencias NCF activas en el sistema. Contacte al administrador para configurar las secuencias fiscales antes de procesar ventas.',
                     sale_id=sale_id,
-                    ncf_type=ncf_type,
-                    sequence_id=ncf_sequence.id,
-                    current_number=ncf_sequence.current_number,
-                    end_number=ncf_sequence.end_number,
-                    user_message=f'No quedan comprobantes de tipo "{ncf_type_display}". Contacte al administrador.'
+                    user_message='Sistema de facturación no configurado. Contacte al administrador.',
+                    status_code=500
                 )
-            
-            # Generate NCF number using current number
-            ncf_number = f"{ncf_sequence.serie}{ncf_sequence.current_number:08d}"
-            print(f"[DEBUG FINALIZE] Generated NCF: {ncf_number}")
-            
-            # Increment counter for next use
-            ncf_sequence.current_number += 1
-            print(f"[DEBUG FINALIZE] NCF sequence incremented to: {ncf_sequence.current_number}")
-        
-        # Enforce cash session requirement BEFORE finalization
-        if payment_method == 'cash':
-            # Check if user has an open cash session for cash payments
-            if not sale.cash_register_id:
-                error_msg = 'No tienes una caja registradora asignada para procesar pagos en efectivo'
-                print(f"[ERROR FINALIZE] {error_msg}")
-                raise ValueError(error_msg)
-            
+        
+        # Check if sequence is exhausted (treat end_number as inclusive)
+        logger.debug(f"NCF sequence status: current={ncf_sequence.current_number}, end={ncf_sequence.end_number}")
+        if ncf_sequence.current_number > ncf_sequence.end_number:
+            ncf_type_display = NCF_TYPE_NAMES.get(ncf_type.upper(), ncf_type)
+            logger.error(f"NCF sequence exhausted for type {ncf_type} (seq: {ncf_sequence.id})")
+            raise SaleFinalizationError(
+                error_type='business',
+                message='Secuencia NCF agotada',
+                details=f'Se han agotado los comprobantes de tipo "{ncf_type_display}". Contacte al administrador para configurar una nueva secuencia fiscal.',
+                sale_id=sale_id,
+                ncf_type=ncf_type,
+                sequence_id=ncf_sequence.id,
+                current_number=ncf_sequence.current_number,
+                end_number=ncf_sequence.end_number,
+                user_message=f'No quedan comprobantes de tipo "{ncf_type_display}". Contacte al administrador.'
+            )
+        
+        # Generate NCF number using current number
+        ncf_number = f"{ncf_sequence.serie}{ncf_sequence.current_number:08d}"
+        logger.debug(f"Generated NCF {ncf_number} for sale {sale.id}")
+        
+        # Increment counter for next use
+        ncf_sequence.current_number += 1
+        logger.debug(f"NCF sequence incremented to: {ncf_sequence.current_number}")
+    
+    # Lock the register's open session: the sale is linked to it and updates its running totals
+    open_session = cash_ledger.get_open_session(sale.cash_register_id, lock=True)
+    
+    # Enforce cash session requirement BEFORE finalization
+    if payment_method == 'cash':
+        # Check if user has an open cash session for cash payments
+        if not sale.cash_register_id:
+            error_msg = 'No tienes una caja registradora asignada para procesar pagos en efectivo'
+        elif not open_session:
             # Verify the cash register has an open session
-            open_session = models.CashSession.query.filter_by(
-                cash_register_id=sale.cash_register_id,
-                status='open'
-            ).order_by(models.CashSession.opened_at.desc()).first()
-            
-            if not open_session:
-                error_msg = 'Debes abrir la caja registradora antes de procesar pagos en efectivo'
-                print(f"[ERROR FINALIZE] {error_msg}")
-                raise ValueError(error_msg)
-            
-            print(f"[DEBUG FINALIZE] Cash payment validated with open session: {open_session.id}")
+            error_msg = 'Debes abrir la caja registradora antes de procesar pagos en efectivo'
+        else:
+            error_msg = None
         
-        # Update sale with NCF and finalize (atomic state transition from pending to completed)
-        sale.ncf_sequence_id = ncf_sequence.id if ncf_sequence else None
-        sale.ncf = ncf_number
-        sale.payment_method = payment_method
-        sale.status = 'completed'
+        if error_msg:
+            logger.warning(f"Cash payment rejected for sale {sale.id}: {error_msg}")
+            raise SaleFinalizationError(
+                error_type='business',
+                message='Error de validación',
+                details=error_msg,
+                user_message=error_msg
+            )
         
-        # Store cash payment details if provided
-        if cash_received is not None:
-            sale.cash_received = cash_received
-        if change_amount is not None:
-            sale.change_amount = change_amount
+        logger.debug(f"Cash payment validated with open session: {open_session.id}")
+    
+    # Update sale with NCF and finalize (atomic state transition from pending to completed)
+    sale.ncf_sequence_id = ncf_sequence.id if ncf_sequence else None
+    sale.ncf = ncf_number
+    sale.payment_method = payment_method
+    sale.status = 'completed'
+    
+    # Store cash payment details if provided
+    if payment['cash_received'] is not None:
+        sale.cash_received = payment['cash_received']
+    if payment['change_amount'] is not None:
+        sale.change_amount = payment['change_amount']
+    
+    # Totals from the shared tax engine:
+    # - subtotal = sum of item prices as stored (may include inclusive taxes)
+    # - tax_amount = inclusive + exclusive taxes, for reporting
+    # - service_charge_amount = 10% tip already included in prices (display only)
+    # - total = subtotal + exclusive taxes, rounded to whole pesos
+    tax_engine.apply_to_sale(sale, apply_service_charge=payment['apply_service_charge'])
+    
+    # Add client info for fiscal/government invoices (NCF compliance)
+    customer_name = payment['customer_name']
+    customer_rnc = payment['customer_rnc']
+    if customer_name and customer_rnc and ncf_type in ['credito_fiscal', 'gubernamental']:
+        sale.customer_name = customer_name
+        sale.customer_rnc = customer_rnc
+    
+    # Reduce stock with one conditional UPDATE (no row locks held while validating);
+    # it fails instead of overselling if another register sold the last units meanwhile
+    try:
+        stock_control.decrement_stock(product_quantities)
+    except stock_control.InsufficientStockError as e:
+        raise _insufficient_stock_error(sale_id, e)
+    
+    # Update per-day invoice aggregates in the same transaction
+    sales_aggregates.record_completed_sale(sale)
+    
+    # Link sale to the open cash session and update its running ledger
+    if open_session:
+        cash_ledger.record_finalized_sale(sale, open_session)
+    
+    # Sale event (NCF and lines) for downstream consumers, in the same transaction
+    outbox.record_completed_sale(sale)
+
+
+def _log_sale_finalized(sale, payment):
+    # Log de operación crítica exitosa
+    log_success(
+        operation='sale_finalized',
+        message=f'Venta finalizada y NCF asignado',
+        context={
+            'sale_id': sale.id,
+            'ncf': sale.ncf,
+            'ncf_type': payment['ncf_type'],
+            'total': float(sale.total),
+            'payment_method': payment['payment_method'],
+            'items_count': len(sale.sale_items),
+            'customer_name': sale.customer_name or 'N/A',
+            'customer_rnc': sale.customer_rnc or 'N/A',
+            'cash_register_id': sale.cash_register_id
+        }
+    )
+
+
+def _attach_automatic_receipt(sale, response_data):
+    """Genera el recibo térmico y el PDF de una venta recién finalizada y los añade a la respuesta"""
+    # AUTOMATIC RECEIPT PRINTING: Generate thermal receipt immediately after successful finalization
+    try:
+        # Prepare sale data for receipt generation
+        sale_data = {
+            'id': sale.id,
+            'ncf': sale.ncf,
+            'created_at': sale.created_at.isoformat(),
+            'payment_method': sale.payment_method,
+            'subtotal': sale.subtotal,
+            'tax_amount': sale.tax_amount,
+            'total': sale.total,
+            'items': [{
+                'product_name': item.product.name,
+                'quantity': item.quantity,
+                'price': item.unit_price,
+                'total_price': item.total_price,
+                'tax_rate': item.tax_rate,
+                'is_tax_included': item.is_tax_included
+            } for item in sale.sale_items]
+        }
         
-        # SIMPLIFIED AND CONSISTENT CALCULATION LOGIC:
-        # - subtotal = sum of all item.total_price (prices as stored, may include inclusive taxes)
-        # - tax_amount = all taxes (inclusive + exclusive) for reporting
-        # - service_charge_amount = 10% of subtotal for display only (NOT added to total)
-        # - total = subtotal + exclusive taxes ONLY (inclusive taxes already in subtotal)
-        
-        # Step 1: Calculate subtotal (sum of all item prices as-is)
-        subtotal = sum(item.total_price for item in sale.sale_items)
-        
-        # Step 2: Extract service charge from prices for display (NOT added to total)
-        # If prices include 10% tip, we need to extract it properly:
-        # price_with_tip = base_price × 1.10
-        # base_price = price_with_tip / 1.10
-        # tip = price_with_tip - base_price
-        service_charge_amount = 0
-        if apply_service_charge:
-            # Extract the 10% tip that's already included in the prices
-            base_without_tip = subtotal / (1 + service_charge_rate)
-            service_charge_amount = round(subtotal - base_without_tip, 2)
-        
-        # Step 3: Calculate exclusive taxes (these WILL be added to total)
-        tax_exclusive = 0
-        for item in sale.sale_items:
-            rate = item.tax_rate if item.tax_rate is not None else item.product.tax_rate
-            is_included = item.is_tax_included if hasattr(item, 'is_tax_included') else item.product.is_tax_included
-            
-            if not is_included and rate > 0:
-                # Only exclusive taxes are added to total
-                tax_exclusive += round(item.total_price * rate, 2)
-        
-        # Step 4: Calculate all taxes for reporting (inclusive + exclusive)
-        tax_all = 0
-        for item in sale.sale_items:
-            rate = item.tax_rate if item.tax_rate is not None else item.product.tax_rate
-            is_included = item.is_tax_included if hasattr(item, 'is_tax_included') else item.product.is_tax_included
+        # Import receipt generators
+        from receipt_generator import generate_thermal_receipt_text, generate_pdf_receipt
+        receipt_text = generate_thermal_receipt_text(sale_data)
+        
+        if receipt_text:
+            response_data['receipt_printed'] = True
+            response_data['receipt_text'] = receipt_text
+            response_data['message'] = 'Venta finalizada exitosamente. Recibo generado automáticamente.'
             
-            if rate > 0:
-                if is_included:
-                    # Included tax: extract from price for reporting
-                    tax_all += round(item.total_price - (item.total_price / (1 + rate)), 2)
+            # Generate PDF receipt for download
+            try:
+                pdf_path = generate_pdf_receipt(sale_data)
+                if pdf_path:
+                    # Convert absolute path to web-accessible relative path
+                    web_path = pdf_path.replace(os.getcwd() + '/', '')
+                    response_data['pdf_receipt_path'] = web_path
+                    response_data['pdf_generated'] = True
+                    logger.info(f"Recibo PDF generado para venta {sale.id}: {web_path}")
                 else:
-                    # Exclusive tax: calculate from price
-                    tax_all += round(item.total_price * rate, 2)
-        
-        # Step 5: Set sale totals
-        sale.subtotal = round(subtotal, 2)  # Sum of item prices
-        sale.tax_amount = round(tax_all, 2)  # All taxes for reporting
-        sale.service_charge_amount = service_charge_amount  # Tip for display
-        sale.total = round(subtotal + tax_exclusive)  # Subtotal + exclusive taxes only
-        
-        # Add client info for fiscal/government invoices (NCF compliance)
-        if customer_name and customer_rnc and ncf_type in ['credito_fiscal', 'gubernamental']:
-            sale.customer_name = customer_name
-            sale.customer_rnc = customer_rnc
-        
-        # Reduce stock for all products (using already locked products to prevent race conditions)
-        for product in locked_products:
-            required_quantity = product_quantities[product.id]
-            product.stock -= required_quantity
+                    response_data['pdf_generated'] = False
+            except Exception as pdf_error:
+                logger.error(f"Error generando PDF para venta {sale.id}: {str(pdf_error)}")
+                response_data['pdf_generated'] = False
             
-        # Commit the transaction
-        db.session.commit()
-        
-        # Log de operación crítica exitosa
-        log_success(
-            operation='sale_finalized',
-            message=f'Venta finalizada y NCF asignado',
-            context={
-                'sale_id': sale.id,
-                'ncf': sale.ncf,
-                'ncf_type': ncf_type,
-                'total': float(sale.total),
-                'payment_method': payment_method,
-                'items_count': len(sale.sale_items),
-                'customer_name': sale.customer_name or 'N/A',
-                'customer_rnc': sale.customer_rnc or 'N/A',
-                'cash_register_id': sale.cash_register_id
-            }
+            # Thermal printing has been replaced with native print dialog
+            # Users will print using browser's native print dialog (window.print())
+            response_data['thermal_print_success'] = False
+        else:
+            response_data['message'] = 'Venta finalizada exitosamente. Error generando recibo automático.'
+    except Exception as print_error:
+        # Don't fail the entire sale if receipt printing fails
+        print(f"[Receipt] Error generando recibo automático para venta {sale.id}: {print_error}")
+        response_data['message'] = 'Venta finalizada exitosamente. Error en impresión automática de recibo.'
+    
+    return response_data
+
+
+def _finalized_sale_response(sale):
+    """Respuesta de una venta recién finalizada, con el recibo automático"""
+    response_data = {
+        'id': sale.id,
+        'ncf': sale.ncf,
+        'total': sale.total,
+        'status': sale.status,
+        'payment_method': sale.payment_method,
+        'created_at': sale.created_at.isoformat(),
+        'receipt_printed': False  # Will be updated if printing succeeds
+    }
+    return _attach_automatic_receipt(sale, response_data)
+
+
+@bp.route('/sales/<int:sale_id>/finalize', methods=['POST'])
+def finalize_sale(sale_id):
+    logger.debug(f"Finalize sale {sale_id} called")
+    
+    user = require_login()
+    if not isinstance(user, models.User):
+        logger.debug("User login failed")
+        return user
+    
+    logger.debug(f"User logged in: {user.username}, role: {user.role.value}")
+    
+    # Validate CSRF token  
+    csrf_error = validate_csrf_token()
+    if csrf_error:
+        logger.debug("CSRF validation failed")
+        return csrf_error
+    
+    logger.debug("CSRF validation passed")
+    
+    # ROLE RESTRICTION: Only cashiers and administrators can finalize sales
+    if user.role.value not in ['ADMINISTRADOR', 'CAJERO']:
+        logger.warning(f"User {user.username} (role: {user.role.value}) attempted to finalize sale {sale_id}")
+        return error_response(
+            error_type='permission',
+            message='Permisos insuficientes',
+            details=f'Solo cajeros y administradores pueden finalizar ventas. Su rol actual es: {user.role.value}',
+            user_role=user.role.value,
+            required_roles=['ADMINISTRADOR', 'CAJERO'],
+            status_code=403
         )
+    
+    data = request.get_json() or {}
+    
+    try:
+        payment = _parse_finalize_payload(data, sale_id)
+    except SaleFinalizationError as e:
+        return e.to_response()
+    
+    # CRITICAL FIX: Idempotent sale finalization with proper locking to prevent NCF race conditions
+    # This ensures exactly one NCF per sale even under concurrent finalization requests
+    try:
+        logger.debug(f"Attempting to finalize sale {sale_id} with NCF type {payment['ncf_type']}")
+        logger.debug(f"Payment method: {payment['payment_method']}")
+        logger.debug(f"Customer info: name={payment['customer_name']}, rnc={payment['customer_rnc']}")
         
-        # If ANY part fails, everything rolls back and no NCF is consumed
+        # Get sale with row-level lock to prevent concurrent modifications
+        sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
         
-        # Success response data
-        response_data = {
-            'id': sale.id,
-            'ncf': sale.ncf,
-            'total': sale.total,
-            'status': sale.status,
-            'payment_method': sale.payment_method,
-            'created_at': sale.created_at.isoformat(),
-            'receipt_printed': False  # Will be updated if printing succeeds
-        }
+        if not sale:
+            logger.error(f"Sale {sale_id} not found during finalization")
+            return error_response(
+                error_type='not_found',
+                message='Venta no encontrada',
+                details=f'No existe una venta con ID {sale_id}',
+                sale_id=sale_id,
+                status_code=404
+            )
         
-        # AUTOMATIC RECEIPT PRINTING: Generate thermal receipt immediately after successful finalization
-        try:
-            # Prepare sale data for receipt generation
-            sale_data = {
+        logger.debug(f"Sale found: ID={sale.id}, status={sale.status}, cash_register_id={sale.cash_register_id}")
+        
+        # IDEMPOTENCY CHECK: If sale is already completed, return existing data
+        # This prevents duplicate NCF allocation for the same sale
+        if sale.status == 'completed':
+            logger.debug(f"Sale {sale_id} already completed with NCF {sale.ncf}")
+            return jsonify({
                 'id': sale.id,
                 'ncf': sale.ncf,
-                'created_at': sale.created_at.isoformat(),
-                'payment_method': sale.payment_method,
-                'subtotal': sale.subtotal,
-                'tax_amount': sale.tax_amount,
                 'total': sale.total,
-                'items': [{
-                    'product_name': item.product.name,
-                    'quantity': item.quantity,
-                    'price': item.unit_price,
-                    'total_price': item.total_price,
-                    'tax_rate': item.tax_rate,
-                    'is_tax_included': item.is_tax_included
-                } for item in sale.sale_items]
-            }
-            
-            # Import receipt generators
-            from receipt_generator import generate_thermal_receipt_text, generate_pdf_receipt
-            receipt_text = generate_thermal_receipt_text(sale_data)
+                'status': sale.status,
+                'payment_method': sale.payment_method,
+                'created_at': sale.created_at.isoformat(),
+                'message': 'Venta ya estaba finalizada'
+            })
+        
+        # Validate that sale is in pending status (only pending sales can be finalized)
+        if sale.status != 'pending':
+            logger.warning(f"Attempted to finalize sale {sale_id} with status {sale.status}")
+            return error_response(
+                error_type='business',
+                message='Estado de venta inválido',
+                details=f'Solo se pueden finalizar ventas con estado "pending". Estado actual: {sale.status}',
+                sale_id=sale_id,
+                current_status=sale.status,
+                required_status='pending'
+            )
+        
+        logger.debug(f"Sale {sale_id} status validation passed")
+        
+        _finalize_pending_sale(sale, user, payment)
             
-            if receipt_text:
-                response_data['receipt_printed'] = True
-                response_data['receipt_text'] = receipt_text
-                response_data['message'] = 'Venta finalizada exitosamente. Recibo generado automáticamente.'
-                
-                # Generate PDF receipt for download
-                try:
-                    pdf_path = generate_pdf_receipt(sale_data)
-                    if pdf_path:
-                        # Convert absolute path to web-accessible relative path
-                        web_path = pdf_path.replace(os.getcwd() + '/', '')
-                        response_data['pdf_receipt_path'] = web_path
-                        response_data['pdf_generated'] = True
-                        logger.info(f"Recibo PDF generado para venta {sale.id}: {web_path}")
-                    else:
-                        response_data['pdf_generated'] = False
-                except Exception as pdf_error:
-                    logger.error(f"Error generando PDF para venta {sale.id}: {str(pdf_error)}")
-                    response_data['pdf_generated'] = False
-                
-                # Thermal printing has been replaced with native print dialog
-                # Users will print using browser's native print dialog (window.print())
-                response_data['thermal_print_success'] = False
-            else:
-                response_data['message'] = 'Venta finalizada exitosamente. Error generando recibo automático.'
-        except Exception as print_error:
-            # Don't fail the entire sale if receipt printing fails
-            print(f"[Receipt] Error generando recibo automático para venta {sale.id}: {print_error}")
-            response_data['message'] = 'Venta finalizada exitosamente. Error en impresión automática de recibo.'
+        # Commit the transaction
+        db.session.commit()
         
-        # Return success response
-        return jsonify(response_data)
+        _log_sale_finalized(sale, payment)
+        
+        # If ANY part fails, everything rolls back and no NCF is consumed
+        
+        # Return success response (with the automatic receipt)
+        return jsonify(_finalized_sale_response(sale))
+    
+    except SaleFinalizationError as e:
+        # Business/validation failure raised before commit: nothing was persisted
+        db.session.rollback()
+        return e.to_response()
         
     except ValueError as e:
         # Handle business logic errors (no sale, wrong status, no NCF sequence, exhausted sequence, stock issues)
@@ -1278,56 +1458,415 @@ def finalize_sale(sale_id):
 
 
 
-@bp.route('/sales/<int:sale_id>/items/<int:item_id>', methods=['DELETE'])
-def remove_sale_item(sale_id, item_id):
-    user = require_login()
-    if not isinstance(user, models.User):
-        return user
+# Máximo de ventas offline aceptadas por lote de reproducción
+OFFLINE_REPLAY_MAX_BATCH = 50
+
+
+def _offline_sale_result(sale, client_uuid, status):
+    return {
+        'client_uuid': client_uuid,
+        'status': status,
+        'sale_id': sale.id,
+        'ncf': sale.ncf,
+        'total': sale.total,
+        'payment_method': sale.payment_method,
+        'created_at': sale.created_at.isoformat() if sale.created_at else None
+    }
+
+
+def _create_and_finalize_sale(envelope, user, cash_register_id):
+    """
+    Crea y finaliza en la transacción actual una venta con todo su carrito (sin commit)
+
+    Usado por la reproducción de ventas offline y por el cobro express. El
+    client_uuid del sobre (opcional en express) se guarda en la venta.
+
+    Raises:
+        SaleFinalizationError: si el sobre no es válido o la venta no puede finalizarse
+    """
+    payment = _parse_finalize_payload(envelope)
     
-    # Validate CSRF token
-    csrf_error = validate_csrf_token()
-    if csrf_error:
-        return csrf_error
+    items = envelope.get('items')
+    if not isinstance(items, list) or not items:
+        raise SaleFinalizationError(
+            error_type='validation',
+            message='Venta sin productos',
+            details='La venta debe incluir al menos un producto en "items"',
+            field='items'
+        )
     
-    try:
-        with db.session.begin():
-            # Get sale and item with locks
-            sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
-            sale_item = db.session.query(models.SaleItem).filter_by(id=item_id, sale_id=sale_id).with_for_update().first()
-            
-            if not sale:
-                raise ValueError('Venta no encontrada')
-            
-            if not sale_item:
-                raise ValueError('Producto no encontrado en la venta')
-            
-            # Only allow removing items from pending sales or open tabs
-            if sale.status not in ['pending', 'tab_open']:
-                raise ValueError('Solo se pueden modificar ventas pendientes o tabs abiertos')
-            
-            # Remove item and update totals
-            item_total = sale_item.total_price
-            db.session.delete(sale_item)
-            
-            # Recalculate sale totals
-            sale.subtotal -= item_total
-            sale.tax_amount = sale.subtotal * 0.18
-            sale.total = sale.subtotal + sale.tax_amount
-            
-            # Ensure totals don't go negative
-            if sale.subtotal < 0:
-                sale.subtotal = 0
-                sale.tax_amount = 0
-                sale.total = 0
-        
-        log_success(
-            operation='sale_item_removed',
-            message=f'Producto eliminado de venta',
+    # Merge quantities per product, keeping the order in which products were scanned
+    product_quantities = {}
+    for item in items:
+        product_id = item.get('product_id') if isinstance(item, dict) else None
+        if not isinstance(product_id, int):
+            raise SaleFinalizationError(
+                error_type='validation',
+                message='Producto inválido',
+                details='Cada item debe tener un product_id numérico',
+                field='product_id',
+                value_received=product_id
+            )
+        quantity_validation = utils.validate_integer_range(
+            item.get('quantity'),
+            min_val=1,
+            max_val=1000,
+            field_name='Cantidad'
+        )
+        if not quantity_validation['valid']:
+            raise SaleFinalizationError(
+                error_type='validation',
+                message=quantity_validation['message'],
+                details='La cantidad debe ser un número entero entre 1 y 1000 unidades',
+                field='quantity',
+                product_id=product_id,
+                value_received=item.get('quantity')
+            )
+        product_quantities[product_id] = product_quantities.get(product_id, 0) + quantity_validation['value']
+    
+    products = db.session.query(models.Product).filter(
+        models.Product.id.in_(list(product_quantities))
+    ).all()
+    products_by_id = {product.id: product for product in products}
+    profiles = tax_profiles.get_profiles(products_by_id)
+    
+    sale = models.Sale()
+    sale.user_id = user.id
+    sale.cash_register_id = cash_register_id
+    sale.client_uuid = envelope.get('client_uuid')
+    sale.description = envelope.get('description')
+    sale.subtotal = 0
+    sale.tax_amount = 0
+    sale.total = 0
+    sale.status = 'pending'
+    db.session.add(sale)
+    
+    for product_id, quantity in product_quantities.items():
+        product = products_by_id.get(product_id)
+        if not product or not product.active:
+            raise SaleFinalizationError(
+                error_type='not_found',
+                message='Producto no encontrado',
+                details=f'No existe un producto activo con ID {product_id}',
+                field='product_id',
+                value_received=product_id,
+                status_code=404
+            )
+        total_tax_rate, has_inclusive_tax = profiles[product.id].rate, profiles[product.id].is_inclusive
+        
+        sale_item = models.SaleItem()
+        sale_item.product_id = product.id
+        sale_item.quantity = quantity
+        sale_item.unit_price = product.price
+        sale_item.total_price = product.price * quantity
+        sale_item.tax_rate = float(total_tax_rate) if total_tax_rate and total_tax_rate > 0 else 0.0
+        sale_item.is_tax_included = has_inclusive_tax
+        sale.sale_items.append(sale_item)
+    
+    # Flush so the sale has an id and its items are visible to the finalization queries
+    db.session.flush()
+    
+    _finalize_pending_sale(sale, user, payment)
+    return sale, payment
+
+
+@bp.route('/sales/offline-replay', methods=['POST'])
+def replay_offline_sales():
+    """
+    Reproduce en lote las ventas capturadas offline por el POS (cola IndexedDB del service worker)
+
+    Body: {"sales": [{"client_uuid": "...", "items": [{"product_id": 1, "quantity": 2}],
+           "payment_method": "cash", "cash_received": 500, "change_amount": 120,
+           "ncf_type": "consumo", "client_name": "...", "client_rnc": "..."}]}
+
+    Cada sobre se procesa en el orden recibido y en su propia transacción, de modo
+    que los NCF se asignan en el orden de captura y un sobre con error no bloquea
+    los siguientes. El client_uuid tiene índice único: un sobre ya reproducido
+    devuelve la venta existente con status 'duplicate' sin consumir otro NCF.
+    """
+    user = require_login()
+    if not isinstance(user, models.User):
+        return user
+    
+    # Validate CSRF token
+    csrf_error = validate_csrf_token()
+    if csrf_error:
+        return csrf_error
+    
+    # ROLE RESTRICTION: Only cashiers and administrators can finalize sales
+    if user.role.value not in ['ADMINISTRADOR', 'CAJERO']:
+        return error_response(
+            error_type='permission',
+            message='Permisos insuficientes',
+            details=f'Solo cajeros y administradores pueden finalizar ventas. Su rol actual es: {user.role.value}',
+            user_role=user.role.value,
+            required_roles=['ADMINISTRADOR', 'CAJERO'],
+            status_code=403
+        )
+    
+    data = request.get_json(silent=True) or {}
+    envelopes = data.get('sales')
+    
+    if not isinstance(envelopes, list) or not envelopes:
+        return error_response(
+            error_type='validation',
+            message='Lote vacío',
+            details='Debe enviar una lista no vacía de ventas en "sales"',
+            field='sales'
+        )
+    
+    if len(envelopes) > OFFLINE_REPLAY_MAX_BATCH:
+        return error_response(
+            error_type='validation',
+            message='Lote demasiado grande',
+            details=f'Se permiten máximo {OFFLINE_REPLAY_MAX_BATCH} ventas por lote. Recibidas: {len(envelopes)}',
+            field='sales',
+            max_batch=OFFLINE_REPLAY_MAX_BATCH
+        )
+    
+    user_cash_register = db.session.query(models.CashRegister).filter_by(
+        user_id=user.id,
+        active=True
+    ).first()
+    cash_register_id = user_cash_register.id if user_cash_register else None
+    
+    results = []
+    for envelope in envelopes:
+        client_uuid = envelope.get('client_uuid') if isinstance(envelope, dict) else None
+        try:
+            client_uuid = str(uuid.UUID(str(client_uuid)))
+        except (ValueError, TypeError):
+            results.append({
+                'client_uuid': client_uuid,
+                'status': 'error',
+                'error': {'error': 'client_uuid inválido', 'type': 'validation', 'field': 'client_uuid'}
+            })
+            continue
+        envelope = dict(envelope, client_uuid=client_uuid)
+        
+        existing = db.session.query(models.Sale).filter_by(client_uuid=client_uuid).first()
+        if existing:
+            results.append(_offline_sale_result(existing, client_uuid, 'duplicate'))
+            continue
+        
+        try:
+            sale, payment = _create_and_finalize_sale(envelope, user, cash_register_id)
+            db.session.commit()
+            _log_sale_finalized(sale, payment)
+            results.append(_offline_sale_result(sale, client_uuid, 'created'))
+        
+        except SaleFinalizationError as e:
+            db.session.rollback()
+            logger.warning(f"Offline sale {client_uuid} rejected: {e.message}")
+            results.append({'client_uuid': client_uuid, 'status': 'error', 'error': e.to_dict()})
+        
+        except IntegrityError:
+            # A concurrent replay of the same envelope won the unique client_uuid index
+            db.session.rollback()
+            existing = db.session.query(models.Sale).filter_by(client_uuid=client_uuid).first()
+            if existing:
+                results.append(_offline_sale_result(existing, client_uuid, 'duplicate'))
+            else:
+                logger.exception(f"Integrity error replaying offline sale {client_uuid}")
+                results.append({
+                    'client_uuid': client_uuid,
+                    'status': 'error',
+                    'error': {'error': 'Error de integridad de datos', 'type': 'server'}
+                })
+        
+        except Exception:
+            db.session.rollback()
+            logger.exception(f"Unexpected error replaying offline sale {client_uuid}")
+            results.append({
+                'client_uuid': client_uuid,
+                'status': 'error',
+                'error': {'error': 'Error interno del servidor', 'type': 'server'}
+            })
+    
+    summary = {status: sum(1 for r in results if r['status'] == status)
+               for status in ('created', 'duplicate', 'error')}
+    
+    log_success(
+        operation='offline_sales_replayed',
+        message=f'Lote de ventas offline procesado',
+        context={
+            'user_id': user.id,
+            'batch_size': len(envelopes),
+            'created_count': summary['created'],
+            'duplicate_count': summary['duplicate'],
+            'error_count': summary['error']
+        }
+    )
+    
+    return jsonify({'results': results, 'processed': len(results), **summary})
+
+
+def _existing_sale_response(sale):
+    return jsonify({
+        'id': sale.id,
+        'ncf': sale.ncf,
+        'total': sale.total,
+        'status': sale.status,
+        'payment_method': sale.payment_method,
+        'created_at': sale.created_at.isoformat() if sale.created_at else None,
+        'duplicate': True,
+        'message': 'Venta ya estaba finalizada'
+    })
+
+
+def _uuid_from_idempotency_key(key):
+    """client_uuid para una cabecera Idempotency-Key: la misma si ya es UUID, si no uno derivado (uuid5)"""
+    try:
+        return str(uuid.UUID(key))
+    except ValueError:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f'idempotency-key:{key}'))
+
+
+@bp.route('/sales/express', methods=['POST'])
+def express_checkout():
+    """
+    Cobro express: crea, agrega productos y finaliza una venta en una sola petición
+
+    Body: {"client_uuid": "...", "items": [{"product_id": 1, "quantity": 2}],
+           "payment_method": "cash", "cash_received": 500, "ncf_type": "consumo",
+           "client_name": "...", "client_rnc": "...", "apply_service_charge": false}
+
+    Todo ocurre en una transacción con las mismas validaciones que
+    finalize_sale (datos de pago, stock, NCF, totales, agregados y libro de
+    caja): si algo falla no queda venta ni se consume NCF. client_uuid (o la
+    cabecera Idempotency-Key) es opcional; si se envía, un reintento con la
+    misma clave devuelve la venta ya creada sin cobrar ni consumir otro NCF.
+    Una cabecera que no es UUID se convierte en uno con uuid5.
+    """
+    user = require_login()
+    if not isinstance(user, models.User):
+        return user
+    
+    # Validate CSRF token
+    csrf_error = validate_csrf_token()
+    if csrf_error:
+        return csrf_error
+    
+    # ROLE RESTRICTION: Only cashiers and administrators can finalize sales
+    if user.role.value not in ['ADMINISTRADOR', 'CAJERO']:
+        return error_response(
+            error_type='permission',
+            message='Permisos insuficientes',
+            details=f'Solo cajeros y administradores pueden finalizar ventas. Su rol actual es: {user.role.value}',
+            user_role=user.role.value,
+            required_roles=['ADMINISTRADOR', 'CAJERO'],
+            status_code=403
+        )
+    
+    data = request.get_json(silent=True) or {}
+    
+    client_uuid = data.get('client_uuid')
+    if client_uuid:
+        try:
+            client_uuid = str(uuid.UUID(str(client_uuid)))
+        except (ValueError, TypeError):
+            return error_response(
+                error_type='validation',
+                message='Clave de idempotencia inválida',
+                details='client_uuid debe ser un UUID',
+                field='client_uuid',
+                value_received=client_uuid
+            )
+    elif request.headers.get('Idempotency-Key'):
+        # The header belongs to the idempotency middleware and may not be a UUID
+        # (older browsers); derive a stable UUID from it instead of rejecting it
+        client_uuid = _uuid_from_idempotency_key(request.headers['Idempotency-Key'])
+    
+    if client_uuid:
+        existing = db.session.query(models.Sale).filter_by(client_uuid=client_uuid).first()
+        if existing:
+            return _existing_sale_response(existing)
+    
+    try:
+        # The finalization assigns the user's active cash register
+        sale, payment = _create_and_finalize_sale(dict(data, client_uuid=client_uuid), user, None)
+        db.session.commit()
+        _log_sale_finalized(sale, payment)
+        return jsonify(_finalized_sale_response(sale))
+    
+    except SaleFinalizationError as e:
+        db.session.rollback()
+        return e.to_response()
+    
+    except IntegrityError as e:
+        db.session.rollback()
+        # A concurrent retry with the same key won the unique client_uuid index
+        existing = db.session.query(models.Sale).filter_by(client_uuid=client_uuid).first() if client_uuid else None
+        if existing:
+            return _existing_sale_response(existing)
+        log_error(
+            error_type='server',
+            message=f'Error de integridad de datos en cobro express: {str(e)}',
+            context={'client_uuid': client_uuid},
+            exc_info=True
+        )
+        return error_response(
+            error_type='server',
+            message='Error de concurrencia',
+            details='Error de concurrencia al generar NCF. Por favor intente nuevamente.',
+            user_message='Error de concurrencia al generar NCF. Intente nuevamente.',
+            status_code=409
+        )
+    
+    except Exception:
+        db.session.rollback()
+        logger.exception(f"Unexpected error in express checkout {client_uuid}")
+        return error_response(
+            error_type='server',
+            message='Error interno del servidor',
+            details='Ocurrió un error inesperado. Por favor contacte al administrador.',
+            error_id=f'ERR_EXPRESS_{int(time.time())}',
+            status_code=500
+        )
+
+
+@bp.route('/sales/<int:sale_id>/items/<int:item_id>', methods=['DELETE'])
+def remove_sale_item(sale_id, item_id):
+    user = require_login()
+    if not isinstance(user, models.User):
+        return user
+    
+    # Validate CSRF token
+    csrf_error = validate_csrf_token()
+    if csrf_error:
+        return csrf_error
+    
+    try:
+        # require_login() already opened the transaction; lock the sale and item and commit explicitly
+        sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
+        sale_item = db.session.query(models.SaleItem).filter_by(id=item_id, sale_id=sale_id).with_for_update().first()
+        
+        if not sale:
+            raise ValueError('Venta no encontrada')
+        
+        if not sale_item:
+            raise ValueError('Producto no encontrado en la venta')
+        
+        # Only allow removing items from pending sales or open tabs
+        if sale.status not in ['pending', 'tab_open']:
+            raise ValueError('Solo se pueden modificar ventas pendientes o tabs abiertos')
+        
+        # Remove item and recalculate totals from the remaining lines
+        remaining_items = [item for item in sale.sale_items if item.id != sale_item.id]
+        db.session.delete(sale_item)
+        tax_engine.apply_to_sale(sale, items=remaining_items)
+        kitchen.sync_sale(sale, items=remaining_items)
+        db.session.commit()
+        
+        log_success(
+            operation='sale_item_removed',
+            message=f'Producto eliminado de venta',
             context={'sale_id': sale_id, 'item_id': item_id, 'new_total': float(sale.total)}
         )
         return jsonify({'success': True, 'new_total': sale.total})
     
     except ValueError as e:
+        db.session.rollback()
         return error_response(
             error_type='validation',
             message='Error de validación',
@@ -1335,6 +1874,7 @@ def remove_sale_item(sale_id, item_id):
             log_context={'sale_id': sale_id, 'item_id': item_id}
         )
     except Exception as e:
+        db.session.rollback()
         return error_response(
             error_type='server',
             message='Error interno del servidor',
@@ -1364,61 +1904,326 @@ def update_item_quantity(sale_id, item_id):
         )
     
     try:
-        with db.session.begin():
-            # Get sale and item with locks
-            sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
-            sale_item = db.session.query(models.SaleItem).filter_by(id=item_id, sale_id=sale_id).with_for_update().first()
-            
-            if not sale:
-                raise ValueError('Venta no encontrada')
-            
-            if not sale_item:
-                raise ValueError('Producto no encontrado en la venta')
-            
-            # Only allow modifying pending sales or open tabs
-            if sale.status not in ['pending', 'tab_open']:
-                raise ValueError('Solo se pueden modificar ventas pendientes o tabs abiertos')
-            
-            # Check stock availability
-            product = sale_item.product
-            if product.stock < new_quantity:
-                raise ValueError(f'Stock insuficiente para {product.name}. Disponible: {product.stock}')
-            
-            # Update quantity and totals
-            old_total = sale_item.total_price
-            sale_item.quantity = new_quantity
-            sale_item.total_price = sale_item.unit_price * new_quantity
-            
-            # Update sale totals
-            sale.subtotal = sale.subtotal - old_total + sale_item.total_price
-            sale.tax_amount = sale.subtotal * 0.18
-            sale.total = sale.subtotal + sale.tax_amount
+        # require_login() already opened the transaction; lock the sale and item and commit explicitly
+        sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
+        sale_item = db.session.query(models.SaleItem).filter_by(id=item_id, sale_id=sale_id).with_for_update().first()
+        
+        if not sale:
+            raise ValueError('Venta no encontrada')
+        
+        if not sale_item:
+            raise ValueError('Producto no encontrado en la venta')
+        
+        # Only allow modifying pending sales or open tabs
+        if sale.status not in ['pending', 'tab_open']:
+            raise ValueError('Solo se pueden modificar ventas pendientes o tabs abiertos')
+        
+        # Check stock availability
+        product = sale_item.product
+        if product.stock < new_quantity:
+            raise ValueError(f'Stock insuficiente para {product.name}. Disponible: {product.stock}')
+        
+        # Update quantity and totals
+        sale_item.quantity = new_quantity
+        sale_item.total_price = sale_item.unit_price * new_quantity
+        
+        # Update sale totals
+        tax_engine.apply_to_sale(sale)
+        kitchen.sync_sale(sale)
+        db.session.commit()
+        
+        log_success(
+            operation='sale_item_quantity_updated',
+            message=f'Cantidad actualizada en venta',
+            context={'sale_id': sale_id, 'item_id': item_id, 'new_quantity': new_quantity}
+        )
+        return jsonify({
+            'success': True,
+            'new_quantity': sale_item.quantity,
+            'new_item_total': sale_item.total_price,
+            'new_sale_total': sale.total
+        })
+    
+    except ValueError as e:
+        db.session.rollback()
+        return error_response(
+            error_type='validation',
+            message='Error de validación',
+            details=str(e),
+            log_context={'sale_id': sale_id, 'item_id': item_id, 'new_quantity': new_quantity}
+        )
+    except Exception as e:
+        db.session.rollback()
+        return error_response(
+            error_type='server',
+            message='Error interno del servidor',
+            details=f'Error inesperado al actualizar cantidad: {str(e)}',
+            log_context={'sale_id': sale_id, 'item_id': item_id},
+            status_code=500
+        )
+
+
+MAX_ITEM_OPS = 100
+ITEM_OPS = ('add', 'set_quantity', 'remove')
+
+
+def _parse_item_ops(raw_ops):
+    """
+    Valida la lista de operaciones del PATCH de líneas antes de bloquear la venta
+
+    Cada operación es {"op": "add", "product_id", "quantity", "tax_type_id"?, "is_inclusive"?},
+    {"op": "set_quantity", "item_id" | "product_id", "quantity"} o
+    {"op": "remove", "item_id" | "product_id"}.
+    """
+    if not isinstance(raw_ops, list) or not raw_ops:
+        raise SaleFinalizationError('validation', 'Operaciones requeridas',
+                                    'Debe enviar una lista "ops" con al menos una operación', field='ops')
+    if len(raw_ops) > MAX_ITEM_OPS:
+        raise SaleFinalizationError('validation', 'Demasiadas operaciones',
+                                    f'Máximo {MAX_ITEM_OPS} operaciones por petición', field='ops',
+                                    max_allowed=MAX_ITEM_OPS)
+
+    ops = []
+    for index, raw in enumerate(raw_ops):
+        kind = raw.get('op') if isinstance(raw, dict) else None
+        if kind not in ITEM_OPS:
+            raise SaleFinalizationError('validation', 'Operación inválida',
+                                        f'La operación {index} debe ser una de: {", ".join(ITEM_OPS)}',
+                                        field='op', op_index=index, allowed_values=list(ITEM_OPS))
+        op = {'op': kind, 'index': index}
+
+        for key in ('item_id', 'product_id'):
+            if raw.get(key) is not None:
+                try:
+                    op[key] = int(raw[key])
+                except (TypeError, ValueError):
+                    raise SaleFinalizationError('validation', f'{key} inválido',
+                                                f'La operación {index} tiene un {key} no numérico',
+                                                field=key, op_index=index, value_received=raw[key])
+        if kind == 'add' and 'product_id' not in op:
+            raise SaleFinalizationError('validation', 'Producto requerido',
+                                        f'La operación {index} (add) requiere product_id',
+                                        field='product_id', op_index=index)
+        if kind != 'add' and 'item_id' not in op and 'product_id' not in op:
+            raise SaleFinalizationError('validation', 'Línea requerida',
+                                        f'La operación {index} ({kind}) requiere item_id o product_id',
+                                        field='item_id', op_index=index)
+
+        if kind != 'remove':
+            quantity_validation = utils.validate_integer_range(raw.get('quantity', 1), min_val=1, max_val=1000,
+                                                               field_name='Cantidad')
+            if not quantity_validation['valid']:
+                raise SaleFinalizationError('validation', quantity_validation['message'],
+                                            'La cantidad debe ser un número entero entre 1 y 1000 unidades',
+                                            field='quantity', op_index=index, value_received=raw.get('quantity'))
+            op['quantity'] = quantity_validation['value']
+        if kind == 'add':
+            op['tax_type_id'] = raw.get('tax_type_id')
+            op['is_inclusive'] = raw.get('is_inclusive')
+        ops.append(op)
+    return ops
+
+
+def _apply_item_ops(sale, items, ops, products, profiles):
+    """
+    Aplica las operaciones en memoria sobre las líneas de la venta (sin commit)
+
+    Las cantidades de un mismo producto se suman en su primera línea, igual
+    que add_sale_item. El stock se valida una vez al final sobre las
+    cantidades resultantes. Devuelve las líneas que quedan en la venta.
+    """
+    items = sorted(items, key=lambda item: item.id)
+    items_by_id = {item.id: item for item in items}
+    line_by_product = {}
+    for item in items:
+        line_by_product.setdefault(item.product_id, item)
+    removed = set()
+
+    for op in ops:
+        if op['op'] == 'add':
+            product = products.get(op['product_id'])
+            if not product:
+                raise SaleFinalizationError('not_found', 'Producto no encontrado',
+                                            f'No existe un producto con ID {op["product_id"]}',
+                                            field='product_id', op_index=op['index'],
+                                            value_received=op['product_id'], status_code=404)
+            tax_rate, is_tax_included, _ = _resolve_line_tax(product.id, op['tax_type_id'], op['is_inclusive'],
+                                                             profiles.get(product.id))
+            line = line_by_product.get(product.id)
+            if line is None:
+                line = models.SaleItem()
+                line.sale_id = sale.id
+                line.product_id = product.id
+                line.quantity = 0
+                line.unit_price = product.price
+                db.session.add(line)
+                items.append(line)
+                line_by_product[product.id] = line
+            line.quantity += op['quantity']
+            line.total_price = product.price * line.quantity
+            line.tax_rate = tax_rate
+            line.is_tax_included = is_tax_included
+            continue
+
+        if 'item_id' in op:
+            line = items_by_id.get(op['item_id'])
+            if line in removed:
+                line = None
+        else:
+            line = line_by_product.get(op['product_id'])
+        if line is None:
+            raise SaleFinalizationError('not_found', 'Producto no encontrado en la venta',
+                                        f'La operación {op["index"]} ({op["op"]}) no corresponde a ninguna línea',
+                                        field='item_id', op_index=op['index'], status_code=404)
+
+        if op['op'] == 'remove':
+            removed.add(line)
+            if line_by_product.get(line.product_id) is line:
+                del line_by_product[line.product_id]
+            if line.id is None:
+                db.session.expunge(line)
+            else:
+                db.session.delete(line)
+        else:
+            line.quantity = op['quantity']
+            line.total_price = line.unit_price * op['quantity']
+
+    remaining = [item for item in items if item not in removed]
+
+    # Stock check on the resulting cart (read-only: the real decrement happens at finalize)
+    quantities = {}
+    for item in remaining:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product and product.product_type == 'inventariable' and product.stock < quantity:
+            raise SaleFinalizationError(
+                error_type='business',
+                message='Stock insuficiente',
+                details=f'No hay suficiente stock de {product.name}. Disponible: {product.stock}, necesario: {quantity}',
+                field='quantity',
+                product_id=product.id,
+                product_name=product.name,
+                stock_available=product.stock,
+                total_needed=quantity,
+                shortage=quantity - product.stock,
+                user_message=f'No hay suficiente stock de {product.name}. Disponible: {product.stock}, necesario: {quantity}'
+            )
+    return remaining
+
+
+@bp.route('/sales/<int:sale_id>/items', methods=['PATCH'])
+def batch_update_sale_items(sale_id):
+    """
+    Agregar, cambiar cantidad y eliminar varias líneas en una sola petición
+
+    Todas las operaciones se aplican bajo un solo bloqueo de la venta, con una
+    consulta para los productos y otra para las líneas existentes, y un solo
+    commit: o se aplican todas o ninguna. Devuelve el estado nuevo de la venta.
+    Payload: {"ops": [{"op": "add", "product_id": 3, "quantity": 2},
+                      {"op": "set_quantity", "item_id": 15, "quantity": 1},
+                      {"op": "remove", "item_id": 16}]}
+    """
+    user = require_login()
+    if not isinstance(user, models.User):
+        return user
+    
+    # Validate CSRF token
+    csrf_error = validate_csrf_token()
+    if csrf_error:
+        return csrf_error
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        ops = _parse_item_ops(data.get('ops'))
+    except SaleFinalizationError as e:
+        return e.to_response()
+    
+    try:
+        sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
+        if not sale:
+            return error_response(
+                error_type='not_found',
+                message='Venta no encontrada',
+                details=f'No existe una venta con ID {sale_id}',
+                sale_id=sale_id,
+                status_code=404
+            )
+        
+        if sale.status not in ['pending', 'tab_open']:
+            return error_response(
+                error_type='business',
+                message='Venta no modificable',
+                details=f'Solo se pueden modificar ventas pendientes o tabs abiertos. Estado actual: {sale.status}',
+                sale_id=sale_id,
+                sale_status=sale.status,
+                allowed_statuses=['pending', 'tab_open']
+            )
+        
+        items = list(sale.sale_items)
+        product_ids = {op['product_id'] for op in ops if 'product_id' in op} | {item.product_id for item in items}
+        products = {
+            product.id: product
+            for product in models.Product.query.filter(models.Product.id.in_(product_ids)).all()
+        } if product_ids else {}
+        profiles = tax_profiles.get_profiles(
+            op['product_id'] for op in ops if op['op'] == 'add' and not op['tax_type_id']
+        )
+        
+        try:
+            remaining = _apply_item_ops(sale, items, ops, products, profiles)
+        except SaleFinalizationError as e:
+            db.session.rollback()
+            return e.to_response()
+        
+        tax_engine.apply_to_sale(sale, items=remaining)
+        kitchen.sync_sale(sale, items=remaining)
+        db.session.flush()
+        
+        # Build the response before commit so the lines are not reloaded one by one
+        state = {
+            'success': True,
+            'sale': {
+                'id': sale.id,
+                'status': sale.status,
+                'subtotal': sale.subtotal,
+                'tax_amount': sale.tax_amount,
+                'total': sale.total
+            },
+            'items': [{
+                'id': item.id,
+                'product_id': item.product_id,
+                'product_name': products[item.product_id].name if item.product_id in products else None,
+                'quantity': item.quantity,
+                'unit_price': item.unit_price,
+                'total_price': item.total_price,
+                'tax_rate': item.tax_rate,
+                'is_tax_included': item.is_tax_included
+            } for item in remaining],
+            'applied': len(ops)
+        }
+        db.session.commit()
         
         log_success(
-            operation='sale_item_quantity_updated',
-            message=f'Cantidad actualizada en venta',
-            context={'sale_id': sale_id, 'item_id': item_id, 'new_quantity': new_quantity}
+            operation='sale_items_batch_updated',
+            message=f'Líneas de venta actualizadas en lote',
+            context={'sale_id': sale_id, 'op_count': len(ops), 'sale_total': float(state['sale']['total'])}
         )
-        return jsonify({
-            'success': True,
-            'new_quantity': sale_item.quantity,
-            'new_item_total': sale_item.total_price,
-            'new_sale_total': sale.total
-        })
+        return jsonify(state)
     
-    except ValueError as e:
-        return error_response(
-            error_type='validation',
-            message='Error de validación',
-            details=str(e),
-            log_context={'sale_id': sale_id, 'item_id': item_id, 'new_quantity': new_quantity}
-        )
     except Exception as e:
+        db.session.rollback()
+        log_error(
+            error_type='server',
+            message=f'Error inesperado al actualizar líneas de venta {sale_id}: {str(e)}',
+            context={'sale_id': sale_id, 'op_count': len(ops)},
+            exc_info=True
+        )
         return error_response(
             error_type='server',
             message='Error interno del servidor',
-            details=f'Error inesperado al actualizar cantidad: {str(e)}',
-            log_context={'sale_id': sale_id, 'item_id': item_id},
+            details='Ocurrió un error inesperado. Por favor contacte al administrador.',
+            log_context={'sale_id': sale_id},
             status_code=500
         )
 
@@ -1463,6 +2268,7 @@ def close_table_properly(table_id):
             if action == 'cancel':
                 # Cancel the sale
                 pending_sale.status = 'cancelled'
+                kitchen.cancel_sale(pending_sale)
                 table.status = models.TableStatus.AVAILABLE
                 return jsonify({
                     'success': True,
@@ -1530,6 +2336,7 @@ def update_kitchen_status(sale_id):
         
         # Update order status
         sale.order_status = models.OrderStatus(new_status)
+        kitchen.order_status_changed(sale)
         db.session.commit()
             
         return jsonify({
@@ -1561,23 +2368,25 @@ def send_to_kitchen(sale_id):
         return csrf_error
     
     try:
-        with db.session.begin():
-            sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
-            
-            if not sale:
-                raise ValueError('Venta no encontrada')
-            
-            # Only allow sending pending sales to kitchen
-            if sale.status != 'pending':
-                raise ValueError('Solo se pueden enviar a cocina pedidos pendientes')
-            
-            # Check if sale has items
-            if not sale.sale_items:
-                raise ValueError('No se puede enviar un pedido vacío a cocina')
-            
-            # Update order status to sent_to_kitchen
-            sale.order_status = models.OrderStatus.SENT_TO_KITCHEN
-            
+        # require_login() already opened the transaction; lock the sale and commit explicitly
+        sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
+        
+        if not sale:
+            raise ValueError('Venta no encontrada')
+        
+        # Only allow sending pending sales to kitchen
+        if sale.status != 'pending':
+            raise ValueError('Solo se pueden enviar a cocina pedidos pendientes')
+        
+        # Check if sale has items
+        if not sale.sale_items:
+            raise ValueError('No se puede enviar un pedido vacío a cocina')
+        
+        # Update order status to sent_to_kitchen and project the order on the kitchen screens
+        sale.order_status = models.OrderStatus.SENT_TO_KITCHEN
+        kitchen.sync_sale(sale)
+        db.session.commit()
+        
         return jsonify({
             'success': True,
             'sale_id': sale.id,
@@ -1588,8 +2397,10 @@ def send_to_kitchen(sale_id):
         })
         
     except ValueError as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 400
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': f'Error interno: {str(e)}'}), 500
 
 
@@ -2009,187 +2820,193 @@ def create_credit_note(sale_id):
         return jsonify({'error': 'Debe especificar al menos un producto'}), 400
     
     try:
-        with db.session.begin():
-            # Get original sale with lock
-            sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
-            
-            if not sale:
-                raise ValueError('Venta no encontrada')
-            
-            # Validate that sale is completed
-            if sale.status != 'completed':
-                raise ValueError('Solo se pueden crear notas para ventas completadas')
-            
-            if not sale.ncf:
-                raise ValueError('La venta debe tener un NCF válido')
-            
-            # Validate NCF type
-            if note_type not in ['nota_credito', 'nota_debito']:
-                raise ValueError('Tipo de nota inválido')
-            
-            # Use CREDITO_FISCAL sequence but generate appropriate NCF type
-            # Since credit/debit note sequences may not exist, use existing CREDITO_FISCAL sequence
-            cash_register = sale.cash_register
-            if not cash_register:
-                raise ValueError('La venta no tiene caja registradora asignada')
-            
-            # Lock NCF sequence for atomic operation to prevent race conditions
-            # Use CREDITO_FISCAL sequence and replace B with A or C as needed
-            ncf_sequence = db.session.query(models.NCFSequence).filter_by(
-                cash_register_id=cash_register.id,
-                ncf_type=models.NCFType.CREDITO_FISCAL,
-                active=True
-            ).with_for_update().first()
-            
-            if not ncf_sequence:
-                raise ValueError('No hay secuencia de NCF de crédito fiscal activa')
-            
-            # Check if sequence has available numbers
-            if ncf_sequence.current_number >= ncf_sequence.end_number:
-                raise ValueError(f'Secuencia de NCF agotada')
-            
-            # Generate next NCF number atomically
-            next_number = ncf_sequence.current_number + 1
+        # require_login() already opened the transaction: lock the sale and commit explicitly
+        # Get original sale with lock
+        sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
+        
+        if not sale:
+            raise ValueError('Venta no encontrada')
+        
+        # Validate that sale is completed
+        if sale.status != 'completed':
+            raise ValueError('Solo se pueden crear notas para ventas completadas')
+        
+        if not sale.ncf:
+            raise ValueError('La venta debe tener un NCF válido')
+        
+        # Validate NCF type
+        if note_type not in ['nota_credito', 'nota_debito']:
+            raise ValueError('Tipo de nota inválido')
+        
+        # Use CREDITO_FISCAL sequence but generate appropriate NCF type
+        # Since credit/debit note sequences may not exist, use existing CREDITO_FISCAL sequence
+        cash_register = sale.cash_register
+        if not cash_register:
+            raise ValueError('La venta no tiene caja registradora asignada')
+        
+        # Lock NCF sequence for atomic operation to prevent race conditions
+        # Use CREDITO_FISCAL sequence and replace B with A or C as needed
+        ncf_sequence = db.session.query(models.NCFSequence).filter_by(
+            cash_register_id=cash_register.id,
+            ncf_type=models.NCFType.CREDITO_FISCAL,
+            active=True
+        ).with_for_update().first()
+        
+        if not ncf_sequence:
+            raise ValueError('No hay secuencia de NCF de crédito fiscal activa')
+        
+        # Check if sequence has available numbers
+        if ncf_sequence.current_number >= ncf_sequence.end_number:
+            raise ValueError(f'Secuencia de NCF agotada')
+        
+        # Generate next NCF number atomically
+        next_number = ncf_sequence.current_number + 1
+        
+        # Generate appropriate NCF: replace B in serie with A (credit) or C (debit)
+        ncf_type_code = 'A' if note_type == 'nota_credito' else 'C'
+        # Replace the B in serie (e.g., "B01") with appropriate letter (e.g., "A01" or "C01")
+        note_serie = ncf_sequence.serie.replace('B', ncf_type_code, 1)
+        ncf = f"{note_serie}{next_number:08d}"
+        
+        # Validate generated NCF
+        if not validate_ncf(ncf):
+            raise ValueError(f'NCF generado inválido: {ncf}')
+        
+        # Validate items and calculate totals using SERVER-SIDE pricing only
+        note_lines = []
+        valid_items = []
+        
+        for item_data in items:
+            product_id = item_data.get('product_id')
+            quantity = item_data.get('quantity', 1)
+            original_sale_item_id = item_data.get('original_sale_item_id')
             
-            # Generate appropriate NCF: replace B in serie with A (credit) or C (debit)
-            ncf_type_code = 'A' if note_type == 'nota_credito' else 'C'
-            # Replace the B in serie (e.g., "B01") with appropriate letter (e.g., "A01" or "C01")
-            note_serie = ncf_sequence.serie.replace('B', ncf_type_code, 1)
-            ncf = f"{note_serie}{next_number:08d}"
+            if not product_id or quantity <= 0:
+                raise ValueError('Datos de producto inválidos')
             
-            # Validate generated NCF
-            if not validate_ncf(ncf):
-                raise ValueError(f'NCF generado inválido: {ncf}')
+            # SECURITY: Always derive pricing from original sale items - NEVER trust client prices
+            original_item = models.SaleItem.query.filter_by(
+                sale_id=sale_id, 
+                product_id=product_id
+            ).first()
             
-            # Validate items and calculate totals using SERVER-SIDE pricing only
-            note_subtotal = 0
-            note_tax_amount = 0
-            valid_items = []
+            if not original_item:
+                raise ValueError(f'Producto {product_id} no está en la venta original')
             
-            for item_data in items:
-                product_id = item_data.get('product_id')
-                quantity = item_data.get('quantity', 1)
-                original_sale_item_id = item_data.get('original_sale_item_id')
-                
-                if not product_id or quantity <= 0:
-                    raise ValueError('Datos de producto inválidos')
-                
-                # SECURITY: Always derive pricing from original sale items - NEVER trust client prices
-                original_item = models.SaleItem.query.filter_by(
-                    sale_id=sale_id, 
-                    product_id=product_id
-                ).first()
-                
-                if not original_item:
-                    raise ValueError(f'Producto {product_id} no está en la venta original')
-                
-                # Validate quantity doesn't exceed original quantity sold
-                if quantity > original_item.quantity:
-                    raise ValueError(f'La cantidad para {original_item.product.name} no puede exceder la cantidad original vendida ({original_item.quantity})')
-                
-                # Use original sale item pricing - never client-provided prices
-                unit_price = original_item.unit_price
-                tax_rate = original_item.tax_rate
-                is_tax_included = original_item.is_tax_included
-                
-                # Calculate item totals
-                line_total = unit_price * quantity
-                
-                if is_tax_included:
-                    line_tax = line_total * (tax_rate / (1 + tax_rate))
-                    line_subtotal = line_total - line_tax
-                else:
-                    line_subtotal = line_total
-                    line_tax = line_subtotal * tax_rate
-                
-                note_subtotal += line_subtotal
-                note_tax_amount += line_tax
-                
-                valid_items.append({
-                    'product_id': product_id,
-                    'product': original_item.product,
-                    'quantity': quantity,
-                    'unit_price': unit_price,
-                    'total_price': line_total,
-                    'tax_rate': tax_rate,
-                    'is_tax_included': is_tax_included,
-                    'original_sale_item_id': original_item.id
-                })
+            # Validate quantity doesn't exceed original quantity sold
+            if quantity > original_item.quantity:
+                raise ValueError(f'La cantidad para {original_item.product.name} no puede exceder la cantidad original vendida ({original_item.quantity})')
             
-            note_total = note_subtotal + note_tax_amount
+            # Use original sale item pricing - never client-provided prices
+            unit_price = original_item.unit_price
+            tax_rate = original_item.tax_rate
+            is_tax_included = original_item.is_tax_included
             
-            # Create credit note
-            credit_note = models.CreditNote()
-            credit_note.original_sale_id = sale_id
-            credit_note.ncf_sequence_id = ncf_sequence.id
-            credit_note.ncf = ncf
-            credit_note.note_type = models.NCFType.NOTA_CREDITO if note_type == 'nota_credito' else models.NCFType.NOTA_DEBITO
-            credit_note.amount = note_subtotal
-            credit_note.tax_amount = note_tax_amount
-            credit_note.total = note_total
-            credit_note.reason = reason
-            credit_note.customer_name = sale.customer_name
-            credit_note.customer_rnc = sale.customer_rnc
-            credit_note.created_by = user.id
+            # Calculate item totals
+            line_total = unit_price * quantity
+            note_lines.append(tax_engine.make_line(quantity, unit_price, tax_rate, is_tax_included))
             
-            db.session.add(credit_note)
-            db.session.flush()  # Get the credit note ID
+            valid_items.append({
+                'product_id': product_id,
+                'product': original_item.product,
+                'quantity': quantity,
+                'unit_price': unit_price,
+                'total_price': line_total,
+                'tax_rate': tax_rate,
+                'is_tax_included': is_tax_included,
+                'original_sale_item_id': original_item.id
+            })
+        
+        # Same per-line rounding as the original sale
+        note_totals = tax_engine.compute_sale(note_lines)
+        note_subtotal = note_totals.base_amount
+        note_tax_amount = note_totals.tax_amount
+        note_total = note_totals.total
+        
+        # Create credit note
+        credit_note = models.CreditNote()
+        credit_note.original_sale_id = sale_id
+        credit_note.ncf_sequence_id = ncf_sequence.id
+        credit_note.ncf = ncf
+        credit_note.note_type = models.NCFType.NOTA_CREDITO if note_type == 'nota_credito' else models.NCFType.NOTA_DEBITO
+        credit_note.amount = note_subtotal
+        credit_note.tax_amount = note_tax_amount
+        credit_note.total = note_total
+        credit_note.reason = reason
+        credit_note.customer_name = sale.customer_name
+        credit_note.customer_rnc = sale.customer_rnc
+        credit_note.created_by = user.id
+        
+        db.session.add(credit_note)
+        db.session.flush()  # Get the credit note ID
+        
+        # Create credit note items
+        for item_data in valid_items:
+            note_item = models.CreditNoteItem()
+            note_item.credit_note_id = credit_note.id
+            note_item.original_sale_item_id = item_data.get('original_sale_item_id')
+            note_item.product_id = item_data['product_id']
+            note_item.quantity = item_data['quantity']
+            note_item.unit_price = item_data['unit_price']
+            note_item.total_price = item_data['total_price']
+            note_item.tax_rate = item_data['tax_rate']
+            note_item.is_tax_included = item_data['is_tax_included']
             
-            # Create credit note items
+            db.session.add(note_item)
+        
+        # Update NCF sequence
+        ncf_sequence.current_number = next_number
+        
+        # For credit notes, increase inventory (returned goods)
+        # For debit notes, no stock adjustment typically needed
+        if note_type == 'nota_credito':
+            returned = {}
             for item_data in valid_items:
-                note_item = models.CreditNoteItem()
-                note_item.credit_note_id = credit_note.id
-                note_item.original_sale_item_id = item_data.get('original_sale_item_id')
-                note_item.product_id = item_data['product_id']
-                note_item.quantity = item_data['quantity']
-                note_item.unit_price = item_data['unit_price']
-                note_item.total_price = item_data['total_price']
-                note_item.tax_rate = item_data['tax_rate']
-                note_item.is_tax_included = item_data['is_tax_included']
-                
-                db.session.add(note_item)
-            
-            # Update NCF sequence
-            ncf_sequence.current_number = next_number
-            
-            # For credit notes, increase inventory (returned goods)
-            # For debit notes, no stock adjustment typically needed
-            if note_type == 'nota_credito':
-                for item_data in valid_items:
-                    product = item_data['product']
-                    if product and product.product_type == 'inventariable':
-                        old_stock = product.stock
-                        product.stock += item_data['quantity']
-                        
-                        # Create stock adjustment record for audit trail
-                        stock_adjustment = models.StockAdjustment()
-                        stock_adjustment.product_id = product.id
-                        stock_adjustment.user_id = user.id
-                        stock_adjustment.adjustment_type = 'credit_note'
-                        stock_adjustment.old_stock = old_stock
-                        stock_adjustment.adjustment = item_data['quantity']
-                        stock_adjustment.new_stock = product.stock
-                        stock_adjustment.reason = f'Nota de crédito NCF {ncf}: {reason}'
-                        stock_adjustment.reference_id = credit_note.id
-                        stock_adjustment.reference_type = 'credit_note'
-                        
-                        db.session.add(stock_adjustment)
-            
-            # Commit transaction
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'credit_note': {
-                    'id': credit_note.id,
-                    'ncf': credit_note.ncf,
-                    'note_type': credit_note.note_type.value,
-                    'total': float(credit_note.total),
-                    'reason': credit_note.reason,
-                    'created_at': credit_note.created_at.isoformat()
-                },
-                'message': f'{"Nota de crédito" if note_type == "nota_credito" else "Nota de débito"} creada exitosamente'
-            })
+                product = item_data['product']
+                if product and product.product_type == 'inventariable':
+                    returned[product.id] = returned.get(product.id, 0) + item_data['quantity']
+            # Atomic increment: concurrent sales of the same product are not overwritten
+            new_stock = stock_control.increment_stock(returned)
+            running_stock = {product_id: new_stock.get(product_id, 0) - quantity
+                             for product_id, quantity in returned.items()}
+            for item_data in valid_items:
+                product = item_data['product']
+                if product and product.id in running_stock:
+                    old_stock = running_stock[product.id]
+                    running_stock[product.id] += item_data['quantity']
+                    
+                    # Create stock adjustment record for audit trail
+                    stock_adjustment = models.StockAdjustment()
+                    stock_adjustment.product_id = product.id
+                    stock_adjustment.user_id = user.id
+                    stock_adjustment.adjustment_type = 'credit_note'
+                    stock_adjustment.old_stock = old_stock
+                    stock_adjustment.adjustment = item_data['quantity']
+                    stock_adjustment.new_stock = running_stock[product.id]
+                    stock_adjustment.reason = f'Nota de crédito NCF {ncf}: {reason}'
+                    stock_adjustment.reference_id = credit_note.id
+                    stock_adjustment.reference_type = 'credit_note'
+                    
+                    db.session.add(stock_adjustment)
+        
+        # Credit/debit note event for downstream consumers, in the same transaction
+        outbox.record_credit_note(credit_note, valid_items, returned if note_type == 'nota_credito' else {})
+        
+        # Commit transaction
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'credit_note': {
+                'id': credit_note.id,
+                'ncf': credit_note.ncf,
+                'note_type': credit_note.note_type.value,
+                'total': float(credit_note.total),
+                'reason': credit_note.reason,
+                'created_at': credit_note.created_at.isoformat()
+            },
+            'message': f'{"Nota de crédito" if note_type == "nota_credito" else "Nota de débito"} creada exitosamente'
+        })
             
     except ValueError as e:
         db.session.rollback()
@@ -2348,76 +3165,88 @@ def cancel_sale(sale_id):
         return jsonify({'error': 'La razón de cancelación es requerida'}), 400
     
     try:
-        with db.session.begin():
-            # Get sale with lock
-            sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
-            
-            if not sale:
-                raise ValueError('Venta no encontrada')
-            
-            # Validate that sale can be cancelled
-            if sale.status == 'cancelled':
-                raise ValueError('La venta ya está cancelada')
-            
-            if sale.status != 'completed':
-                raise ValueError('Solo se pueden cancelar ventas completadas')
-            
-            if not sale.ncf:
-                raise ValueError('La venta debe tener un NCF válido para cancelar')
-            
-            # Update sale status
-            sale.status = 'cancelled'
-            sale.cancellation_reason = reason
-            sale.cancelled_at = datetime.utcnow()
-            sale.cancelled_by = user.id
+        # Get sale with lock
+        sale = db.session.query(models.Sale).filter_by(id=sale_id).with_for_update().first()
+        
+        if not sale:
+            raise ValueError('Venta no encontrada')
+        
+        # Validate that sale can be cancelled
+        if sale.status == 'cancelled':
+            raise ValueError('La venta ya está cancelada')
+        
+        if sale.status != 'completed':
+            raise ValueError('Solo se pueden cancelar ventas completadas')
+        
+        if not sale.ncf:
+            raise ValueError('La venta debe tener un NCF válido para cancelar')
+        
+        # Update sale status
+        sale.status = 'cancelled'
+        sale.cancellation_reason = reason
+        sale.cancelled_at = datetime.utcnow()
+        sale.cancelled_by = user.id
+        
+        # Remove the sale from the per-day invoice aggregates and its session ledger
+        sales_aggregates.record_cancelled_sale(sale)
+        cash_ledger.record_cancelled_sale(sale)
+        
+        # Register cancelled NCF for DGII compliance
+        if sale.ncf_sequence_id:
+            cancelled_ncf = models.CancelledNCF()
+            cancelled_ncf.ncf_sequence_id = sale.ncf_sequence_id
+            cancelled_ncf.ncf = sale.ncf
+            cancelled_ncf.ncf_type = sale.ncf_sequence.ncf_type
+            cancelled_ncf.original_sale_id = sale.id
+            cancelled_ncf.reason = reason
+            cancelled_ncf.cancelled_by = user.id
             
-            # Register cancelled NCF for DGII compliance
-            if sale.ncf_sequence_id:
-                cancelled_ncf = models.CancelledNCF()
-                cancelled_ncf.ncf_sequence_id = sale.ncf_sequence_id
-                cancelled_ncf.ncf = sale.ncf
-                cancelled_ncf.original_sale_id = sale.id
-                cancelled_ncf.reason = reason
-                cancelled_ncf.cancelled_by = user.id
+            db.session.add(cancelled_ncf)
+        
+        # For inventoriable products, restore stock
+        sale_items = models.SaleItem.query.filter_by(sale_id=sale_id).all()
+        restored = {}
+        for item in sale_items:
+            restored[item.product_id] = restored.get(item.product_id, 0) + item.quantity
+        # Atomic increment (only inventariable products): no read-modify-write on the product row
+        new_stock = stock_control.increment_stock(restored)
+        running_stock = {product_id: stock - restored[product_id] for product_id, stock in new_stock.items()}
+        for item in sale_items:
+            if item.product_id in running_stock:
+                old_stock = running_stock[item.product_id]
+                running_stock[item.product_id] += item.quantity
                 
-                db.session.add(cancelled_ncf)
-            
-            # For inventoriable products, restore stock
-            sale_items = models.SaleItem.query.filter_by(sale_id=sale_id).all()
-            for item in sale_items:
-                product = item.product
-                if product and product.product_type == 'inventariable':
-                    old_stock = product.stock
-                    product.stock += item.quantity
-                    
-                    # Create stock adjustment record
-                    stock_adjustment = models.StockAdjustment()
-                    stock_adjustment.product_id = product.id
-                    stock_adjustment.user_id = user.id
-                    stock_adjustment.adjustment_type = 'sale_cancellation'
-                    stock_adjustment.old_stock = old_stock
-                    stock_adjustment.adjustment = item.quantity
-                    stock_adjustment.new_stock = product.stock
-                    stock_adjustment.reason = f'Cancelación de venta: {reason}'
-                    stock_adjustment.reference_id = sale.id
-                    stock_adjustment.reference_type = 'sale_cancellation'
-                    
-                    db.session.add(stock_adjustment)
-            
-            # Commit transaction
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': 'Venta cancelada exitosamente',
-                'sale': {
-                    'id': sale.id,
-                    'ncf': sale.ncf,
-                    'status': sale.status,
-                    'cancelled_at': sale.cancelled_at.isoformat() if sale.cancelled_at else None
-                }
-            })
-            
+                # Create stock adjustment record
+                stock_adjustment = models.StockAdjustment()
+                stock_adjustment.product_id = item.product_id
+                stock_adjustment.user_id = user.id
+                stock_adjustment.adjustment_type = 'sale_cancellation'
+                stock_adjustment.old_stock = old_stock
+                stock_adjustment.adjustment = item.quantity
+                stock_adjustment.new_stock = running_stock[item.product_id]
+                stock_adjustment.reason = f'Cancelación de venta: {reason}'
+                stock_adjustment.reference_id = sale.id
+                stock_adjustment.reference_type = 'sale_cancellation'
+                
+                db.session.add(stock_adjustment)
+        
+        # Cancellation event with the restocked units, in the same transaction
+        outbox.record_cancelled_sale(sale, {product_id: restored[product_id] for product_id in new_stock})
+        
+        # Commit transaction
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Venta cancelada exitosamente',
+            'sale': {
+                'id': sale.id,
+                'ncf': sale.ncf,
+                'status': sale.status,
+                'cancelled_at': sale.cancelled_at.isoformat() if sale.cancelled_at else None
+            }
+        })
+        
     except ValueError as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 400
@@ -2601,6 +3430,15 @@ def finalize_table_sale(sale_id):
         if sale.table:
             sale.table.status = models.TableStatus.AVAILABLE
         
+        # Update per-day invoice aggregates in the same transaction
+        sales_aggregates.record_completed_sale(sale)
+        
+        # Link sale to the open cash session and update its running ledger
+        cash_ledger.record_finalized_sale(sale)
+        
+        # Sale event (NCF and lines) for downstream consumers, in the same transaction
+        outbox.record_completed_sale(sale)
+        
         # Commit changes
         db.session.commit()
         
@@ -2649,7 +3487,10 @@ def finalize_table_sale(sale_id):
 
 @bp.route('/sales/cash-summary', methods=['GET'])
 def get_cash_summary():
-    """Get cash summary for the current day broken down by payment method"""
+    """Get cash summary for the current day broken down by payment method
+    
+    With ?scope=session returns the running ledger of the user's open cash session instead.
+    """
     user = require_login()
     if not isinstance(user, models.User):
         return user
@@ -2658,6 +3499,22 @@ def get_cash_summary():
     today = datetime.now().date()
     
     try:
+        if request.args.get('scope') == 'session':
+            cash_register = models.CashRegister.query.filter_by(user_id=user.id, active=True).first()
+            current_session = cash_ledger.get_open_session(cash_register.id) if cash_register else None
+            if not current_session:
+                return jsonify({'error': 'No hay una sesión de caja abierta'}), 400
+            
+            summary = cash_ledger.session_summary(current_session)
+            return jsonify({
+                'cash_total': summary['cash_sales'],
+                'card_total': summary['card_sales'],
+                'transfer_total': summary['transfer_sales'],
+                'total_sales': summary['total_sales'],
+                'session_id': current_session.id,
+                'opened_at': summary['opened_at']
+            })
+        
         # Get sales grouped by payment method for today
         from sqlalchemy import func
         
@@ -2722,10 +3579,7 @@ def get_cash_register_status():
             })
         
         # Find current open cash session
-        current_session = models.CashSession.query.filter_by(
-            cash_register_id=cash_register.id,
-            status='open'
-        ).order_by(models.CashSession.opened_at.desc()).first()
+        current_session = cash_ledger.get_open_session(cash_register.id)
         
         if current_session:
             return jsonify({
@@ -2736,7 +3590,8 @@ def get_cash_register_status():
                 'session_id': current_session.id,
                 'opened_at': current_session.opened_at.isoformat(),
                 'opening_amount': current_session.opening_amount,
-                'session_status': 'open'
+                'session_status': 'open',
+                'session_summary': cash_ledger.session_summary(current_session)
             })
         else:
             return jsonify({
@@ -2752,6 +3607,37 @@ def get_cash_register_status():
         return jsonify({'error': 'Error obteniendo estado de caja'}), 500
 
 
+@bp.route('/cash-register/x-report', methods=['GET'])
+def get_cash_register_x_report():
+    """X report: running totals of the current open session, without closing it"""
+    user = require_login()
+    if not isinstance(user, models.User):
+        return user
+    
+    if user.role.value not in ['ADMINISTRADOR', 'CAJERO']:
+        return jsonify({'error': 'No tienes permisos para acceder al reporte de caja'}), 403
+    
+    try:
+        cash_register = models.CashRegister.query.filter_by(user_id=user.id, active=True).first()
+        if not cash_register:
+            return jsonify({'error': 'No tienes una caja registradora asignada'}), 400
+        
+        current_session = cash_ledger.get_open_session(cash_register.id)
+        if not current_session:
+            return jsonify({'error': 'No hay una sesión de caja abierta'}), 400
+        
+        return jsonify({
+            'register_name': cash_register.name,
+            'register_id': cash_register.id,
+            'generated_at': datetime.utcnow().isoformat(),
+            'session_summary': cash_ledger.session_summary(current_session)
+        })
+        
+    except Exception as e:
+        print(f"[ERROR] Failed to get X report: {str(e)}")
+        return jsonify({'error': 'Error obteniendo reporte X de caja'}), 500
+
+
 @bp.route('/cash-register/open', methods=['POST'])
 def open_cash_register():
     """Open cash register session"""
@@ -2849,43 +3735,15 @@ def close_cash_register():
         if not cash_register:
             return jsonify({'error': 'No tienes una caja registradora asignada'}), 400
         
-        # Find current open session
-        current_session = models.CashSession.query.filter_by(
-            cash_register_id=cash_register.id,
-            status='open'
-        ).order_by(models.CashSession.opened_at.desc()).first()
+        # Find current open session (locked so no sale is linked while closing)
+        current_session = cash_ledger.get_open_session(cash_register.id, lock=True)
         
         if not current_session:
             return jsonify({'error': 'No hay una sesión de caja abierta para cerrar'}), 400
         
-        # Get sales summary for the session period
-        from sqlalchemy import func
-        session_sales = db.session.query(
-            models.Sale.payment_method,
-            func.sum(models.Sale.total).label('total'),
-            func.count(models.Sale.id).label('count')
-        ).filter(
-            models.Sale.cash_register_id == cash_register.id,
-            models.Sale.created_at >= current_session.opened_at,
-            models.Sale.status == 'completed'
-        ).group_by(models.Sale.payment_method).all()
-        
-        # Calculate session totals
-        cash_sales = 0.0
-        card_sales = 0.0
-        transfer_sales = 0.0
-        total_transactions = 0
-        
-        for payment_method, total, count in session_sales:
-            if payment_method in ['cash', 'efectivo']:
-                cash_sales += float(total or 0)
-            elif payment_method == 'card':
-                card_sales += float(total or 0)
-            elif payment_method == 'transfer':
-                transfer_sales += float(total or 0)
-            total_transactions += count
-        
-        expected_cash = current_session.opening_amount + cash_sales
+        # Session totals come from the running ledger updated at finalize time
+        summary = cash_ledger.session_summary(current_session)
+        expected_cash = summary['expected_cash']
         cash_difference = closing_amount - expected_cash
         
         # Close the session
@@ -2900,17 +3758,9 @@ def close_cash_register():
             'success': True,
             'message': f'Caja {cash_register.name} cerrada exitosamente',
             'session_summary': {
-                'session_id': current_session.id,
-                'opened_at': current_session.opened_at.isoformat(),
+                **summary,
                 'closed_at': current_session.closed_at.isoformat(),
-                'opening_amount': current_session.opening_amount,
                 'closing_amount': closing_amount,
-                'cash_sales': cash_sales,
-                'card_sales': card_sales,
-                'transfer_sales': transfer_sales,
-                'total_sales': cash_sales + card_sales + transfer_sales,
-                'total_transactions': total_transactions,
-                'expected_cash': expected_cash,
                 'cash_difference': cash_difference,
                 'opening_notes': current_session.opening_notes,
                 'closing_notes': closing_notes
@@ -2950,6 +3800,31 @@ def get_customers():
     return jsonify(customers_data)
 
 
+@bp.route('/rnc/search')
+def search_rnc():
+    """Autocompletar cliente por prefijo de RNC/cédula o de nombre en el padrón de la DGII"""
+    user = require_login()
+    if not isinstance(user, models.User):
+        return user
+    
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', rnc_registry.DEFAULT_LIMIT, type=int)
+    return jsonify(rnc_registry.search(query, limit))
+
+
+@bp.route('/rnc/<rnc>')
+def get_rnc(rnc):
+    """Datos del contribuyente con ese RNC/cédula en el padrón de la DGII"""
+    user = require_login()
+    if not isinstance(user, models.User):
+        return user
+    
+    taxpayer = rnc_registry.lookup(rnc)
+    if taxpayer is None:
+        return jsonify({'error': 'RNC no encontrado en el padrón de la DGII'}), 404
+    return jsonify(taxpayer)
+
+
 # PWA Authentication Endpoints
 
 @bp.route('/auth/login', methods=['POST'])
@@ -3071,20 +3946,17 @@ def preview_sale_calculation():
     
     items = data.get('items', [])
     apply_service_charge = data.get('apply_service_charge', False)
-    service_charge_rate = 0.10  # 10% standard tip rate in Dominican Republic
     
     if not items:
         return jsonify({'error': 'Se requiere al menos un producto'}), 400
     
     try:
         # Calculate totals using same logic as finalize_sale
-        subtotal_by_rate = {}
-        exclusive_tax_by_rate = {}
-        total_subtotal = 0
-        total_tax_included = 0
+        tax_lines = []
         item_details = []
         
-        # Process each item
+        # Validate each item first so products and tax profiles load in one batch
+        requested = []
         for item_data in items:
             product_id = item_data.get('product_id')
             quantity = item_data.get('quantity', 1)
@@ -3092,6 +3964,11 @@ def preview_sale_calculation():
             if not product_id:
                 return jsonify({'error': 'product_id es requerido para cada item'}), 400
             
+            try:
+                product_id = int(product_id)
+            except (ValueError, TypeError):
+                return jsonify({'error': f'Producto {product_id} no encontrado'}), 404
+            
             try:
                 quantity = int(quantity)
                 if quantity <= 0:
@@ -3099,8 +3976,18 @@ def preview_sale_calculation():
             except (ValueError, TypeError):
                 return jsonify({'error': 'La cantidad debe ser un número válido'}), 400
             
-            # Get product
-            product = models.Product.query.get(product_id)
+            requested.append((item_data, product_id, quantity))
+        
+        product_ids = [product_id for _, product_id, _ in requested]
+        products_by_id = {
+            product.id: product
+            for product in models.Product.query.filter(models.Product.id.in_(product_ids)).all()
+        }
+        profiles = tax_profiles.get_profiles(products_by_id)
+        
+        # Process each item
+        for item_data, product_id, quantity in requested:
+            product = products_by_id.get(product_id)
             if not product:
                 return jsonify({'error': f'Producto {product_id} no encontrado'}), 404
             
@@ -3110,11 +3997,7 @@ def preview_sale_calculation():
             
             if frontend_tax_type_id:
                 # Use tax information explicitly provided by frontend
-                tax_type = None
-                for tt in models.TaxType.query.filter_by(active=True).all():
-                    if tt.id == frontend_tax_type_id:
-                        tax_type = {'rate': tt.rate, 'is_inclusive': tt.is_inclusive}
-                        break
+                tax_type = get_tax_type_by_id(frontend_tax_type_id)
                 
                 if tax_type:
                     total_tax_rate = tax_type['rate']
@@ -3123,52 +4006,14 @@ def preview_sale_calculation():
                     total_tax_rate = 0.18  # Default ITBIS 18%
                     has_inclusive_tax = True
             else:
-                # Get product's tax types for NEW TAX SYSTEM
-                product_tax_types = []
-                for product_tax in product.product_taxes:
-                    if product_tax.tax_type.active:
-                        product_tax_types.append({
-                            'rate': product_tax.tax_type.rate,
-                            'is_inclusive': product_tax.tax_type.is_inclusive
-                        })
-                
-                if product_tax_types:
-                    total_tax_rate = sum(tax['rate'] for tax in product_tax_types)
-                    has_inclusive_tax = any(tax['is_inclusive'] for tax in product_tax_types)
-                else:
-                    # Default fallback for fiscal compliance
-                    total_tax_rate = 0.18  # Default ITBIS 18%
-                    has_inclusive_tax = True
+                profile = profiles[product.id]
+                total_tax_rate, has_inclusive_tax = profile.rate, profile.is_inclusive
             
             # Calculate item totals
             item_total = product.price * quantity
+            tax_lines.append(tax_engine.make_line(quantity, product.price, total_tax_rate, has_inclusive_tax))
             
-            if total_tax_rate not in subtotal_by_rate:
-                subtotal_by_rate[total_tax_rate] = 0
-            
-            item_subtotal = 0
-            item_tax_amount = 0
-            
-            if has_inclusive_tax and total_tax_rate > 0:
-                # Tax is included in the price
-                base_amount = item_total / (1 + total_tax_rate)
-                tax_amount = item_total - base_amount
-                subtotal_by_rate[total_tax_rate] += base_amount
-                total_subtotal += base_amount
-                total_tax_included += round(tax_amount, 2)
-                item_subtotal = base_amount
-                item_tax_amount = tax_amount
-            else:
-                # Tax is exclusive or no tax
-                subtotal_by_rate[total_tax_rate] += item_total
-                total_subtotal += item_total
-                item_subtotal = item_total
-                if total_tax_rate > 0:
-                    if total_tax_rate not in exclusive_tax_by_rate:
-                        exclusive_tax_by_rate[total_tax_rate] = 0
-                    exclusive_tax_by_rate[total_tax_rate] += item_total
-            
-            # Add item details for response
+            # Add item details for response (per-line amounts filled in below)
             item_details.append({
                 'product_id': product_id,
                 'product_name': product.name,
@@ -3176,41 +4021,20 @@ def preview_sale_calculation():
                 'unit_price': product.price,
                 'total_price': item_total,
                 'tax_rate': total_tax_rate,
-                'is_tax_included': has_inclusive_tax,
-                'item_subtotal': round(item_subtotal, 2),
-                'item_tax_amount': round(item_tax_amount, 2)
+                'is_tax_included': has_inclusive_tax
             })
         
-        # Calculate service charge from subtotal - extract the tip that's already included
-        # If prices include 10% tip: price_with_tip = base_price × 1.10
-        # Then: base_price = price_with_tip / 1.10 and tip = price_with_tip - base_price
-        service_charge_amount = 0
-        if apply_service_charge:
-            base_without_tip = total_subtotal / (1 + service_charge_rate)
-            service_charge_amount = round(total_subtotal - base_without_tip, 2)
-        
-        # Calculate exclusive taxes on subtotal ONLY (service charge NOT included in tax base per user preference)
-        tax_base = total_subtotal
-        total_tax_added = 0
-        
-        for rate, rate_subtotal in exclusive_tax_by_rate.items():
-            # Apply tax proportionally to items that have this rate
-            proportion = rate_subtotal / total_subtotal if total_subtotal > 0 else 0
-            tax_on_base = tax_base * proportion * rate
-            total_tax_added += round(tax_on_base, 2)
-            
-            # Update item details with exclusive tax amounts
-            for item in item_details:
-                if item['tax_rate'] == rate and not item['is_tax_included']:
-                    item_proportion = (item['total_price']) / rate_subtotal if rate_subtotal > 0 else 0
-                    item['item_tax_amount'] = round(tax_on_base * item_proportion, 2)
-        
-        # Final totals
+        # Same engine and rounding as finalize_sale, so the preview total is the charged total
         # NOTE: service_charge is for DISPLAY ONLY (assumed included in prices), NOT added to total
-        final_subtotal = round(total_subtotal, 2)
-        final_tax_amount = round(total_tax_included + total_tax_added, 2)
-        final_service_charge = service_charge_amount
-        final_total = round(total_subtotal + total_tax_added, 2)  # Service charge NOT added (already included)
+        totals = tax_engine.compute_sale(tax_lines, apply_service_charge=apply_service_charge)
+        for item, line in zip(item_details, totals.lines):
+            item['item_subtotal'] = line.base_amount
+            item['item_tax_amount'] = line.tax_amount
+        
+        final_subtotal = totals.base_amount
+        final_tax_amount = totals.tax_amount
+        final_service_charge = totals.service_charge_amount
+        final_total = totals.rounded_total
         
         return jsonify({
             'success': True,
@@ -3223,10 +4047,10 @@ def preview_sale_calculation():
                 'total': final_total
             },
             'tax_breakdown': {
-                'included_taxes': round(total_tax_included, 2),
-                'exclusive_taxes': round(total_tax_added, 2),
-                'service_charge_rate': service_charge_rate if apply_service_charge else 0,
-                'tax_base': round(tax_base, 2) if exclusive_tax_by_rate else final_subtotal
+                'included_taxes': totals.tax_included,
+                'exclusive_taxes': totals.tax_exclusive,
+                'service_charge_rate': tax_engine.SERVICE_CHARGE_RATE if apply_service_charge else 0,
+                'tax_base': totals.base_amount
             }
         })
         
@@ -3366,11 +4190,10 @@ def get_tab_details(tab_id):
             return jsonify({'error': 'Este tab no está abierto'}), 400
         
         # Get all items in the tab
+        totals = tax_engine.compute_sale_items(tab.sale_items)
         items = []
-        subtotal = 0
-        tax_amount = 0
         
-        for item in tab.sale_items:
+        for item, line in zip(tab.sale_items, totals.lines):
             item_data = {
                 'id': item.id,
                 'product_id': item.product_id,
@@ -3378,13 +4201,9 @@ def get_tab_details(tab_id):
                 'quantity': item.quantity,
                 'unit_price': item.unit_price,
                 'total_price': item.total_price,
-                'tax_amount': item.tax_amount
+                'tax_amount': line.tax_amount
             }
             items.append(item_data)
-            subtotal += item.total_price - item.tax_amount
-            tax_amount += item.tax_amount
-        
-        total = subtotal + tax_amount
         
         return jsonify({
             'success': True,
@@ -3396,9 +4215,9 @@ def get_tab_details(tab_id):
                 'created_at': tab.created_at.isoformat(),
                 'waiter_name': tab.user.name,
                 'items': items,
-                'subtotal': round(subtotal, 2),
-                'tax_amount': round(tax_amount, 2),
-                'total': round(total, 2)
+                'subtotal': totals.base_amount,
+                'tax_amount': totals.tax_amount,
+                'total': totals.total
             }
         })
         
@@ -3430,20 +4249,8 @@ def close_tab(tab_id):
         if not tab.sale_items:
             return jsonify({'error': 'No se puede cerrar un tab sin items'}), 400
         
-        # Calculate totals
-        subtotal = 0
-        tax_amount = 0
-        
-        for item in tab.sale_items:
-            subtotal += item.total_price - item.tax_amount
-            tax_amount += item.tax_amount
-        
-        total = subtotal + tax_amount
-        
-        # Update sale totals and status
-        tab.subtotal = round(subtotal, 2)
-        tab.tax_amount = round(tax_amount, 2)
-        tab.total = round(total, 2)
+        # Update sale totals (same as finalize_sale) and status
+        tax_engine.apply_to_sale(tab)
         tab.status = 'pending'  # Ready for payment
         
         db.session.commit()
@@ -3674,9 +4481,7 @@ def _split_by_items(original_sale, splits, user):
         db.session.flush()  # Get the ID
         
         # Copy assigned items
-        split_subtotal = 0
-        split_tax_included = 0
-        split_tax_added = 0
+        split_items = []
         
         for item_id in item_ids:
             original_item = next((item for item in original_sale.sale_items if item.id == item_id), None)
@@ -3692,28 +4497,10 @@ def _split_by_items(original_sale, splits, user):
             new_item.tax_rate = original_item.tax_rate
             new_item.is_tax_included = original_item.is_tax_included
             db.session.add(new_item)
-            
-            # Calculate totals based on tax configuration
-            rate = original_item.tax_rate if original_item.tax_rate is not None else 0
-            is_included = original_item.is_tax_included
-            
-            if is_included and rate > 0:
-                # Tax included in price
-                base_amount = original_item.total_price / (1 + rate)
-                tax_amount = original_item.total_price - base_amount
-                split_subtotal += base_amount
-                split_tax_included += tax_amount
-            else:
-                # Tax added to price or no tax
-                split_subtotal += original_item.total_price
-                if rate > 0:
-                    tax_amount = original_item.total_price * rate
-                    split_tax_added += tax_amount
-        
-        # Set totals for this split sale
-        new_sale.subtotal = round(split_subtotal, 2)
-        new_sale.tax_amount = round(split_tax_included + split_tax_added, 2)
-        new_sale.total = round(split_subtotal + split_tax_added, 2)
+            split_items.append(new_item)
+        
+        # Set totals for this split sale (same rules as finalize_sale)
+        tax_engine.apply_to_sale(new_sale, items=split_items)
         
         new_sales.append(new_sale)
     
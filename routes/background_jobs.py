@@ -0,0 +1,68 @@
+from flask import Blueprint, jsonify, session, send_file, request
+import os
+import models
+from models import db
+import jobs
+
+bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+
+def _get_job(job_id):
+    """Trabajo visible para el usuario actual (su creador o un administrador), o una respuesta de error"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+
+    job = db.session.get(models.BackgroundJob, job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    if job.created_by != session['user_id'] and session.get('role') != 'ADMINISTRADOR':
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return job
+
+
+@bp.route('/')
+def list_jobs():
+    """Trabajos recientes del usuario actual"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    recent = models.BackgroundJob.query.filter_by(created_by=session['user_id']).order_by(
+        models.BackgroundJob.id.desc()
+    ).limit(limit).all()
+    return jsonify({'jobs': [jobs.job_dict(job) for job in recent]})
+
+
+@bp.route('/<int:job_id>')
+def job_status(job_id):
+    """Estado, avance y resultado de un trabajo"""
+    job = _get_job(job_id)
+    if not isinstance(job, models.BackgroundJob):
+        return job
+    return jsonify(jobs.job_dict(job))
+
+
+@bp.route('/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancelar un trabajo en cola o en curso"""
+    job = _get_job(job_id)
+    if not isinstance(job, models.BackgroundJob):
+        return job
+    if job.status in jobs.FINISHED_STATUSES:
+        return jsonify({'error': 'El trabajo ya terminó', 'job': jobs.job_dict(job)}), 409
+
+    job = jobs.cancel(job)
+    return jsonify({'success': True, 'job': jobs.job_dict(job)})
+
+
+@bp.route('/<int:job_id>/artifact')
+def job_artifact(job_id):
+    """Descargar el archivo generado por un trabajo"""
+    job = _get_job(job_id)
+    if not isinstance(job, models.BackgroundJob):
+        return job
+    if job.status != 'succeeded' or not job.artifact_path or not os.path.exists(job.artifact_path):
+        return jsonify({'error': 'El trabajo no tiene archivo disponible'}), 404
+
+    return send_file(job.artifact_path, as_attachment=True, download_name=job.artifact_name,
+                     mimetype=job.artifact_mimetype)
@@ -2,23 +2,33 @@
 from flask import Blueprint, request, jsonify, send_file, current_app
 from flask import render_template, session, redirect, url_for, flash
 import csv
+import hashlib
 import io
+import json
 import tempfile
 import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import calendar
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 
+from sqlalchemy import func, select
+
 from models import db, User, Sale, Purchase, Product, Supplier, NCFSequence
 from utils import get_company_info_for_receipt
+import db_routing
+import dgii_excel
+import fiscal_archive
+import jobs
 
 bp = Blueprint('dgii', __name__, url_prefix='/dgii')
+# DGII exports only read: they run on the read replica when one is configured
+db_routing.read_only_blueprint(bp)
 
 
 def require_admin():
@@ -456,8 +466,14 @@ def preview_607(year, month):
             Sale.status == 'completed'
         ).all()
         
+        # Closed periods moved out of the live tables are read from the fiscal archive
+        archived = fiscal_archive.is_archived(year, month)
+        if archived:
+            sales += fiscal_archive.archived_sales(year, month)
+        
         return render_template('dgii/preview_607.html',
                              sales=sales,
+                             archived=archived,
                              year=year,
                              month=month,
                              month_name=calendar.month_name[month])
@@ -467,8 +483,60 @@ def preview_607(year, month):
         return redirect(url_for('dgii.reports'))
 
 
+def _606_excel_row(record):
+    """Fila DGII 606 de una compra (rnc del proveedor, ncf, fecha, total, itbis)"""
+    supplier_rnc, ncf_supplier, created_at, total_amount, tax_amount = record
+    
+    # Determine identification type
+    if supplier_rnc and len(supplier_rnc) == 9:
+        tipo_id = '1'  # RNC
+        rnc_cedula = supplier_rnc
+    elif supplier_rnc and len(supplier_rnc) == 11:
+        tipo_id = '2'  # Cédula  
+        rnc_cedula = supplier_rnc
+    else:
+        tipo_id = '1'  # Default to RNC
+        rnc_cedula = supplier_rnc or '000000000'
+    
+    # Format dates as YYYYMMDD
+    fecha_comprobante = created_at.strftime('%Y%m%d')
+    fecha_pago = created_at.strftime('%Y%m%d')
+    
+    return [
+        rnc_cedula, tipo_id, ncf_supplier or '', '',
+        fecha_comprobante, fecha_pago, f"{total_amount:.2f}",
+        f"{tax_amount or 0:.2f}", '0.00', '0.00', '0.00', '0.00',
+        '0.00', '', '0.00', ''
+    ]
+
+
+def _607_excel_row(record, company_rnc):
+    """Fila DGII 607 de una venta (rnc del cliente, ncf, fecha, total, itbis)"""
+    customer_rnc, ncf, created_at, total, tax_amount = record
+    
+    if customer_rnc and len(customer_rnc) == 9:
+        tipo_id, rnc_cedula = '1', customer_rnc
+    elif customer_rnc and len(customer_rnc) == 11:
+        tipo_id, rnc_cedula = '2', customer_rnc
+    else:
+        # Use company RNC if available for general public sales
+        if company_rnc and len(company_rnc) >= 9:
+            tipo_id = '1'  # Use RNC
+            rnc_cedula = company_rnc[:9] if len(company_rnc) > 9 else company_rnc.ljust(9, '0')
+        else:
+            # Fallback to cédula format for general public
+            tipo_id, rnc_cedula = '2', '00000000000'
+    
+    return [
+        rnc_cedula, tipo_id, ncf, '',
+        created_at.strftime('%Y%m%d'), f"{total:.2f}",
+        f"{tax_amount or 0:.2f}", '0.00', '0.00', '0.00', '0.00', '0.00', '0.00', ''
+    ]
+
+
 # EXPORT TO EXCEL FUNCTIONALITY
 @bp.route('/export/606/excel', methods=['POST'])
+@jobs.supports_async
 def export_606_excel():
     """Export DGII 606 (Purchases) to Excel format"""
     user = require_admin()
@@ -510,82 +578,28 @@ def export_606_excel():
         else:
             end_date = datetime(year, month + 1, 1)
         
-        purchases = Purchase.query.filter(
-            Purchase.created_at >= start_date,
-            Purchase.created_at < end_date
-        ).join(Supplier).all()
-        
-        # Create Excel workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        if ws is None:
-            ws = wb.create_sheet('DGII 606')
-            wb.active = ws
-        ws.title = f"DGII 606 - {calendar.month_name[month]} {year}"
-        current_app.logger.debug(f'Excel workbook created with {len(purchases)} purchases')
-        
-        # Add title
-        ws.merge_cells('A1:P1')
-        title_cell = ws['A1']
-        title_cell.value = f"Reporte DGII 606 - Compras - {calendar.month_name[month]} {year}"
-        title_cell.font = Font(size=16, bold=True)
-        title_cell.alignment = Alignment(horizontal='center')
-        title_cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        title_cell.font = Font(color='FFFFFF', size=16, bold=True)
-        
-        # Add headers
-        for col, header in enumerate(DGII_606_HEADERS, 1):
-            cell = ws.cell(row=3, column=col)
-            cell.value = header
-            cell.font = Font(bold=True)
-            cell.fill = PatternFill(start_color='D9E2F3', end_color='D9E2F3', fill_type='solid')
-        
-        # Add data rows
-        row_num = 4
-        for purchase in purchases:
-            supplier = purchase.supplier
-            
-            # Determine identification type
-            if supplier.rnc and len(supplier.rnc) == 9:
-                tipo_id = '1'  # RNC
-                rnc_cedula = supplier.rnc
-            elif supplier.rnc and len(supplier.rnc) == 11:
-                tipo_id = '2'  # Cédula  
-                rnc_cedula = supplier.rnc
-            else:
-                tipo_id = '1'  # Default to RNC
-                rnc_cedula = supplier.rnc or '000000000'
-            
-            # Format dates as YYYYMMDD
-            fecha_comprobante = purchase.created_at.strftime('%Y%m%d')
-            fecha_pago = purchase.created_at.strftime('%Y%m%d')
-            
-            # Calculate amounts
-            monto_facturado = purchase.total_amount
-            itbis_facturado = purchase.tax_amount or 0
-            
-            # Data row
-            row_data = [
-                rnc_cedula, tipo_id, purchase.ncf_supplier or '', '',
-                fecha_comprobante, fecha_pago, f"{monto_facturado:.2f}",
-                f"{itbis_facturado:.2f}", '0.00', '0.00', '0.00', '0.00',
-                '0.00', '', '0.00', ''
-            ]
-            
-            for col, value in enumerate(row_data, 1):
-                ws.cell(row=row_num, column=col, value=value)
-            
-            row_num += 1
-        
-        # Save to temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-        wb.save(temp_file.name)
-        temp_file.close()
+        period_filter = (Purchase.created_at >= start_date, Purchase.created_at < end_date)
+        total_rows = db.session.execute(
+            select(func.count()).select_from(Purchase).join(Purchase.supplier).where(*period_filter)
+        ).scalar()
+        current_app.logger.debug(f'Excel 606 streaming {total_rows} purchases')
+        
+        # Only the columns the format needs, read in batches: memory does not grow with the month
+        purchases = select(
+            Supplier.rnc, Purchase.ncf_supplier, Purchase.created_at, Purchase.total_amount, Purchase.tax_amount
+        ).select_from(Purchase).join(Purchase.supplier).where(*period_filter).order_by(Purchase.created_at, Purchase.id)
+        
+        output = dgii_excel.write_report(
+            f"Reporte DGII 606 - Compras - {calendar.month_name[month]} {year}",
+            f"DGII 606 - {calendar.month_name[month]} {year}",
+            DGII_606_HEADERS,
+            dgii_excel.stream_rows(db.session, purchases, _606_excel_row),
+            progress=lambda count: jobs.report_progress(10 + 80 * count // max(total_rows, 1), 'Escribiendo Excel')
+        )
         
         filename = f"606_{year}_{month:02d}.xlsx"
         
-        return send_file(temp_file.name, as_attachment=True, download_name=filename,
-                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        return send_file(output, as_attachment=True, download_name=filename, mimetype=dgii_excel.XLSX_MIMETYPE)
         
     except Exception as e:
         current_app.logger.exception(f'Error generating Excel 606: {str(e)}')
@@ -628,71 +642,36 @@ def export_607_excel():
         start_date = datetime(year, month, 1)
         end_date = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
         
-        sales = Sale.query.filter(
-            Sale.created_at >= start_date, Sale.created_at < end_date,
-            Sale.status == 'completed'
-        ).all()
-        
-        # Create Excel workbook
-        wb = openpyxl.Workbook()  # Use default mode, not write_only
-        ws = wb.active
-        if ws is None:
-            ws = wb.create_sheet('DGII 607')
-        ws.title = f"DGII 607 - {calendar.month_name[month]} {year}"
-        
-        # Add title and headers
-        ws.merge_cells('A1:N1')
-        ws['A1'] = f"Reporte DGII 607 - Ventas - {calendar.month_name[month]} {year}"
-        ws['A1'].font = Font(color='FFFFFF', size=16, bold=True)
-        ws['A1'].fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        ws['A1'].alignment = Alignment(horizontal='center')
-        
-        for col, header in enumerate(DGII_607_HEADERS, 1):
-            cell = ws.cell(row=3, column=col, value=header)
-            cell.font = Font(bold=True)
-            cell.fill = PatternFill(start_color='D9E2F3', end_color='D9E2F3', fill_type='solid')
+        period_filter = (Sale.created_at >= start_date, Sale.created_at < end_date, Sale.status == 'completed')
+        total_rows = db.session.execute(select(func.count()).select_from(Sale).where(*period_filter)).scalar()
         
         # Get company information for default RNC
         company_info = get_company_info_for_receipt()
         company_rnc = company_info.get('rnc', '').replace('-', '')  # Remove dashes for DGII format
         
-        # Add data
-        for row_num, sale in enumerate(sales, 4):
-            if sale.customer_rnc and len(sale.customer_rnc) == 9:
-                tipo_id, rnc_cedula = '1', sale.customer_rnc
-            elif sale.customer_rnc and len(sale.customer_rnc) == 11:
-                tipo_id, rnc_cedula = '2', sale.customer_rnc
-            else:
-                # Use company RNC if available for general public sales
-                if company_rnc and len(company_rnc) >= 9:
-                    tipo_id = '1'  # Use RNC
-                    rnc_cedula = company_rnc[:9] if len(company_rnc) > 9 else company_rnc.ljust(9, '0')
-                else:
-                    # Fallback to cédula format for general public
-                    tipo_id, rnc_cedula = '2', '00000000000'
-            
-            row_data = [
-                rnc_cedula, tipo_id, sale.ncf, '',
-                sale.created_at.strftime('%Y%m%d'), f"{sale.total:.2f}",
-                f"{sale.tax_amount or 0:.2f}", '0.00', '0.00', '0.00', '0.00', '0.00', '0.00', ''
-            ]
-            
-            for col, value in enumerate(row_data, 1):
-                ws.cell(row=row_num, column=col, value=value)
-        
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-        wb.save(temp_file.name)
-        temp_file.close()
+        # Only the columns the format needs, read in batches: memory does not grow with the month
+        sales = select(
+            Sale.customer_rnc, Sale.ncf, Sale.created_at, Sale.total, Sale.tax_amount
+        ).where(*period_filter).order_by(Sale.created_at, Sale.id)
+        
+        output = dgii_excel.write_report(
+            f"Reporte DGII 607 - Ventas - {calendar.month_name[month]} {year}",
+            f"DGII 607 - {calendar.month_name[month]} {year}",
+            DGII_607_HEADERS,
+            dgii_excel.stream_rows(db.session, sales, lambda record: _607_excel_row(record, company_rnc)),
+            progress=lambda count: jobs.report_progress(10 + 80 * count // max(total_rows, 1), 'Escribiendo Excel')
+        )
         
-        return send_file(temp_file.name, as_attachment=True, 
+        return send_file(output, as_attachment=True, 
                         download_name=f"607_{year}_{month:02d}.xlsx",
-                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+                        mimetype=dgii_excel.XLSX_MIMETYPE)
         
     except Exception as e:
         return jsonify({'error': f'Error generando Excel 607: {str(e)}'}), 400
 
 
 @bp.route('/export/607/pdf', methods=['POST'])
+@jobs.supports_async
 def export_607_pdf():
     """Export DGII 607 (Sales) to PDF format"""
     try:
@@ -911,6 +890,7 @@ def export_607_pdf():
         story.append(footer)
         
         # Build PDF
+        jobs.report_progress(50, 'Generando PDF')
         doc.build(story)
         temp_file.close()
         
@@ -1024,4 +1004,196 @@ def export_607_txt():
         
     except Exception as e:
         current_app.logger.error(f"Error generando TXT 607: {str(e)}")
-        return jsonify({'error': f'Error generando TXT 607: {str(e)}'}), 400
\ No newline at end of file
+        return jsonify({'error': f'Error generando TXT 607: {str(e)}'}), 400
+
+
+# MULTI-PERIOD FILING BATCH
+DGII_BATCH_MAX_MONTHS = 24
+DGII_BATCH_WORKERS = int(os.environ.get('DGII_BATCH_WORKERS', 4))
+DGII_BATCH_REPORTS = ('606', '607')
+DGII_BATCH_FORMATS = ('csv', 'txt', 'xlsx')
+
+
+def _parse_month(value):
+    year, month = map(int, str(value).split('-')[:2])
+    if not (1 <= month <= 12):
+        raise ValueError(value)
+    return year, month
+
+
+def _batch_months(start, end):
+    """Meses (año, mes) entre start y end, ambos incluidos"""
+    months = []
+    year, month = start
+    while (year, month) <= end:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def _batch_selection(data, key, allowed):
+    """Valores elegidos de una lista (JSON, repetidos en el formulario o separados por comas); todos si no se indica"""
+    values = data.getlist(key) if hasattr(data, 'getlist') else data.get(key)
+    if isinstance(values, str):
+        values = [values]
+    chosen = {part.strip().lower() for value in (values or allowed) for part in str(value).split(',')}
+    return [value for value in allowed if value in chosen]
+
+
+def _606_csv_row(record, company_rnc):
+    """Fila del CSV/TXT 606: como export_606, usa el RNC de la empresa si el proveedor no tiene uno válido"""
+    row = _606_excel_row(record)
+    supplier_rnc = record[0]
+    if not (supplier_rnc and len(supplier_rnc) in (9, 11)):
+        if company_rnc and len(company_rnc) >= 9:
+            row[0] = company_rnc[:9] if len(company_rnc) > 9 else company_rnc.ljust(9, '0')
+        else:
+            row[0] = '000000000'
+    return row
+
+
+def _pipe_csv(headers, rows):
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter='|')
+    writer.writerow(headers)
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def _dgii_month_files(app, engine, year, month, company_rnc, reports, formats):
+    """Genera los archivos 606/607 de un mes con una sola consulta por reporte (se ejecuta en un hilo del lote)"""
+    start_date = datetime(year, month, 1)
+    end_date = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    month_name = calendar.month_name[month]
+    files = []
+
+    with app.app_context(), engine.connect() as connection:
+        if '606' in reports:
+            purchases = connection.execute(
+                select(Supplier.rnc, Purchase.ncf_supplier, Purchase.created_at, Purchase.total_amount,
+                       Purchase.tax_amount)
+                .select_from(Purchase).join(Purchase.supplier)
+                .where(Purchase.created_at >= start_date, Purchase.created_at < end_date)
+                .order_by(Purchase.created_at, Purchase.id)
+            ).all()
+            if 'csv' in formats or 'txt' in formats:
+                # The 606 TXT is the same pipe-delimited content with another extension
+                content = _pipe_csv(DGII_606_HEADERS, [_606_csv_row(record, company_rnc) for record in purchases])
+                for extension in ('csv', 'txt'):
+                    if extension in formats:
+                        files.append(('606', extension, len(purchases), content.encode('utf-8')))
+            if 'xlsx' in formats:
+                with dgii_excel.write_report(f"Reporte DGII 606 - Compras - {month_name} {year}",
+                                             f"DGII 606 - {month_name} {year}", DGII_606_HEADERS,
+                                             (_606_excel_row(record) for record in purchases)) as workbook:
+                    files.append(('606', 'xlsx', len(purchases), workbook.read()))
+
+        if '607' in reports:
+            sales = connection.execute(
+                select(Sale.customer_rnc, Sale.ncf, Sale.created_at, Sale.total, Sale.tax_amount)
+                .where(Sale.created_at >= start_date, Sale.created_at < end_date, Sale.status == 'completed')
+                .order_by(Sale.created_at, Sale.id)
+            ).all()
+            rows = [_607_excel_row(record, company_rnc) for record in sales]
+            if 'csv' in formats:
+                files.append(('607', 'csv', len(rows), _pipe_csv(DGII_607_HEADERS, rows).encode('utf-8')))
+            if 'txt' in formats:
+                lines = ['|'.join('' if value is None else str(value) for value in row) for row in rows]
+                files.append(('607', 'txt', len(rows), '\n'.join(lines).encode('utf-8')))
+            if 'xlsx' in formats:
+                with dgii_excel.write_report(f"Reporte DGII 607 - Ventas - {month_name} {year}",
+                                             f"DGII 607 - {month_name} {year}", DGII_607_HEADERS, rows) as workbook:
+                    files.append(('607', 'xlsx', len(rows), workbook.read()))
+
+    return [
+        {
+            'name': f"{year}-{month:02d}/{report}_{year}_{month:02d}.{extension}",
+            'period': f"{year}-{month:02d}",
+            'report': report,
+            'format': extension,
+            'records': records,
+            'content': content
+        }
+        for report, extension, records, content in files
+    ]
+
+
+@bp.route('/export/batch', methods=['POST'])
+@jobs.supports_async
+def export_batch():
+    """Genera los 606/607 (CSV, TXT y Excel) de varios meses en un zip con manifiesto y sumas SHA-256"""
+    user = require_admin()
+    if not isinstance(user, User):
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    data = request.get_json(silent=True) or request.form or request.args
+    if not data or not data.get('start') or not data.get('end'):
+        return jsonify({'error': 'Período inicial y final son requeridos (start/end en formato YYYY-MM)'}), 400
+    
+    try:
+        start, end = _parse_month(data['start']), _parse_month(data['end'])
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Formato de período inválido. Use YYYY-MM'}), 400
+    if start > end:
+        return jsonify({'error': 'El período inicial debe ser anterior al final'}), 400
+    
+    months = _batch_months(start, end)
+    if len(months) > DGII_BATCH_MAX_MONTHS:
+        return jsonify({'error': f'Máximo {DGII_BATCH_MAX_MONTHS} meses por lote'}), 400
+    
+    reports = _batch_selection(data, 'reports', DGII_BATCH_REPORTS)
+    formats = _batch_selection(data, 'formats', DGII_BATCH_FORMATS)
+    if not reports or not formats:
+        return jsonify({'error': 'Seleccione al menos un reporte (606, 607) y un formato (csv, txt, xlsx)'}), 400
+    
+    try:
+        # One company snapshot for every month of the batch
+        company_info = get_company_info_for_receipt()
+        company_rnc = company_info.get('rnc', '').replace('-', '')  # Remove dashes for DGII format
+        
+        app = current_app._get_current_object()
+        engine = db_routing.read_engine()
+        generated = {}
+        
+        # One worker per month, bounded so the batch does not drain the connection pool
+        with ThreadPoolExecutor(max_workers=max(1, min(DGII_BATCH_WORKERS, len(months)))) as executor:
+            futures = {
+                executor.submit(_dgii_month_files, app, engine, year, month, company_rnc, reports, formats): (year, month)
+                for year, month in months
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                generated[futures[future]] = future.result()
+                jobs.report_progress(5 + 85 * done // len(months), f'{done} de {len(months)} meses generados')
+        
+        manifest = {
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'generated_by': user.username,
+            'start': f"{start[0]}-{start[1]:02d}",
+            'end': f"{end[0]}-{end[1]:02d}",
+            'company': {'name': company_info.get('name', ''), 'rnc': company_rnc},
+            'files': []
+        }
+        checksums = []
+        
+        bundle = tempfile.SpooledTemporaryFile(max_size=dgii_excel.SPOOL_MAX_SIZE, suffix='.zip')
+        with zipfile.ZipFile(bundle, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for period in months:
+                for entry in generated[period]:
+                    content = entry.pop('content')
+                    entry['bytes'] = len(content)
+                    entry['sha256'] = hashlib.sha256(content).hexdigest()
+                    archive.writestr(entry['name'], content)
+                    manifest['files'].append(entry)
+                    checksums.append(f"{entry['sha256']}  {entry['name']}")
+            archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+            archive.writestr('SHA256SUMS', '\n'.join(checksums) + '\n')
+        bundle.seek(0)
+        
+        filename = f"dgii_{manifest['start']}_{manifest['end']}.zip"
+        current_app.logger.info(f"Lote DGII generado: {filename} ({len(manifest['files'])} archivos)")
+        
+        return send_file(bundle, as_attachment=True, download_name=filename, mimetype='application/zip')
+        
+    except Exception as e:
+        current_app.logger.exception(f'Error generando lote DGII: {str(e)}')
+        return jsonify({'error': f'Error generando lote DGII: {str(e)}'}), 400
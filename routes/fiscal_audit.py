@@ -1,10 +1,15 @@
-from flask import Blueprint, render_template, jsonify, session, redirect, url_for
+from flask import Blueprint, render_template, jsonify, session, redirect, url_for, request
 import models
 from models import db
 from sqlalchemy import func
-from datetime import datetime
+from datetime import datetime, timedelta
+import tax_engine
+import db_routing
+import ncf_integrity
 
 bp = Blueprint('fiscal_audit', __name__, url_prefix='/fiscal-audit')
+# Audit reports only read: they run on the read replica when one is configured
+db_routing.read_only_blueprint(bp)
 
 
 def require_admin():
@@ -279,3 +284,89 @@ def api_products_without_taxes():
         'count': len(result),
         'products': result
     })
+
+
+@bp.route('/api/ncf-integrity')
+def api_ncf_integrity():
+    """API endpoint con los hallazgos abiertos del verificador de secuencias NCF"""
+    user = require_admin()
+    if not isinstance(user, models.User):
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    query = models.NCFIntegrityIssue.query
+    sequence_id = request.args.get('sequence_id', type=int)
+    if sequence_id:
+        query = query.filter_by(sequence_id=sequence_id)
+    kind = request.args.get('kind')
+    if kind:
+        query = query.filter_by(kind=kind)
+    
+    issues = query.order_by(models.NCFIntegrityIssue.sequence_id, models.NCFIntegrityIssue.number_from).limit(1000).all()
+    return jsonify({
+        'sequences': ncf_integrity.summary_by_sequence(),
+        'count': len(issues),
+        'issues': [ncf_integrity.issue_dict(issue) for issue in issues]
+    })
+
+
+@bp.route('/api/tax-consistency')
+def api_tax_consistency():
+    """
+    Recalcula con tax_engine (modo masivo) el ITBIS y total de las ventas
+    completadas de los últimos N días y lista las que no coinciden con lo guardado
+    """
+    user = require_admin()
+    if not isinstance(user, models.User):
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    since = datetime.utcnow() - timedelta(days=days)
+    
+    # One columnar query for every line; the engine groups by sale
+    rows = db.session.query(
+        models.SaleItem.sale_id,
+        models.SaleItem.total_price,
+        models.SaleItem.tax_rate,
+        models.SaleItem.is_tax_included
+    ).join(models.Sale).filter(
+        models.Sale.status == 'completed',
+        models.Sale.created_at >= since
+    ).all()
+    
+    recomputed = tax_engine.compute_bulk_totals(
+        [row[0] for row in rows],
+        [row[1] for row in rows],
+        [row[2] for row in rows],
+        [bool(row[3]) for row in rows]
+    )
+    
+    stored = db.session.query(
+        models.Sale.id, models.Sale.ncf, models.Sale.tax_amount, models.Sale.total
+    ).filter(
+        models.Sale.status == 'completed',
+        models.Sale.created_at >= since
+    ).all()
+    
+    mismatches = []
+    for sale_id, ncf, tax_amount, total in stored:
+        expected = recomputed.get(sale_id)
+        if expected is None:
+            continue
+        expected_tax = tax_engine.from_cents(expected.tax_cents)
+        expected_total = tax_engine.round_to_pesos(expected.total_cents)
+        if abs((tax_amount or 0) - expected_tax) > 0.01 or abs((total or 0) - expected_total) >= 1:
+            mismatches.append({
+                'sale_id': sale_id,
+                'ncf': ncf,
+                'stored_tax_amount': tax_amount,
+                'expected_tax_amount': expected_tax,
+                'stored_total': total,
+                'expected_total': expected_total
+            })
+    
+    return jsonify({
+        'days': days,
+        'sales_checked': len(recomputed),
+        'count': len(mismatches),
+        'mismatches': mismatches[:200]
+    })
@@ -3,6 +3,11 @@ import models
 from models import db
 from datetime import datetime
 import utils
+import tax_profiles
+import stock_control
+import low_stock
+import outbox
+import product_codes
 
 bp = Blueprint('inventory', __name__, url_prefix='/inventory')
 
@@ -200,19 +205,10 @@ def stock_alerts():
     if not isinstance(user, models.User):
         return user
     
-    # Get products with low stock (only inventariables)
-    low_stock_products = models.Product.query.filter(
-        models.Product.stock <= models.Product.min_stock,
-        models.Product.active == True,
-        models.Product.product_type == 'inventariable'
-    ).all()
-    
-    # Get products with very low stock (less than half of minimum, only inventariables)
-    critical_stock_products = models.Product.query.filter(
-        models.Product.stock <= (models.Product.min_stock / 2),
-        models.Product.active == True,
-        models.Product.product_type == 'inventariable'
-    ).all()
+    # Alert set maintained on every stock change (see low_stock); critical ones are also low
+    alerts = low_stock.alerts()
+    low_stock_products = [alert.product for alert in alerts]
+    critical_stock_products = [alert.product for alert in alerts if alert.level == low_stock.CRITICAL]
     
     return render_template('inventory/stock_alerts.html', 
                          low_stock_products=low_stock_products,
@@ -310,6 +306,9 @@ def create_product():
         db.session.add(product)
         db.session.flush()  # Get product ID before adding tax relationships
         
+        # Barcode, SKU and alternate codes (unique across all products)
+        product_codes.set_product_codes(product, data.get('barcode'), data.get('sku'), data.get('barcode_aliases'))
+        
         # Handle tax types - products MUST have at least one tax type (FISCAL COMPLIANCE)
         tax_type_ids = data.get('tax_type_ids', [])
         
@@ -328,6 +327,9 @@ def create_product():
                 product_tax.tax_type_id = tax_type_id
                 db.session.add(product_tax)
         
+        tax_profiles.products_changed([product.id])
+        product_codes.products_changed([product.id])
+        low_stock.refresh([product.id])
         db.session.commit()
         
         # Get tax types for response
@@ -346,6 +348,7 @@ def create_product():
                 'description': product.description,
                 'price': product.price,
                 'stock': product.stock,
+                **product_codes.product_codes_dict(product),
                 'tax_types': tax_types
             }
         })
@@ -426,6 +429,14 @@ def update_product(product_id):
             
         product.active = data.get('active', True)
         
+        # Codes not sent are kept as they are
+        product_codes.set_product_codes(
+            product,
+            data.get('barcode', product.barcode),
+            data.get('sku', product.sku),
+            data.get('barcode_aliases')
+        )
+        
         # Update tax types if provided
         if 'tax_type_ids' in data:
             tax_type_ids = list(set(data.get('tax_type_ids', [])))
@@ -447,7 +458,13 @@ def update_product(product_id):
                     product_tax.product_id = product.id
                     product_tax.tax_type_id = tax_type_id
                     db.session.add(product_tax)
+            
+            tax_profiles.products_changed([product.id])
         
+        # Codes or active flag may have changed: refresh the scanner map
+        product_codes.products_changed([product.id])
+        # Stock, minimum, type or active flag may have changed the alert level
+        low_stock.refresh([product.id])
         db.session.commit()
         
         # Get updated tax types for response
@@ -466,6 +483,7 @@ def update_product(product_id):
                 'description': product.description,
                 'price': product.price,
                 'stock': product.stock,
+                **product_codes.product_codes_dict(product),
                 'tax_types': tax_types
             }
         })
@@ -504,6 +522,7 @@ def get_product(product_id):
             'stock': product.stock,
             'min_stock': product.min_stock,
             'active': product.active,
+            **product_codes.product_codes_dict(product),
             'tax_types': tax_types
         }
     })
@@ -800,57 +819,60 @@ def create_purchase():
         }), 400
     
     try:
-        with db.session.begin():
-            # Create purchase record
-            purchase = models.Purchase()
-            purchase.supplier_id = data['supplier_id']
-            purchase.ncf_supplier = ncf_supplier
-            purchase.total_amount = calculated_total
-            purchase.tax_amount = calculated_tax
-            purchase.notes = utils.sanitize_input(data.get('notes', ''), 500)
+        # One transaction (require_admin() already opened it), committed once at the end
+        # Create purchase record
+        purchase = models.Purchase()
+        purchase.supplier_id = data['supplier_id']
+        purchase.ncf_supplier = ncf_supplier
+        purchase.total_amount = calculated_total
+        purchase.tax_amount = calculated_tax
+        purchase.notes = utils.sanitize_input(data.get('notes', ''), 500)
+        
+        db.session.add(purchase)
+        db.session.flush()  # Get purchase ID
+        
+        # Process each item
+        for item_info in items_to_process:
+            product = item_info['product']
+            quantity = item_info['quantity']
+            unit_cost = item_info['unit_cost']
+            total_cost = item_info['total_cost']
             
-            db.session.add(purchase)
-            db.session.flush()  # Get purchase ID
+            # Create purchase item
+            purchase_item = models.PurchaseItem()
+            purchase_item.purchase_id = purchase.id
+            purchase_item.product_id = product.id
+            purchase_item.quantity = quantity
+            purchase_item.unit_cost = unit_cost
+            purchase_item.total_cost = total_cost
             
-            # Process each item
-            for item_info in items_to_process:
-                product = item_info['product']
-                quantity = item_info['quantity']
-                unit_cost = item_info['unit_cost']
-                total_cost = item_info['total_cost']
-                
-                # Create purchase item
-                purchase_item = models.PurchaseItem()
-                purchase_item.purchase_id = purchase.id
-                purchase_item.product_id = product.id
-                purchase_item.quantity = quantity
-                purchase_item.unit_cost = unit_cost
-                purchase_item.total_cost = total_cost
-                
-                db.session.add(purchase_item)
-                
-                # Update product stock and cost
-                old_stock = product.stock
-                new_stock = old_stock + quantity
-                product.stock = new_stock
-                product.cost = unit_cost  # Update cost to latest purchase price
-                
-                # Create stock adjustment record for audit trail
-                stock_adjustment = models.StockAdjustment()
-                stock_adjustment.product_id = product.id
-                stock_adjustment.user_id = user.id
-                stock_adjustment.adjustment_type = 'purchase'
-                stock_adjustment.old_stock = old_stock
-                stock_adjustment.adjustment = quantity
-                stock_adjustment.new_stock = new_stock
-                stock_adjustment.reason = f'Compra #{purchase.id} - {supplier.name}'
-                stock_adjustment.reference_id = purchase.id
-                stock_adjustment.reference_type = 'purchase'
-                
-                db.session.add(stock_adjustment)
+            db.session.add(purchase_item)
             
-            # Final commit of all changes
-            db.session.commit()
+            # Update product stock and cost
+            new_stock = stock_control.increment_stock({product.id: quantity},
+                                                      inventariable_only=False)[product.id]
+            old_stock = new_stock - quantity
+            product.cost = unit_cost  # Update cost to latest purchase price
+            
+            # Create stock adjustment record for audit trail
+            stock_adjustment = models.StockAdjustment()
+            stock_adjustment.product_id = product.id
+            stock_adjustment.user_id = user.id
+            stock_adjustment.adjustment_type = 'purchase'
+            stock_adjustment.old_stock = old_stock
+            stock_adjustment.adjustment = quantity
+            stock_adjustment.new_stock = new_stock
+            stock_adjustment.reason = f'Compra #{purchase.id} - {supplier.name}'
+            stock_adjustment.reference_id = purchase.id
+            stock_adjustment.reference_type = 'purchase'
+            
+            db.session.add(stock_adjustment)
+        
+        # Purchase event for downstream consumers, in the same transaction
+        outbox.record_purchase(purchase, items_to_process, user.id)
+        
+        # Final commit of all changes
+        db.session.commit()
         
         return jsonify({
             'success': True,
@@ -899,30 +921,34 @@ def adjust_stock(product_id):
         if new_stock < 0:
             return jsonify({'error': f'El stock no puede ser negativo. Stock actual: {old_stock}, Ajuste: {adjustment}'}), 400
         
-        # Use transaction to ensure atomicity
-        with db.session.begin():
-            # Update product stock
-            product.stock = new_stock
-            
-            # Create stock adjustment record for audit trail
-            stock_adjustment = models.StockAdjustment()
-            stock_adjustment.product_id = product_id
-            stock_adjustment.user_id = user.id
-            stock_adjustment.adjustment_type = adjustment_type
-            stock_adjustment.old_stock = old_stock
-            stock_adjustment.adjustment = adjustment
-            stock_adjustment.new_stock = new_stock
-            stock_adjustment.reason = reason
-            stock_adjustment.reference_id = reference_id
-            stock_adjustment.reference_type = reference_type
-            
-            db.session.add(stock_adjustment)
-            
-            # Update product minimum stock alert if stock was very low and now restored
-            if old_stock <= product.min_stock and new_stock > product.min_stock:
-                flash(f'Stock de {product.name} restaurado por encima del mínimo', 'success')
-            elif new_stock <= product.min_stock and old_stock > product.min_stock:
-                flash(f'¡Alerta! Stock de {product.name} está por debajo del mínimo ({product.min_stock})', 'warning')
+        # One transaction (require_admin() already opened it), committed explicitly
+        # Update product stock
+        product.stock = new_stock
+        
+        # Create stock adjustment record for audit trail
+        stock_adjustment = models.StockAdjustment()
+        stock_adjustment.product_id = product_id
+        stock_adjustment.user_id = user.id
+        stock_adjustment.adjustment_type = adjustment_type
+        stock_adjustment.old_stock = old_stock
+        stock_adjustment.adjustment = adjustment
+        stock_adjustment.new_stock = new_stock
+        stock_adjustment.reason = reason
+        stock_adjustment.reference_id = reference_id
+        stock_adjustment.reference_type = reference_type
+        
+        db.session.add(stock_adjustment)
+        db.session.flush()
+        outbox.record_stock_adjustment(stock_adjustment)
+        low_stock.refresh([product_id])
+        
+        # Update product minimum stock alert if stock was very low and now restored
+        if old_stock <= product.min_stock and new_stock > product.min_stock:
+            flash(f'Stock de {product.name} restaurado por encima del mínimo', 'success')
+        elif new_stock <= product.min_stock and old_stock > product.min_stock:
+            flash(f'¡Alerta! Stock de {product.name} está por debajo del mínimo ({product.min_stock})', 'warning')
+        
+        db.session.commit()
         
         return jsonify({
             'success': True,
@@ -986,35 +1012,23 @@ def stock_alerts_api():
     if not isinstance(user, models.User):
         return jsonify({'error': 'No autorizado'}), 401
     
-    # Get products with low stock (only inventariables)
-    low_stock_products = models.Product.query.filter(
-        models.Product.stock <= models.Product.min_stock,
-        models.Product.active == True,
-        models.Product.product_type == 'inventariable'
-    ).all()
-    
-    # Get products with critical stock (less than half of minimum, only inventariables)
-    critical_stock_products = models.Product.query.filter(
-        models.Product.stock <= (models.Product.min_stock / 2),
-        models.Product.active == True,
-        models.Product.product_type == 'inventariable'
-    ).all()
-    
-    low_stock_list = []
-    for product in low_stock_products:
-        low_stock_list.append({
-            'id': product.id,
-            'name': product.name,
-            'current_stock': product.stock,
-            'min_stock': product.min_stock,
-            'category': product.category.name if product.category else None,
-            'status': 'critical' if product.stock <= (product.min_stock / 2) else 'low'
-        })
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'Cursor inválido'}), 400
+    
+    cursor, full, changes = low_stock.changed_since(since)
+    alerts = low_stock.alerts()
+    critical_count = sum(1 for alert in alerts if alert.level == low_stock.CRITICAL)
     
     return jsonify({
         'success': True,
-        'total_alerts': len(low_stock_list),
-        'critical_count': len(critical_stock_products),
-        'low_count': len(low_stock_products) - len(critical_stock_products),
-        'products': low_stock_list
+        'total_alerts': len(alerts),
+        'critical_count': critical_count,
+        'low_count': len(alerts) - critical_count,
+        'products': [low_stock.alert_dict(alert) for alert in alerts],
+        # Threshold crossings since the client's cursor; full=True means replace the whole list
+        'cursor': cursor,
+        'full': full,
+        'changes': [low_stock.event_dict(event) for event in changes]
     })
\ No newline at end of file
@@ -0,0 +1,75 @@
+from flask import Blueprint, jsonify, session, request
+import models
+from models import db
+import kitchen
+
+bp = Blueprint('kitchen', __name__, url_prefix='/api/kitchen')
+
+
+def _require_login():
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    return None
+
+
+@bp.route('/tickets')
+def list_tickets():
+    """
+    Tickets de cocina cambiados desde un cursor
+
+    Query: since=<cursor de la respuesta anterior> (0 o ausente: todos los activos),
+           station=<estación> (opcional)
+    La pantalla aplica los tickets recibidos sobre los que ya tiene: los que
+    llegan con estado distinto de 'active' se quitan.
+    """
+    error = _require_login()
+    if error:
+        return error
+
+    since = request.args.get('since', 0, type=int)
+    station = request.args.get('station') or None
+    cursor, full, tickets = kitchen.changed_since(since, station)
+    return jsonify({
+        'cursor': cursor,
+        'full': full,
+        'tickets': [kitchen.ticket_dict(ticket) for ticket in tickets]
+    })
+
+
+def _ticket_action(ticket_id, action):
+    error = _require_login()
+    if error:
+        return error
+
+    ticket = db.session.query(models.KitchenTicket).filter_by(id=ticket_id).with_for_update().first()
+    if ticket is None:
+        return jsonify({'error': 'Ticket no encontrado'}), 404
+
+    try:
+        action(ticket)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error interno: {str(e)}'}), 500
+
+    return jsonify({
+        'success': True,
+        'cursor': ticket.revision,
+        'ticket': kitchen.ticket_dict(ticket),
+        'order_status': ticket.sale.order_status.value if ticket.sale.order_status else None
+    })
+
+
+@bp.route('/tickets/<int:ticket_id>/bump', methods=['POST'])
+def bump_ticket(ticket_id):
+    """Despachar un ticket (sale de la pantalla)"""
+    return _ticket_action(ticket_id, kitchen.bump)
+
+
+@bp.route('/tickets/<int:ticket_id>/recall', methods=['POST'])
+def recall_ticket(ticket_id):
+    """Volver a mostrar un ticket despachado"""
+    return _ticket_action(ticket_id, kitchen.recall)
@@ -0,0 +1,150 @@
+"""
+Agregados diarios de ventas completadas
+Mantiene SalesDailyAggregate al finalizar/cancelar ventas para que las
+estadísticas del listado de facturas no requieran COUNT(*)/SUM() sobre sales
+"""
+import logging
+from datetime import date, datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+import models
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+def _get_or_create_aggregate(day: date, cash_register_id: Optional[int]) -> models.SalesDailyAggregate:
+    """Obtiene (con bloqueo) o crea la fila de agregado para el día y caja indicados"""
+    aggregate = db.session.query(models.SalesDailyAggregate).filter_by(
+        day=day,
+        cash_register_id=cash_register_id
+    ).with_for_update().first()
+
+    if aggregate:
+        return aggregate
+
+    # Savepoint: si otra transacción insertó la misma fila, reintentar la lectura
+    try:
+        with db.session.begin_nested():
+            aggregate = models.SalesDailyAggregate()
+            aggregate.day = day
+            aggregate.cash_register_id = cash_register_id
+            aggregate.sales_count = 0
+            aggregate.total_amount = 0.0
+            db.session.add(aggregate)
+    except IntegrityError:
+        aggregate = db.session.query(models.SalesDailyAggregate).filter_by(
+            day=day,
+            cash_register_id=cash_register_id
+        ).with_for_update().first()
+
+    return aggregate
+
+
+def _apply_delta(sale: models.Sale, count_delta: int, amount_delta: float):
+    created_at = sale.created_at or datetime.utcnow()
+    aggregate = _get_or_create_aggregate(created_at.date(), sale.cash_register_id)
+    aggregate.sales_count = (aggregate.sales_count or 0) + count_delta
+    aggregate.total_amount = round((aggregate.total_amount or 0.0) + amount_delta, 2)
+
+
+def record_completed_sale(sale: models.Sale):
+    """
+    Suma una venta recién completada al agregado de su día
+
+    Debe llamarse dentro de la misma transacción que cambia sale.status a 'completed'.
+    """
+    _apply_delta(sale, 1, float(sale.total or 0))
+
+
+def record_cancelled_sale(sale: models.Sale):
+    """
+    Resta una venta completada que pasa a 'cancelled' del agregado de su día
+
+    Debe llamarse dentro de la misma transacción que cancela la venta.
+    """
+    _apply_delta(sale, -1, -float(sale.total or 0))
+
+
+def get_completed_totals(date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                         cash_register_id: Optional[int] = None) -> Tuple[int, float]:
+    """
+    Cantidad y monto de ventas completadas leídos de los agregados diarios
+
+    El costo es proporcional al número de días del rango, no al número de ventas.
+
+    Args:
+        date_from: Inicio del rango (se toma el día completo)
+        date_to: Fin del rango (se toma el día completo)
+        cash_register_id: Limitar a una caja registradora
+
+    Returns:
+        Tuple (total_sales, total_amount)
+    """
+    query = db.session.query(
+        func.coalesce(func.sum(models.SalesDailyAggregate.sales_count), 0),
+        func.coalesce(func.sum(models.SalesDailyAggregate.total_amount), 0.0)
+    )
+
+    if date_from:
+        query = query.filter(models.SalesDailyAggregate.day >= date_from.date())
+    if date_to:
+        query = query.filter(models.SalesDailyAggregate.day <= date_to.date())
+    if cash_register_id is not None:
+        query = query.filter(models.SalesDailyAggregate.cash_register_id == cash_register_id)
+
+    total_sales, total_amount = query.one()
+    return int(total_sales or 0), float(total_amount or 0.0)
+
+
+def rebuild_daily_aggregates(date_from: Optional[date] = None, date_to: Optional[date] = None) -> int:
+    """
+    Recalcula los agregados diarios desde la tabla sales
+
+    Se usa para la carga inicial y para reconciliar después de correcciones manuales.
+
+    Args:
+        date_from: Primer día a recalcular (None = desde el inicio)
+        date_to: Último día a recalcular (None = hasta hoy)
+
+    Returns:
+        int: Número de filas de agregado generadas
+    """
+    sale_day = func.date(models.Sale.created_at)
+
+    delete_query = db.session.query(models.SalesDailyAggregate)
+    if date_from:
+        delete_query = delete_query.filter(models.SalesDailyAggregate.day >= date_from)
+    if date_to:
+        delete_query = delete_query.filter(models.SalesDailyAggregate.day <= date_to)
+    delete_query.delete(synchronize_session=False)
+
+    rows_query = db.session.query(
+        sale_day.label('day'),
+        models.Sale.cash_register_id,
+        func.count(models.Sale.id),
+        func.coalesce(func.sum(models.Sale.total), 0.0)
+    ).filter(models.Sale.status == 'completed')
+
+    if date_from:
+        rows_query = rows_query.filter(models.Sale.created_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        rows_query = rows_query.filter(models.Sale.created_at <= datetime.combine(date_to, datetime.max.time()))
+
+    rows = rows_query.group_by(sale_day, models.Sale.cash_register_id).all()
+
+    for day, cash_register_id, sales_count, total_amount in rows:
+        aggregate = models.SalesDailyAggregate()
+        # SQLite devuelve func.date() como texto
+        aggregate.day = date.fromisoformat(day) if isinstance(day, str) else day
+        aggregate.cash_register_id = cash_register_id
+        aggregate.sales_count = int(sales_count)
+        aggregate.total_amount = round(float(total_amount), 2)
+        db.session.add(aggregate)
+
+    db.session.commit()
+    logger.info(f"Agregados diarios de ventas reconstruidos: {len(rows)} filas")
+    return len(rows)
@@ -69,6 +69,28 @@ function getCsrfToken() {
     return null;
 }
 
+// Network retries for mutating requests (the Idempotency-Key makes them safe)
+const API_NETWORK_RETRIES = 2;
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    // RFC 4122 version 4 UUID, so the key is also accepted where a UUID is required
+    const bytes = new Uint8Array(16);
+    if (window.crypto && crypto.getRandomValues) {
+        crypto.getRandomValues(bytes);
+    } else {
+        for (let i = 0; i < bytes.length; i++) {
+            bytes[i] = Math.floor(Math.random() * 256);
+        }
+    }
+    bytes[6] = (bytes[6] & 0x0f) | 0x40;
+    bytes[8] = (bytes[8] & 0x3f) | 0x80;
+    const hex = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+    return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+}
+
 // Centralized API request function with CSRF and proper error handling
 async function apiRequest(url, options = {}) {
     const defaultOptions = {
@@ -85,6 +107,8 @@ async function apiRequest(url, options = {}) {
         if (csrfToken) {
             defaultOptions.headers['X-CSRFToken'] = csrfToken;
         }
+        // Same key on every retry: the server replays the first response instead of repeating the action
+        defaultOptions.headers['Idempotency-Key'] = newIdempotencyKey();
     }
     
     // Merge options
@@ -98,7 +122,25 @@ async function apiRequest(url, options = {}) {
     };
     
     try {
-        const response = await fetch(url, finalOptions);
+        const isMutating = finalOptions.method && finalOptions.method !== 'GET';
+        let response;
+        for (let attempt = 0; ; attempt++) {
+            try {
+                response = await fetch(url, finalOptions);
+            } catch (networkError) {
+                // fetch only rejects on network failures (flaky Wi-Fi); HTTP errors are handled below
+                if (!isMutating || attempt >= API_NETWORK_RETRIES) {
+                    throw networkError;
+                }
+                await new Promise(resolve => setTimeout(resolve, 500 * (attempt + 1)));
+                continue;
+            }
+            // 503: the server lost its database connection and reset the pool; a retry gets a fresh one
+            if (response.status !== 503 || attempt >= API_NETWORK_RETRIES) {
+                break;
+            }
+            await new Promise(resolve => setTimeout(resolve, 500 * (attempt + 1)));
+        }
         
         // Try to parse JSON response
         let data = {};
@@ -1,18 +1,40 @@
 // Service Worker para Four One POS - Enhanced Offline Support
-const CACHE_VERSION = 'v4-tax-fix';
+
+// Precache list and version generated by `python static_assets.py` from the asset manifest
+try {
+  importScripts('/static/dist/precache-manifest.js');
+} catch (error) {
+  console.log('[SW] No asset manifest, using unversioned assets');
+}
+
+const ASSET_MANIFEST = self.__ASSET_MANIFEST || {
+  version: 'dev',
+  precache: [
+    '/static/css/pos-style.css',
+    '/static/vendor/bootstrap/bootstrap.min.css',
+    '/static/vendor/bootstrap-icons/bootstrap-icons.min.css',
+    '/static/vendor/bootstrap/popper.min.js',
+    '/static/vendor/bootstrap/bootstrap.min.js'
+  ]
+};
+
+const CACHE_VERSION = `v5-${ASSET_MANIFEST.version}`;
 const STATIC_CACHE = `fourone-static-${CACHE_VERSION}`;
 const API_CACHE = `fourone-api-${CACHE_VERSION}`;
 const OFFLINE_QUEUE = `fourone-queue-${CACHE_VERSION}`;
 
+// Offline sales are replayed in batches through /api/sales/offline-replay
+const OFFLINE_REPLAY_URL = '/api/sales/offline-replay';
+const OFFLINE_SALES_BATCH_SIZE = 25;  // server accepts up to 50 per batch
+let replayCsrfToken = null;
+let flushingOfflineSales = false;
+
 // URLs to precache
 const staticAssets = [
   '/static/manifest.json',
-  '/static/css/pos-style.css',
   '/static/css/logo.png',
   '/static/favicon.ico',
-  'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
-  'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css',
-  'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js'
+  ...ASSET_MANIFEST.precache
 ];
 
 // API endpoints to cache
@@ -26,7 +48,7 @@ const apiEndpoints = [
 
 // Install Service Worker
 self.addEventListener('install', function(event) {
-  console.log('[SW] Installing service worker v4-tax-fix');
+  console.log('[SW] Installing service worker', CACHE_VERSION);
   self.skipWaiting();
   
   event.waitUntil(
@@ -44,7 +66,7 @@ self.addEventListener('install', function(event) {
 
 // Activate Service Worker
 self.addEventListener('activate', function(event) {
-  console.log('[SW] Activating service worker v4-tax-fix');
+  console.log('[SW] Activating service worker', CACHE_VERSION);
   self.clients.claim();
   
   event.waitUntil(
@@ -179,6 +201,18 @@ async function handleApiRequest(request) {
       }
     }
     
+    // Sale checkout steps reference server ids that don't exist offline:
+    // the POS queues a complete sale envelope instead (see QUEUE_OFFLINE_SALE)
+    if (isSaleFlowRequest(url)) {
+      return new Response(JSON.stringify({
+        error: 'Sin conexión',
+        offline: true
+      }), {
+        headers: { 'Content-Type': 'application/json' },
+        status: 503
+      });
+    }
+    
     // For POST/PUT/DELETE, queue the request
     if (['POST', 'PUT', 'DELETE'].includes(request.method)) {
       await queueOfflineRequest(request);
@@ -237,11 +271,11 @@ async function processOfflineQueue() {
   try {
     const db = await openIndexedDB();
     const tx = db.transaction(['requests'], 'readonly');
-    const requests = await tx.objectStore('requests').getAll();
-    
-    if (requests.length === 0) return;
+    const requests = await idbRequest(tx.objectStore('requests').getAll());
     
-    console.log(`[SW] Processing ${requests.length} queued requests`);
+    if (requests.length > 0) {
+      console.log(`[SW] Processing ${requests.length} queued requests`);
+    }
     
     for (const requestData of requests) {
       try {
@@ -266,12 +300,106 @@ async function processOfflineQueue() {
   } catch (error) {
     console.error('[SW] Error processing offline queue:', error);
   }
+  
+  await flushOfflineSales();
+}
+
+// Queue a complete sale captured while offline (keyed by its client UUID)
+async function queueOfflineSale(envelope) {
+  const db = await openIndexedDB();
+  const sale = Object.assign({}, envelope, {
+    captured_at: envelope.captured_at || new Date().toISOString(),
+    sync_status: 'pending'
+  });
+  
+  await idbRequest(db.transaction(['sales'], 'readwrite').objectStore('sales').put(sale));
+  console.log('[SW] Queued offline sale:', sale.client_uuid);
+  broadcastToClients('offline-sale-queued', { client_uuid: sale.client_uuid });
+  return sale;
+}
+
+// Replay queued sales in capture order, one batch at a time
+async function flushOfflineSales() {
+  if (flushingOfflineSales) return;
+  flushingOfflineSales = true;
+  
+  try {
+    const db = await openIndexedDB();
+    const queued = await idbRequest(db.transaction(['sales'], 'readonly').objectStore('sales').getAll());
+    const pending = queued
+      .filter(sale => sale.sync_status === 'pending')
+      .sort((a, b) => a.captured_at.localeCompare(b.captured_at));
+    
+    if (pending.length === 0) return;
+    console.log(`[SW] Replaying ${pending.length} offline sales`);
+    
+    for (let start = 0; start < pending.length; start += OFFLINE_SALES_BATCH_SIZE) {
+      const batch = pending.slice(start, start + OFFLINE_SALES_BATCH_SIZE);
+      const csrfToken = replayCsrfToken || batch[batch.length - 1].csrf_token;
+      
+      let response;
+      try {
+        response = await fetch(OFFLINE_REPLAY_URL, {
+          method: 'POST',
+          credentials: 'same-origin',
+          headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrfToken || ''
+          },
+          body: JSON.stringify({ sales: batch.map(toReplayEnvelope) })
+        });
+      } catch (error) {
+        // Still offline: keep the rest queued for the next sync
+        console.log('[SW] Offline sale replay interrupted:', error);
+        return;
+      }
+      
+      if (!response.ok) {
+        // Auth/CSRF/batch-level failure: retry on the next sync with a fresh token
+        console.log('[SW] Offline sale replay rejected:', response.status);
+        broadcastToClients('offline-sale-replay-rejected', { status: response.status });
+        return;
+      }
+      
+      const payload = await response.json();
+      const store = db.transaction(['sales'], 'readwrite').objectStore('sales');
+      for (const result of payload.results) {
+        if (result.status === 'created' || result.status === 'duplicate') {
+          store.delete(result.client_uuid);
+          broadcastToClients('offline-sale-synced', result);
+        } else {
+          // Rejected by business rules (stock, NCF...): keep it for the cashier to review
+          const sale = batch.find(item => item.client_uuid === result.client_uuid);
+          if (sale) {
+            store.put(Object.assign({}, sale, { sync_status: 'failed', sync_error: result.error }));
+          }
+          broadcastToClients('offline-sale-failed', result);
+        }
+      }
+    }
+  } catch (error) {
+    console.error('[SW] Error replaying offline sales:', error);
+  } finally {
+    flushingOfflineSales = false;
+  }
+}
+
+function toReplayEnvelope(sale) {
+  const { csrf_token, sync_status, sync_error, ...envelope } = sale;
+  return envelope;
+}
+
+function idbRequest(request) {
+  return new Promise((resolve, reject) => {
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
 }
 
 // Open IndexedDB
 function openIndexedDB() {
   return new Promise((resolve, reject) => {
-    const request = indexedDB.open('FourOnePOSOffline', 1);
+    const request = indexedDB.open('FourOnePOSOffline', 2);
     
     request.onerror = () => reject(request.error);
     request.onsuccess = () => resolve(request.result);
@@ -282,6 +410,9 @@ function openIndexedDB() {
         const store = db.createObjectStore('requests', { keyPath: 'timestamp' });
         store.createIndex('url', 'url', { unique: false });
       }
+      if (!db.objectStoreNames.contains('sales')) {
+        db.createObjectStore('sales', { keyPath: 'client_uuid' });
+      }
     };
   });
 }
@@ -317,6 +448,10 @@ function isApiRequest(url) {
   return url.includes('/api/');
 }
 
+function isSaleFlowRequest(url) {
+  return url.pathname === '/api/sales' || url.pathname.startsWith('/api/sales/');
+}
+
 // Background sync event
 self.addEventListener('sync', function(event) {
   if (event.tag === 'offline-sync') {
@@ -327,7 +462,16 @@ self.addEventListener('sync', function(event) {
 // Message handler for communication with main thread
 self.addEventListener('message', function(event) {
   if (event.data && event.data.type === 'FORCE_SYNC') {
+    if (event.data.csrf_token) replayCsrfToken = event.data.csrf_token;
     processOfflineQueue();
+  } else if (event.data && event.data.type === 'QUEUE_OFFLINE_SALE') {
+    if (event.data.sale.csrf_token) replayCsrfToken = event.data.sale.csrf_token;
+    queueOfflineSale(event.data.sale).then(sale => {
+      if (event.ports[0]) event.ports[0].postMessage({ success: true, client_uuid: sale.client_uuid });
+    }).catch(error => {
+      console.error('[SW] Failed to queue offline sale:', error);
+      if (event.ports[0]) event.ports[0].postMessage({ success: false });
+    });
   } else if (event.data && event.data.type === 'CACHE_API_DATA') {
     // Pre-cache API data when requested
     const promises = apiEndpoints.map(endpoint => {
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Pipeline de archivos estáticos con huella de contenido
+Copia static/css, static/js, static/icons y static/vendor a static/dist con el
+hash del contenido en el nombre (pos-style.css -> pos-style.3f2a9c1b0d4e.css)
+y escribe el manifiesto que usa url_for('static', ...) para servir esas
+versiones con caché inmutable de un año. El mismo manifiesto genera la lista
+de precaché del service worker.
+
+Uso (paso de build, también en el Dockerfile):
+    python static_assets.py
+"""
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+import shutil
+import sys
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Carpetas de static/ que se versionan
+ASSET_DIRS = ('css', 'js', 'icons', 'vendor')
+DIST_DIR = 'dist'
+MANIFEST_FILENAME = 'asset-manifest.json'
+PRECACHE_FILENAME = 'precache-manifest.js'
+
+# Archivos que no se publican (mapas de depuración, fuentes originales)
+SKIPPED_SUFFIXES = ('.map',)
+SKIPPED_FILES = ('logo-source.png',)
+
+# Extensiones que el service worker precachea (las imágenes grandes se cachean al usarse)
+PRECACHE_SUFFIXES = ('.css', '.js', '.woff2')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+CSS_URL_PATTERN = re.compile(r"url\(\s*(['\"]?)([^'\")]+)\1\s*\)")
+
+
+def _content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def _fingerprinted_name(logical_path: str, content: bytes) -> str:
+    directory, filename = posixpath.split(logical_path)
+    stem, suffix = posixpath.splitext(filename)
+    return posixpath.join(DIST_DIR, directory, f"{stem}.{_content_hash(content)}{suffix}")
+
+
+def _rewrite_css_urls(logical_path: str, content: bytes, assets: Dict[str, str]) -> bytes:
+    """Apunta los url(...) relativos de un CSS a las versiones con huella de sus recursos"""
+    css_dir = posixpath.dirname(logical_path)
+    dist_dir = posixpath.join(DIST_DIR, css_dir)
+
+    def replace(match):
+        quote, url = match.group(1), match.group(2)
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        path = re.split(r'[?#]', url, maxsplit=1)[0]
+        target = posixpath.normpath(posixpath.join(css_dir, path))
+        if target not in assets:
+            return match.group(0)
+        return f"url({quote}{posixpath.relpath(assets[target], dist_dir)}{quote})"
+
+    return CSS_URL_PATTERN.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def build_manifest(static_folder: str) -> Dict[str, object]:
+    """
+    Genera static/dist con los archivos versionados, el manifiesto y la lista de precaché
+
+    Args:
+        static_folder: Ruta de la carpeta static/
+
+    Returns:
+        El manifiesto: {'version': hash global, 'assets': {ruta lógica: ruta con huella}}
+    """
+    dist_path = os.path.join(static_folder, DIST_DIR)
+    if os.path.isdir(dist_path):
+        shutil.rmtree(dist_path)
+
+    sources = {}
+    for asset_dir in ASSET_DIRS:
+        for root, _, files in os.walk(os.path.join(static_folder, asset_dir)):
+            for filename in files:
+                if filename.endswith(SKIPPED_SUFFIXES) or filename in SKIPPED_FILES:
+                    continue
+                full_path = os.path.join(root, filename)
+                logical_path = os.path.relpath(full_path, static_folder).replace(os.sep, '/')
+                with open(full_path, 'rb') as f:
+                    sources[logical_path] = f.read()
+
+    # CSS last: its url(...) references must point at already fingerprinted files
+    assets = {}
+    ordered = sorted(sources, key=lambda path: (path.endswith('.css'), path))
+    for logical_path in ordered:
+        content = sources[logical_path]
+        if logical_path.endswith('.css'):
+            content = _rewrite_css_urls(logical_path, content, assets)
+        fingerprinted = _fingerprinted_name(logical_path, content)
+        assets[logical_path] = fingerprinted
+
+        target = os.path.join(static_folder, fingerprinted)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(content)
+
+    version = _content_hash(json.dumps(assets, sort_keys=True).encode('utf-8'))
+    manifest = {'version': version, 'assets': dict(sorted(assets.items()))}
+
+    with open(os.path.join(dist_path, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    precache = sorted(
+        f"/static/{path}" for path in assets.values() if path.endswith(PRECACHE_SUFFIXES)
+    )
+    with open(os.path.join(dist_path, PRECACHE_FILENAME), 'w') as f:
+        f.write("// Generado por static_assets.py - no editar\n")
+        f.write("self.__ASSET_MANIFEST = ")
+        json.dump({'version': version, 'precache': precache}, f, indent=2)
+        f.write(";\n")
+
+    return manifest
+
+
+def load_manifest(static_folder: str) -> Optional[Dict[str, object]]:
+    """Lee static/dist/asset-manifest.json; None si no se ha ejecutado el build"""
+    path = os.path.join(static_folder, DIST_DIR, MANIFEST_FILENAME)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"Manifiesto de estáticos inválido en {path}: {e}")
+        return None
+
+
+def is_fingerprinted(filename: str) -> bool:
+    return filename.startswith(DIST_DIR + '/')
+
+
+def init_app(app):
+    """
+    Reescribe url_for('static', filename=...) a la versión con huella del manifiesto
+
+    Se activa con STATIC_FINGERPRINT (por defecto en producción) y solo si el
+    manifiesto existe; sin build los templates siguen usando los archivos originales.
+    """
+    app.config.setdefault('STATIC_FINGERPRINT', os.environ.get("ENVIRONMENT") == "production")
+    app.extensions['static_assets'] = {}
+
+    if not app.config['STATIC_FINGERPRINT']:
+        return
+
+    manifest = load_manifest(app.static_folder)
+    if not manifest:
+        logger.warning("STATIC_FINGERPRINT activo pero no hay manifiesto: ejecute python static_assets.py")
+        return
+
+    assets = manifest['assets']
+    app.extensions['static_assets'] = assets
+
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = assets.get(values['filename'], values['filename'])
+
+
+def main(argv) -> int:
+    static_folder = argv[0] if argv else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    manifest = build_manifest(static_folder)
+    print(f"✅ {len(manifest['assets'])} archivos versionados en {os.path.join(static_folder, DIST_DIR)} "
+          f"(versión {manifest['version']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
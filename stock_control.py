@@ -0,0 +1,155 @@
+"""
+Movimientos de stock atómicos
+Descuenta o repone stock con una sola sentencia UPDATE condicional por lote,
+sin SELECT ... FOR UPDATE previo:
+
+    UPDATE products SET stock = stock - CASE id WHEN :id THEN :q ... END
+    WHERE id IN (...) AND (product_type = 'consumible' OR stock >= <cantidad>)
+    RETURNING id, stock
+
+La condición se evalúa sobre la fila vigente en el momento de escribirla, así
+que dos cajas vendiendo el mismo producto no pueden dejar el stock negativo y
+ninguna tiene que esperar a que la otra termine de validar. Si algún producto
+no alcanza, se lanza InsufficientStockError y el llamador debe hacer rollback
+de la transacción (los demás descuentos del lote se deshacen con ella).
+"""
+from typing import Dict, Mapping
+
+from sqlalchemy import case, update
+
+import models
+import low_stock
+from models import db
+
+
+class InsufficientStockError(Exception):
+    """Un producto inventariable no tiene stock suficiente para el descuento pedido"""
+
+    def __init__(self, product_id: int, product_name: str, available: int, required: int):
+        self.product_id = product_id
+        self.product_name = product_name
+        self.available = available
+        self.required = required
+        super().__init__(f'Stock insuficiente de {product_name}. Disponible: {available}, requerido: {required}')
+
+    @property
+    def shortage(self) -> int:
+        return self.required - self.available
+
+
+def _quantity_case(quantities: Mapping[int, int]):
+    return case(dict(quantities), value=models.Product.id, else_=0)
+
+
+def _returning_supported() -> bool:
+    return db.engine.dialect.update_returning
+
+
+def _read_stock(product_ids) -> Dict[int, int]:
+    return dict(db.session.query(models.Product.id, models.Product.stock).filter(
+        models.Product.id.in_(list(product_ids))
+    ).all())
+
+
+def _execute(statement) -> Dict[int, int]:
+    """Ejecuta el UPDATE con RETURNING y devuelve {product_id: stock nuevo} de las filas modificadas"""
+    result = db.session.execute(
+        statement.returning(models.Product.id, models.Product.stock),
+        execution_options={'synchronize_session': 'fetch'}
+    )
+    return {product_id: stock for product_id, stock in result.all()}
+
+
+def _decrement_each(quantities: Mapping[int, int]) -> Dict[int, int]:
+    """Sin RETURNING: una sentencia condicional por producto y rowcount para saber cuál falló"""
+    updated = []
+    for product_id, quantity in quantities.items():
+        result = db.session.execute(
+            update(models.Product).where(
+                models.Product.id == product_id,
+                (models.Product.product_type == 'consumible') | (models.Product.stock >= quantity)
+            ).values(stock=models.Product.stock - quantity),
+            execution_options={'synchronize_session': 'fetch'}
+        )
+        if result.rowcount:
+            updated.append(product_id)
+    # The updated rows stay locked by this transaction, so reading them back is consistent
+    return _read_stock(updated) if updated else {}
+
+
+def _raise_insufficient(product_ids, quantities: Mapping[int, int]):
+    products = db.session.query(models.Product.id, models.Product.name, models.Product.stock).filter(
+        models.Product.id.in_(list(product_ids))
+    ).order_by(models.Product.id).all()
+    for product_id, name, stock in products:
+        raise InsufficientStockError(product_id, name, stock, quantities[product_id])
+
+
+def decrement_stock(quantities: Mapping[int, int]) -> Dict[int, int]:
+    """
+    Descuenta stock de varios productos en una sola sentencia
+
+    Los productos consumibles se descuentan siempre; los inventariables solo si
+    su stock alcanza. Los IDs inexistentes se ignoran.
+
+    Args:
+        quantities: {product_id: cantidad a descontar}
+
+    Returns:
+        {product_id: stock resultante}
+
+    Raises:
+        InsufficientStockError: Si algún producto inventariable no alcanza
+            (el llamador debe hacer rollback)
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+    if not quantities:
+        return {}
+
+    if _returning_supported():
+        quantity = _quantity_case(quantities)
+        new_stock = _execute(update(models.Product).where(
+            models.Product.id.in_(list(quantities)),
+            (models.Product.product_type == 'consumible') | (models.Product.stock >= quantity)
+        ).values(stock=models.Product.stock - quantity))
+    else:
+        new_stock = _decrement_each(quantities)
+
+    not_updated = [product_id for product_id in quantities if product_id not in new_stock]
+    if not_updated:
+        # Missing products are ignored; an existing one means there was not enough stock
+        _raise_insufficient(not_updated, quantities)
+    low_stock.refresh(new_stock)
+    return new_stock
+
+
+def increment_stock(quantities: Mapping[int, int], inventariable_only: bool = True) -> Dict[int, int]:
+    """
+    Repone stock (cancelaciones, notas de crédito, compras) sin leer-modificar-escribir
+
+    Args:
+        quantities: {product_id: cantidad a sumar}
+        inventariable_only: Solo reponer productos inventariables
+
+    Returns:
+        {product_id: stock resultante} de los productos modificados
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+    if not quantities:
+        return {}
+
+    conditions = [models.Product.id.in_(list(quantities))]
+    if inventariable_only:
+        conditions.append(models.Product.product_type == 'inventariable')
+    statement = update(models.Product).where(*conditions).values(
+        stock=models.Product.stock + _quantity_case(quantities)
+    )
+    if _returning_supported():
+        new_stock = _execute(statement)
+    else:
+        # The UPDATE locks the rows, so reading them back in the same transaction is consistent
+        db.session.execute(statement, execution_options={'synchronize_session': 'fetch'})
+        new_stock = _read_stock(product_id for (product_id,)
+                                in db.session.query(models.Product.id).filter(*conditions).all())
+    low_stock.refresh(new_stock)
+    return new_stock
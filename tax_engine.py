@@ -0,0 +1,320 @@
+"""
+Motor de cálculo de impuestos (ITBIS) y propina
+Un solo lugar para calcular, a partir de las líneas de una venta (cantidad,
+precio, tasa, impuesto incluido o no), el impuesto y la base de cada línea y
+los totales de la venta. Todo el cálculo se hace en centavos enteros y las
+tasas en partes por millón, con redondeo ROUND_HALF_UP por línea, de modo que
+agregar productos, la vista previa, el cierre de la venta, las notas de crédito
+y los recibos dan exactamente los mismos montos.
+
+Convenciones (las mismas que usa finalize_sale):
+- subtotal: suma de los precios de las líneas tal como se cobran (bruto)
+- tax_amount: impuestos incluidos + agregados, para reportes
+- total: subtotal + impuestos agregados (los incluidos ya están en el precio)
+- rounded_total: total redondeado a pesos enteros (valor que se guarda en Sale.total)
+- service_charge_amount: propina del 10% ya incluida en los precios (solo informativa)
+
+Para recálculos masivos (reportes, reconstrucción de agregados) está
+compute_bulk_totals, que usa numpy si está instalado y un ciclo en Python
+con la misma aritmética entera si no.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # numpy es opcional: el cálculo masivo cae al ciclo en Python
+    np = None
+
+RATE_SCALE = 1_000_000  # tasas en partes por millón (0.18 -> 180000)
+SERVICE_CHARGE_RATE = 0.10  # propina legal del 10%
+
+
+def to_cents(amount) -> int:
+    """Convierte un monto (float, Decimal, str) a centavos enteros con ROUND_HALF_UP"""
+    if amount is None:
+        return 0
+    if isinstance(amount, (int, float)):
+        # Rounding to 6 decimals first drops float representation error
+        # (0.285 * 100 = 28.499999...) so half-up matches the decimal amount
+        scaled = round(amount * 100, 6)
+        cents = int(abs(scaled) + 0.5)
+        return -cents if scaled < 0 else cents
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> float:
+    # int / 100 is correctly rounded: same float as Decimal('12.34')
+    return cents / 100
+
+
+_rate_units_cache: Dict[float, int] = {}
+
+
+def to_rate_units(rate) -> int:
+    """Tasa decimal (0.18) a partes por millón"""
+    if not rate:
+        return 0
+    units = _rate_units_cache.get(rate)
+    if units is None:
+        # Only a handful of distinct rates exist (0.18, 0.16, 0.10...)
+        units = int((Decimal(str(rate)) * RATE_SCALE).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+        if len(_rate_units_cache) < 1024:
+            _rate_units_cache[rate] = units
+    return units
+
+
+def _div_half_up(numerator: int, denominator: int) -> int:
+    """División entera redondeando la mitad hacia arriba (en valor absoluto)"""
+    if numerator < 0:
+        return -_div_half_up(-numerator, denominator)
+    return (2 * numerator + denominator) // (2 * denominator)
+
+
+def _line_tax_cents(line_cents: int, rate_units: int, is_inclusive: bool) -> int:
+    if rate_units <= 0:
+        return 0
+    if is_inclusive:
+        # Base = precio / (1 + tasa); el impuesto es lo que resta para llegar al precio
+        return line_cents - _div_half_up(line_cents * RATE_SCALE, RATE_SCALE + rate_units)
+    return _div_half_up(line_cents * rate_units, RATE_SCALE)
+
+
+def _included_charge_cents(gross_cents: int, rate_units: int) -> int:
+    """Monto de un cargo porcentual que ya está incluido en gross_cents"""
+    return gross_cents - _div_half_up(gross_cents * RATE_SCALE, RATE_SCALE + rate_units)
+
+
+class TaxLine(NamedTuple):
+    """Línea de entrada: monto de la línea en centavos, tasa en ppm y si el impuesto está incluido"""
+    line_cents: int
+    rate_units: int
+    is_inclusive: bool
+
+
+class LineTax(NamedTuple):
+    """Resultado por línea (montos en pesos)"""
+    line_total: float
+    base_amount: float
+    tax_amount: float
+    rate: float
+    is_inclusive: bool
+
+
+class SaleTaxTotals(NamedTuple):
+    """Resultado por venta (montos en pesos)"""
+    lines: List[LineTax]
+    subtotal: float
+    base_amount: float
+    tax_included: float
+    tax_exclusive: float
+    tax_amount: float
+    service_charge_amount: float
+    total: float
+    rounded_total: float
+
+
+def make_line(quantity=1, unit_price=None, rate=0, is_inclusive=False, line_total=None) -> TaxLine:
+    """
+    Construye una línea de entrada
+
+    Args:
+        quantity: Cantidad vendida
+        unit_price: Precio unitario (se ignora si se da line_total)
+        rate: Tasa decimal (0.18 = 18%)
+        is_inclusive: True si el impuesto ya está en el precio
+        line_total: Monto de la línea ya calculado (p. ej. SaleItem.total_price)
+    """
+    if line_total is None:
+        line_total = Decimal(str(unit_price or 0)) * Decimal(str(quantity or 0))
+    return TaxLine(to_cents(line_total), to_rate_units(rate), bool(is_inclusive))
+
+
+def lines_from_items(items: Iterable, rate_override=None, inclusive_override=None) -> List[TaxLine]:
+    """
+    Líneas de entrada a partir de SaleItem (o cualquier objeto con total_price,
+    tax_rate e is_tax_included). Si la línea no tiene tasa se usa la del producto.
+
+    rate_override / inclusive_override aplican una misma tasa a todas las líneas
+    (modo de impuesto uniforme de la venta).
+    """
+    lines = []
+    for item in items:
+        if rate_override is not None:
+            rate = rate_override
+        else:
+            rate = item.tax_rate
+            if rate is None and getattr(item, 'product', None) is not None:
+                rate = item.product.tax_rate
+        if inclusive_override is not None:
+            is_inclusive = inclusive_override
+        else:
+            is_inclusive = getattr(item, 'is_tax_included', None)
+            if is_inclusive is None and getattr(item, 'product', None) is not None:
+                is_inclusive = item.product.is_tax_included
+        lines.append(make_line(rate=rate or 0, is_inclusive=is_inclusive, line_total=item.total_price))
+    return lines
+
+
+def compute_line(line: TaxLine) -> LineTax:
+    tax_cents = _line_tax_cents(line.line_cents, line.rate_units, line.is_inclusive)
+    base_cents = line.line_cents - tax_cents if line.is_inclusive else line.line_cents
+    return LineTax(
+        line_total=from_cents(line.line_cents),
+        base_amount=from_cents(base_cents),
+        tax_amount=from_cents(tax_cents),
+        rate=line.rate_units / RATE_SCALE,
+        is_inclusive=line.is_inclusive
+    )
+
+
+def compute_sale(lines: Sequence[TaxLine], apply_service_charge: bool = False) -> SaleTaxTotals:
+    """
+    Calcula en una sola pasada los montos por línea y los totales de la venta
+
+    Args:
+        lines: Líneas de entrada (make_line / lines_from_items)
+        apply_service_charge: Extraer la propina del 10% incluida en los precios
+    """
+    gross = base = included = exclusive = 0
+    results = []
+    for line in lines:
+        tax_cents = _line_tax_cents(line.line_cents, line.rate_units, line.is_inclusive)
+        gross += line.line_cents
+        if line.is_inclusive:
+            included += tax_cents
+            line_base = line.line_cents - tax_cents
+        else:
+            exclusive += tax_cents
+            line_base = line.line_cents
+        base += line_base
+        results.append(LineTax(line.line_cents / 100, line_base / 100, tax_cents / 100,
+                               line.rate_units / RATE_SCALE, line.is_inclusive))
+
+    service_charge = 0
+    if apply_service_charge:
+        service_charge = _included_charge_cents(gross, to_rate_units(SERVICE_CHARGE_RATE))
+
+    total = gross + exclusive
+    return SaleTaxTotals(
+        lines=results,
+        subtotal=from_cents(gross),
+        base_amount=from_cents(base),
+        tax_included=from_cents(included),
+        tax_exclusive=from_cents(exclusive),
+        tax_amount=from_cents(included + exclusive),
+        service_charge_amount=from_cents(service_charge),
+        total=from_cents(total),
+        rounded_total=round_to_pesos(total)
+    )
+
+
+def compute_sale_items(items: Iterable, apply_service_charge: bool = False) -> SaleTaxTotals:
+    """Atajo: compute_sale(lines_from_items(items))"""
+    return compute_sale(lines_from_items(items), apply_service_charge=apply_service_charge)
+
+
+def apply_to_sale(sale, items: Optional[Iterable] = None,
+                  apply_service_charge: Optional[bool] = None) -> SaleTaxTotals:
+    """
+    Recalcula y guarda subtotal, tax_amount y total de una venta
+
+    Args:
+        sale: Venta (models.Sale)
+        items: Líneas a considerar; por defecto sale.sale_items
+        apply_service_charge: Si no es None, también actualiza service_charge_amount
+    """
+    totals = compute_sale_items(sale.sale_items if items is None else items,
+                                apply_service_charge=bool(apply_service_charge))
+    sale.subtotal = totals.subtotal
+    sale.tax_amount = totals.tax_amount
+    sale.total = totals.rounded_total
+    if apply_service_charge is not None:
+        sale.service_charge_amount = totals.service_charge_amount
+    return totals
+
+
+def round_to_pesos(cents: int) -> float:
+    """Redondea centavos a pesos enteros (ROUND_HALF_UP), como Sale.total"""
+    return float(_div_half_up(cents, 100))
+
+
+def tax_for_amount(amount, rate=0.18, is_inclusive=False) -> float:
+    """Impuesto de un monto suelto con el mismo redondeo que las líneas de venta"""
+    return from_cents(_line_tax_cents(to_cents(amount), to_rate_units(rate), bool(is_inclusive)))
+
+
+class BulkTotals(NamedTuple):
+    """Totales por venta del cálculo masivo (centavos enteros)"""
+    subtotal_cents: int
+    tax_cents: int
+    total_cents: int
+
+
+def compute_bulk_totals(sale_ids: Sequence[int], line_totals: Sequence[float],
+                        rates: Sequence[float], inclusive: Sequence[bool]) -> Dict[int, BulkTotals]:
+    """
+    Recalcula los totales de muchas ventas a partir de sus líneas en columnas
+
+    Los cuatro argumentos son columnas paralelas (una fila por SaleItem), tal como
+    salen de una consulta SELECT sale_id, total_price, tax_rate, is_tax_included.
+    Da exactamente los mismos centavos que compute_sale para cada venta.
+
+    Returns:
+        {sale_id: BulkTotals(subtotal_cents, tax_cents, total_cents)}
+    """
+    if not len(sale_ids):
+        return {}
+    if np is not None:
+        return _bulk_numpy(sale_ids, line_totals, rates, inclusive)
+    return _bulk_python(sale_ids, line_totals, rates, inclusive)
+
+
+def _bulk_python(sale_ids, line_totals, rates, inclusive) -> Dict[int, BulkTotals]:
+    accumulated = {}
+    for sale_id, line_total, rate, is_inclusive in zip(sale_ids, line_totals, rates, inclusive):
+        line_cents = to_cents(line_total)
+        tax_cents = _line_tax_cents(line_cents, to_rate_units(rate), bool(is_inclusive))
+        gross, tax, exclusive = accumulated.get(sale_id, (0, 0, 0))
+        accumulated[sale_id] = (gross + line_cents, tax + tax_cents,
+                                exclusive + (0 if is_inclusive else tax_cents))
+    return {sale_id: BulkTotals(gross, tax, gross + exclusive)
+            for sale_id, (gross, tax, exclusive) in accumulated.items()}
+
+
+def _np_div_half_up(numerator, denominator):
+    sign = np.where(numerator < 0, -1, 1)
+    magnitude = np.abs(numerator)
+    return sign * ((2 * magnitude + denominator) // (2 * denominator))
+
+
+def _np_to_units(values, scale: int):
+    # Rounding to 6 decimals first drops float representation error
+    # (0.285 * 100 = 28.499999...) so half-up matches to_cents()
+    scaled = np.round(np.asarray(values, dtype=np.float64) * scale, 6)
+    return (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+
+
+def _bulk_numpy(sale_ids, line_totals, rates, inclusive) -> Dict[int, BulkTotals]:
+    keys, group = np.unique(np.asarray(sale_ids), return_inverse=True)
+    line_cents = _np_to_units(line_totals, 100)
+    rate_units = np.clip(_np_to_units(np.nan_to_num(np.asarray(rates, dtype=np.float64)), RATE_SCALE), 0, None)
+    is_inclusive = np.asarray(inclusive, dtype=bool)
+
+    exclusive_tax = _np_div_half_up(line_cents * rate_units, RATE_SCALE)
+    inclusive_tax = line_cents - _np_div_half_up(line_cents * RATE_SCALE, RATE_SCALE + rate_units)
+    tax = np.where(rate_units > 0, np.where(is_inclusive, inclusive_tax, exclusive_tax), 0)
+    exclusive = np.where(is_inclusive, 0, tax)
+
+    size = len(keys)
+    gross_sum = np.zeros(size, dtype=np.int64)
+    tax_sum = np.zeros(size, dtype=np.int64)
+    exclusive_sum = np.zeros(size, dtype=np.int64)
+    np.add.at(gross_sum, group, line_cents)
+    np.add.at(tax_sum, group, tax)
+    np.add.at(exclusive_sum, group, exclusive)
+
+    return {
+        key.item(): BulkTotals(int(gross), int(tax_total), int(gross + excl))
+        for key, gross, tax_total, excl in zip(keys, gross_sum, tax_sum, exclusive_sum)
+    }
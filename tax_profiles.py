@@ -0,0 +1,269 @@
+"""
+Perfil de impuestos efectivo por producto (caché en memoria)
+Resuelve una sola vez, para cada producto, la tasa total de impuestos, si el
+impuesto está incluido en el precio y si lleva propina, a partir de sus
+ProductTax/TaxType. Agregar productos a una venta y la vista previa leen el
+perfil de aquí en lugar de consultar las tablas de impuestos en cada llamada.
+
+La caché se carga completa al arrancar (una sola consulta) y se refresca:
+- en este proceso, cuando los endpoints de inventario y de tipos de impuesto
+  llaman a products_changed() / tax_types_changed();
+- en los demás procesos (otros workers de gunicorn), porque esas funciones
+  cambian la versión guardada en SystemConfiguration y cada proceso la
+  compara como máximo cada TAX_PROFILE_CHECK_INTERVAL segundos.
+"""
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event
+
+import models
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Sin impuestos configurados se usa ITBIS 18% incluido (cumplimiento fiscal)
+DEFAULT_TAX_RATE = 0.18
+DEFAULT_IS_INCLUSIVE = True
+
+VERSION_KEY = 'tax_profiles_version'
+DEFAULT_CHECK_INTERVAL = 5.0  # segundos entre comprobaciones de versión
+
+
+class TaxProfile(NamedTuple):
+    """Impuestos efectivos de un producto"""
+    product_id: int
+    rate: float                 # suma de tipos de categoría 'tax' (sin propina)
+    is_inclusive: bool
+    has_service_charge: bool
+    service_charge_rate: float
+    tax_types: Tuple[dict, ...]  # detalle para recibos y respuestas de la API
+    configured: bool            # False si se aplicó el valor por defecto
+
+
+class _Cache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles: Dict[int, TaxProfile] = {}
+        self.tax_types: Optional[Dict[int, dict]] = None
+        self.loaded = False
+        self.version: Optional[str] = None
+        self.checked_at = 0.0
+        self.check_interval = DEFAULT_CHECK_INTERVAL
+
+    def clear(self):
+        with self.lock:
+            self.profiles = {}
+            self.tax_types = None
+            self.loaded = False
+
+
+_cache = _Cache()
+
+
+def _category_value(tax_category) -> str:
+    # Defensive fallback for tax_category (handles NULL/missing values)
+    if not tax_category:
+        return 'tax'
+    return tax_category.value if hasattr(tax_category, 'value') else str(tax_category)
+
+
+def _tax_type_dict(tax_type) -> dict:
+    return {
+        'id': tax_type.id,
+        'name': tax_type.name,
+        'rate': tax_type.rate,
+        'is_inclusive': tax_type.is_inclusive,
+        'tax_category': _category_value(tax_type.tax_category)
+    }
+
+
+def resolve_profile(product_id: int, tax_types: Iterable[dict]) -> TaxProfile:
+    """
+    Calcula el perfil a partir de los tipos de impuesto activos del producto
+
+    Solo los tipos de categoría 'tax' suman a la tasa; los de 'service_charge'
+    marcan la propina. Sin tipos 'tax' se usa ITBIS 18% incluido.
+    """
+    tax_types = tuple(tax_types)
+    tax_only = [tax for tax in tax_types if tax['tax_category'] == 'tax']
+    service = [tax for tax in tax_types if tax['tax_category'] == 'service_charge']
+
+    if tax_types:
+        rate = sum(tax['rate'] for tax in tax_only)
+        is_inclusive = any(tax['is_inclusive'] for tax in tax_only)
+    else:
+        rate = DEFAULT_TAX_RATE
+        is_inclusive = DEFAULT_IS_INCLUSIVE
+
+    return TaxProfile(
+        product_id=product_id,
+        rate=rate,
+        is_inclusive=is_inclusive,
+        has_service_charge=bool(service),
+        service_charge_rate=sum(tax['rate'] for tax in service),
+        tax_types=tax_types,
+        configured=bool(tax_types)
+    )
+
+
+def _load_profiles(product_ids: Optional[List[int]] = None) -> Dict[int, TaxProfile]:
+    """Perfiles de los productos indicados (o de todos) con una consulta por tabla"""
+    product_query = db.session.query(models.Product.id)
+    tax_query = db.session.query(models.ProductTax.product_id, models.TaxType).join(
+        models.TaxType, models.ProductTax.tax_type_id == models.TaxType.id
+    ).filter(models.TaxType.active == True)
+    if product_ids is not None:
+        product_query = product_query.filter(models.Product.id.in_(product_ids))
+        tax_query = tax_query.filter(models.ProductTax.product_id.in_(product_ids))
+
+    by_product: Dict[int, List[dict]] = {product_id: [] for (product_id,) in product_query.all()}
+    for product_id, tax_type in tax_query.order_by(models.ProductTax.id).all():
+        by_product.setdefault(product_id, []).append(_tax_type_dict(tax_type))
+
+    return {product_id: resolve_profile(product_id, tax_types) for product_id, tax_types in by_product.items()}
+
+
+def _read_version() -> Optional[str]:
+    return db.session.query(models.SystemConfiguration.value).filter_by(key=VERSION_KEY).scalar()
+
+
+def _check_version():
+    """Descarta la caché si otro proceso cambió impuestos (como máximo cada check_interval)"""
+    now = time.monotonic()
+    if now - _cache.checked_at < _cache.check_interval:
+        return
+    _cache.checked_at = now
+    version = _read_version()
+    if version != _cache.version:
+        _cache.clear()
+        _cache.version = version
+
+
+def warm():
+    """Carga los perfiles de todos los productos y los tipos de impuesto activos"""
+    profiles = _load_profiles()
+    tax_types = _load_tax_types()
+    version = _read_version()
+    with _cache.lock:
+        _cache.profiles = profiles
+        _cache.tax_types = tax_types
+        _cache.loaded = True
+        _cache.version = version
+        _cache.checked_at = time.monotonic()
+    return len(profiles)
+
+
+def get_profiles(product_ids: Iterable[int]) -> Dict[int, TaxProfile]:
+    """
+    Perfiles de varios productos; los que faltan se cargan juntos en una consulta
+
+    Los productos inexistentes no aparecen en el resultado.
+    """
+    _check_version()
+    if not _cache.loaded:
+        warm()
+
+    product_ids = list(dict.fromkeys(product_ids))
+    profiles = _cache.profiles
+    missing = [product_id for product_id in product_ids if product_id not in profiles]
+    if missing:
+        loaded = _load_profiles(missing)
+        with _cache.lock:
+            _cache.profiles.update(loaded)
+        profiles = _cache.profiles
+    return {product_id: profiles[product_id] for product_id in product_ids if product_id in profiles}
+
+
+def get_profile(product_id: int) -> Optional[TaxProfile]:
+    """Perfil de impuestos de un producto (None si el producto no existe)"""
+    return get_profiles([product_id]).get(product_id)
+
+
+def _load_tax_types() -> Dict[int, dict]:
+    return {
+        tax_type.id: {
+            'id': tax_type.id,
+            'name': tax_type.name,
+            'rate': tax_type.rate,
+            'is_inclusive': tax_type.is_inclusive,
+            'description': getattr(tax_type, 'description', ''),
+            'is_percentage': True,
+            'display_order': tax_type.id
+        }
+        for tax_type in models.TaxType.query.filter_by(active=True).all()
+    }
+
+
+def get_tax_type(tax_type_id) -> Optional[dict]:
+    """Tipo de impuesto activo por ID, desde la caché (para el tax_type_id que envía el POS)"""
+    if not tax_type_id:
+        return None
+    _check_version()
+    if _cache.tax_types is None:
+        tax_types = _load_tax_types()
+        with _cache.lock:
+            _cache.tax_types = tax_types
+    try:
+        return _cache.tax_types.get(int(tax_type_id))
+    except (TypeError, ValueError):
+        return None
+
+
+def _bump_version():
+    """Nueva versión en SystemConfiguration (se confirma con la transacción del llamador)"""
+    version = uuid.uuid4().hex
+    config = models.SystemConfiguration.query.filter_by(key=VERSION_KEY).first()
+    if not config:
+        config = models.SystemConfiguration()
+        config.key = VERSION_KEY
+        config.description = 'Versión de la caché de perfiles de impuestos por producto'
+        db.session.add(config)
+    config.value = version
+    return version
+
+
+def products_changed(product_ids: Iterable[int]):
+    """
+    Registrar cambios de impuestos o alta/baja de productos
+
+    Llamar antes de db.session.commit(): la nueva versión se guarda en la misma
+    transacción y los perfiles locales se recalculan en el siguiente acceso.
+    """
+    _cache.version = _bump_version()
+    with _cache.lock:
+        for product_id in product_ids:
+            _cache.profiles.pop(product_id, None)
+
+
+def tax_types_changed():
+    """Registrar altas/cambios/bajas de TaxType (afecta a todos los productos); antes del commit"""
+    _cache.version = _bump_version()
+    _cache.clear()
+
+
+def init_app(app):
+    """Configura el intervalo de comprobación y precarga los perfiles al arrancar"""
+    app.config.setdefault('TAX_PROFILE_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL)
+    _cache.check_interval = float(app.config['TAX_PROFILE_CHECK_INTERVAL'])
+
+    with app.app_context():
+        try:
+            count = warm()
+            logger.info(f"Perfiles de impuestos precargados: {count} productos")
+        except Exception as e:
+            # Base de datos sin migrar o no disponible: se cargará en el primer uso
+            db.session.rollback()
+            logger.info(f"Perfiles de impuestos no precargados: {e}")
+        finally:
+            db.session.remove()
+
+
+@event.listens_for(models.ProductTax.__table__, 'after_create')
+def _on_tables_created(target, connection, **kw):
+    # A freshly created schema (db.create_all) invalidates any cached ids
+    _cache.clear()
+    _cache.version = None
@@ -0,0 +1,151 @@
+"""
+Tests para el libro de caja por sesión (totales acumulados en CashSession)
+"""
+import pytest
+import json
+import os
+from flask import g
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, Category, Sale, SaleItem, CashRegister,
+                    CashSession, NCFSequence, NCFType, CancelledNCF, SalesDailyAggregate)
+import cash_ledger
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(test_app):
+    return test_app.test_client()
+
+
+@pytest.fixture
+def cashier_setup(client):
+    """Cajero autenticado con caja, producto y secuencia NCF de consumo"""
+    cashier = User(username='cajero_ledger', email='ledger@test.com', role=UserRole.CAJERO,
+                   name='Cajero Ledger', password_hash='x')
+    db.session.add(cashier)
+    db.session.flush()
+
+    register = CashRegister(name='Caja Ledger', user_id=cashier.id, active=True)
+    category = Category(name='Bebidas Ledger', description='', active=True)
+    db.session.add_all([register, category])
+    db.session.flush()
+
+    product = Product(name='Cerveza', description='', price=150.0, stock=100, min_stock=5,
+                      product_type='inventariable', category_id=category.id, active=True)
+    sequence = NCFSequence(ncf_type=NCFType.CONSUMO, serie='B02', start_number=1,
+                           end_number=1000, current_number=1, active=True)
+    db.session.add_all([product, sequence])
+    db.session.commit()
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = cashier.id
+        sess['username'] = cashier.username
+        sess['role'] = cashier.role.value
+
+    # The module-wide app context shares flask.g across requests; drop any token cached by a previous client
+    g.pop('csrf_token', None)
+    csrf_token = client.get('/api/csrf').get_json()['csrf_token']
+
+    yield {'cashier': cashier, 'register': register, 'product': product,
+           'headers': {'X-CSRFToken': csrf_token}}
+
+    for model in (CancelledNCF, SaleItem, SalesDailyAggregate, Sale, CashSession,
+                  NCFSequence, Product, Category, CashRegister, User):
+        model.query.delete()
+    db.session.commit()
+
+
+def _post(client, url, headers, payload=None):
+    return client.post(url, data=json.dumps(payload or {}), content_type='application/json', headers=headers)
+
+
+def _sell(client, setup, payment_method, quantity=1):
+    headers = setup['headers']
+    sale_id = _post(client, '/api/sales', headers).get_json()['id']
+    _post(client, f'/api/sales/{sale_id}/items', headers,
+          {'product_id': setup['product'].id, 'quantity': quantity})
+    response = _post(client, f'/api/sales/{sale_id}/finalize', headers,
+                     {'payment_method': payment_method, 'ncf_type': 'consumo'})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+class TestCashSessionLedger:
+    """Tests de enlace de ventas a la sesión y totales acumulados"""
+
+    def test_finalize_updates_open_session(self, client, cashier_setup):
+        headers = cashier_setup['headers']
+        response = _post(client, '/api/cash-register/open', headers, {'opening_amount': 500})
+        session_id = response.get_json()['session_id']
+
+        cash_sale = _sell(client, cashier_setup, 'cash', quantity=2)
+        card_sale = _sell(client, cashier_setup, 'card')
+
+        cash_session = db.session.get(CashSession, session_id)
+        assert db.session.get(Sale, cash_sale['id']).cash_session_id == session_id
+        assert cash_session.cash_sales_count == 1
+        assert cash_session.cash_sales_total == pytest.approx(cash_sale['total'])
+        assert cash_session.card_sales_count == 1
+        assert cash_session.card_sales_total == pytest.approx(card_sale['total'])
+
+        report = client.get('/api/cash-register/x-report').get_json()['session_summary']
+        assert report['total_transactions'] == 2
+        assert report['expected_cash'] == pytest.approx(500 + cash_sale['total'])
+
+    def test_cancel_reverts_session_totals(self, client, cashier_setup):
+        headers = cashier_setup['headers']
+        session_id = _post(client, '/api/cash-register/open', headers, {'opening_amount': 0}).get_json()['session_id']
+
+        sale = _sell(client, cashier_setup, 'cash')
+        response = _post(client, f"/api/sales/{sale['id']}/cancel", headers, {'reason': 'Error de cobro'})
+        assert response.status_code == 200, response.get_json()
+
+        cash_session = db.session.get(CashSession, session_id)
+        assert cash_session.cash_sales_count == 0
+        assert cash_session.cash_sales_total == pytest.approx(0)
+        assert cash_session.cancelled_count == 1
+        assert cash_session.cancelled_total == pytest.approx(sale['total'])
+        assert cash_ledger.reconcile_sessions(session_id=session_id) == []
+
+    def test_close_reads_running_totals(self, client, cashier_setup):
+        headers = cashier_setup['headers']
+        _post(client, '/api/cash-register/open', headers, {'opening_amount': 100})
+        sale = _sell(client, cashier_setup, 'transfer')
+
+        response = _post(client, '/api/cash-register/close', headers, {'closing_amount': 100})
+        summary = response.get_json()['session_summary']
+        assert summary['transfer_sales'] == pytest.approx(sale['total'])
+        assert summary['total_transactions'] == 1
+        assert summary['cash_difference'] == pytest.approx(0)
+
+    def test_reconcile_detects_and_fixes_drift(self, client, cashier_setup):
+        headers = cashier_setup['headers']
+        session_id = _post(client, '/api/cash-register/open', headers, {'opening_amount': 0}).get_json()['session_id']
+        _sell(client, cashier_setup, 'cash')
+
+        cash_session = db.session.get(CashSession, session_id)
+        cash_session.cash_sales_total = 1.0
+        db.session.commit()
+
+        mismatches = cash_ledger.reconcile_sessions(session_id=session_id, fix=True)
+        assert [m['field'] for m in mismatches] == ['cash_sales_total']
+        assert cash_ledger.reconcile_sessions(session_id=session_id) == []
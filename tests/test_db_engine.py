@@ -0,0 +1,112 @@
+"""
+Tests para la configuración del pool, statement_timeout y métricas del pool
+"""
+import pytest
+import os
+from flask import Flask, g
+from sqlalchemy import create_engine, exc
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+import db_engine
+from utils import error_response
+
+
+class TestPoolSizing:
+    """Tamaño del pool según el modelo de worker"""
+
+    def test_worker_models(self):
+        assert db_engine.worker_pool_size('sync', 8, 100) == (2, 2)
+        assert db_engine.worker_pool_size('gthread', 8, 100) == (8, 4)
+        assert db_engine.worker_pool_size('gthread', 2, 100) == (2, 2)
+        assert db_engine.worker_pool_size('gevent', 8, 100) == (20, 10)
+
+    def test_engine_options(self, monkeypatch):
+        monkeypatch.setenv('GUNICORN_WORKER_CLASS', 'gthread')
+        monkeypatch.setenv('GUNICORN_THREADS', '4')
+        assert db_engine.engine_options('sqlite:///:memory:', {}) == {'pool_pre_ping': False}
+
+        options = db_engine.engine_options('postgresql://pos@db/pos', {})
+        assert options['poolclass'] is db_engine.MeteredQueuePool
+        assert (options['pool_size'], options['max_overflow']) == (4, 2)
+        assert options['pool_pre_ping'] is False
+
+        options = db_engine.engine_options('postgresql://pos@db/pos', {'DB_POOL_SIZE': 3, 'DB_MAX_OVERFLOW': 0,
+                                                                       'DB_POOL_TIMEOUT': 2})
+        assert (options['pool_size'], options['max_overflow'], options['pool_timeout']) == (3, 0, 2)
+
+
+class TestStatementTimeout:
+    """statement_timeout por blueprint"""
+
+    def test_per_blueprint(self):
+        assert db_engine.statement_timeout_for('api', app.config) == 10000
+        assert db_engine.statement_timeout_for('dgii', app.config) == 300000
+        assert db_engine.statement_timeout_for(None, app.config) == db_engine.DEFAULT_STATEMENT_TIMEOUT
+
+    def test_request_blueprint(self):
+        assert db_engine._current_statement_timeout(app.config) == 0
+        with app.test_request_context('/api/sales', method='POST'):
+            assert db_engine._current_statement_timeout(app.config) == 10000
+        with app.test_request_context('/dgii/'):
+            assert db_engine._current_statement_timeout(app.config) == 300000
+
+
+class TestPoolMetrics:
+    """Esperas y timeouts del pool"""
+
+    def test_checked_out_and_pool_timeout(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=db_engine.MeteredQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.05)
+        db_engine._stats.reset()
+        try:
+            held = engine.connect()
+            assert db_engine.pool_status(engine)['checked_out'] == 1
+            with pytest.raises(exc.TimeoutError):
+                engine.connect()
+            held.close()
+
+            status = db_engine.pool_status(engine)
+            assert status['checked_out'] == 0
+            assert status['pool_timeouts'] == 1
+            assert status['checkouts'] == 2
+            assert status['waited'] >= 1
+            assert status['wait_max_ms'] >= 50
+        finally:
+            engine.dispose()
+            db_engine._stats.reset()
+
+
+class TestDisconnectResponse:
+    """Una petición que perdió la conexión responde 503 con Retry-After"""
+
+    @pytest.fixture
+    def client(self):
+        mini = Flask(__name__)
+
+        @mini.route('/<int:status>')
+        def fail(status):
+            g.db_disconnected = True
+            if status == 200:
+                return 'ok'
+            return error_response(error_type='server', message='Error interno', status_code=status)
+
+        @mini.route('/plain-error')
+        def plain_error():
+            return error_response(error_type='server', message='Error interno', status_code=500)
+
+        mini.after_request(db_engine.retry_after_disconnect)
+        return mini.test_client()
+
+    def test_error_becomes_503(self, client):
+        response = client.get('/500')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert response.get_json()['type'] == 'server'
+
+    def test_other_responses_unchanged(self, client):
+        assert client.get('/200').status_code == 200
+        assert client.get('/plain-error').status_code == 500
@@ -0,0 +1,156 @@
+"""
+Tests para el enrutamiento de lecturas a la réplica (con una segunda base SQLite como réplica)
+"""
+import pytest
+import os
+import time
+from flask import g, session
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import db, User, UserRole, Product, Category
+import db_routing
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _add_product(session, name):
+    category = Category(name=f'Categoría {name}', description='', active=True)
+    session.add(category)
+    session.flush()
+    session.add(Product(name=name, description='', price=10.0, stock=0, product_type='consumible',
+                        category_id=category.id, active=True))
+    session.commit()
+
+
+@pytest.fixture
+def replica(test_app, tmp_path):
+    """Primario y réplica con un producto distinto en cada uno"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    db.metadata.create_all(engine)
+    with Session(engine) as replica_session:
+        _add_product(replica_session, 'Producto réplica')
+    _add_product(db.session, 'Producto primario')
+
+    test_app.extensions[db_routing.EXTENSION_KEY] = engine
+    db_routing._state.reset()
+
+    yield engine
+
+    # The module-wide app context shares flask.g across requests
+    for flag in ('db_read_only', 'db_fresh', 'db_wrote'):
+        g.pop(flag, None)
+
+    test_app.extensions.pop(db_routing.EXTENSION_KEY)
+    db_routing._state.reset()
+    engine.dispose()
+    db.session.rollback()
+    for model in (Product, Category, User):
+        model.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def _product_names():
+    names = [product.name for product in Product.query.all()]
+    # Each check starts from a clean identity map, as a new request would
+    db.session.expunge_all()
+    return names
+
+
+class TestRouting:
+    """Lecturas a la réplica, escrituras al primario"""
+
+    def test_read_only_view_reads_replica(self, replica):
+        with app.test_request_context('/admin/api/sales-report'):
+            assert _product_names() == ['Producto primario']
+            g.db_read_only = True
+            assert _product_names() == ['Producto réplica']
+        with app.test_request_context('/fiscal-audit/api/summary'):
+            assert _product_names() == ['Producto réplica']
+
+    def test_writes_go_to_primary(self, replica):
+        with app.test_request_context('/dgii/export/607', method='POST'):
+            g.db_read_only = True
+            db.session.add(Category(name='Nueva', description='', active=True))
+            db.session.commit()
+            assert g.db_wrote is True
+        assert Category.query.filter_by(name='Nueva').count() == 1
+        with Session(replica) as replica_session:
+            assert replica_session.query(Category).filter_by(name='Nueva').count() == 0
+
+    def test_without_replica_uses_primary(self, replica):
+        app.extensions.pop(db_routing.EXTENSION_KEY)
+        try:
+            with app.test_request_context('/dgii/'):
+                g.db_read_only = True
+                assert _product_names() == ['Producto primario']
+        finally:
+            app.extensions[db_routing.EXTENSION_KEY] = replica
+
+
+class TestFreshness:
+    """Control de frescura: lectura tras escritura, retraso de la réplica y require_fresh()"""
+
+    def test_recent_write_reads_primary(self, replica):
+        with app.test_request_context('/admin/api/sales-report'):
+            g.db_read_only = True
+            session['db_last_write'] = time.time()
+            assert _product_names() == ['Producto primario']
+            session['db_last_write'] = time.time() - 60
+            assert _product_names() == ['Producto réplica']
+
+    def test_lagging_replica_reads_primary(self, replica):
+        db_routing._state.lag = 60.0
+        db_routing._state.checked_at = time.monotonic()
+        with app.test_request_context('/dgii/'):
+            g.db_read_only = True
+            assert _product_names() == ['Producto primario']
+
+    def test_require_fresh(self, replica):
+        with app.test_request_context('/dgii/'):
+            g.db_read_only = True
+            db_routing.require_fresh()
+            assert _product_names() == ['Producto primario']
+
+    def test_endpoint_and_read_after_write_cookie(self, test_app, replica):
+        admin = User(username='admin_replica', email='replica@test.com', role=UserRole.ADMINISTRADOR,
+                     name='Admin Réplica', password_hash='x')
+        db.session.add(admin)
+        db.session.commit()
+        # The admin row must exist where the view reads it
+        with Session(replica) as replica_session:
+            replica_session.add(User(id=admin.id, username='admin_replica', email='replica@test.com',
+                                     role=UserRole.ADMINISTRADOR, name='Admin Réplica', password_hash='x'))
+            replica_session.commit()
+
+        client = test_app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = admin.id
+            sess['role'] = admin.role.value
+
+        body = client.get('/fiscal-audit/api/products-without-taxes').get_json()
+        assert [product['name'] for product in body['products']] == ['Producto réplica']
+
+        with client.session_transaction() as sess:
+            sess['db_last_write'] = time.time()
+        body = client.get('/fiscal-audit/api/products-without-taxes').get_json()
+        assert [product['name'] for product in body['products']] == ['Producto primario']
@@ -0,0 +1,152 @@
+"""
+Tests para la exportación Excel en streaming y el lote multi-período de los formatos DGII 606 y 607
+"""
+import pytest
+import hashlib
+import io
+import json
+import os
+import zipfile
+from datetime import datetime
+
+import openpyxl
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import db, User, UserRole, Sale, Purchase, Supplier
+import dgii_excel
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def admin_client(test_app):
+    """Administrador autenticado con compras y ventas de septiembre 2026"""
+    admin = User(username='admin_excel', email='excel@test.com', role=UserRole.ADMINISTRADOR,
+                 name='Admin Excel', password_hash='x', active=True)
+    supplier = Supplier(name='Distribuidora Caribe', rnc='131234567', contact_person='', phone='', email='',
+                        address='')
+    db.session.add_all([admin, supplier])
+    db.session.flush()
+    db.session.add_all([
+        Purchase(supplier_id=supplier.id, ncf_supplier='B0100000010', total_amount=1180.0, tax_amount=180.0, notes='',
+                 created_at=datetime(2026, 9, 3, 10, 0)),
+        Purchase(supplier_id=supplier.id, ncf_supplier='B0100000011', total_amount=500.0, tax_amount=None, notes='',
+                 created_at=datetime(2026, 10, 1, 9, 0)),
+        Sale(user_id=admin.id, ncf='B0200000001', subtotal=100.0, tax_amount=18.0, total=118.0,
+             status='completed', customer_rnc='40212345678', created_at=datetime(2026, 9, 5, 12, 0)),
+        Sale(user_id=admin.id, ncf='B0200000002', subtotal=50.0, tax_amount=9.0, total=59.0,
+             status='cancelled', created_at=datetime(2026, 9, 6, 12, 0)),
+    ])
+    db.session.commit()
+
+    client = test_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = admin.id
+        sess['role'] = admin.role.value
+
+    yield client
+
+    db.session.rollback()
+    for model in (Sale, Purchase, Supplier, User):
+        model.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def _sheet(response):
+    assert response.status_code == 200
+    return openpyxl.load_workbook(io.BytesIO(response.data)).active
+
+
+class TestDgiiExcel:
+    """606 y 607 escritos fila por fila con estilos con nombre"""
+
+    def test_606_rows_and_styles(self, admin_client):
+        response = admin_client.post('/dgii/export/606/excel', data=json.dumps({'period': '2026-09'}),
+                                     content_type='application/json')
+        assert response.headers['Content-Disposition'].endswith('606_2026_09.xlsx')
+        sheet = _sheet(response)
+
+        assert sheet['A1'].value == 'Reporte DGII 606 - Compras - September 2026'
+        assert sheet['A1'].style == dgii_excel.TITLE_STYLE
+        assert 'A1:P1' in [str(cells) for cells in sheet.merged_cells.ranges]
+        assert sheet['A3'].style == dgii_excel.HEADER_STYLE
+        rows = [list(row) for row in sheet.iter_rows(min_row=4, values_only=True)]
+        assert len(rows) == 1
+        assert rows[0][:8] == ['131234567', '1', 'B0100000010', None, '20260903', '20260903', '1180.00', '180.00']
+
+    def test_607_only_completed_sales(self, admin_client):
+        response = admin_client.post('/dgii/export/607/excel', data=json.dumps({'year': 2026, 'month': 9}),
+                                     content_type='application/json')
+        sheet = _sheet(response)
+        rows = [list(row) for row in sheet.iter_rows(min_row=4, values_only=True)]
+        assert len(rows) == 1
+        assert rows[0][:7] == ['40212345678', '2', 'B0200000001', None, '20260905', '118.00', '18.00']
+
+    def test_write_report_consumes_rows_lazily(self):
+        progress = []
+        rows = ([str(index), index] for index in range(2500))
+        output = dgii_excel.write_report('Título', 'Hoja', ['Código', 'Valor'], rows, progress=progress.append)
+        assert progress == [1000, 2000]
+        sheet = openpyxl.load_workbook(output).active
+        assert sheet.max_row == 2503
+
+
+def _post(client, url, payload):
+    return client.post(url, data=json.dumps(payload), content_type='application/json')
+
+
+class TestDgiiBatch:
+    """Lote de varios meses en un zip con manifiesto y sumas SHA-256"""
+
+    def test_batch_bundle_matches_single_exports(self, admin_client):
+        response = _post(admin_client, '/dgii/export/batch', {'start': '2026-08', 'end': '2026-10'})
+        assert response.status_code == 200
+        assert response.headers['Content-Disposition'].endswith('dgii_2026-08_2026-10.zip')
+        bundle = zipfile.ZipFile(io.BytesIO(response.data))
+
+        manifest = json.loads(bundle.read('manifest.json'))
+        assert [entry['period'] for entry in manifest['files'][::6]] == ['2026-08', '2026-09', '2026-10']
+        assert len(manifest['files']) == 18  # 3 months x (606 + 607) x (csv, txt, xlsx)
+        for entry in manifest['files']:
+            assert hashlib.sha256(bundle.read(entry['name'])).hexdigest() == entry['sha256']
+        sums = bundle.read('SHA256SUMS').decode().splitlines()
+        assert sums[0] == f"{manifest['files'][0]['sha256']}  {manifest['files'][0]['name']}"
+
+        records = {(entry['period'], entry['report'], entry['format']): entry['records'] for entry in manifest['files']}
+        assert records[('2026-09', '606', 'csv')] == 1
+        assert records[('2026-09', '607', 'txt')] == 1
+        assert records[('2026-10', '606', 'xlsx')] == 1
+        assert records[('2026-08', '607', 'csv')] == 0
+
+        single_606 = _post(admin_client, '/dgii/export/606', {'period': '2026-09'}).get_json()
+        assert bundle.read('2026-09/606_2026_09.csv').decode() == single_606['csv_data']
+        single_607 = _post(admin_client, '/dgii/export/607/txt', {'period': '2026-09'}).get_json()
+        assert bundle.read('2026-09/607_2026_09.txt').decode() == single_607['txt_data']
+
+    def test_batch_selection_and_limits(self, admin_client):
+        response = _post(admin_client, '/dgii/export/batch',
+                         {'start': '2026-09', 'end': '2026-09', 'reports': ['607'], 'formats': 'txt,xlsx'})
+        names = sorted(zipfile.ZipFile(io.BytesIO(response.data)).namelist())
+        assert names == ['2026-09/607_2026_09.txt', '2026-09/607_2026_09.xlsx', 'SHA256SUMS', 'manifest.json']
+
+        assert _post(admin_client, '/dgii/export/batch', {'start': '2024-01', 'end': '2026-09'}).status_code == 400
+        assert _post(admin_client, '/dgii/export/batch', {'start': '2026-09', 'end': '2026-01'}).status_code == 400
+        assert _post(admin_client, '/dgii/export/batch', {'start': '2026-13'}).status_code == 400
@@ -0,0 +1,142 @@
+"""
+Tests para el cobro express (crear, agregar y finalizar en una petición)
+"""
+import pytest
+import json
+import os
+import uuid
+from flask import g
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, Category, Sale, SaleItem, CashRegister,
+                    CashSession, NCFSequence, NCFType, SalesDailyAggregate)
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(test_app):
+    return test_app.test_client()
+
+
+@pytest.fixture
+def cashier_setup(client):
+    """Cajero autenticado con caja, productos y secuencia NCF de consumo"""
+    cashier = User(username='cajero_express', email='express@test.com', role=UserRole.CAJERO,
+                   name='Cajero Express', password_hash='x')
+    db.session.add(cashier)
+    db.session.flush()
+
+    register = CashRegister(name='Caja Express', user_id=cashier.id, active=True)
+    category = Category(name='Bebidas Express', description='', active=True)
+    db.session.add_all([register, category])
+    db.session.flush()
+
+    product = Product(name='Refresco', description='', price=100.0, stock=10, min_stock=1,
+                      product_type='inventariable', category_id=category.id, active=True)
+    sequence = NCFSequence(ncf_type=NCFType.CONSUMO, serie='B02', start_number=1,
+                           end_number=1000, current_number=1, active=True)
+    db.session.add_all([product, sequence])
+    db.session.commit()
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = cashier.id
+        sess['username'] = cashier.username
+        sess['role'] = cashier.role.value
+
+    # The module-wide app context shares flask.g across requests; drop any token cached by a previous client
+    g.pop('csrf_token', None)
+    csrf_token = client.get('/api/csrf').get_json()['csrf_token']
+
+    yield {'cashier': cashier, 'register': register, 'product': product,
+           'headers': {'X-CSRFToken': csrf_token}}
+
+    for model in (SaleItem, SalesDailyAggregate, Sale, CashSession,
+                  NCFSequence, Product, Category, CashRegister, User):
+        model.query.delete()
+    db.session.commit()
+
+
+def _express(client, headers, payload, extra_headers=None):
+    return client.post('/api/sales/express', data=json.dumps(payload), content_type='application/json',
+                       headers=dict(headers, **(extra_headers or {})))
+
+
+def _cart(product_id, quantity=1, **extra):
+    payload = {'items': [{'product_id': product_id, 'quantity': quantity}],
+               'payment_method': 'card', 'ncf_type': 'consumo'}
+    payload.update(extra)
+    return payload
+
+
+class TestExpressCheckout:
+    """Tests del endpoint /api/sales/express"""
+
+    def test_single_request_completes_sale(self, client, cashier_setup):
+        product_id = cashier_setup['product'].id
+        response = _express(client, cashier_setup['headers'], _cart(product_id, quantity=3))
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+
+        assert body['status'] == 'completed'
+        assert body['ncf'] == 'B0200000001'
+        assert body['total'] == pytest.approx(300.0)
+        assert db.session.get(Product, product_id).stock == 7
+        sale = db.session.get(Sale, body['id'])
+        assert sale.cash_register_id == cashier_setup['register'].id
+        assert SalesDailyAggregate.query.count() == 1
+
+    def test_retry_with_same_key_is_idempotent(self, client, cashier_setup):
+        product_id = cashier_setup['product'].id
+        key = str(uuid.uuid4())
+
+        first = _express(client, cashier_setup['headers'], _cart(product_id), {'Idempotency-Key': key}).get_json()
+        second = _express(client, cashier_setup['headers'], _cart(product_id, client_uuid=key)).get_json()
+
+        assert second['duplicate'] is True
+        assert (second['id'], second['ncf']) == (first['id'], first['ncf'])
+        assert Sale.query.count() == 1
+        assert db.session.get(Product, product_id).stock == 9
+
+    def test_non_uuid_idempotency_header_is_accepted(self, client, cashier_setup):
+        product_id = cashier_setup['product'].id
+        legacy_key = {'Idempotency-Key': '1760850000000-9f3a2c'}
+
+        first = _express(client, cashier_setup['headers'], _cart(product_id), legacy_key)
+        assert first.status_code == 200, first.get_json()
+        second = _express(client, cashier_setup['headers'], _cart(product_id), legacy_key).get_json()
+
+        assert second['id'] == first.get_json()['id']
+        assert Sale.query.count() == 1
+        assert uuid.UUID(db.session.get(Sale, second['id']).client_uuid).version == 5
+
+    def test_failure_leaves_no_sale_and_no_ncf(self, client, cashier_setup):
+        product_id = cashier_setup['product'].id
+        headers = cashier_setup['headers']
+
+        response = _express(client, headers, _cart(product_id, quantity=11))
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'Stock insuficiente'
+        assert _express(client, headers, _cart(product_id, payment_method='bitcoin')).status_code == 400
+        assert _express(client, headers, _cart(product_id, client_uuid='no-uuid')).status_code == 400
+        assert _express(client, headers, {'items': [], 'payment_method': 'card'}).status_code == 400
+        assert Sale.query.count() == 0
+
+        assert _express(client, headers, _cart(product_id)).get_json()['ncf'] == 'B0200000001'
@@ -0,0 +1,136 @@
+"""
+Tests para el archivo de períodos fiscales cerrados y su lectura en la vista previa DGII 607
+"""
+import pytest
+import gzip
+import json
+import os
+from datetime import date, datetime
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, Category, Sale, SaleItem, NCFSequence, NCFType, NCFLedger,
+                    StockAdjustment, CreditNote)
+import fiscal_archive
+
+
+@pytest.fixture(scope='module')
+def test_app(tmp_path_factory):
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+    app.config['FISCAL_ARCHIVE_DIR'] = str(tmp_path_factory.mktemp('fiscal_archive'))
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def seeded(test_app):
+    """Ventas de enero 2014 (cerrado) y septiembre 2026 (abierto) con artículos, ledger y ajustes"""
+    admin = User(username='admin_archive', email='archive@test.com', role=UserRole.ADMINISTRADOR,
+                 name='Admin Archivo', password_hash='x', active=True)
+    category = Category(name='Bebidas', description='')
+    db.session.add_all([admin, category])
+    db.session.flush()
+    product = Product(name='Refresco', description='', category_id=category.id, price=50.0, cost=20.0, stock=10)
+    sequence = NCFSequence(ncf_type=NCFType.CONSUMO, serie='B02', start_number=1, end_number=100, current_number=3)
+    db.session.add_all([product, sequence])
+    db.session.flush()
+
+    old_sale = Sale(user_id=admin.id, ncf='B0200000001', subtotal=100.0, tax_amount=18.0, total=118.0,
+                    status='completed', customer_name='Cliente 2014', created_at=datetime(2014, 1, 10, 9, 0))
+    recent_sale = Sale(user_id=admin.id, ncf='B0200000002', subtotal=50.0, tax_amount=9.0, total=59.0,
+                       status='completed', created_at=datetime(2026, 9, 5, 12, 0))
+    db.session.add_all([old_sale, recent_sale])
+    db.session.flush()
+    db.session.add_all([
+        SaleItem(sale_id=old_sale.id, product_id=product.id, quantity=2, unit_price=50.0, total_price=100.0),
+        SaleItem(sale_id=recent_sale.id, product_id=product.id, quantity=1, unit_price=50.0, total_price=50.0),
+        NCFLedger(sequence_id=sequence.id, sale_id=old_sale.id, serie='B02', number=1, ncf='B0200000001',
+                  user_id=admin.id, issued_at=datetime(2014, 1, 10, 9, 0)),
+        NCFLedger(sequence_id=sequence.id, sale_id=recent_sale.id, serie='B02', number=2, ncf='B0200000002',
+                  user_id=admin.id, issued_at=datetime(2026, 9, 5, 12, 0)),
+        StockAdjustment(product_id=product.id, user_id=admin.id, adjustment_type='sale', old_stock=12,
+                        adjustment=-2, new_stock=10, reason='', created_at=datetime(2014, 1, 10, 9, 0)),
+    ])
+    db.session.commit()
+
+    client = test_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = admin.id
+        sess['role'] = admin.role.value
+
+    yield {'client': client, 'admin': admin, 'sequence': sequence, 'old_sale_id': old_sale.id}
+
+    db.session.rollback()
+    for model in (CreditNote, StockAdjustment, NCFLedger, SaleItem, Sale, NCFSequence, Product, Category, User):
+        model.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+class TestFiscalArchive:
+    """Exportación a JSONL comprimido y eliminación de las tablas vivas"""
+
+    def test_closed_months_respect_retention(self, seeded):
+        months = fiscal_archive.closed_months(10, today=date(2026, 10, 19))
+        assert months[0] == (2014, 1)
+        assert months[-1] == (2016, 9)
+
+    def test_archive_period_moves_rows_to_files(self, seeded):
+        summary = fiscal_archive.archive_periods(10, today=date(2026, 10, 19))
+        assert summary['skipped'] == []
+
+        manifest = fiscal_archive.read_manifest(2014, 1)
+        counts = {name: table['rows'] for name, table in manifest['tables'].items()}
+        assert counts == {'sales': 1, 'sale_items': 1, 'ncf_ledger': 1, 'cancelled_ncfs': 0,
+                          'stock_adjustments': 1}
+        assert (2014, 1) in fiscal_archive.archived_months()
+
+        path = os.path.join(app.config['FISCAL_ARCHIVE_DIR'], '2014-01', 'sales.jsonl.gz')
+        with gzip.open(path, 'rt') as archive:
+            assert json.loads(archive.readline())['ncf'] == 'B0200000001'
+
+        db.session.expunge_all()
+        assert [sale.ncf for sale in Sale.query.all()] == ['B0200000002']
+        assert SaleItem.query.count() == 1
+        assert NCFLedger.query.count() == 1
+        assert StockAdjustment.query.count() == 0
+
+    def test_preview_reads_archived_period(self, seeded):
+        fiscal_archive.archive_month(2014, 1)
+
+        response = seeded['client'].get('/dgii/preview/607/2014/1')
+        assert response.status_code == 200
+        assert b'B0200000001' in response.data
+        assert b'Cliente 2014' in response.data
+        assert 'archivo fiscal'.encode() in response.data
+
+        archived = fiscal_archive.archived_sales(2014, 1)
+        assert archived[0].created_at == datetime(2014, 1, 10, 9, 0)
+        assert archived[0].total == 118.0
+
+    def test_credit_note_blocks_month(self, seeded):
+        db.session.add(CreditNote(original_sale_id=seeded['old_sale_id'], ncf_sequence_id=seeded['sequence'].id,
+                                  ncf='B0400000001', note_type=NCFType.NOTA_CREDITO, amount=50.0, total=59.0,
+                                  reason='Devolución', created_by=seeded['admin'].id,
+                                  created_at=datetime(2026, 9, 1, 9, 0)))
+        db.session.commit()
+
+        with pytest.raises(fiscal_archive.ArchiveError):
+            fiscal_archive.archive_month(2014, 1, directory=app.config['FISCAL_ARCHIVE_DIR'] + '-blocked')
+        assert Sale.query.count() == 2
+        assert not os.path.exists(app.config['FISCAL_ARCHIVE_DIR'] + '-blocked/2014-01')
+
+    def test_partitions_are_postgresql_only(self, seeded):
+        with db.engine.begin() as connection:
+            assert fiscal_archive.ensure_partitions(connection) == []
@@ -0,0 +1,158 @@
+"""
+Tests para la capa Idempotency-Key de la API
+"""
+import pytest
+import json
+import os
+from datetime import datetime, timedelta
+from flask import g
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, Category, Sale, SaleItem, CashRegister,
+                    IdempotencyRecord)
+import idempotency
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def cashier(test_app):
+    """Cajero autenticado con caja y un producto"""
+    client = test_app.test_client()
+    user = User(username='cajero_idem', email='idem@test.com', role=UserRole.CAJERO,
+                name='Cajero Idem', password_hash='x')
+    category = Category(name='Idem', description='', active=True)
+    db.session.add_all([user, category])
+    db.session.flush()
+    product = Product(name='Malta', description='', price=60.0, stock=50, product_type='inventariable',
+                      category_id=category.id, active=True)
+    db.session.add_all([product, CashRegister(name='Caja Idem', user_id=user.id, active=True)])
+    db.session.commit()
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['username'] = user.username
+        sess['role'] = user.role.value
+    g.pop('csrf_token', None)
+    headers = {'X-CSRFToken': client.get('/api/csrf').get_json()['csrf_token']}
+
+    yield {'client': client, 'headers': headers, 'product_id': product.id}
+
+    for model in (IdempotencyRecord, SaleItem, Sale, CashRegister, Product, Category, User):
+        model.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def _post(setup, url, payload, key=None):
+    headers = dict(setup['headers'])
+    if key:
+        headers['Idempotency-Key'] = key
+    return setup['client'].post(url, data=json.dumps(payload), content_type='application/json', headers=headers)
+
+
+class TestIdempotencyKey:
+    """Reintentos con la misma clave"""
+
+    def test_retry_replays_create_sale(self, cashier):
+        first = _post(cashier, '/api/sales', {}, key='tablet-1-0001')
+        retry = _post(cashier, '/api/sales', {}, key='tablet-1-0001')
+
+        assert first.status_code == retry.status_code == 200
+        assert retry.get_json()['id'] == first.get_json()['id']
+        assert retry.headers.get('Idempotent-Replayed') == 'true'
+        assert Sale.query.count() == 1
+
+        # Without a key every request runs
+        _post(cashier, '/api/sales', {})
+        assert Sale.query.count() == 2
+
+    def test_retry_does_not_add_line_twice(self, cashier):
+        sale_id = _post(cashier, '/api/sales', {}).get_json()['id']
+        payload = {'product_id': cashier['product_id'], 'quantity': 2}
+        for _ in range(3):
+            response = _post(cashier, f'/api/sales/{sale_id}/items', payload, key='add-line-1')
+            assert response.status_code == 200
+        assert SaleItem.query.filter_by(sale_id=sale_id).one().quantity == 2
+
+    def test_reused_key_with_other_body_is_rejected(self, cashier):
+        sale_id = _post(cashier, '/api/sales', {}).get_json()['id']
+        _post(cashier, f'/api/sales/{sale_id}/items', {'product_id': cashier['product_id'], 'quantity': 1}, key='k1')
+        response = _post(cashier, f'/api/sales/{sale_id}/items',
+                          {'product_id': cashier['product_id'], 'quantity': 5}, key='k1')
+        assert response.status_code == 422
+
+    def test_in_flight_key_returns_conflict(self, cashier):
+        user_id = User.query.filter_by(username='cajero_idem').one().id
+        db.session.add(IdempotencyRecord(key=f'{user_id}:busy', fingerprint='x' * 64, status='processing',
+                                         expires_at=datetime.utcnow() + timedelta(hours=1)))
+        db.session.commit()
+        # Same key but a different request: rejected before looking at the status
+        response = _post(cashier, '/api/sales', {}, key='busy')
+        assert response.status_code == 422
+
+        record = IdempotencyRecord.query.filter_by(key=f'{user_id}:busy').one()
+        with app.test_request_context('/api/sales', method='POST', data='{}', content_type='application/json'):
+            record.fingerprint = idempotency.request_fingerprint()
+        db.session.commit()
+        response = _post(cashier, '/api/sales', {}, key='busy')
+        assert response.status_code == 409
+        assert response.headers['Retry-After'] == '1'
+
+    def test_abandoned_processing_key_is_reclaimed(self, cashier):
+        user_id = User.query.filter_by(username='cajero_idem').one().id
+        with app.test_request_context('/api/sales', method='POST', data='{}', content_type='application/json'):
+            fingerprint = idempotency.request_fingerprint()
+        # A worker killed mid-request never releases its claim
+        db.session.add(IdempotencyRecord(key=f'{user_id}:stale', fingerprint=fingerprint, status='processing',
+                                         created_at=datetime.utcnow() - timedelta(minutes=10),
+                                         expires_at=datetime.utcnow() + timedelta(hours=23)))
+        db.session.commit()
+
+        response = _post(cashier, '/api/sales', {}, key='stale')
+        assert response.status_code == 200
+        assert Sale.query.count() == 1
+        db.session.expire_all()
+        assert IdempotencyRecord.query.filter_by(key=f'{user_id}:stale').one().status == 'completed'
+
+    def test_failed_store_releases_key(self, cashier, monkeypatch):
+        user_id = User.query.filter_by(username='cajero_idem').one().id
+        # Any error while saving the response (here a bad limit) must not leave the key 'processing'
+        monkeypatch.setitem(app.config, 'IDEMPOTENCY_MAX_BODY', None)
+        assert _post(cashier, '/api/sales', {}, key='lost').status_code == 200
+        assert IdempotencyRecord.query.filter_by(key=f'{user_id}:lost').count() == 0
+
+        monkeypatch.undo()
+        assert _post(cashier, '/api/sales', {}, key='lost').status_code == 200
+        assert Sale.query.count() == 2
+
+    def test_errors_are_replayed_but_expired_keys_are_purged(self, cashier):
+        response = _post(cashier, '/api/sales/999999/items', {'product_id': 1, 'quantity': 1}, key='missing')
+        assert response.status_code == 404
+        assert _post(cashier, '/api/sales/999999/items', {'product_id': 1, 'quantity': 1},
+                     key='missing').headers.get('Idempotent-Replayed') == 'true'
+
+        IdempotencyRecord.query.update({'expires_at': datetime.utcnow() - timedelta(minutes=1)})
+        db.session.commit()
+        assert idempotency.purge_expired() == 1
+        assert IdempotencyRecord.query.count() == 0
+
+    def test_invalid_key(self, cashier):
+        assert _post(cashier, '/api/sales', {}, key='x' * 101).status_code == 400
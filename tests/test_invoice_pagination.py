@@ -0,0 +1,145 @@
+"""
+Tests para paginación keyset del listado de facturas y agregados diarios de ventas
+"""
+import pytest
+import os
+from datetime import datetime, timedelta
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import db, Sale, CashRegister, SalesDailyAggregate, User, UserRole
+from utils import encode_keyset_cursor, decode_keyset_cursor, keyset_paginate
+import sales_aggregates
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def sales(test_app):
+    """Crea 25 ventas completadas repartidas en 3 días, con fechas repetidas para probar desempate por id"""
+    user = User(username='cajero_paginacion', email='paginacion@test.com',
+                role=UserRole.CAJERO, name='Cajero Paginación', password_hash='x')
+    register = CashRegister(name='Caja Paginación', active=True)
+    db.session.add_all([user, register])
+    db.session.flush()
+
+    base = datetime(2025, 3, 10, 12, 0, 0)
+    created = []
+    for i in range(25):
+        sale = Sale(
+            cash_register_id=register.id,
+            user_id=user.id,
+            subtotal=100.0,
+            total=118.0,
+            status='completed',
+            created_at=base + timedelta(hours=(i // 2) * 3)
+        )
+        db.session.add(sale)
+        created.append(sale)
+    db.session.commit()
+
+    yield register, created
+
+    SalesDailyAggregate.query.delete()
+    Sale.query.delete()
+    CashRegister.query.delete()
+    User.query.delete()
+    db.session.commit()
+
+
+class TestKeysetCursor:
+    """Tests para codificación de cursores"""
+
+    def test_roundtrip(self):
+        created_at = datetime(2025, 1, 31, 23, 59, 59, 123456)
+        cursor = encode_keyset_cursor(created_at, 42)
+        assert decode_keyset_cursor(cursor) == (created_at, 42)
+
+    def test_invalid_cursor(self):
+        assert decode_keyset_cursor('no-es-un-cursor') is None
+        assert decode_keyset_cursor('') is None
+        assert decode_keyset_cursor(None) is None
+
+
+class TestKeysetPaginate:
+    """Tests para keyset_paginate sobre (created_at, id)"""
+
+    def test_walks_all_pages_without_gaps_or_duplicates(self, sales):
+        _, created = sales
+        expected = sorted(created, key=lambda s: (s.created_at, s.id), reverse=True)
+
+        seen = []
+        cursor = None
+        while True:
+            page = keyset_paginate(Sale.query, Sale, cursor=cursor, per_page=10)
+            seen.extend(page.items)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        assert [s.id for s in seen] == [s.id for s in expected]
+
+    def test_first_page_flags(self, sales):
+        page = keyset_paginate(Sale.query, Sale, per_page=10)
+        assert len(page.items) == 10
+        assert page.has_next is True
+        assert page.has_prev is False
+        assert page.prev_cursor is None
+
+    def test_prev_returns_previous_page(self, sales):
+        first = keyset_paginate(Sale.query, Sale, per_page=10)
+        second = keyset_paginate(Sale.query, Sale, cursor=first.next_cursor, per_page=10)
+        back = keyset_paginate(Sale.query, Sale, cursor=second.prev_cursor, direction='prev', per_page=10)
+
+        assert [s.id for s in back.items] == [s.id for s in first.items]
+        assert back.has_prev is False
+        assert back.has_next is True
+
+
+class TestSalesDailyAggregates:
+    """Tests para los agregados diarios de ventas completadas"""
+
+    def test_rebuild_matches_sales(self, sales):
+        register, created = sales
+        sales_aggregates.rebuild_daily_aggregates()
+
+        total_sales, total_amount = sales_aggregates.get_completed_totals(cash_register_id=register.id)
+        assert total_sales == len(created)
+        assert total_amount == pytest.approx(118.0 * len(created))
+
+    def test_date_range_filter(self, sales):
+        register, created = sales
+        sales_aggregates.rebuild_daily_aggregates()
+
+        day = datetime(2025, 3, 10)
+        total_sales, _ = sales_aggregates.get_completed_totals(date_from=day, date_to=day)
+        assert total_sales == len([s for s in created if s.created_at.date() == day.date()])
+
+    def test_record_completed_and_cancelled(self, sales):
+        register, created = sales
+        sales_aggregates.rebuild_daily_aggregates()
+        before_count, before_amount = sales_aggregates.get_completed_totals()
+
+        sale = created[0]
+        sales_aggregates.record_cancelled_sale(sale)
+        db.session.commit()
+        assert sales_aggregates.get_completed_totals() == (before_count - 1, pytest.approx(before_amount - 118.0))
+
+        sales_aggregates.record_completed_sale(sale)
+        db.session.commit()
+        assert sales_aggregates.get_completed_totals() == (before_count, pytest.approx(before_amount))
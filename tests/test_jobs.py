@@ -0,0 +1,157 @@
+"""
+Tests para los trabajos en segundo plano (modo async de reportes, exportaciones y Bluetooth)
+"""
+import pytest
+import json
+import os
+from flask import g
+from sqlalchemy import update
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import db, User, UserRole, BackgroundJob
+import jobs
+import thermal_printer
+
+
+@pytest.fixture(scope='module')
+def test_app(tmp_path_factory):
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+    # Jobs run only when the test calls work_once
+    app.config['JOBS_IN_PROCESS_WORKERS'] = 0
+    app.config['JOBS_ARTIFACT_DIR'] = str(tmp_path_factory.mktemp('job_artifacts'))
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _login(test_app, user):
+    client = test_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['username'] = user.username
+        sess['role'] = user.role.value
+    return client
+
+
+@pytest.fixture
+def admin(test_app):
+    """Administrador y cajero autenticados"""
+    admin_user = User(username='admin_jobs', email='jobs@test.com', role=UserRole.ADMINISTRADOR,
+                      name='Admin Jobs', password_hash='x', active=True)
+    cashier = User(username='cajero_jobs', email='cajero_jobs@test.com', role=UserRole.CAJERO,
+                   name='Cajero Jobs', password_hash='x', active=True)
+    db.session.add_all([admin_user, cashier])
+    db.session.commit()
+
+    yield {'client': _login(test_app, admin_user), 'cashier': _login(test_app, cashier)}
+
+    g.pop('background_job', None)
+    db.session.rollback()
+    for model in (BackgroundJob, User):
+        model.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def _post(client, url, payload):
+    return client.post(url, data=json.dumps(payload), content_type='application/json')
+
+
+def _status(client, job_id):
+    db.session.expunge_all()
+    return client.get(f'/api/jobs/{job_id}').get_json()
+
+
+class TestAsyncViews:
+    """Vistas existentes ejecutadas como trabajo"""
+
+    def test_scan_runs_in_worker(self, admin, monkeypatch):
+        monkeypatch.setattr(thermal_printer, 'scan_bluetooth_devices',
+                            lambda scan_duration=8: [{'mac': '00:11:22:33:44:55', 'name': 'Impresora'}])
+
+        response = _post(admin['client'], '/admin/api/bluetooth/scan', {'scan_duration': 2, 'async': True})
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+        assert _status(admin['client'], job_id)['status'] == 'queued'
+
+        assert jobs.work_once('test-worker') is True
+        status = _status(admin['client'], job_id)
+        assert status['status'] == 'succeeded'
+        assert status['progress'] == 100
+        assert status['result']['count'] == 1
+
+    def test_export_artifact_download(self, admin):
+        response = _post(admin['client'], '/dgii/export/606/excel?async=1', {'period': '2026-09'})
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+
+        jobs.work_once('test-worker')
+        status = _status(admin['client'], job_id)
+        assert status['status'] == 'succeeded'
+        assert status['artifact_name'] == '606_2026_09.xlsx'
+
+        download = admin['client'].get(status['artifact_url'])
+        assert download.status_code == 200
+        assert download.data[:2] == b'PK'  # xlsx is a zip
+
+    def test_without_async_stays_synchronous(self, admin):
+        response = _post(admin['client'], '/dgii/export/606/excel', {'period': '2026-09'})
+        assert response.status_code == 200
+        assert BackgroundJob.query.count() == 0
+
+    def test_failed_view_fails_job(self, admin):
+        response = _post(admin['cashier'], '/admin/api/bluetooth/scan?async=1', {})
+        job_id = response.get_json()['job_id']
+
+        jobs.work_once('test-worker')
+        status = _status(admin['cashier'], job_id)
+        assert status['status'] == 'failed'
+        assert status['error'] == 'No autorizado'
+
+    def test_jobs_are_private(self, admin):
+        response = _post(admin['cashier'], '/admin/api/bluetooth/scan?async=1', {})
+        job_id = response.get_json()['job_id']
+        assert _status(admin['client'], job_id)['id'] == job_id  # administrators see every job
+
+        admin_job = _post(admin['client'], '/admin/api/bluetooth/scan?async=1', {}).get_json()['job_id']
+        assert admin['cashier'].get(f'/api/jobs/{admin_job}').status_code == 404
+
+
+class TestCancellation:
+    """Cancelación en cola y en el siguiente punto de avance"""
+
+    def test_cancel_queued(self, admin):
+        job_id = _post(admin['client'], '/admin/api/bluetooth/scan?async=1', {}).get_json()['job_id']
+
+        response = admin['client'].post(f'/api/jobs/{job_id}/cancel')
+        assert response.get_json()['job']['status'] == 'cancelled'
+        assert jobs.work_once('test-worker') is False
+        assert admin['client'].post(f'/api/jobs/{job_id}/cancel').status_code == 409
+
+    def test_cancel_running_at_checkpoint(self, admin, monkeypatch):
+        def slow_scan(scan_duration=8):
+            # The user cancels while the scan runs; the next checkpoint stops the job
+            table = BackgroundJob.__table__
+            with db.engine.begin() as connection:
+                connection.execute(update(table).values(cancel_requested=True))
+            jobs.report_progress(60, 'Procesando dispositivos')
+            return []
+
+        monkeypatch.setattr(thermal_printer, 'scan_bluetooth_devices', slow_scan)
+        job_id = _post(admin['client'], '/admin/api/bluetooth/scan?async=1', {}).get_json()['job_id']
+
+        jobs.work_once('test-worker')
+        status = _status(admin['client'], job_id)
+        assert status['status'] == 'cancelled'
+        assert status['progress'] == 60
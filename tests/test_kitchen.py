@@ -0,0 +1,193 @@
+"""
+Tests para la pantalla de cocina (KDS): tickets por estación, cursor de cambios y despacho
+"""
+import pytest
+import json
+import os
+from flask import g
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, Category, Sale, SaleItem, Table,
+                    KitchenTicket, KitchenTicketLine, KitchenCursor)
+import product_codes
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def order(test_app):
+    """Pedido pendiente de la mesa 4 con un plato (cocina) y una bebida (bar)"""
+    client = test_app.test_client()
+    waiter = User(username='mesero_kds', email='kds@test.com', role=UserRole.MESERO,
+                  name='Mesero KDS', password_hash='x')
+    food = Category(name='Platos', description='', active=True)
+    drinks = Category(name='Bebidas', description='', active=True, kitchen_station='bar')
+    table = Table(number=4, name='Mesa 4')
+    db.session.add_all([waiter, food, drinks, table])
+    db.session.flush()
+    mofongo = Product(name='Mofongo', description='', price=450.0, stock=50, product_type='consumible',
+                      category_id=food.id, active=True)
+    juice = Product(name='Jugo de chinola', description='', price=150.0, stock=50, product_type='consumible',
+                    category_id=drinks.id, active=True)
+    db.session.add_all([mofongo, juice])
+    db.session.flush()
+    sale = Sale(user_id=waiter.id, table_id=table.id, subtotal=0, total=0, status='pending')
+    db.session.add(sale)
+    db.session.flush()
+    db.session.add_all([
+        SaleItem(sale_id=sale.id, product_id=mofongo.id, quantity=2, unit_price=450.0, total_price=900.0),
+        SaleItem(sale_id=sale.id, product_id=juice.id, quantity=1, unit_price=150.0, total_price=150.0),
+    ])
+    db.session.commit()
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = waiter.id
+        sess['username'] = waiter.username
+        sess['role'] = waiter.role.value
+    g.pop('csrf_token', None)
+    headers = {'X-CSRFToken': client.get('/api/csrf').get_json()['csrf_token']}
+
+    yield {'client': client, 'headers': headers, 'sale_id': sale.id, 'mofongo': mofongo.id, 'juice': juice.id}
+
+    db.session.rollback()
+    for model in (KitchenTicketLine, KitchenTicket, KitchenCursor, SaleItem, Sale, Product, Category, Table, User):
+        model.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+    product_codes.warm()
+
+
+def _post(setup, url, payload=None):
+    return setup['client'].post(url, data=json.dumps(payload or {}), content_type='application/json',
+                                headers=setup['headers'])
+
+
+def _send(setup):
+    response = _post(setup, f"/api/sales/{setup['sale_id']}/send-to-kitchen")
+    assert response.status_code == 200
+    db.session.expunge_all()
+
+
+def _tickets(setup, since=0, station=None):
+    url = f'/api/kitchen/tickets?since={since}' + (f'&station={station}' if station else '')
+    response = setup['client'].get(url)
+    assert response.status_code == 200
+    return response
+
+
+class TestProjection:
+    """Tickets creados al enviar y actualizados al cambiar las líneas"""
+
+    def test_not_sent_orders_have_no_tickets(self, order):
+        data = _tickets(order).get_json()
+        assert data == {'cursor': 0, 'full': True, 'tickets': []}
+
+    def test_send_creates_one_ticket_per_station(self, order):
+        _send(order)
+        data = _tickets(order).get_json()
+        assert data['full'] is True
+        tickets = {ticket['station']: ticket for ticket in data['tickets']}
+        assert set(tickets) == {'cocina', 'bar'}
+        assert tickets['cocina']['table'] == 'Mesa 4'
+        assert [(line['name'], line['qty']) for line in tickets['cocina']['lines']] == [('Mofongo', 2)]
+
+        bar = _tickets(order, station='bar').get_json()['tickets']
+        assert [ticket['station'] for ticket in bar] == ['bar']
+
+    def test_unchanged_kitchen_gets_tiny_delta(self, order):
+        _send(order)
+        cursor = _tickets(order).get_json()['cursor']
+        response = _tickets(order, since=cursor)
+        assert response.get_json() == {'cursor': cursor, 'full': False, 'tickets': []}
+        assert len(response.data) < 64
+
+        # Sending again without changes touches nothing
+        _send(order)
+        assert _tickets(order, since=cursor).get_json()['tickets'] == []
+
+    def test_item_changes_reach_the_ticket(self, order):
+        _send(order)
+        cursor = _tickets(order).get_json()['cursor']
+
+        response = _post(order, f"/api/sales/{order['sale_id']}/items",
+                         {'product_id': order['mofongo'], 'quantity': 1})
+        assert response.status_code == 200
+        data = _tickets(order, since=cursor).get_json()
+        assert [ticket['station'] for ticket in data['tickets']] == ['cocina']
+        assert sum(line['qty'] for line in data['tickets'][0]['lines'] if not line['voided']) == 3
+
+        juice_line = SaleItem.query.filter_by(sale_id=order['sale_id'], product_id=order['juice']).one()
+        response = order['client'].delete(f"/api/sales/{order['sale_id']}/items/{juice_line.id}",
+                                          headers=order['headers'])
+        assert response.status_code == 200
+        data = _tickets(order, since=data['cursor']).get_json()
+        assert data['tickets'] == [{'id': data['tickets'][0]['id'], 'status': 'cancelled'}]
+
+    def test_scanned_items_reach_the_ticket(self, order):
+        _send(order)
+        cursor = _tickets(order).get_json()['cursor']
+        mofongo = db.session.get(Product, order['mofongo'])
+        product_codes.set_product_codes(mofongo, '7460002000014', None)
+        product_codes.products_changed([mofongo.id])
+        db.session.commit()
+
+        response = _post(order, f"/api/sales/{order['sale_id']}/scan", {'code': '7460002000014'})
+        assert response.status_code == 200, response.get_json()
+        data = _tickets(order, since=cursor).get_json()
+        assert [ticket['station'] for ticket in data['tickets']] == ['cocina']
+        assert sum(line['qty'] for line in data['tickets'][0]['lines'] if not line['voided']) == 3
+
+
+class TestActions:
+    """Despachar y recuperar tickets"""
+
+    def test_bump_and_recall(self, order):
+        _send(order)
+        data = _tickets(order).get_json()
+        ids = [ticket['id'] for ticket in data['tickets']]
+
+        first = _post(order, f'/api/kitchen/tickets/{ids[0]}/bump').get_json()
+        assert first['ticket'] == {'id': ids[0], 'status': 'bumped'}
+        assert first['order_status'] == 'sent_to_kitchen'
+        assert _post(order, f'/api/kitchen/tickets/{ids[0]}/bump').status_code == 409
+
+        last = _post(order, f'/api/kitchen/tickets/{ids[1]}/bump').get_json()
+        assert last['order_status'] == 'ready'
+        delta = _tickets(order, since=data['cursor']).get_json()
+        assert {ticket['status'] for ticket in delta['tickets']} == {'bumped'}
+
+        recalled = _post(order, f'/api/kitchen/tickets/{ids[1]}/recall').get_json()
+        assert recalled['ticket']['status'] == 'active'
+        assert recalled['order_status'] == 'in_preparation'
+        assert [ticket['id'] for ticket in _tickets(order).get_json()['tickets']] == [ids[1]]
+
+    def test_new_items_after_bump_open_a_new_ticket(self, order):
+        _send(order)
+        ids = [ticket['id'] for ticket in _tickets(order).get_json()['tickets']]
+        for ticket_id in ids:
+            _post(order, f'/api/kitchen/tickets/{ticket_id}/bump')
+
+        _post(order, f"/api/sales/{order['sale_id']}/items", {'product_id': order['juice'], 'quantity': 2})
+        tickets = _tickets(order).get_json()['tickets']
+        assert len(tickets) == 1 and tickets[0]['id'] not in ids
+        assert [(line['name'], line['qty']) for line in tickets[0]['lines']] == [('Jugo de chinola', 2)]
+
+    def test_requires_login(self, order):
+        assert app.test_client().get('/api/kitchen/tickets').status_code == 401
@@ -0,0 +1,197 @@
+"""
+Tests para la proyección de alertas de stock bajo: cruces de umbral al mover stock y cursor de cambios
+"""
+import pytest
+import json
+import os
+from flask import g
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, Category, Sale, SaleItem, CashRegister, CashSession,
+                    NCFSequence, NCFType, SalesDailyAggregate, StockAdjustment, CancelledNCF, OutboxEvent,
+                    LowStockAlert, StockAlertEvent, StockAlertCursor)
+import low_stock
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def pos(test_app):
+    """Caja abierta, secuencia B02, ron (stock 10, mínimo 4) y café consumible"""
+    cashier = User(username='cajero_alertas', email='alertas@test.com', role=UserRole.CAJERO,
+                   name='Cajero Alertas', password_hash='x')
+    admin = User(username='admin_alertas', email='admin_alertas@test.com', role=UserRole.ADMINISTRADOR,
+                 name='Admin Alertas', password_hash='x')
+    category = Category(name='Licores', description='', active=True)
+    db.session.add_all([cashier, admin, category])
+    db.session.flush()
+    rum = Product(name='Ron', description='', price=500.0, stock=10, min_stock=4, product_type='inventariable',
+                  category_id=category.id, active=True)
+    coffee = Product(name='Café', description='', price=75.0, stock=0, min_stock=5, product_type='consumible',
+                     category_id=category.id, active=True)
+    db.session.add_all([
+        rum, coffee,
+        CashRegister(name='Caja Alertas', user_id=cashier.id, active=True),
+        NCFSequence(ncf_type=NCFType.CONSUMO, serie='B02', start_number=1, end_number=1000,
+                    current_number=1, active=True)
+    ])
+    db.session.commit()
+
+    clients = {}
+    for key, user in (('cashier', cashier), ('admin', admin)):
+        client = test_app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user.id
+            sess['username'] = user.username
+            sess['role'] = user.role.value
+        g.pop('csrf_token', None)
+        clients[key] = (client, {'X-CSRFToken': client.get('/api/csrf').get_json()['csrf_token']})
+    _post(clients['cashier'], '/api/cash-register/open', {'opening_amount': 0})
+
+    yield {'clients': clients, 'rum': rum.id, 'coffee': coffee.id}
+
+    db.session.rollback()
+    for model in (StockAlertEvent, LowStockAlert, StockAlertCursor, OutboxEvent, StockAdjustment, CancelledNCF,
+                  SaleItem, SalesDailyAggregate, Sale, CashSession, NCFSequence, Product, Category,
+                  CashRegister, User):
+        model.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def _post(client_headers, url, payload):
+    client, headers = client_headers
+    return client.post(url, data=json.dumps(payload), content_type='application/json', headers=headers)
+
+
+def _sell(pos, quantity):
+    cashier = pos['clients']['cashier']
+    sale_id = _post(cashier, '/api/sales', {}).get_json()['id']
+    for product_id, amount in ((pos['rum'], quantity), (pos['coffee'], 1)):
+        assert _post(cashier, f'/api/sales/{sale_id}/items',
+                     {'product_id': product_id, 'quantity': amount}).status_code == 200
+    response = _post(cashier, f'/api/sales/{sale_id}/finalize', {'payment_method': 'cash', 'cash_received': 10000,
+                                                                  'ncf_type': 'consumo'})
+    assert response.status_code == 200, response.get_json()
+    return sale_id
+
+
+def _adjust(pos, adjustment):
+    response = _post(pos['clients']['admin'], f"/inventory/api/stock/{pos['rum']}/adjust",
+                     {'adjustment': adjustment, 'reason': 'Conteo físico'})
+    assert response.status_code == 200, response.get_json()
+
+
+def _alerts():
+    db.session.expunge_all()
+    return {alert.product_id: alert.level for alert in LowStockAlert.query.all()}
+
+
+def _crossings():
+    return [(event.previous_level, event.level, event.stock)
+            for event in StockAlertEvent.query.order_by(StockAlertEvent.id).all()]
+
+
+def _api(pos, since=0):
+    client, _ = pos['clients']['admin']
+    response = client.get(f'/inventory/api/stock/alerts?since={since}')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+class TestLevels:
+    """Umbrales iguales a los de las consultas anteriores"""
+
+    def test_level_for(self):
+        assert low_stock.level_for(5, 4) is None
+        assert low_stock.level_for(4, 4) == low_stock.LOW
+        assert low_stock.level_for(3, 4) == low_stock.LOW
+        assert low_stock.level_for(2, 4) == low_stock.CRITICAL
+        assert low_stock.level_for(2, 5) == low_stock.CRITICAL  # 2 <= 2.5
+        assert low_stock.level_for(0, 0) == low_stock.CRITICAL
+        assert low_stock.level_for(0, 5, product_type='consumible') is None
+        assert low_stock.level_for(0, 5, active=False) is None
+
+
+class TestProjection:
+    """La proyección se mantiene en la misma transacción que mueve el stock"""
+
+    def test_sale_above_minimum_writes_nothing(self, pos):
+        _sell(pos, 1)
+        assert _alerts() == {}
+        assert _crossings() == []
+        assert low_stock.current_revision() == 0
+
+    def test_sales_and_cancel_cross_thresholds(self, pos):
+        _sell(pos, 6)  # 10 -> 4
+        assert _alerts() == {pos['rum']: 'low'}
+        critical_sale = _sell(pos, 2)  # 4 -> 2
+        assert _alerts() == {pos['rum']: 'critical'}
+
+        response = _post(pos['clients']['cashier'], f'/api/sales/{critical_sale}/cancel', {'reason': 'Error de cobro'})
+        assert response.status_code == 200, response.get_json()
+        assert _alerts() == {pos['rum']: 'low'}
+        # Consumibles never enter the alert set
+        assert _crossings() == [(None, 'low', 4), ('low', 'critical', 2), ('critical', 'low', 4)]
+
+    def test_adjustment_restores_stock(self, pos):
+        _adjust(pos, -8)
+        assert _alerts() == {pos['rum']: 'critical'}
+        _adjust(pos, 20)
+        assert _alerts() == {}
+        assert _crossings() == [(None, 'critical', 2), ('critical', None, 22)]
+
+    def test_rebuild_seeds_existing_products(self, pos):
+        Product.query.filter_by(id=pos['rum']).update({'stock': 3})
+        db.session.commit()
+        assert low_stock.rebuild() == 1
+        db.session.commit()
+        assert _alerts() == {pos['rum']: 'low'}
+        assert low_stock.rebuild() == 0
+
+
+class TestEndpoint:
+    """Lista vigente más los cruces desde el cursor del cliente"""
+
+    def test_full_list_then_delta(self, pos):
+        data = _api(pos)
+        assert (data['total_alerts'], data['full'], data['changes']) == (0, True, [])
+
+        _adjust(pos, -6)
+        data = _api(pos)
+        assert data['full'] is True
+        assert [(product['name'], product['status'], product['category']) for product in data['products']] == \
+            [('Ron', 'low', 'Licores')]
+        assert (data['low_count'], data['critical_count']) == (1, 0)
+        cursor = data['cursor']
+
+        assert _api(pos, since=cursor)['changes'] == []
+        _adjust(pos, 10)
+        data = _api(pos, since=cursor)
+        assert data['full'] is False and data['products'] == []
+        assert [(change['product_id'], change['from'], change['to']) for change in data['changes']] == \
+            [(pos['rum'], 'low', None)]
+
+    def test_stock_alerts_page(self, pos):
+        _adjust(pos, -9)
+        client, _ = pos['clients']['admin']
+        response = client.get('/inventory/stock-alerts')
+        assert response.status_code == 200
+        assert 'Ron' in response.get_data(as_text=True)
@@ -0,0 +1,196 @@
+"""
+Tests para el verificador de huecos y duplicados de secuencias NCF
+"""
+import pytest
+import os
+from datetime import datetime
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Sale, NCFSequence, NCFType, NCFLedger, CancelledNCF, CreditNote,
+                    NCFIntegrityCheckpoint, NCFIntegrityIssue)
+import fiscal_archive
+import ncf_integrity
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def sequence(test_app):
+    """Secuencia B01 1-1000 y un administrador"""
+    admin = User(username='admin_ncf', email='admin_ncf@test.com', role=UserRole.ADMINISTRADOR,
+                 name='Admin NCF', password_hash='x')
+    sequence = NCFSequence(ncf_type=NCFType.CREDITO_FISCAL, serie='B01', start_number=1, end_number=1000,
+                           current_number=1, active=True)
+    db.session.add_all([admin, sequence])
+    db.session.commit()
+
+    yield {'sequence': sequence, 'admin': admin}
+
+    db.session.rollback()
+    for model in (NCFIntegrityIssue, NCFIntegrityCheckpoint, NCFLedger, CancelledNCF, CreditNote, Sale,
+                  NCFSequence, User):
+        model.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def _sale(setup, number, serie='B01', created_at=None):
+    sale = Sale(user_id=setup['admin'].id, ncf_sequence_id=setup['sequence'].id, ncf=f'{serie}{number:08d}',
+                subtotal=100.0, total=118.0, status='completed', created_at=created_at or datetime.utcnow())
+    db.session.add(sale)
+    db.session.flush()
+    return sale
+
+
+def _issue(setup, numbers):
+    """Emite los números como ventas y deja el contador en el siguiente"""
+    sales = [_sale(setup, number) for number in numbers]
+    setup['sequence'].current_number = max(numbers) + 1
+    db.session.commit()
+    return sales
+
+
+def _issues():
+    return sorted((issue.kind, issue.number_from, issue.number_to) for issue in NCFIntegrityIssue.query.all())
+
+
+class TestCheck:
+    """Huecos, duplicados y números sin venta"""
+
+    def test_clean_sequence(self, sequence):
+        sales = _issue(sequence, [1, 2, 3, 4])
+        note = CreditNote(original_sale_id=sales[0].id, ncf_sequence_id=sequence['sequence'].id,
+                          ncf='A0100000005', note_type=NCFType.NOTA_CREDITO, amount=100.0, total=118.0,
+                          reason='Devolución', created_by=sequence['admin'].id)
+        cancelled = CancelledNCF(ncf=sales[1].ncf, ncf_type=NCFType.CREDITO_FISCAL,
+                                 ncf_sequence_id=sequence['sequence'].id, original_sale_id=sales[1].id,
+                                 reason='Error de cobro', cancelled_by=sequence['admin'].id)
+        db.session.add_all([note, cancelled])
+        sequence['sequence'].current_number = 6
+        db.session.commit()
+
+        result = ncf_integrity.check_sequence(sequence['sequence'])
+        assert result['checked_through'] == 5
+        assert result['found'] == {'gap': 0, 'duplicate': 0, 'unlinked': 0}
+        assert _issues() == []
+
+    def test_gap_duplicate_and_unlinked(self, sequence):
+        sales = _issue(sequence, [1, 2, 4, 5])
+        # A credit note that reused sale 4's number, and a ledger entry no sale carries
+        db.session.add_all([
+            CreditNote(original_sale_id=sales[0].id, ncf_sequence_id=sequence['sequence'].id, ncf='A0100000004',
+                       note_type=NCFType.NOTA_CREDITO, amount=10.0, total=11.8, reason='Error',
+                       created_by=sequence['admin'].id),
+            NCFLedger(sequence_id=sequence['sequence'].id, serie='B01', number=6, ncf='B0100000006',
+                      user_id=sequence['admin'].id)
+        ])
+        sequence['sequence'].current_number = 7
+        db.session.commit()
+
+        result = ncf_integrity.check_sequence(sequence['sequence'])
+        assert result['found'] == {'gap': 1, 'duplicate': 1, 'unlinked': 1}
+        assert _issues() == [('duplicate', 4, 4), ('gap', 3, 3), ('unlinked', 6, 6)]
+        duplicate = NCFIntegrityIssue.query.filter_by(kind='duplicate').one()
+        assert duplicate.detail['sales'] == [sales[2].id] and len(duplicate.detail['credit_notes']) == 1
+
+    def test_chunks_match_single_pass(self, sequence):
+        _issue(sequence, [1, 2, 3, 6, 7, 10, 11])
+        result = ncf_integrity.check_sequence(sequence['sequence'], chunk_size=2)
+        assert result['checked_through'] == 11
+        assert _issues() == [('gap', 4, 5), ('gap', 8, 9)]
+
+
+class TestIncremental:
+    """Checkpoint por secuencia"""
+
+    def test_only_new_numbers_and_reopened_gaps(self, sequence):
+        _issue(sequence, [1, 2, 4])
+        ncf_integrity.check_sequence(sequence['sequence'])
+        assert _issues() == [('gap', 3, 3)]
+
+        # The missing sale committed late, and two more were issued
+        _issue(sequence, [3, 5, 7])
+        result = ncf_integrity.check_sequence(sequence['sequence'])
+        assert result['checked_from'] == 5
+        assert result['gaps_filled'] == 1
+        assert _issues() == [('gap', 6, 6)]
+        assert db.session.get(NCFIntegrityCheckpoint, sequence['sequence'].id).checked_through == 7
+
+    def test_counter_ahead_is_pending_not_gap(self, sequence):
+        _issue(sequence, [1, 2])
+        sequence['sequence'].current_number = 5  # numbers 3 and 4 handed out, sales not committed yet
+        db.session.commit()
+
+        result = ncf_integrity.check_sequence(sequence['sequence'])
+        assert result['pending'] == 2
+        assert _issues() == []
+
+        _issue(sequence, [3, 4])
+        assert ncf_integrity.check_sequence(sequence['sequence'])['checked_through'] == 4
+
+    def test_full_run_rebuilds_issues(self, sequence):
+        sales = _issue(sequence, [1, 2, 4])
+        ncf_integrity.check_sequence(sequence['sequence'])
+        db.session.delete(sales[1])
+        db.session.commit()
+
+        # Incremental runs do not look behind the checkpoint; a full run does
+        ncf_integrity.check_sequence(sequence['sequence'])
+        assert _issues() == [('gap', 3, 3)]
+        ncf_integrity.check_sequence(sequence['sequence'], full=True)
+        assert _issues() == [('gap', 2, 3)]
+
+    def test_audit_endpoint(self, sequence):
+        _issue(sequence, [1, 3])
+        ncf_integrity.check_sequence(sequence['sequence'])
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = sequence['admin'].id
+            sess['role'] = sequence['admin'].role.value
+
+        data = client.get('/fiscal-audit/api/ncf-integrity').get_json()
+        assert [(issue['kind'], issue['number_from']) for issue in data['issues']] == [('gap', 2)]
+        assert data['sequences'][str(sequence['sequence'].id)]['gap'] == 1
+
+
+class TestArchivedPeriods:
+    """Números de meses archivados por fiscal_archive"""
+
+    def test_full_run_counts_archived_numbers(self, sequence, tmp_path, monkeypatch):
+        monkeypatch.setitem(app.config, 'FISCAL_ARCHIVE_DIR', str(tmp_path))
+        archived = [_sale(sequence, number, created_at=datetime(2014, 1, 10)) for number in (1, 2, 4)]
+        db.session.add(NCFLedger(sequence_id=sequence['sequence'].id, serie='B01', number=2, ncf='B0100000002',
+                                 sale_id=archived[1].id, user_id=sequence['admin'].id,
+                                 issued_at=datetime(2014, 1, 10)))
+        _issue(sequence, [5, 6])
+        fiscal_archive.archive_month(2014, 1)
+        assert Sale.query.count() == 2
+
+        assert ncf_integrity.main(['--full']) == 1
+        # Only the number missing inside the archived month is a gap
+        assert _issues() == [('gap', 3, 3)]
+
+        # A live sale reusing an archived number is a duplicate
+        _sale(sequence, 2)
+        db.session.commit()
+        ncf_integrity.check_sequence(sequence['sequence'], full=True)
+        assert _issues() == [('duplicate', 2, 2), ('gap', 3, 3)]
+        duplicate = NCFIntegrityIssue.query.filter_by(kind='duplicate').one()
+        assert (duplicate.detail['archived_documents'], duplicate.detail['archived_records']) == (1, 1)
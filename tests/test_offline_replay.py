@@ -0,0 +1,161 @@
+"""
+Tests para la reproducción idempotente de ventas capturadas offline
+"""
+import pytest
+import json
+import os
+import uuid
+from flask import g
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, Category, Sale, SaleItem, CashRegister,
+                    CashSession, NCFSequence, NCFType, SalesDailyAggregate)
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(test_app):
+    return test_app.test_client()
+
+
+@pytest.fixture
+def cashier_setup(client):
+    """Cajero autenticado con caja, productos y secuencia NCF de consumo"""
+    cashier = User(username='cajero_offline', email='offline@test.com', role=UserRole.CAJERO,
+                   name='Cajero Offline', password_hash='x')
+    db.session.add(cashier)
+    db.session.flush()
+
+    register = CashRegister(name='Caja Offline', user_id=cashier.id, active=True)
+    category = Category(name='Bebidas Offline', description='', active=True)
+    db.session.add_all([register, category])
+    db.session.flush()
+
+    product = Product(name='Refresco', description='', price=100.0, stock=10, min_stock=1,
+                      product_type='inventariable', category_id=category.id, active=True)
+    sequence = NCFSequence(ncf_type=NCFType.CONSUMO, serie='B02', start_number=1,
+                           end_number=1000, current_number=1, active=True)
+    db.session.add_all([product, sequence])
+    db.session.commit()
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = cashier.id
+        sess['username'] = cashier.username
+        sess['role'] = cashier.role.value
+
+    # The module-wide app context shares flask.g across requests; drop any token cached by a previous client
+    g.pop('csrf_token', None)
+    csrf_token = client.get('/api/csrf').get_json()['csrf_token']
+
+    yield {'cashier': cashier, 'register': register, 'product': product,
+           'headers': {'X-CSRFToken': csrf_token}}
+
+    for model in (SaleItem, SalesDailyAggregate, Sale, CashSession,
+                  NCFSequence, Product, Category, CashRegister, User):
+        model.query.delete()
+    db.session.commit()
+
+
+def _envelope(product_id, quantity=1, payment_method='card', **extra):
+    envelope = {
+        'client_uuid': str(uuid.uuid4()),
+        'items': [{'product_id': product_id, 'quantity': quantity}],
+        'payment_method': payment_method,
+        'ncf_type': 'consumo'
+    }
+    envelope.update(extra)
+    return envelope
+
+
+def _replay(client, headers, envelopes):
+    return client.post('/api/sales/offline-replay', data=json.dumps({'sales': envelopes}),
+                       content_type='application/json', headers=headers)
+
+
+class TestOfflineReplay:
+    """Tests del endpoint /api/sales/offline-replay"""
+
+    def test_batch_assigns_ncf_in_order(self, client, cashier_setup):
+        product_id = cashier_setup['product'].id
+        envelopes = [_envelope(product_id), _envelope(product_id, quantity=2)]
+
+        response = _replay(client, cashier_setup['headers'], envelopes)
+        assert response.status_code == 200, response.get_json()
+        payload = response.get_json()
+
+        assert payload['created'] == 2
+        assert [r['client_uuid'] for r in payload['results']] == [e['client_uuid'] for e in envelopes]
+        assert [r['ncf'] for r in payload['results']] == ['B0200000001', 'B0200000002']
+        assert db.session.get(Product, product_id).stock == 7
+
+        sale = db.session.get(Sale, payload['results'][1]['sale_id'])
+        assert sale.status == 'completed'
+        assert sale.cash_register_id == cashier_setup['register'].id
+        assert sale.total == pytest.approx(200.0)
+
+    def test_replaying_same_envelope_is_idempotent(self, client, cashier_setup):
+        envelope = _envelope(cashier_setup['product'].id)
+
+        first = _replay(client, cashier_setup['headers'], [envelope]).get_json()['results'][0]
+        second = _replay(client, cashier_setup['headers'], [envelope, envelope]).get_json()
+
+        assert second['duplicate'] == 2
+        assert all(r['sale_id'] == first['sale_id'] and r['ncf'] == first['ncf'] for r in second['results'])
+        assert Sale.query.filter_by(client_uuid=envelope['client_uuid']).count() == 1
+        assert db.session.get(NCFSequence, Sale.query.first().ncf_sequence_id).current_number == 2
+
+    def test_failed_envelope_does_not_block_batch(self, client, cashier_setup):
+        product_id = cashier_setup['product'].id
+        envelopes = [
+            _envelope(product_id, quantity=50),                # stock insuficiente
+            _envelope(product_id, payment_method='bitcoin'),  # método inválido
+            _envelope(product_id)
+        ]
+
+        payload = _replay(client, cashier_setup['headers'], envelopes).get_json()
+        assert [r['status'] for r in payload['results']] == ['error', 'error', 'created']
+        assert payload['results'][0]['error']['error'] == 'Stock insuficiente'
+        assert payload['results'][1]['error']['field'] == 'payment_method'
+        # The rejected envelopes consumed no NCF
+        assert payload['results'][2]['ncf'] == 'B0200000001'
+        assert Sale.query.filter(Sale.client_uuid == envelopes[0]['client_uuid']).count() == 0
+
+    def test_cash_requires_open_session(self, client, cashier_setup):
+        envelope = _envelope(cashier_setup['product'].id, payment_method='cash', cash_received=200)
+
+        result = _replay(client, cashier_setup['headers'], [envelope]).get_json()['results'][0]
+        assert result['status'] == 'error'
+
+        client.post('/api/cash-register/open', data=json.dumps({'opening_amount': 0}),
+                    content_type='application/json', headers=cashier_setup['headers'])
+        result = _replay(client, cashier_setup['headers'], [envelope]).get_json()['results'][0]
+        assert result['status'] == 'created'
+        assert db.session.get(Sale, result['sale_id']).cash_session_id is not None
+
+    def test_rejects_invalid_batches(self, client, cashier_setup):
+        headers = cashier_setup['headers']
+        assert _replay(client, headers, []).status_code == 400
+        too_many = [_envelope(cashier_setup['product'].id) for _ in range(51)]
+        assert _replay(client, headers, too_many).status_code == 400
+
+        result = _replay(client, headers, [dict(_envelope(1), client_uuid='no-uuid')]).get_json()['results'][0]
+        assert result['status'] == 'error'
+        assert result['error']['field'] == 'client_uuid'
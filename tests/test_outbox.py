@@ -0,0 +1,199 @@
+"""
+Tests para el outbox transaccional: eventos en la transacción de negocio y entrega con cursores
+"""
+import pytest
+import json
+import os
+from flask import g
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, Category, Sale, SaleItem, CashRegister, CashSession,
+                    NCFSequence, NCFType, SalesDailyAggregate, StockAdjustment, CancelledNCF, Supplier,
+                    Purchase, PurchaseItem, OutboxEvent, OutboxConsumer)
+import outbox
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def pos(test_app):
+    """Caja abierta, secuencia B02, un producto inventariable y uno consumible"""
+    cashier = User(username='cajero_outbox', email='outbox@test.com', role=UserRole.CAJERO,
+                   name='Cajero Outbox', password_hash='x')
+    admin = User(username='admin_outbox', email='admin_outbox@test.com', role=UserRole.ADMINISTRADOR,
+                 name='Admin Outbox', password_hash='x')
+    category = Category(name='Outbox', description='', active=True)
+    db.session.add_all([cashier, admin, category])
+    db.session.flush()
+    rum = Product(name='Ron', description='', price=500.0, stock=10, product_type='inventariable',
+                  category_id=category.id, active=True)
+    coffee = Product(name='Café', description='', price=75.0, stock=0, product_type='consumible',
+                     category_id=category.id, active=True)
+    supplier = Supplier(name='Licores del Caribe', rnc='131234567', contact_person='', phone='', email='',
+                        address='', active=True)
+    db.session.add_all([
+        rum, coffee, supplier,
+        CashRegister(name='Caja Outbox', user_id=cashier.id, active=True),
+        NCFSequence(ncf_type=NCFType.CONSUMO, serie='B02', start_number=1, end_number=1000,
+                    current_number=1, active=True)
+    ])
+    db.session.commit()
+
+    clients = {}
+    for key, user in (('cashier', cashier), ('admin', admin)):
+        client = test_app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user.id
+            sess['username'] = user.username
+            sess['role'] = user.role.value
+        g.pop('csrf_token', None)
+        clients[key] = (client, {'X-CSRFToken': client.get('/api/csrf').get_json()['csrf_token']})
+    _post(clients['cashier'], '/api/cash-register/open', {'opening_amount': 0})
+
+    yield {'clients': clients, 'rum': rum.id, 'coffee': coffee.id, 'supplier': supplier.id}
+
+    db.session.rollback()
+    for model in (OutboxEvent, OutboxConsumer, StockAdjustment, CancelledNCF, SaleItem, SalesDailyAggregate,
+                  Sale, CashSession, PurchaseItem, Purchase, Supplier, NCFSequence, Product, Category,
+                  CashRegister, User):
+        model.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+    outbox._gaps.clear()
+    outbox._retry_at.clear()
+
+
+def _post(client_headers, url, payload):
+    client, headers = client_headers
+    return client.post(url, data=json.dumps(payload), content_type='application/json', headers=headers)
+
+
+def _completed_sale(pos):
+    cashier = pos['clients']['cashier']
+    sale_id = _post(cashier, '/api/sales', {}).get_json()['id']
+    for product_id, quantity in ((pos['rum'], 2), (pos['coffee'], 1)):
+        assert _post(cashier, f'/api/sales/{sale_id}/items',
+                     {'product_id': product_id, 'quantity': quantity}).status_code == 200
+    response = _post(cashier, f'/api/sales/{sale_id}/finalize', {'payment_method': 'card', 'ncf_type': 'consumo'})
+    assert response.status_code == 200, response.get_json()
+    return sale_id
+
+
+def _events():
+    db.session.expunge_all()
+    return [(event.event_type, event.aggregate_id, json.loads(event.payload))
+            for event in OutboxEvent.query.order_by(OutboxEvent.id).all()]
+
+
+class FailingSink:
+    def deliver(self, events):
+        raise ConnectionError('destino caído')
+
+
+class TestEvents:
+    """Eventos escritos junto con la operación"""
+
+    def test_finalize_and_cancel_write_events(self, pos):
+        sale_id = _completed_sale(pos)
+        response = _post(pos['clients']['cashier'], f'/api/sales/{sale_id}/cancel', {'reason': 'Error de cobro'})
+        assert response.status_code == 200, response.get_json()
+
+        (completed_type, completed_id, completed), (cancelled_type, _, cancelled) = _events()
+        assert (completed_type, completed_id) == ('sale.completed', sale_id)
+        assert completed['ncf'] == 'B0200000001' and completed['ncf_type'] == 'CONSUMO'
+        assert [item[:2] for item in completed['items']] == [[pos['rum'], 2], [pos['coffee'], 1]]
+        assert 'rnc' not in completed  # empty fields are left out
+        assert cancelled_type == 'sale.cancelled'
+        # Consumibles are not restocked
+        assert cancelled['restock'] == [[pos['rum'], 2]]
+
+    def test_failed_operation_writes_no_event(self, pos):
+        sale_id = _completed_sale(pos)
+        cashier = pos['clients']['cashier']
+        assert _post(cashier, f'/api/sales/{sale_id}/cancel', {'reason': 'Primera'}).status_code == 200
+        assert _post(cashier, f'/api/sales/{sale_id}/cancel', {'reason': 'Segunda'}).status_code == 400
+        assert [event[0] for event in _events()] == ['sale.completed', 'sale.cancelled']
+
+    def test_purchase_and_stock_adjustment(self, pos):
+        admin = pos['clients']['admin']
+        response = _post(admin, '/inventory/api/purchases', {
+            'supplier_id': pos['supplier'], 'tax_rate': 0.18,
+            'items': [{'product_id': pos['rum'], 'quantity': 6, 'unit_cost': 300.0}]
+        })
+        assert response.status_code == 200, response.get_json()
+        response = _post(admin, f"/inventory/api/stock/{pos['rum']}/adjust", {'adjustment': -1, 'reason': 'Botella rota'})
+        assert response.status_code == 200, response.get_json()
+
+        (purchase_type, _, purchase), (stock_type, product_id, stock) = _events()
+        assert purchase_type == 'purchase.created' and purchase['items'] == [[pos['rum'], 6, 300.0]]
+        assert (stock_type, product_id) == ('stock.adjusted', pos['rum'])
+        assert (stock['old'], stock['delta'], stock['new']) == (16, -1, 15)
+
+
+class TestRelay:
+    """Entrega en orden con cursor por consumidor"""
+
+    def test_jsonl_delivery_advances_cursor(self, pos, tmp_path):
+        _completed_sale(pos)
+        _completed_sale(pos)
+        sink = outbox.JsonlSink('bi', str(tmp_path))
+
+        assert outbox.relay_once('bi', sink, batch_size=1) == 1
+        assert outbox.relay_once('bi', sink) == 1
+        assert outbox.relay_once('bi', sink) == 0
+
+        (path,) = tmp_path.iterdir()
+        lines = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+        assert [line['type'] for line in lines] == ['sale.completed', 'sale.completed']
+        assert lines[0]['id'] < lines[1]['id']
+        assert db.session.get(OutboxConsumer, 'bi').last_event_id == lines[1]['id']
+
+    def test_failed_delivery_keeps_cursor(self, pos):
+        _completed_sale(pos)
+        assert outbox.relay_once('contabilidad', FailingSink()) == 0
+        consumer = db.session.get(OutboxConsumer, 'contabilidad')
+        assert (consumer.last_event_id, consumer.failures) == (0, 1)
+        assert 'destino caído' in consumer.last_error
+
+        sink = outbox.QueueSink('contabilidad')
+        assert outbox.relay_once('contabilidad', sink) == 1
+        assert sink.queue.get_nowait()['type'] == 'sale.completed'
+        assert db.session.get(OutboxConsumer, 'contabilidad').failures == 0
+
+    def test_waits_for_uncommitted_gap(self, pos):
+        for event_id in (1, 2, 4):
+            db.session.add(OutboxEvent(id=event_id, event_type='test', aggregate_id=event_id, payload='{}'))
+        db.session.commit()
+        sink = outbox.QueueSink('gaps')
+
+        assert outbox.relay_once('gaps', sink, gap_timeout=60) == 2
+        assert outbox.relay_once('gaps', sink, gap_timeout=60) == 0
+        # Id 3 never committed: after the timeout the relay moves past it
+        assert outbox.relay_once('gaps', sink, gap_timeout=0) == 1
+        assert [sink.queue.get_nowait()['id'] for _ in range(3)] == [1, 2, 4]
+
+    def test_maintenance_keeps_undelivered_events(self, pos):
+        _completed_sale(pos)
+        outbox.relay_once('bi', outbox.QueueSink('bi'))
+        _completed_sale(pos)
+        config = dict(app.config, OUTBOX_RETENTION_DAYS=-1)
+
+        assert outbox.maintenance(config) == 1
+        assert outbox.status()[0]['lag'] == 1
@@ -0,0 +1,170 @@
+"""
+Tests para códigos de barras/SKU y el endpoint de escaneo
+"""
+import pytest
+import json
+import os
+from flask import g
+from sqlalchemy import event
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, ProductBarcode, Category, Sale, SaleItem, CashRegister,
+                    SystemConfiguration)
+import product_codes
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def catalog(test_app):
+    """Dos productos con código de barras, SKU y un código alterno"""
+    category = Category(name='Colmado', description='', active=True)
+    db.session.add(category)
+    db.session.flush()
+
+    milk = Product(name='Leche', description='', price=85.0, stock=5, product_type='inventariable',
+                   category_id=category.id, active=True)
+    bread = Product(name='Pan', description='', price=10.0, stock=0, product_type='consumible',
+                    category_id=category.id, active=True)
+    db.session.add_all([milk, bread])
+    db.session.flush()
+    product_codes.set_product_codes(milk, '7460001000011', 'lec-1l', ['7460001000028'])
+    product_codes.set_product_codes(bread, '2000000000015', None)
+    product_codes.products_changed([milk.id, bread.id])
+    db.session.commit()
+    product_codes.warm()
+
+    yield {'milk': milk, 'bread': bread}
+
+    for model in (SaleItem, Sale, CashRegister, ProductBarcode, Product, Category, SystemConfiguration, User):
+        model.query.delete()
+    db.session.commit()
+    # Bulk deletes leave the instances in the identity map; the next fixture reuses their ids
+    db.session.expunge_all()
+    product_codes.warm()
+
+
+class TestLookup:
+    """Mapa código -> producto"""
+
+    def test_barcode_sku_and_alias(self, catalog):
+        milk = catalog['milk']
+        assert product_codes.lookup('7460001000011') == milk.id
+        assert product_codes.lookup(' LEC-1L\r\n') == milk.id
+        assert product_codes.lookup('7460001000028') == milk.id
+        assert product_codes.lookup('0000') is None
+
+    def test_duplicate_code_rejected(self, catalog):
+        with pytest.raises(ValueError, match='Leche'):
+            product_codes.set_product_codes(catalog['bread'], '7460001000028', None)
+        with pytest.raises(ValueError, match='repetir'):
+            product_codes.set_product_codes(catalog['bread'], 'X1', 'x1')
+
+    def test_products_changed_refreshes_codes(self, catalog):
+        milk = catalog['milk']
+        product_codes.set_product_codes(milk, '7460001000035', 'LEC-1L', ['7460001000028'])
+        product_codes.products_changed([milk.id])
+        db.session.commit()
+        assert product_codes.lookup('7460001000011') is None
+        assert product_codes.lookup('7460001000035') == milk.id
+
+        milk.active = False
+        product_codes.products_changed([milk.id])
+        db.session.commit()
+        assert product_codes.lookup('7460001000035') is None
+
+    def test_cached_lookup_skips_database(self, catalog):
+        bread_id = catalog['bread'].id
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            assert product_codes.lookup('2000000000015') == bread_id
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        assert statements == []
+
+
+class TestScanEndpoint:
+    """POST /api/sales/<id>/scan"""
+
+    def _login(self, test_app):
+        client = test_app.test_client()
+        cashier = User(username='cajero_scan', email='scan@test.com', role=UserRole.CAJERO,
+                       name='Cajero Scan', password_hash='x')
+        db.session.add(cashier)
+        db.session.flush()
+        db.session.add(CashRegister(name='Caja Scan', user_id=cashier.id, active=True))
+        db.session.commit()
+
+        with client.session_transaction() as sess:
+            sess['user_id'] = cashier.id
+            sess['username'] = cashier.username
+            sess['role'] = cashier.role.value
+        g.pop('csrf_token', None)
+        headers = {'X-CSRFToken': client.get('/api/csrf').get_json()['csrf_token']}
+        sale_id = client.post('/api/sales', data='{}', content_type='application/json',
+                              headers=headers).get_json()['id']
+        return client, headers, sale_id
+
+    def _scan(self, client, headers, sale_id, payload):
+        return client.post(f'/api/sales/{sale_id}/scan', data=json.dumps(payload),
+                           content_type='application/json', headers=headers)
+
+    def test_scan_appends_then_increments(self, test_app, catalog):
+        client, headers, sale_id = self._login(test_app)
+
+        first = self._scan(client, headers, sale_id, {'code': '7460001000011'})
+        assert first.status_code == 200, first.get_json()
+        second = self._scan(client, headers, sale_id, {'code': '7460001000028', 'quantity': 2})
+        body = second.get_json()
+
+        assert body['id'] == first.get_json()['id']
+        assert body['quantity'] == 3
+        assert body['sale']['total'] == pytest.approx(255.0)
+        assert SaleItem.query.filter_by(sale_id=sale_id).count() == 1
+
+    def test_unknown_code_and_stock_limit(self, test_app, catalog):
+        client, headers, sale_id = self._login(test_app)
+
+        assert self._scan(client, headers, sale_id, {'code': '999'}).status_code == 404
+        assert self._scan(client, headers, sale_id, {}).status_code == 400
+
+        response = self._scan(client, headers, sale_id, {'code': 'LEC-1L', 'quantity': 6})
+        assert response.status_code == 400
+        assert response.get_json()['shortage'] == 1
+
+    def test_stale_map_after_deactivation_or_delete(self, test_app, catalog):
+        client, headers, sale_id = self._login(test_app)
+        milk_id, bread_id = catalog['milk'].id, catalog['bread'].id
+
+        # Changed from another worker: this process still maps the codes until its next version check
+        Product.query.filter_by(id=milk_id).update({'active': False})
+        Product.query.filter_by(id=bread_id).delete()
+        db.session.commit()
+
+        response = self._scan(client, headers, sale_id, {'code': '7460001000011'})
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'Producto inactivo'
+        assert self._scan(client, headers, sale_id, {'code': '2000000000015'}).status_code == 404
+        assert SaleItem.query.filter_by(sale_id=sale_id).count() == 0
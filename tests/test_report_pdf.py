@@ -0,0 +1,84 @@
+"""
+Tests para el renderizado por bloques de reportes PDF grandes (report_pdf)
+"""
+import pytest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from pypdf import PdfReader
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph
+
+import receipt_generator
+import report_pdf
+
+
+def _detail(rows):
+    styles = getSampleStyleSheet()
+    return report_pdf.DetailTable(
+        ['#', 'Producto', 'Total'],
+        [[str(index), f'Producto {index}', f'RD$ {index}.00'] for index in range(1, rows + 1)],
+        [40, 200, 100],
+        [('GRID', (0, 0), (-1, -1), 0.5, colors.grey)],
+        intro=[Paragraph('Detalle', styles['Heading2'])]
+    )
+
+
+def _pages(path):
+    return [page.extract_text() for page in PdfReader(path).pages]
+
+
+@pytest.fixture
+def chunked(monkeypatch):
+    """Bloques de 50 filas desde el primer reporte"""
+    monkeypatch.setenv('REPORT_PDF_PARALLEL_MIN_ROWS', '0')
+    monkeypatch.setenv('REPORT_PDF_CHUNK_ROWS', '50')
+    monkeypatch.setenv('REPORT_PDF_WORKERS', '1')
+    yield monkeypatch
+    report_pdf.shutdown(wait=True)
+
+
+class TestBuildReport:
+    """Un solo build para reportes pequeños, bloques unidos para los grandes"""
+
+    def test_small_report_single_build(self, tmp_path):
+        styles = getSampleStyleSheet()
+        path = report_pdf.build_report(str(tmp_path / 'r.pdf'), [Paragraph('Resumen', styles['Title'])],
+                                       _detail(30), [Paragraph('Firma Autorizada', styles['Normal'])])
+        pages = _pages(path)
+        assert len(pages) == 1
+        assert 'Producto 30' in pages[0] and 'Firma Autorizada' in pages[0]
+
+    def test_chunks_are_stitched_in_order(self, chunked, tmp_path):
+        styles = getSampleStyleSheet()
+        path = report_pdf.build_report(str(tmp_path / 'r.pdf'), [Paragraph('Resumen', styles['Title'])],
+                                       _detail(120), [Paragraph('Firma Autorizada', styles['Normal'])])
+        text = '\n'.join(_pages(path))
+        assert text.index('Resumen') < text.index('Detalle') < text.index('Producto 1\n') \
+            < text.index('Producto 51') < text.index('Producto 120') < text.index('Firma Autorizada')
+        # Every chunk starts with the column header
+        assert text.count('Producto\n') >= 3
+
+    def test_process_pool_matches_in_process(self, chunked, tmp_path):
+        in_process = report_pdf.build_report(str(tmp_path / 'a.pdf'), [], _detail(120))
+        chunked.setenv('REPORT_PDF_WORKERS', '2')
+        pooled = report_pdf.build_report(str(tmp_path / 'b.pdf'), [], _detail(120))
+        assert _pages(pooled) == _pages(in_process)
+
+
+class TestSalesReport:
+    """generate_sales_report_pdf con la tabla de detalle por bloques"""
+
+    def test_sales_report_chunked(self, chunked, tmp_path):
+        chunked.chdir(tmp_path)
+        start = datetime(2025, 1, 1, 8, 0)
+        sales = [SimpleNamespace(created_at=start + timedelta(minutes=index), ncf=f'B02{index:08d}',
+                                 customer_name=None, payment_method='efectivo',
+                                 subtotal=100.0, tax_amount=18.0, total=118.0)
+                 for index in range(1, 121)]
+        path = receipt_generator.generate_sales_report_pdf(sales, 'Año 2025', datetime(2025, 1, 1),
+                                                           datetime(2025, 12, 31))
+        text = '\n'.join(_pages(path))
+        assert 'B0200000120' in text
+        assert text.index('Detalle de Ventas') < text.index('B0200000001') < text.index('Firma Autorizada')
@@ -0,0 +1,115 @@
+"""
+Tests para la compresión de respuestas y el serializador JSON compacto
+"""
+import gzip
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import brotli
+import pytest
+from flask import Flask, Response, jsonify, stream_with_context
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+import json_provider
+import response_compression
+
+LARGE_PAYLOAD = {'sales': [{'id': i, 'ncf': f'B02{i:08d}', 'total': 118.0, 'status': 'completed'}
+                           for i in range(200)]}
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    json_provider.init_app(app)
+    response_compression.init_app(app)
+
+    @app.route('/large')
+    def large():
+        return jsonify(LARGE_PAYLOAD)
+
+    @app.route('/small')
+    def small():
+        return jsonify({'ok': True})
+
+    @app.route('/types')
+    def types():
+        return jsonify({'when': datetime(2025, 3, 10, 12, 30), 'amount': Decimal('10.50'), 1: 'uno'})
+
+    @app.route('/stream')
+    def stream():
+        def generate():
+            for i in range(50):
+                yield f'linea {i},' * 20 + '\n'
+        return Response(stream_with_context(generate()), mimetype='text/csv')
+
+    @app.route('/binary')
+    def binary():
+        return Response(b'\x00' * 5000, mimetype='application/pdf')
+
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class TestCompactJSON:
+    """Tests de CompactJSONProvider"""
+
+    def test_output_is_compact(self, client):
+        body = client.get('/large', headers={'Accept-Encoding': 'identity'}).get_data(as_text=True)
+        assert '\n' not in body and ', ' not in body and '": ' not in body
+        assert json.loads(body) == LARGE_PAYLOAD
+
+    def test_types_match_flask_default(self, client):
+        data = client.get('/types').get_json()
+        assert data == {'when': 'Mon, 10 Mar 2025 12:30:00 GMT', 'amount': '10.50', '1': 'uno'}
+
+    def test_request_json_roundtrip(self, app):
+        @app.route('/echo', methods=['POST'])
+        def echo():
+            from flask import request
+            return jsonify(request.get_json())
+
+        response = app.test_client().post('/echo', data=json.dumps({'ñ': [1, 2.5]}),
+                                          content_type='application/json')
+        assert response.get_json() == {'ñ': [1, 2.5]}
+
+
+class TestResponseCompression:
+    """Tests de negociación gzip/brotli"""
+
+    def test_brotli_preferred(self, client):
+        response = client.get('/large', headers={'Accept-Encoding': 'gzip, deflate, br'})
+        assert response.headers['Content-Encoding'] == 'br'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert json.loads(brotli.decompress(response.get_data())) == LARGE_PAYLOAD
+
+    def test_gzip(self, client):
+        response = client.get('/large', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert int(response.headers['Content-Length']) == len(response.get_data())
+        assert json.loads(gzip.decompress(response.get_data())) == LARGE_PAYLOAD
+
+    def test_respects_quality_values(self, client):
+        response = client.get('/large', headers={'Accept-Encoding': 'br;q=0.5, gzip;q=1.0'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+
+    def test_small_and_identity_not_compressed(self, client):
+        assert 'Content-Encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+        assert 'Content-Encoding' not in client.get('/large').headers
+
+    def test_non_text_not_compressed(self, client):
+        assert 'Content-Encoding' not in client.get('/binary', headers={'Accept-Encoding': 'gzip'}).headers
+
+    def test_streamed_response_compressed_incrementally(self, client):
+        response = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Content-Length' not in response.headers
+        assert gzip.decompress(response.get_data()).decode().count('\n') == 50
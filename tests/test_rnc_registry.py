@@ -0,0 +1,132 @@
+"""
+Tests para el padrón de RNC de la DGII: importación por diferencia y autocompletado por prefijo
+"""
+import pytest
+import os
+import zipfile
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import db, User, UserRole, RNCRegistry, SystemConfiguration
+import rnc_registry
+
+REGISTRY = [
+    '101000011|ASOCIACIÓN DE PANADEROS DEL CIBAO|PANACIBAO|SERVICIOS|||||01/02/1990|ACTIVO|NORMAL',
+    '131234567|DISTRIBUIDORA CARIBE SRL|CARIBE DISTRIBUCIONES|COMERCIO|||||05/06/2010|ACTIVO|NORMAL',
+    '40212345678|JUAN PEREZ|  |PROFESIONAL|||||10/10/2015|SUSPENDIDO|NORMAL',
+    'NO-ES-RNC|FILA INVALIDA',
+]
+
+
+def _write(path, lines):
+    with open(path, 'w', encoding='latin-1') as registry:
+        registry.write('\n'.join(lines) + '\n')
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def registry(test_app, tmp_path):
+    """Padrón importado y cajero autenticado"""
+    cashier = User(username='cajero_rnc', email='rnc@test.com', role=UserRole.CAJERO,
+                   name='Cajero RNC', password_hash='x', active=True)
+    db.session.add(cashier)
+    db.session.commit()
+    path = _write(tmp_path / 'DGII_RNC.TXT', REGISTRY)
+    rnc_registry.import_registry(path)
+    rnc_registry.warm()
+
+    client = test_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = cashier.id
+        sess['role'] = cashier.role.value
+
+    yield {'client': client, 'path': path, 'dir': tmp_path}
+
+    db.session.rollback()
+    for model in (RNCRegistry, SystemConfiguration, User):
+        model.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+    rnc_registry._cache.index = None
+
+
+class TestImport:
+    """Carga por lotes y actualización por diferencia"""
+
+    def test_import_parses_registry(self, registry):
+        assert RNCRegistry.query.count() == 3
+        taxpayer = db.session.get(RNCRegistry, '101000011')
+        assert taxpayer.name == 'ASOCIACIÓN DE PANADEROS DEL CIBAO'
+        assert taxpayer.name_key == 'ASOCIACION DE PANADEROS DEL CIBAO'
+        assert taxpayer.trade_name == 'PANACIBAO'
+        assert db.session.get(RNCRegistry, '40212345678').trade_name is None
+
+    def test_same_file_is_skipped(self, registry):
+        assert rnc_registry.import_registry(registry['path'])['skipped'] is True
+
+    def test_reimport_applies_diff(self, registry):
+        lines = [REGISTRY[0], REGISTRY[1].replace('ACTIVO', 'SUSPENDIDO'),
+                 '501000001|COOPERATIVA NUEVA|||||||01/01/2026|ACTIVO|NORMAL']
+        zip_path = registry['dir'] / 'DGII_RNC.zip'
+        with zipfile.ZipFile(zip_path, 'w') as archive:
+            archive.writestr('TMP/DGII_RNC.TXT', '\n'.join(lines).encode('latin-1'))
+
+        summary = rnc_registry.import_registry(str(zip_path))
+        assert (summary['inserted'], summary['updated'], summary['deleted']) == (1, 1, 1)
+        db.session.expunge_all()
+        assert db.session.get(RNCRegistry, '131234567').status == 'SUSPENDIDO'
+        assert db.session.get(RNCRegistry, '40212345678') is None
+
+    def test_empty_file_never_clears_registry(self, registry):
+        path = _write(registry['dir'] / 'vacio.txt', ['encabezado sin datos'])
+        with pytest.raises(ValueError):
+            rnc_registry.import_registry(path)
+        assert RNCRegistry.query.count() == 3
+
+
+class TestSearch:
+    """Búsqueda por prefijo en memoria y en la base de datos"""
+
+    def test_search_by_rnc_prefix(self, registry):
+        response = registry['client'].get('/api/rnc/search?q=131-23')
+        data = response.get_json()
+        assert data['source'] == 'memory'
+        assert [t['rnc'] for t in data['results']] == ['131234567']
+        assert data['results'][0]['name'] == 'DISTRIBUIDORA CARIBE SRL'
+
+    def test_search_by_name_and_trade_name(self, registry):
+        assert [t['rnc'] for t in rnc_registry.search('asociacion de pan')['results']] == ['101000011']
+        assert [t['rnc'] for t in rnc_registry.search('Caribe Dist')['results']] == ['131234567']
+        assert rnc_registry.search('j')['results'] == []  # too short
+
+    def test_database_fallback_matches_memory(self, registry, monkeypatch):
+        monkeypatch.setattr(rnc_registry._cache, 'enabled', False)
+        data = rnc_registry.search('DISTRIB')
+        assert data['source'] == 'database'
+        assert [t['rnc'] for t in data['results']] == ['131234567']
+        assert [t['rnc'] for t in rnc_registry.search('402')['results']] == ['40212345678']
+
+    def test_exact_lookup(self, registry):
+        assert registry['client'].get('/api/rnc/402-1234567-8').get_json()['status'] == 'SUSPENDIDO'
+        assert registry['client'].get('/api/rnc/999999999').status_code == 404
+
+    def test_requires_login(self, registry):
+        assert app.test_client().get('/api/rnc/search?q=131').status_code == 401
@@ -0,0 +1,144 @@
+"""
+Tests para el PATCH en lote de líneas de venta
+"""
+import pytest
+import json
+import os
+from flask import g
+from sqlalchemy import event
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import db, User, UserRole, Product, Category, Sale, SaleItem, CashRegister
+import tax_engine
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def sale_setup(test_app):
+    """Mesero autenticado con una venta abierta y tres productos"""
+    client = test_app.test_client()
+    waiter = User(username='mesero_lote', email='lote@test.com', role=UserRole.MESERO,
+                  name='Mesero Lote', password_hash='x')
+    category = Category(name='Lote', description='', active=True)
+    db.session.add_all([waiter, category])
+    db.session.flush()
+
+    products = [
+        Product(name='Tostones', description='', price=200.0, stock=0, product_type='consumible',
+                category_id=category.id, active=True),
+        Product(name='Presidente', description='', price=150.0, stock=4, product_type='inventariable',
+                category_id=category.id, active=True),
+        Product(name='Agua', description='', price=50.0, stock=20, product_type='inventariable',
+                category_id=category.id, active=True),
+    ]
+    db.session.add_all(products + [CashRegister(name='Caja Lote', user_id=waiter.id, active=True)])
+    db.session.commit()
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = waiter.id
+        sess['username'] = waiter.username
+        sess['role'] = waiter.role.value
+    g.pop('csrf_token', None)
+    headers = {'X-CSRFToken': client.get('/api/csrf').get_json()['csrf_token']}
+    sale_id = client.post('/api/sales', data='{}', content_type='application/json',
+                          headers=headers).get_json()['id']
+
+    yield {'client': client, 'headers': headers, 'sale_id': sale_id, 'products': products}
+
+    for model in (SaleItem, Sale, CashRegister, Product, Category, User):
+        model.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def _patch(setup, ops):
+    return setup['client'].patch(f"/api/sales/{setup['sale_id']}/items", data=json.dumps({'ops': ops}),
+                                 content_type='application/json', headers=setup['headers'])
+
+
+class TestBatchItems:
+    """Operaciones add / set_quantity / remove"""
+
+    def test_table_order_in_one_request(self, sale_setup):
+        tostones, beer, water = sale_setup['products']
+        response = _patch(sale_setup, [
+            {'op': 'add', 'product_id': tostones.id, 'quantity': 2},
+            {'op': 'add', 'product_id': beer.id, 'quantity': 1},
+            {'op': 'add', 'product_id': water.id, 'quantity': 3},
+            {'op': 'add', 'product_id': beer.id, 'quantity': 2},
+            {'op': 'set_quantity', 'product_id': water.id, 'quantity': 1},
+        ])
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+
+        assert [(item['product_id'], item['quantity']) for item in body['items']] == [
+            (tostones.id, 2), (beer.id, 3), (water.id, 1)
+        ]
+        expected = tax_engine.compute_sale([tax_engine.make_line(2, 200.0, 0.18, True),
+                                            tax_engine.make_line(3, 150.0, 0.18, True),
+                                            tax_engine.make_line(1, 50.0, 0.18, True)])
+        assert body['sale']['total'] == expected.rounded_total
+        assert db.session.get(Sale, sale_setup['sale_id']).total == expected.rounded_total
+
+    def test_set_and_remove_existing_lines(self, sale_setup):
+        tostones, beer, water = sale_setup['products']
+        items = _patch(sale_setup, [{'op': 'add', 'product_id': tostones.id},
+                                    {'op': 'add', 'product_id': water.id}]).get_json()['items']
+        ops = [
+            {'op': 'set_quantity', 'item_id': items[0]['id'], 'quantity': 4},
+            {'op': 'remove', 'item_id': items[1]['id']},
+            {'op': 'add', 'product_id': beer.id, 'quantity': 1},
+        ]
+
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            response = _patch(sale_setup, ops)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
+        assert response.status_code == 200, response.get_json()
+        assert [(item['product_id'], item['quantity']) for item in response.get_json()['items']] == [
+            (tostones.id, 4), (beer.id, 1)
+        ]
+        selects = [s for s in statements if s.startswith('SELECT')]
+        assert len([s for s in selects if 'FROM products' in s]) == 1
+        assert len([s for s in selects if 'FROM sale_items' in s]) == 1
+
+    def test_failed_op_applies_nothing(self, sale_setup):
+        tostones, beer, water = sale_setup['products']
+        response = _patch(sale_setup, [
+            {'op': 'add', 'product_id': tostones.id},
+            {'op': 'add', 'product_id': beer.id, 'quantity': 5},
+        ])
+        assert response.status_code == 400
+        assert response.get_json()['shortage'] == 1
+
+        response = _patch(sale_setup, [{'op': 'add', 'product_id': water.id}, {'op': 'remove', 'item_id': 999}])
+        assert response.status_code == 404
+        assert response.get_json()['op_index'] == 1
+
+        assert _patch(sale_setup, [{'op': 'rename'}]).status_code == 400
+        assert SaleItem.query.filter_by(sale_id=sale_setup['sale_id']).count() == 0
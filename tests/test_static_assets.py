@@ -0,0 +1,99 @@
+"""
+Tests para el manifiesto de archivos estáticos con huella de contenido
+"""
+import json
+import os
+
+import pytest
+from flask import Flask, url_for
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+import static_assets
+
+
+@pytest.fixture
+def static_folder(tmp_path):
+    """Carpeta static mínima con CSS que referencia una fuente y un JS"""
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'js').mkdir()
+    (tmp_path / 'vendor' / 'icons' / 'fonts').mkdir(parents=True)
+    (tmp_path / 'css' / 'app.css').write_text('body { color: red; }')
+    (tmp_path / 'js' / 'app.js').write_text('console.log("pos");')
+    (tmp_path / 'js' / 'app.js.map').write_text('{}')
+    (tmp_path / 'vendor' / 'icons' / 'fonts' / 'icons.woff2').write_bytes(b'font-data')
+    (tmp_path / 'vendor' / 'icons' / 'icons.css').write_text(
+        '@font-face{src:url("fonts/icons.woff2?abc") format("woff2")}'
+    )
+    return tmp_path
+
+
+class TestBuildManifest:
+    """Tests de build_manifest()"""
+
+    def test_fingerprints_files_by_content(self, static_folder):
+        manifest = static_assets.build_manifest(str(static_folder))
+        assets = manifest['assets']
+
+        assert set(assets) == {'css/app.css', 'js/app.js', 'vendor/icons/icons.css',
+                               'vendor/icons/fonts/icons.woff2'}
+        assert assets['js/app.js'].startswith('dist/js/app.')
+        assert (static_folder / assets['js/app.js']).read_text() == 'console.log("pos");'
+
+        # Same content, same name; changed content, new name and version
+        assert static_assets.build_manifest(str(static_folder)) == manifest
+        (static_folder / 'css' / 'app.css').write_text('body { color: blue; }')
+        rebuilt = static_assets.build_manifest(str(static_folder))
+        assert rebuilt['assets']['css/app.css'] != assets['css/app.css']
+        assert rebuilt['version'] != manifest['version']
+        assert not (static_folder / assets['css/app.css']).exists()
+
+    def test_rewrites_css_urls_to_fingerprinted_files(self, static_folder):
+        assets = static_assets.build_manifest(str(static_folder))['assets']
+        css = (static_folder / assets['vendor/icons/icons.css']).read_text()
+        font_name = os.path.basename(assets['vendor/icons/fonts/icons.woff2'])
+        assert f'url("fonts/{font_name}")' in css
+
+    def test_writes_service_worker_precache(self, static_folder):
+        manifest = static_assets.build_manifest(str(static_folder))
+        content = (static_folder / 'dist' / static_assets.PRECACHE_FILENAME).read_text()
+        precache = json.loads(content.split('self.__ASSET_MANIFEST = ', 1)[1].rstrip().rstrip(';'))
+
+        assert precache['version'] == manifest['version']
+        assert f"/static/{manifest['assets']['js/app.js']}" in precache['precache']
+        assert static_assets.load_manifest(str(static_folder)) == manifest
+
+
+class TestFlaskIntegration:
+    """Tests de la reescritura de url_for('static') y cabeceras de caché"""
+
+    def test_url_for_uses_manifest(self, static_folder):
+        manifest = static_assets.build_manifest(str(static_folder))
+        app = Flask(__name__, static_folder=str(static_folder), static_url_path='/static')
+        app.config['STATIC_FINGERPRINT'] = True
+        static_assets.init_app(app)
+
+        with app.test_request_context():
+            assert url_for('static', filename='js/app.js') == f"/static/{manifest['assets']['js/app.js']}"
+            assert url_for('static', filename='manifest.json') == '/static/manifest.json'
+
+    def test_disabled_without_manifest(self, tmp_path):
+        app = Flask(__name__, static_folder=str(tmp_path), static_url_path='/static')
+        app.config['STATIC_FINGERPRINT'] = True
+        static_assets.init_app(app)
+
+        with app.test_request_context():
+            assert url_for('static', filename='js/app.js') == '/static/js/app.js'
+
+    def test_fingerprinted_assets_are_immutable(self):
+        from main import app, add_cache_headers
+
+        with app.test_request_context('/static/dist/css/pos-style.0123456789ab.css'):
+            response = add_cache_headers(app.response_class())
+            assert response.headers['Cache-Control'] == static_assets.IMMUTABLE_CACHE_CONTROL
+
+        with app.test_request_context('/static/css/pos-style.css'):
+            response = add_cache_headers(app.response_class())
+            assert 'immutable' not in response.headers['Cache-Control']
@@ -0,0 +1,177 @@
+"""
+Tests para los descuentos y reposiciones atómicas de stock (stock_control)
+"""
+import pytest
+import json
+import os
+from flask import g
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, Category, Sale, SaleItem, CashRegister,
+                    NCFSequence, NCFType, SalesDailyAggregate, CashSession, StockAdjustment)
+import stock_control
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def products(test_app):
+    """Dos productos inventariables y uno consumible"""
+    category = Category(name='Stock', description='', active=True)
+    db.session.add(category)
+    db.session.flush()
+
+    rum = Product(name='Ron', description='', price=500.0, stock=10, product_type='inventariable',
+                  category_id=category.id, active=True)
+    beer = Product(name='Cerveza', description='', price=150.0, stock=3, product_type='inventariable',
+                   category_id=category.id, active=True)
+    coffee = Product(name='Café', description='', price=75.0, stock=0, product_type='consumible',
+                     category_id=category.id, active=True)
+    db.session.add_all([rum, beer, coffee])
+    db.session.commit()
+
+    yield {'rum': rum, 'beer': beer, 'coffee': coffee, 'category': category}
+
+    for model in (StockAdjustment, SaleItem, SalesDailyAggregate, Sale, CashSession, NCFSequence, Product,
+                  Category, CashRegister, User):
+        model.query.delete()
+    db.session.commit()
+    # Bulk deletes leave the instances in the identity map; the next fixture reuses their ids
+    db.session.expunge_all()
+
+
+class TestDecrementStock:
+    """UPDATE condicional en lote"""
+
+    def test_decrements_all_products(self, products):
+        rum, beer, coffee = products['rum'], products['beer'], products['coffee']
+        new_stock = stock_control.decrement_stock({rum.id: 4, beer.id: 3, coffee.id: 2})
+        db.session.commit()
+
+        assert new_stock == {rum.id: 6, beer.id: 0, coffee.id: -2}
+        assert db.session.get(Product, rum.id).stock == 6
+
+    def test_insufficient_stock_raises(self, products):
+        rum, beer = products['rum'], products['beer']
+        with pytest.raises(stock_control.InsufficientStockError) as exc_info:
+            stock_control.decrement_stock({rum.id: 1, beer.id: 5})
+        db.session.rollback()
+
+        error = exc_info.value
+        assert (error.product_id, error.available, error.required, error.shortage) == (beer.id, 3, 5, 2)
+        # The rollback also undoes the products that did have stock
+        assert db.session.get(Product, rum.id).stock == 10
+
+    def test_missing_products_are_ignored(self, products):
+        assert stock_control.decrement_stock({999999: 1, products['rum'].id: 0}) == {}
+
+
+class TestIncrementStock:
+    """Reposición sin leer-modificar-escribir"""
+
+    def test_only_inventariable_by_default(self, products):
+        rum, coffee = products['rum'], products['coffee']
+        assert stock_control.increment_stock({rum.id: 5, coffee.id: 5}) == {rum.id: 15}
+        assert stock_control.increment_stock({coffee.id: 5}, inventariable_only=False) == {coffee.id: 5}
+
+
+class TestFinalize:
+    """Finalizar una venta usa el descuento condicional"""
+
+    def _client(self, test_app, suffix):
+        client = test_app.test_client()
+        cashier = User(username=f'cajero_stock_{suffix}', email=f'stock_{suffix}@test.com', role=UserRole.CAJERO,
+                       name='Cajero Stock', password_hash='x')
+        db.session.add(cashier)
+        db.session.flush()
+        db.session.add_all([
+            CashRegister(name=f'Caja Stock {suffix}', user_id=cashier.id, active=True),
+            NCFSequence(ncf_type=NCFType.CONSUMO, serie='B02', start_number=1, end_number=1000,
+                        current_number=1, active=True)
+        ])
+        db.session.commit()
+
+        with client.session_transaction() as sess:
+            sess['user_id'] = cashier.id
+            sess['username'] = cashier.username
+            sess['role'] = cashier.role.value
+        g.pop('csrf_token', None)
+        headers = {'X-CSRFToken': client.get('/api/csrf').get_json()['csrf_token']}
+        client.post('/api/cash-register/open', data=json.dumps({'opening_amount': 0}),
+                    content_type='application/json', headers=headers)
+        return client, headers
+
+    def _sale(self, client, headers, items):
+        sale_id = client.post('/api/sales', data='{}', content_type='application/json',
+                              headers=headers).get_json()['id']
+        for product_id, quantity in items:
+            response = client.post(f'/api/sales/{sale_id}/items', content_type='application/json', headers=headers,
+                                   data=json.dumps({'product_id': product_id, 'quantity': quantity}))
+            assert response.status_code == 200, response.get_json()
+        return sale_id
+
+    def _finalize(self, client, headers, sale_id):
+        return client.post(f'/api/sales/{sale_id}/finalize', content_type='application/json', headers=headers,
+                           data=json.dumps({'payment_method': 'card', 'ncf_type': 'consumo'}))
+
+    def test_finalize_decrements_stock(self, test_app, products):
+        client, headers = self._client(test_app, 'ok')
+        rum, coffee = products['rum'], products['coffee']
+        sale_id = self._sale(client, headers, [(rum.id, 2), (coffee.id, 1)])
+
+        response = self._finalize(client, headers, sale_id)
+        assert response.status_code == 200, response.get_json()
+        assert db.session.get(Product, rum.id).stock == 8
+        assert db.session.get(Product, coffee.id).stock == -1
+
+    def test_stock_sold_elsewhere_rejects_finalize(self, test_app, products):
+        client, headers = self._client(test_app, 'short')
+        rum, beer = products['rum'], products['beer']
+        sale_id = self._sale(client, headers, [(rum.id, 1), (beer.id, 3)])
+
+        # Another register sold the last beers after they were added to this sale
+        stock_control.decrement_stock({beer.id: 2})
+        db.session.commit()
+
+        response = self._finalize(client, headers, sale_id)
+        assert response.status_code == 400
+        body = response.get_json()
+        assert body['product_id'] == beer.id
+        assert body['shortage'] == 2
+        assert db.session.get(Product, rum.id).stock == 10
+        assert db.session.get(Sale, sale_id).status == 'pending'
+
+    def test_cancel_restores_stock_with_audit_trail(self, test_app, products):
+        client, headers = self._client(test_app, 'cancel')
+        rum, coffee = products['rum'], products['coffee']
+        sale_id = self._sale(client, headers, [(rum.id, 2), (rum.id, 1), (coffee.id, 1)])
+        assert self._finalize(client, headers, sale_id).status_code == 200
+        assert db.session.get(Product, rum.id).stock == 7
+
+        response = client.post(f'/api/sales/{sale_id}/cancel', content_type='application/json', headers=headers,
+                               data=json.dumps({'reason': 'Error de digitación'}))
+        assert response.status_code == 200, response.get_json()
+        assert db.session.get(Product, rum.id).stock == 10
+        assert db.session.get(Product, coffee.id).stock == -1
+
+        adjustments = StockAdjustment.query.filter_by(reference_id=sale_id,
+                                                      reference_type='sale_cancellation').all()
+        # Consumibles are not restocked, so only the rum gets an audit row
+        assert [(a.product_id, a.old_stock, a.new_stock) for a in adjustments] == [(rum.id, 7, 10)]
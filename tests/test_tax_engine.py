@@ -0,0 +1,208 @@
+"""
+Tests para el motor de impuestos compartido (tax_engine)
+"""
+import pytest
+import json
+import os
+from flask import g
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, Category, Sale, SaleItem, CashRegister,
+                    NCFSequence, NCFType, SalesDailyAggregate, CashSession)
+import tax_engine
+import utils
+
+
+class TestLineMath:
+    """Cálculo por línea y por venta en centavos enteros"""
+
+    def test_inclusive_line_extracts_tax(self):
+        line = tax_engine.compute_line(tax_engine.make_line(1, 118.0, 0.18, True))
+        assert line.base_amount == 100.0
+        assert line.tax_amount == 18.0
+
+    def test_exclusive_line_rounds_half_up(self):
+        # 11878.75 * 0.18 = 2138.175 exactly: half-up gives .18 (float math gave .17)
+        line = tax_engine.compute_line(tax_engine.make_line(line_total=11878.75, rate=0.18, is_inclusive=False))
+        assert line.tax_amount == 2138.18
+        assert line.base_amount == 11878.75
+
+    def test_sale_totals_follow_finalize_conventions(self):
+        lines = [
+            tax_engine.make_line(2, 150.0, 0.18, True),    # 300 incl.
+            tax_engine.make_line(1, 100.0, 0.18, False),   # 100 + 18
+            tax_engine.make_line(3, 50.0, 0, False),       # exento
+        ]
+        totals = tax_engine.compute_sale(lines)
+        assert totals.subtotal == 550.0
+        assert totals.tax_included == 45.76
+        assert totals.tax_exclusive == 18.0
+        assert totals.tax_amount == 63.76
+        assert totals.base_amount == pytest.approx(550.0 - 45.76)
+        assert totals.total == 568.0
+        assert totals.rounded_total == 568.0
+
+    def test_rounded_total_is_half_up_pesos(self):
+        totals = tax_engine.compute_sale([tax_engine.make_line(line_total=748.5, rate=0.18, is_inclusive=True)])
+        assert totals.total == 748.5
+        assert totals.rounded_total == 749.0
+
+    def test_service_charge_extracted_from_gross(self):
+        totals = tax_engine.compute_sale([tax_engine.make_line(1, 1100.0, 0.18, True)], apply_service_charge=True)
+        assert totals.service_charge_amount == 100.0
+        assert totals.total == 1100.0
+
+    def test_uniform_overrides(self):
+        class Item:
+            total_price = 100.0
+            tax_rate = 0.0
+            is_tax_included = False
+        lines = tax_engine.lines_from_items([Item()], rate_override=0.16, inclusive_override=False)
+        assert tax_engine.compute_sale(lines).tax_amount == 16.0
+
+    def test_calculate_itbis_delegates(self):
+        assert utils.calculate_itbis(1000) == 180.0
+        assert utils.calculate_itbis(0.25) == 0.05  # 0.045 -> half-up
+
+
+class TestBulkTotals:
+    """Recalculo masivo por columnas"""
+
+    def _columns(self):
+        return (
+            [1, 1, 2, 3, 3, 3],
+            [300.0, 100.0, 11878.75, 748.5, 0.285, 99.99],
+            [0.18, 0.18, 0.18, 0.16, 0.18, None],
+            [True, False, False, True, False, False],
+        )
+
+    def test_bulk_matches_single_sale_engine(self):
+        sale_ids, line_totals, rates, inclusive = self._columns()
+        bulk = tax_engine.compute_bulk_totals(sale_ids, line_totals, rates, inclusive)
+        for sale_id in set(sale_ids):
+            lines = [tax_engine.make_line(line_total=t, rate=r or 0, is_inclusive=i)
+                     for s, t, r, i in zip(sale_ids, line_totals, rates, inclusive) if s == sale_id]
+            totals = tax_engine.compute_sale(lines)
+            assert tax_engine.from_cents(bulk[sale_id].subtotal_cents) == totals.subtotal
+            assert tax_engine.from_cents(bulk[sale_id].tax_cents) == totals.tax_amount
+            assert tax_engine.from_cents(bulk[sale_id].total_cents) == totals.total
+
+    @pytest.mark.skipif(tax_engine.np is None, reason='numpy no instalado')
+    def test_numpy_and_python_paths_agree(self):
+        sale_ids, line_totals, rates, inclusive = self._columns()
+        assert (tax_engine._bulk_numpy(sale_ids, line_totals, rates, inclusive)
+                == tax_engine._bulk_python(sale_ids, line_totals, rates, inclusive))
+
+    def test_empty_input(self):
+        assert tax_engine.compute_bulk_totals([], [], [], []) == {}
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(test_app):
+    return test_app.test_client()
+
+
+@pytest.fixture
+def cashier_setup(client):
+    """Cajero autenticado con caja, dos productos y secuencia NCF de consumo"""
+    cashier = User(username='cajero_tax', email='tax@test.com', role=UserRole.CAJERO,
+                   name='Cajero Tax', password_hash='x')
+    db.session.add(cashier)
+    db.session.flush()
+
+    register = CashRegister(name='Caja Tax', user_id=cashier.id, active=True)
+    category = Category(name='Comidas Tax', description='', active=True)
+    db.session.add_all([register, category])
+    db.session.flush()
+
+    beer = Product(name='Cerveza', description='', price=150.0, stock=100, min_stock=5,
+                   product_type='inventariable', category_id=category.id, active=True)
+    mofongo = Product(name='Mofongo', description='', price=425.5, stock=100, min_stock=5,
+                      product_type='inventariable', category_id=category.id, active=True)
+    sequence = NCFSequence(ncf_type=NCFType.CONSUMO, serie='B02', start_number=1,
+                           end_number=1000, current_number=1, active=True)
+    db.session.add_all([beer, mofongo, sequence])
+    db.session.commit()
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = cashier.id
+        sess['username'] = cashier.username
+        sess['role'] = cashier.role.value
+
+    # The module-wide app context shares flask.g across requests; drop any token cached by a previous client
+    g.pop('csrf_token', None)
+    csrf_token = client.get('/api/csrf').get_json()['csrf_token']
+
+    yield {'products': [beer, mofongo], 'headers': {'X-CSRFToken': csrf_token}}
+
+    for model in (SaleItem, SalesDailyAggregate, Sale, CashSession, NCFSequence, Product, Category,
+                  CashRegister, User):
+        model.query.delete()
+    db.session.commit()
+
+
+def _post(client, url, headers, payload=None):
+    return client.post(url, data=json.dumps(payload or {}), content_type='application/json', headers=headers)
+
+
+class TestCallSitesAgree:
+    """Agregar producto, vista previa y finalizar dan el mismo total"""
+
+    def test_preview_matches_finalize(self, client, cashier_setup):
+        headers = cashier_setup['headers']
+        beer, mofongo = cashier_setup['products']
+        items = [{'product_id': beer.id, 'quantity': 3}, {'product_id': mofongo.id, 'quantity': 1}]
+
+        preview = _post(client, '/api/sales/preview', headers, {'items': items}).get_json()
+        assert preview['success'], preview
+
+        sale_id = _post(client, '/api/sales', headers).get_json()['id']
+        for item in items:
+            _post(client, f'/api/sales/{sale_id}/items', headers, item)
+        sale = db.session.get(Sale, sale_id)
+        assert sale.total == preview['totals']['total']
+        assert sale.tax_amount == preview['totals']['tax_amount']
+
+        _post(client, '/api/cash-register/open', headers, {'opening_amount': 0})
+        response = _post(client, f'/api/sales/{sale_id}/finalize', headers,
+                         {'payment_method': 'card', 'ncf_type': 'consumo'})
+        assert response.status_code == 200, response.get_json()
+        assert response.get_json()['total'] == preview['totals']['total']
+
+    def test_model_totals_use_engine(self, client, cashier_setup):
+        headers = cashier_setup['headers']
+        beer, mofongo = cashier_setup['products']
+
+        sale_id = _post(client, '/api/sales', headers).get_json()['id']
+        _post(client, f'/api/sales/{sale_id}/items', headers, {'product_id': beer.id, 'quantity': 2})
+        _post(client, f'/api/sales/{sale_id}/items', headers, {'product_id': mofongo.id, 'quantity': 1})
+
+        sale = db.session.get(Sale, sale_id)
+        expected = tax_engine.compute_sale([tax_engine.make_line(2, 150.0, 0.18, True),
+                                            tax_engine.make_line(1, 425.5, 0.18, True)])
+        assert sale.calculate_totals() == {
+            'subtotal': expected.base_amount,
+            'tax_amount': expected.tax_amount,
+            'total': expected.total
+        }
+        assert sale.tax_amount == expected.tax_amount
+        assert sale.total == expected.rounded_total
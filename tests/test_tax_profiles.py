@@ -0,0 +1,169 @@
+"""
+Tests para la caché de perfiles de impuestos por producto
+"""
+import pytest
+import json
+import os
+from flask import g
+from sqlalchemy import event
+
+# Configure environment for testing
+os.environ['SESSION_SECRET'] = 'test_secret_key_for_testing_only'
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from models import (db, User, UserRole, Product, Category, Sale, SaleItem, CashRegister, TaxType,
+                    ProductTax, TaxCategory, SystemConfiguration)
+import tax_profiles
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    """Fixture para configurar la aplicación en modo de testing"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def catalog(test_app):
+    """Productos con ITBIS 18% agregado, ITBIS + propina y sin impuestos configurados"""
+    category = Category(name='Bar Perfiles', description='', active=True)
+    itbis = TaxType(name='ITBIS 18%', description='', rate=0.18, is_inclusive=False, tax_category=TaxCategory.TAX, active=True)
+    tip = TaxType(name='Propina Legal', description='', rate=0.10, is_inclusive=True,
+                  tax_category=TaxCategory.SERVICE_CHARGE, active=True)
+    db.session.add_all([category, itbis, tip])
+    db.session.flush()
+
+    taxed = Product(name='Ron', description='', price=500.0, stock=50, category_id=category.id, active=True)
+    with_tip = Product(name='Picadera', description='', price=800.0, stock=50, category_id=category.id, active=True)
+    untaxed = Product(name='Agua', description='', price=50.0, stock=50, category_id=category.id, active=True)
+    db.session.add_all([taxed, with_tip, untaxed])
+    db.session.flush()
+    db.session.add_all([
+        ProductTax(product_id=taxed.id, tax_type_id=itbis.id),
+        ProductTax(product_id=with_tip.id, tax_type_id=itbis.id),
+        ProductTax(product_id=with_tip.id, tax_type_id=tip.id),
+    ])
+    db.session.commit()
+    tax_profiles.warm()
+
+    yield {'taxed': taxed, 'with_tip': with_tip, 'untaxed': untaxed, 'itbis': itbis, 'tip': tip,
+           'category': category}
+
+    for model in (SaleItem, Sale, CashRegister, ProductTax, Product, TaxType, Category,
+                  SystemConfiguration, User):
+        model.query.delete()
+    db.session.commit()
+    tax_profiles.warm()
+
+
+class TestResolveProfile:
+    """Resolución de la tasa efectiva"""
+
+    def test_tax_types_are_summed_without_service_charge(self, catalog):
+        profile = tax_profiles.get_profile(catalog['with_tip'].id)
+        assert profile.rate == pytest.approx(0.18)
+        assert profile.is_inclusive is False
+        assert profile.has_service_charge is True
+        assert profile.service_charge_rate == pytest.approx(0.10)
+        assert {tax['name'] for tax in profile.tax_types} == {'ITBIS 18%', 'Propina Legal'}
+
+    def test_default_when_not_configured(self, catalog):
+        profile = tax_profiles.get_profile(catalog['untaxed'].id)
+        assert profile.configured is False
+        assert profile.rate == tax_profiles.DEFAULT_TAX_RATE
+        assert profile.is_inclusive is tax_profiles.DEFAULT_IS_INCLUSIVE
+
+    def test_unknown_product(self, catalog):
+        assert tax_profiles.get_profile(999999) is None
+
+
+class TestInvalidation:
+    """Refresco de la caché al cambiar impuestos"""
+
+    def test_products_changed_refreshes_profile(self, catalog):
+        product = catalog['untaxed']
+        assert tax_profiles.get_profile(product.id).configured is False
+
+        db.session.add(ProductTax(product_id=product.id, tax_type_id=catalog['itbis'].id))
+        tax_profiles.products_changed([product.id])
+        db.session.commit()
+
+        profile = tax_profiles.get_profile(product.id)
+        assert profile.configured is True
+        assert profile.rate == pytest.approx(0.18)
+
+    def test_tax_types_changed_refreshes_all(self, catalog):
+        catalog['itbis'].rate = 0.16
+        tax_profiles.tax_types_changed()
+        db.session.commit()
+
+        assert tax_profiles.get_profile(catalog['taxed'].id).rate == pytest.approx(0.16)
+        assert tax_profiles.get_tax_type(catalog['itbis'].id)['rate'] == pytest.approx(0.16)
+
+    def test_version_change_from_other_process(self, catalog, monkeypatch):
+        product = catalog['taxed']
+        assert tax_profiles.get_profile(product.id).rate == pytest.approx(0.18)
+
+        # Another worker changed the tax and bumped the version; this process only sees the row
+        catalog['itbis'].rate = 0.16
+        db.session.add(SystemConfiguration(key=tax_profiles.VERSION_KEY, value='otro-proceso'))
+        db.session.commit()
+        assert tax_profiles.get_profile(product.id).rate == pytest.approx(0.18)
+
+        monkeypatch.setattr(tax_profiles._cache, 'checked_at', 0.0)
+        assert tax_profiles.get_profile(product.id).rate == pytest.approx(0.16)
+
+
+class TestHotPaths:
+    """Agregar producto y vista previa no consultan las tablas de impuestos"""
+
+    def test_add_item_and_preview_skip_tax_tables(self, test_app, catalog):
+        client = test_app.test_client()
+        cashier = User(username='cajero_perfiles', email='perfiles@test.com', role=UserRole.CAJERO,
+                       name='Cajero Perfiles', password_hash='x')
+        db.session.add(cashier)
+        db.session.flush()
+        db.session.add(CashRegister(name='Caja Perfiles', user_id=cashier.id, active=True))
+        db.session.commit()
+
+        with client.session_transaction() as sess:
+            sess['user_id'] = cashier.id
+            sess['username'] = cashier.username
+            sess['role'] = cashier.role.value
+        g.pop('csrf_token', None)
+        headers = {'X-CSRFToken': client.get('/api/csrf').get_json()['csrf_token']}
+
+        sale_id = client.post('/api/sales', data='{}', content_type='application/json',
+                              headers=headers).get_json()['id']
+
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            response = client.post(f'/api/sales/{sale_id}/items', content_type='application/json', headers=headers,
+                                   data=json.dumps({'product_id': catalog['with_tip'].id, 'quantity': 2}))
+            assert response.status_code == 200, response.get_json()
+            assert response.get_json()['tax_rate'] == pytest.approx(0.18)
+            assert len(response.get_json()['tax_types']) == 2
+
+            response = client.post('/api/sales/preview', content_type='application/json', headers=headers,
+                                   data=json.dumps({'items': [{'product_id': catalog['taxed'].id, 'quantity': 1},
+                                                              {'product_id': catalog['untaxed'].id, 'quantity': 3}]}))
+            assert response.status_code == 200, response.get_json()
+            assert response.get_json()['totals']['tax_amount'] == pytest.approx(90.0 + 22.88)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
+        assert not [s for s in statements if 'product_taxes' in s or 'tax_types' in s]
@@ -4,11 +4,15 @@ Includes RNC validation and NCF compliance for DGII 606
 """
 import re
 import uuid
+import base64
+import binascii
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from datetime import datetime
 from flask import jsonify, session
 
+import tax_engine
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -397,9 +401,9 @@ def calculate_itbis(subtotal: float, rate: float = 0.18) -> float:
         rate: Tax rate (default 18% estándar, también soporta 16% reducido y 0% exento)
         
     Returns:
-        Tax amount
+        Tax amount (same per-line rounding as tax_engine)
     """
-    return round(subtotal * rate, 2)
+    return tax_engine.tax_for_amount(subtotal, rate)
 
 
 def validate_phone_rd(phone: str) -> Dict[str, Any]:
@@ -679,6 +683,112 @@ def validate_json_structure(data: dict, required_fields: list, optional_fields:
     }
 
 
+def encode_keyset_cursor(created_at: datetime, record_id: int) -> str:
+    """
+    Codifica la posición (created_at, id) de un registro como cursor opaco
+    
+    Args:
+        created_at: Fecha de creación del registro
+        record_id: ID del registro (desempate para fechas iguales)
+        
+    Returns:
+        str: Cursor URL-safe en base64
+    """
+    raw = f"{created_at.isoformat()}|{record_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_keyset_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """
+    Decodifica un cursor generado por encode_keyset_cursor()
+    
+    Args:
+        cursor: Cursor opaco recibido del cliente
+        
+    Returns:
+        Tuple (created_at, id) o None si el cursor es inválido
+    """
+    if not cursor:
+        return None
+    
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        created_at_str, record_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at_str), int(record_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return None
+
+
+class KeysetPage:
+    """Página de resultados obtenida por paginación keyset sobre (created_at, id)"""
+    
+    def __init__(self, items: list, per_page: int, has_next: bool, has_prev: bool):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+    
+    @property
+    def next_cursor(self) -> Optional[str]:
+        if not self.has_next or not self.items:
+            return None
+        last = self.items[-1]
+        return encode_keyset_cursor(last.created_at, last.id)
+    
+    @property
+    def prev_cursor(self) -> Optional[str]:
+        if not self.has_prev or not self.items:
+            return None
+        first = self.items[0]
+        return encode_keyset_cursor(first.created_at, first.id)
+
+
+def keyset_paginate(query, model, cursor: str = None, direction: str = 'next',
+                    per_page: int = 20) -> KeysetPage:
+    """
+    Paginación por cursor (keyset) en orden descendente de (created_at, id)
+    
+    A diferencia de paginate(), no usa OFFSET ni COUNT(*): cada página es una
+    búsqueda por rango sobre el índice (created_at, id), con costo constante
+    sin importar la profundidad de la página.
+    
+    Args:
+        query: Query ya filtrada (sin ORDER BY)
+        model: Modelo con columnas created_at e id
+        cursor: Cursor de la página actual (None para la primera página)
+        direction: 'next' (registros más antiguos) o 'prev' (más recientes)
+        per_page: Registros por página
+        
+    Returns:
+        KeysetPage con los registros de la página
+    """
+    position = decode_keyset_cursor(cursor)
+    
+    if direction == 'prev' and position:
+        created_at, record_id = position
+        rows = query.filter(
+            (model.created_at > created_at) |
+            ((model.created_at == created_at) & (model.id > record_id))
+        ).order_by(model.created_at.asc(), model.id.asc()).limit(per_page + 1).all()
+        
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        return KeysetPage(items, per_page, has_next=True, has_prev=has_prev)
+    
+    if position:
+        created_at, record_id = position
+        query = query.filter(
+            (model.created_at < created_at) |
+            ((model.created_at == created_at) & (model.id < record_id))
+        )
+    
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1).all()
+    
+    has_next = len(rows) > per_page
+    return KeysetPage(rows[:per_page], per_page, has_next=has_next, has_prev=position is not None)
+
+
 def initialize_company_settings():
     """
     Initialize default company settings in SystemConfiguration table